@@ -25,6 +25,8 @@ OVERRIDES   = ""
 
 # log do autofee que MOSTRA o que foi aplicado
 AUTOFEE_LOG_PATH = ""
+# métricas estruturadas da última execução do autofee (RUN_METRICS_PATH do brln-autofee.py)
+AUTOFEE_METRICS_PATH = "/home/admin/.cache/auto_fee_run_metrics.json"
 
 # controle de versão centralizado (texto)
 # 1ª linha útil (não vazia e não começando com '#') = versão ativa
@@ -259,6 +261,13 @@ def get_7d_kpis():
 
 def read_symptoms_from_logs():
     counts = { "floor_lock": 0, "no_down_low": 0, "hold_small": 0, "cb_trigger": 0, "discovery": 0 }
+    metrics = load_json(AUTOFEE_METRICS_PATH, default=None) if AUTOFEE_METRICS_PATH else None
+    if isinstance(metrics, dict) and isinstance(metrics.get("symptoms"), dict):
+        for k in counts.keys():
+            v = metrics["symptoms"].get(k)
+            if isinstance(v, (int, float)):
+                counts[k] = int(v)
+        return counts
     log_path = Path(AUTOFEE_LOG_PATH)
     if not log_path.exists():
         return counts
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, sys, time, json, math, sqlite3, datetime, subprocess, argparse
-from collections import defaultdict
+import os, sys, time, json, math, sqlite3, datetime, subprocess, argparse, tempfile
+import multiprocessing
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import requests
 import re
 from pathlib import Path
@@ -38,6 +42,12 @@ VERSIONS_FILE = ""
 LOOKBACK_DAYS = 7
 CACHE_PATH    = "/home/admin/.cache/auto_fee_amboss.json"
 STATE_PATH    = "/home/admin/.cache/auto_fee_state.json"
+RUN_METRICS_PATH = "/home/admin/.cache/auto_fee_run_metrics.json"  # lido pelo ai_param_tuner
+REPORT_FILE_PATH = ""             # opcional: grava o relatório completo (texto) a cada execução
+REPORT_SPOOL_MAX_BYTES = 1 << 20  # acima disso o spool do relatório transborda p/ disco
+DECISION_WORKERS = 1                 # >1: decide_channel em N processos (--workers N)
+DECISION_WORKERS_MIN_CHANNELS = 200  # abaixo disso o custo dos processos não compensa
+FEE_KERNEL_NUMPY = False             # opcional: estágios por canal em lote com NumPy (--numpy-kernel)
 
 # --- limites base ---
 BASE_FEE_MSAT = 0
@@ -258,6 +268,16 @@ SEED_RATIO_K              = 0.20   # ganho do viés por ratio out/in
 SEED_RATIO_MIN_FACTOR     = 0.80   # clamp do fator final por ratio
 SEED_RATIO_MAX_FACTOR     = 1.50
 AMBOSS_CACHE_TTL_SEC      = 3*3600 # reaproveita respostas por 3h
+AMBOSS_PREFETCH_ENABLE    = True   # busca as séries do Amboss em paralelo antes do loop de canais
+AMBOSS_PREFETCH_WORKERS   = 8      # máx. requisições simultâneas ao Amboss
+# séries lidas por build_enhanced_seed (a série do seed_with_guard é sempre buscada)
+AMBOSS_PREFETCH_SERIES    = (
+    ("incoming_fee_rate_metrics", "median"),
+    ("incoming_fee_rate_metrics", "mean"),
+    ("incoming_fee_rate_metrics", "std"),
+    ("incoming_fee_rate_metrics", "weighted_corrected_mean"),
+    ("outgoing_fee_rate_metrics", "weighted_corrected_mean"),
+)
 
 # --- Suavização do lock global quando canal está saudável ---
 GLOBAL_NEG_LOCK_SOFTEN_ENABLE   = True
@@ -422,6 +442,21 @@ def save_json(path, data):
     with open(path, "w") as f:
         json.dump(data, f)
 
+# sintomas contados por canal (tag final) para o tuner; cb_trigger é contado no CB
+SYMPTOM_TAGS = {
+    "floor_lock": "🧱floor-lock",
+    "no_down_low": "🙅‍♂️no-down-low",
+    "hold_small": "🧘hold-small",
+    "discovery": "🧪discovery",
+}
+
+def emit_run_metrics(metrics):
+    """Registro estruturado da execução (sintomas, contadores, tempos por etapa)."""
+    try:
+        save_json(RUN_METRICS_PATH, metrics)
+    except Exception as e:
+        logger.warning(f"Falha ao gravar métricas da execução: {e}")
+
 def run(cmd):
     p = subprocess.run(cmd, shell=True, capture_output=True, text=True)
     if p.returncode != 0:
@@ -457,6 +492,46 @@ def apply_step_cap2(current_ppm, target_ppm, cap_frac=None, min_step_ppm=1):
     if delta < -cap: return current_ppm - cap
     return target_ppm
 
+# === estágios do núcleo de taxa (decide_channel; espelhados em NumPy no kernel e em tools/fee_kernel.py) ===
+def liquidity_adjust(target, out_ratio, fwd_count, new_inbound=False):
+    """Ajuste do alvo por liquidez: alta se drenado, queda se sobrando (faixa morta no meio)."""
+    if out_ratio < LOW_OUTBOUND_THRESH:
+        if not new_inbound:
+            target *= (1.0 + LOW_OUTBOUND_BUMP)
+    elif out_ratio > HIGH_OUTBOUND_THRESH:
+        target *= (1.0 - HIGH_OUTBOUND_CUT)
+        if fwd_count == 0 and out_ratio > 0.60:
+            target *= (1.0 - IDLE_EXTRA_CUT)
+    return target
+
+def dynamic_step_cap_frac(out_ratio, fwd_count):
+    """Step cap base do canal (antes de discovery, lock global, extreme drain, router e explorer)."""
+    cap_frac = STEP_CAP
+    if DYNAMIC_STEP_CAP_ENABLE:
+        if out_ratio < 0.03:
+            cap_frac = max(cap_frac, STEP_CAP_LOW_005)
+        elif out_ratio < 0.05:
+            cap_frac = max(cap_frac, STEP_CAP_LOW_010)
+        if fwd_count == 0 and out_ratio > 0.60:
+            cap_frac = max(cap_frac, STEP_CAP_IDLE_DOWN)
+    return cap_frac
+
+def router_step_cap_frac(cap_frac):
+    """Bônus leve de reatividade em ROUTER."""
+    return min(0.50, cap_frac + ROUTER_STEP_CAP_BONUS)
+
+def step_toward(local_ppm, target, cap_frac, min_step_up):
+    """Passo do local_ppm rumo ao alvo: local 0 vai direto; passo mínimo
+    STEP_MIN_STEP_PPM na descida e ``min_step_up`` na subida."""
+    if local_ppm == 0:
+        return target
+    return apply_step_cap2(local_ppm, target, cap_frac,
+                           STEP_MIN_STEP_PPM if target <= local_ppm else min_step_up)
+
+def rebal_cost_floor(cost_ppm):
+    """Piso pelo custo de rebal (ppm) com REBAL_FLOOR_MARGIN."""
+    return clamp_ppm(math.ceil(cost_ppm * (1.0 + REBAL_FLOOR_MARGIN)))
+
 def _chunk_text(text, max_len=4000):
     """Quebra em blocos <= max_len, preferindo quebras em '\n'."""
     chunks = []
@@ -553,132 +628,13 @@ def _format_channel_entry(entry: str) -> str:
 
 
 def _format_telegram_report(report: list) -> str:
-    if not report:
-        return ""
-
-    full_text = '\n'.join(report)
-    import re
-
-    lines = []
-    header_lines = []
-    channel_entries = []
-    footer_lines = []
-
-    current_block = []
-    in_channel = False
-
-    for line in report:
-        stripped = line.strip() if line else ""
-
-        is_channel_start = (
-            stripped.startswith('✅') or
-            stripped.startswith('🫤') or
-            stripped.startswith('⏭️') or
-            stripped.startswith('🧭') or
-            stripped.startswith('🧯')
-        ) and ('TARGET' in stripped or 'chan_id' in stripped.lower() or '(' in stripped)
-
-        if is_channel_start:
-            if current_block:
-                block_text = '\n'.join(current_block)
-                if any(block_text.startswith(e) for e in ['✅', '🫤', '⏭️', '🧭', '🧯']):
-                    channel_entries.append(block_text)
-                elif not in_channel:
-                    header_lines.extend(current_block)
-                else:
-                    footer_lines.extend(current_block)
-            current_block = [stripped]
-            in_channel = True
-        elif in_channel and stripped:
-            current_block.append(stripped)
-        elif not in_channel and stripped:
-            header_lines.append(stripped)
-        elif in_channel and not stripped:
-            current_block.append("")
-
-    if current_block:
-        block_text = '\n'.join(current_block)
-        if any(block_text.startswith(e) for e in ['✅', '🫤', '⏭️', '🧭', '🧯']):
-            channel_entries.append(block_text)
-        else:
-            footer_lines.extend(current_block)
-
-    changed = []
-    kept = []
-    skipped = []
-    explorer = []
-    cb = []
-
-    for entry in channel_entries:
-        if entry.startswith('✅'):
-            changed.append(entry)
-        elif entry.startswith('🫤'):
-            kept.append(entry)
-        elif entry.startswith('⏭️'):
-            skipped.append(entry)
-        elif entry.startswith('🧭'):
-            explorer.append(entry)
-        elif entry.startswith('🧯'):
-            cb.append(entry)
-
-    output = []
-
-    if header_lines:
-        output.extend(header_lines[:2])
-        output.append("")
-        output.append("")
-
-    if changed:
-        output.append("✅ CANAIS ALTERADOS")
-        output.append("")
-        for entry in changed:
-            output.append(_format_channel_entry(entry))
-            output.append("")
-            output.append("")
-
-    if kept:
-        output.append("🫤 CANAIS MANTIDOS")
-        output.append("")
-        for entry in kept:
-            output.append(_format_channel_entry(entry))
-            output.append("")
-            output.append("")
-
-    if skipped:
-        output.append("⏭️ CANAIS IGNORADOS")
-        output.append("")
-        for entry in skipped:
-            output.append(_format_channel_entry(entry))
-            output.append("")
-            output.append("")
-
-    if explorer:
-        output.append("🧭 EXPLORER STATUS")
-        output.append("")
-        for entry in explorer:
-            output.append(_format_channel_entry(entry))
-            output.append("")
-            output.append("")
-
-    if cb:
-        output.append("🧯 CIRCUIT BREAKER")
-        output.append("")
-        for entry in cb:
-            output.append(_format_channel_entry(entry))
-            output.append("")
-            output.append("")
-
-    if footer_lines:
-        useful_footer = [f for f in footer_lines if f.strip()]
-        if useful_footer:
-            output.append("")
-            output.append("ℹ️ Informações:")
-            output.append("")
-            for f in useful_footer:
-                output.append(f)
-                output.append("")
-
-    return '\n'.join(output)
+    """Texto completo da versão Telegram (ver TelegramReportSink)."""
+    parts = []
+    sink = TelegramReportSink(parts.append, max_len=sys.maxsize)
+    for line in report or []:
+        sink.write(line)
+    sink.close()
+    return ''.join(parts)
 
 
 def tg_send_big(text):
@@ -692,6 +648,208 @@ def tg_send_big(text):
         except Exception:
             pass
 
+# ==== Relatório em streaming ====
+# main() não acumula o relatório em lista: as linhas vão para um spool (memória
+# limitada, transborda p/ disco) e, no fechamento, são entregues uma a uma, já na
+# ordem final, a cada sink. Em memória ficam só cabeçalho, resumo e as ações dos
+# updates pendentes.
+
+class ReportSink:
+    """Consumidor do relatório: recebe as linhas na ordem final, uma a uma."""
+
+    def write(self, line):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StdoutReportSink(ReportSink):
+    def __init__(self, stream=None):
+        self.stream = stream  # None => sys.stdout do momento da escrita
+
+    def write(self, line):
+        print(line, file=self.stream)
+
+
+class FileReportSink(ReportSink):
+    """Grava o relatório completo em arquivo (troca atômica no close)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = f"{path}.tmp"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fh = open(self._tmp, "w", encoding="utf-8")
+
+    def write(self, line):
+        self._fh.write(line + "\n")
+
+    def close(self):
+        self._fh.close()
+        os.replace(self._tmp, self.path)
+
+
+_TG_SECTIONS = (
+    ("✅", "✅ CANAIS ALTERADOS"),
+    ("🫤", "🫤 CANAIS MANTIDOS"),
+    ("⏭️", "⏭️ CANAIS IGNORADOS"),
+    ("🧭", "🧭 EXPLORER STATUS"),
+    ("🧯", "🧯 CIRCUIT BREAKER"),
+)
+_TG_ENTRY_PREFIXES = tuple(prefix for prefix, _ in _TG_SECTIONS)
+
+
+class TelegramReportSink(ReportSink):
+    """Versão para o Telegram: cabeçalho + seções por tipo de canal, enviada em
+    blocos <= max_len (mesmas quebras de _chunk_text). Cada seção acumula as
+    entradas já formatadas num spool próprio."""
+
+    def __init__(self, send, max_len=4000, spool_max=None):
+        self.send = send
+        self.max_len = max_len
+        self._spool_max = REPORT_SPOOL_MAX_BYTES if spool_max is None else spool_max
+        self._header = []
+        self._block = []
+        self._in_channel = False
+        self._sections = {}
+        self._buf = ""
+        self._started = False
+
+    def write(self, line):
+        stripped = line.strip() if line else ""
+        is_channel_start = stripped.startswith(_TG_ENTRY_PREFIXES) and (
+            'TARGET' in stripped or 'chan_id' in stripped.lower() or '(' in stripped
+        )
+        if is_channel_start:
+            self._end_block()
+            self._block = [stripped]
+            self._in_channel = True
+        elif self._in_channel:
+            # linhas seguintes (inclusive rodapé) pertencem ao último bloco de canal
+            self._block.append(stripped)
+        elif stripped and len(self._header) < 2:
+            self._header.append(stripped)
+
+    def _end_block(self):
+        if not self._block:
+            return
+        entry = '\n'.join(self._block)
+        self._block = []
+        for prefix, _title in _TG_SECTIONS:
+            if entry.startswith(prefix):
+                spool = self._sections.get(prefix)
+                if spool is None:
+                    spool = tempfile.SpooledTemporaryFile(max_size=self._spool_max, mode="w+", encoding="utf-8")
+                    self._sections[prefix] = spool
+                spool.write('\n' + _format_channel_entry(entry) + '\n\n')
+                break
+
+    def _emit(self, text, item=True):
+        # item=True: novo item do '\n'.join(); False: texto bruto já com separadores
+        if item and self._started:
+            text = '\n' + text
+        self._started = True
+        self._buf += text
+        while len(self._buf) > self.max_len:
+            cut = self._buf.rfind("\n", 0, self.max_len)
+            if cut <= 0:
+                cut = self.max_len
+            self.send(self._buf[:cut])
+            self._buf = self._buf[cut:]
+
+    def close(self):
+        self._end_block()
+        if self._header:
+            for item in (*self._header, "", ""):
+                self._emit(item)
+        for prefix, title in _TG_SECTIONS:
+            spool = self._sections.pop(prefix, None)
+            if spool is None:
+                continue
+            self._emit(title)
+            self._emit("")
+            spool.seek(0)
+            for chunk in iter(lambda: spool.read(65536), ""):
+                self._emit(chunk, item=False)
+            spool.close()
+        if self._buf:
+            self.send(self._buf)
+            self._buf = ""
+
+
+class StreamingReport:
+    """Relatório de uma execução. A 1ª linha é o cabeçalho e o resumo entra logo
+    depois dele (set_summary); as demais vão para o spool. Updates pendentes
+    reservam um slot (cabeça/cauda no spool) cuja ação é preenchida após o apply."""
+
+    def __init__(self, sinks, spool_max=None):
+        self.sinks = list(sinks)
+        if spool_max is None:
+            spool_max = REPORT_SPOOL_MAX_BYTES
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_max, mode="w+", encoding="utf-8")
+        self._header = None
+        self._summary = None
+        self._actions = {}
+        self._slots = 0
+
+    def append(self, line):
+        if self._header is None:
+            self._header = line
+        else:
+            self._spool.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def reserve(self, line_head, line_tail):
+        slot = self._slots
+        self._slots += 1
+        self._spool.write(json.dumps([slot, line_head, line_tail], ensure_ascii=False) + "\n")
+        return slot
+
+    def fill(self, slot, action):
+        self._actions[slot] = action
+
+    def set_summary(self, summary):
+        self._summary = summary
+
+    def _lines(self):
+        if self._header is not None:
+            yield self._header
+        if self._summary is not None:
+            yield self._summary
+        self._spool.seek(0)
+        for raw in self._spool:
+            rec = json.loads(raw)
+            if isinstance(rec, list):
+                slot, line_head, line_tail = rec
+                rec = line_head + self._actions.get(slot, "") + line_tail
+            yield rec
+
+    def close(self):
+        try:
+            for line in self._lines():
+                for sink in list(self.sinks):
+                    try:
+                        sink.write(line)
+                    except Exception as e:
+                        logger.warning(f"Relatório: sink {type(sink).__name__} falhou: {e}")
+                        self.sinks.remove(sink)
+            for sink in self.sinks:
+                try:
+                    sink.close()
+                except Exception as e:
+                    logger.warning(f"Relatório: sink {type(sink).__name__} falhou ao fechar: {e}")
+        finally:
+            self._spool.close()
+
+
+def make_report_sinks(dry_run):
+    """Destinos padrão do relatório (o orquestrador substitui este hook)."""
+    sinks = [StdoutReportSink()]
+    if REPORT_FILE_PATH:
+        sinks.append(FileReportSink(REPORT_FILE_PATH))
+    if not dry_run and TELEGRAM_TOKEN and TELEGRAM_CHAT:
+        sinks.append(TelegramReportSink(lambda part: tg_send_big(part)))
+    return sinks
+
 def has_column(cur, table, column):
     cur.execute(f"PRAGMA table_info({table})")
     return any(r[1] == column for r in cur.fetchall())
@@ -839,23 +997,117 @@ def pick_floor_base_per_channel(
 
 
 # ========== DB QUERIES ==========
-SQL_FORWARDS = """
-SELECT chan_id_in, chan_id_out, amt_in_msat, amt_out_msat, fee, forward_date
+# Agregações no SQLite (GROUP BY) — mesmas conversões do loop linha a linha:
+# int(fee), int(amt_msat/1000); corte 1d por comparação de texto ISO.
+SQL_FORWARDS_OUT_AGG = """
+SELECT chan_id_out,
+       SUM(CAST(COALESCE(fee, 0) AS INTEGER)),
+       SUM(CAST(COALESCE(amt_out_msat, 0) / 1000.0 AS INTEGER)),
+       COUNT(*),
+       SUM(CASE WHEN forward_date >= ? THEN CAST(COALESCE(amt_out_msat, 0) / 1000.0 AS INTEGER) ELSE 0 END),
+       SUM(CASE WHEN forward_date >= ? THEN 1 ELSE 0 END)
 FROM gui_forwards
 WHERE forward_date BETWEEN ? AND ?
+  AND chan_id_out IS NOT NULL AND chan_id_out <> ''
+GROUP BY chan_id_out
 """
-# inclui rebal_chan para piso por canal
-SQL_REBAL_PAYMENTS = """
-SELECT rebal_chan, value, fee, creation_date
+SQL_FORWARDS_IN_AGG = """
+SELECT chan_id_in,
+       SUM(CAST(COALESCE(amt_in_msat, 0) / 1000.0 AS INTEGER)),
+       COUNT(*),
+       SUM(COALESCE(amt_in_msat, 0))
+FROM gui_forwards
+WHERE forward_date BETWEEN ? AND ?
+  AND chan_id_in IS NOT NULL AND chan_id_in <> ''
+GROUP BY chan_id_in
+"""
+SQL_REBAL_AGG = """
+SELECT rebal_chan,
+       SUM(CAST(COALESCE(value, 0) AS INTEGER)),
+       SUM(CAST(COALESCE(fee, 0) AS INTEGER))
 FROM gui_payments
 WHERE rebal_chan IS NOT NULL
   AND chan_out IS NOT NULL
   AND creation_date BETWEEN ? AND ?
+GROUP BY rebal_chan
 """
 
 def db_connect():
     return sqlite3.connect(DB_PATH)
 
+def load_forward_aggregates(cur, start_dt, end_dt, one_day_ago_naive):
+    """
+    Somatórios de forwards da janela por canal (7d e 1d).
+    Retorna dict de mapas cid -> valor; o orquestrador substitui esta função
+    por um rollup incremental (só lê forwards novos a cada ciclo).
+    """
+    out_fee_sat = defaultdict(int)
+    out_amt_sat = defaultdict(int)
+    out_count   = defaultdict(int)
+    out_amt_sat_1d = defaultdict(int)
+    out_count_1d   = defaultdict(int)
+    in_amt_sat_by_cid  = defaultdict(int)
+    in_count_by_cid    = defaultdict(int)
+    in_amt_msat_by_cid = defaultdict(int)
+
+    t1s, t2s = to_sqlite_str(start_dt), to_sqlite_str(end_dt)
+    one_day_s = to_sqlite_str(one_day_ago_naive)
+    cur.execute(SQL_FORWARDS_OUT_AGG, (one_day_s, one_day_s, t1s, t2s))
+    for (cid_out, fee_sat, amt_sat, count, amt_sat_1d, count_1d) in cur.fetchall():
+        k = str(cid_out)
+        out_fee_sat[k] += int(fee_sat or 0)
+        out_amt_sat[k] += int(amt_sat or 0)
+        out_count[k]   += int(count or 0)
+        if count_1d:
+            out_amt_sat_1d[k] += int(amt_sat_1d or 0)
+            out_count_1d[k]   += int(count_1d)
+    cur.execute(SQL_FORWARDS_IN_AGG, (t1s, t2s))
+    for (cid_in, amt_sat, count, amt_msat) in cur.fetchall():
+        k = str(cid_in)
+        in_amt_sat_by_cid[k] += int(amt_sat or 0)
+        in_count_by_cid[k]   += int(count or 0)
+        in_amt_msat_by_cid[k] += int(amt_msat or 0)
+
+    return {
+        "out_fee_sat": out_fee_sat,
+        "out_amt_sat": out_amt_sat,
+        "out_count": out_count,
+        "out_amt_sat_1d": out_amt_sat_1d,
+        "out_count_1d": out_count_1d,
+        "in_amt_sat_by_cid": in_amt_sat_by_cid,
+        "in_count_by_cid": in_count_by_cid,
+        "in_amt_msat_by_cid": in_amt_msat_by_cid,
+    }
+
+def load_rebal_aggregates(cur, start_dt, end_dt):
+    """
+    Custo de rebal da janela: totais globais + value/fee por canal (SCID decimal).
+    O orquestrador substitui por um rollup incremental compartilhado com AR/Tuner.
+    """
+    value_sat_global = 0
+    fee_sat_global   = 0
+    perchan_value_sat = defaultdict(int)
+    perchan_fee_sat   = defaultdict(int)
+
+    cur.execute(SQL_REBAL_AGG, (to_sqlite_str(start_dt), to_sqlite_str(end_dt)))
+    for (rebal_chan, value, fee) in cur.fetchall():
+        v = int(value or 0)
+        f = int(fee or 0)
+        value_sat_global += v
+        fee_sat_global   += f
+
+        rcid = _norm_scid(rebal_chan)  # ✅ usa só SCID DECIMAL
+        if rcid:
+            perchan_value_sat[rcid] += v
+            perchan_fee_sat[rcid]   += f
+
+    return {
+        "value_sat_global": value_sat_global,
+        "fee_sat_global": fee_sat_global,
+        "perchan_value_sat": perchan_value_sat,
+        "perchan_fee_sat": perchan_fee_sat,
+    }
+
 # ========== LND SNAPSHOT ==========
 def listchannels_snapshot():
     """
@@ -900,19 +1152,24 @@ def _norm_scid(x: str) -> str:
     return s if s.isdigit() else ""
 
 # ========== AMBOSS ==========
-def _percentile(vals, q):
-    """Percentil linear (0..1)."""
+def _percentiles(vals, qs):
+    """Percentis lineares (0..1) com uma única ordenação."""
     if not vals:
-        return None
+        return [None for _ in qs]
     vs = sorted(vals)
     if len(vs) == 1:
-        return float(vs[0])
-    pos = q * (len(vs) - 1)
-    lo = math.floor(pos)
-    hi = math.ceil(pos)
-    if lo == hi:
-        return float(vs[lo])
-    return vs[lo] * (hi - pos) + vs[hi] * (pos - lo)
+        return [float(vs[0]) for _ in qs]
+    out = []
+    for q in qs:
+        pos = q * (len(vs) - 1)
+        lo = math.floor(pos)
+        hi = math.ceil(pos)
+        out.append(float(vs[lo]) if lo == hi else vs[lo] * (hi - pos) + vs[hi] * (pos - lo))
+    return out
+
+def _percentile(vals, q):
+    """Percentil linear (0..1)."""
+    return _percentiles(vals, (q,))[0]
 
 def amboss_seed_series_7d(pubkey, cache):
     """Busca série 7d de incoming_fee_rate_metrics/weighted_corrected_mean. Cache 3h."""
@@ -920,6 +1177,8 @@ def amboss_seed_series_7d(pubkey, cache):
     now = int(time.time())
     if key in cache and now - cache[key]["ts"] < AMBOSS_CACHE_TTL_SEC:
         return cache[key]["vals"]
+    if key in _AMBOSS_RUN_MISSES:
+        return None
 
     from_date = (now_utc() - datetime.timedelta(days=LOOKBACK_DAYS)).strftime("%Y-%m-%d")
     q = {
@@ -959,6 +1218,8 @@ def amboss_series_generic(pubkey: str, metric: str, submetric: str, cache: dict)
     c = cache.get(key)
     if c and now - c.get("ts", 0) < AMBOSS_CACHE_TTL_SEC:
         return c.get("vals") or []
+    if key in _AMBOSS_RUN_MISSES:
+        return []
 
     from_date = (now_utc() - datetime.timedelta(days=LOOKBACK_DAYS)).strftime("%Y-%m-%d")
     q = {
@@ -981,6 +1242,75 @@ def amboss_series_generic(pubkey: str, metric: str, submetric: str, cache: dict)
     except Exception:
         return []
 
+def incoming_p65_7d(pubkey, cache):
+    """p65 da série incoming 7d já presente no cache (não consulta a Amboss)."""
+    memo = _SEED_SUMMARIES.get(pubkey)
+    if memo and memo[1]["p65"] is not None:
+        return memo[1]["p65"]
+    in_p65 = cache.get(f"incoming_p65_7d:{pubkey}")
+    if in_p65 is None:
+        series_entry = cache.get(f"incoming_series_7d:{pubkey}")
+        if isinstance(series_entry, dict) and series_entry.get("vals"):
+            in_p65 = _percentile(series_entry["vals"], 0.65)
+            cache[f"incoming_p65_7d:{pubkey}"] = in_p65
+    return in_p65
+
+# chaves que falharam no prefetch desta execução (o loop não tenta de novo)
+_AMBOSS_RUN_MISSES = set()
+
+def amboss_cache_key(pubkey, metric=None, submetric=None):
+    """Chave do cache p/ a série do seed (metric=None) ou uma série genérica."""
+    if metric is None:
+        return f"incoming_series_7d:{pubkey}"
+    return f"series7d:{metric}:{submetric}:{pubkey}"
+
+def amboss_prefetch_jobs(pubkeys, cache):
+    """Lista (pubkey, metric, submetric) ainda sem cache válido; metric=None é a série do seed."""
+    now = int(time.time())
+    jobs = []
+    for pk in sorted({p for p in pubkeys if p}):
+        wanted = [(None, None)]
+        if SEED_ADJUST_ENABLE:
+            wanted.extend(AMBOSS_PREFETCH_SERIES)
+        for metric, submetric in wanted:
+            entry = cache.get(amboss_cache_key(pk, metric, submetric))
+            if isinstance(entry, dict) and now - int(entry.get("ts") or 0) < AMBOSS_CACHE_TTL_SEC:
+                continue
+            jobs.append((pk, metric, submetric))
+    return jobs
+
+def amboss_prefetch(pubkeys, cache):
+    """
+    Aquece o cache com as séries Amboss de todos os peers antes do loop de canais.
+    As buscas faltantes rodam em paralelo (até AMBOSS_PREFETCH_WORKERS); cada worker
+    escreve num dict próprio e só a thread principal mexe no cache.
+    Retorna o nº de séries buscadas.
+    """
+    _AMBOSS_RUN_MISSES.clear()
+    if not AMBOSS_PREFETCH_ENABLE:
+        return 0
+    jobs = amboss_prefetch_jobs(pubkeys, cache)
+    if not jobs:
+        return 0
+
+    def _fetch(job):
+        pk, metric, submetric = job
+        local = {}
+        if metric is None:
+            amboss_seed_series_7d(pk, local)
+        else:
+            amboss_series_generic(pk, metric, submetric, local)
+        return job, local
+
+    workers = max(1, min(int(AMBOSS_PREFETCH_WORKERS or 1), len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (pk, metric, submetric), local in pool.map(_fetch, jobs):
+            if local:
+                cache.update(local)
+            else:
+                _AMBOSS_RUN_MISSES.add(amboss_cache_key(pk, metric, submetric))
+    return len(jobs)
+
 def _avg(vals):
     return (sum(vals)/len(vals)) if vals else None
 
@@ -992,6 +1322,55 @@ def _safe_div(a, b, default=1.0):
         pass
     return default
 
+# séries auxiliares do seed ajustado (nome no resumo -> metric, submetric)
+SEED_SUMMARY_SERIES = (
+    ("inc_median", "incoming_fee_rate_metrics", "median"),
+    ("inc_mean",   "incoming_fee_rate_metrics", "mean"),
+    ("inc_std",    "incoming_fee_rate_metrics", "std"),
+    ("inc_wcorr",  "incoming_fee_rate_metrics", "weighted_corrected_mean"),
+    ("out_wcorr",  "outgoing_fee_rate_metrics", "weighted_corrected_mean"),
+)
+
+# pubkey -> (fingerprint das séries no cache, resumo)
+_SEED_SUMMARIES = {}
+
+def make_seed_summary(n, p65, p95, means):
+    """Monta o resumo do seed: n/p65/p95 da série incoming 7d + médias auxiliares e ratio out/in."""
+    summary = {"n": int(n or 0), "p65": p65, "p95": p95}
+    for name, _metric, _submetric in SEED_SUMMARY_SERIES:
+        summary[name] = means.get(name)
+    inc_wcorr, out_wcorr = summary["inc_wcorr"], summary["out_wcorr"]
+    summary["ratio"] = _safe_div(float(out_wcorr), float(inc_wcorr), 1.0) if (inc_wcorr and out_wcorr) else None
+    return summary
+
+def _seed_summary_fingerprint(pubkey, cache):
+    keys = [amboss_cache_key(pubkey)] + [amboss_cache_key(pubkey, m, sm) for _n, m, sm in SEED_SUMMARY_SERIES]
+    return tuple((cache.get(k) or {}).get("ts") for k in keys)
+
+def seed_summary(pubkey, cache):
+    """
+    Resumo por peer usado no seed (seed_with_guard, build_enhanced_seed, classificação).
+    Uma ordenação para todos os percentis; memoizado enquanto as séries do cache
+    não forem renovadas (mesmos ts e dentro do TTL).
+    """
+    now = int(time.time())
+    memo = _SEED_SUMMARIES.get(pubkey)
+    if memo:
+        fp = _seed_summary_fingerprint(pubkey, cache)
+        stamps = [ts for ts in fp if ts]
+        if memo[0] == fp and stamps and now - min(stamps) < AMBOSS_CACHE_TTL_SEC:
+            return memo[1]
+
+    vals = amboss_seed_series_7d(pubkey, cache) or []
+    p65, p95 = _percentiles(vals, (0.65, 0.95))
+    means = {}
+    if SEED_ADJUST_ENABLE and pubkey:
+        for name, metric, submetric in SEED_SUMMARY_SERIES:
+            means[name] = _avg(amboss_series_generic(pubkey, metric, submetric, cache))
+    summary = make_seed_summary(len(vals), p65, p95, means)
+    _SEED_SUMMARIES[pubkey] = (_seed_summary_fingerprint(pubkey, cache), summary)
+    return summary
+
 def build_enhanced_seed(pubkey: str, seed_base: float, cache: dict):
     """
     Ajusta o seed_base com:
@@ -1000,15 +1379,21 @@ def build_enhanced_seed(pubkey: str, seed_base: float, cache: dict):
       - viés por ratio (outgoing/incoming) usando weighted_corrected_mean.
     Retorna (seed_ajustado, debug_tags[list]).
     """
+    if not (SEED_ADJUST_ENABLE and pubkey):
+        return float(seed_base), []
+    return enhance_seed_from_summary(pubkey, seed_base, seed_summary(pubkey, cache))
+
+def enhance_seed_from_summary(pubkey, seed_base, summ):
+    """build_enhanced_seed a partir de um seed_summary() já calculado."""
     if not (SEED_ADJUST_ENABLE and pubkey):
         return float(seed_base), []
 
     dbg = []
 
     # a) incoming median / mean / std
-    inc_median = _avg(amboss_series_generic(pubkey, "incoming_fee_rate_metrics", "median", cache))
-    inc_mean   = _avg(amboss_series_generic(pubkey, "incoming_fee_rate_metrics", "mean", cache))
-    inc_std    = _avg(amboss_series_generic(pubkey, "incoming_fee_rate_metrics", "std", cache))
+    inc_median = summ["inc_median"]
+    inc_mean   = summ["inc_mean"]
+    inc_std    = summ["inc_std"]
 
     seed = float(seed_base)
 
@@ -1027,11 +1412,9 @@ def build_enhanced_seed(pubkey: str, seed_base: float, cache: dict):
             dbg.append(f"🔬volσ/μ-{pen*100:.0f}%")
 
     # b) ratio = outgoing_weighted_corrected_mean / incoming_weighted_corrected_mean
-    inc_wcorr = _avg(amboss_series_generic(pubkey, "incoming_fee_rate_metrics",  "weighted_corrected_mean", cache))
-    out_wcorr = _avg(amboss_series_generic(pubkey, "outgoing_fee_rate_metrics", "weighted_corrected_mean", cache))
+    ratio = summ["ratio"]
 
-    if inc_wcorr and out_wcorr:
-        ratio = _safe_div(float(out_wcorr), float(inc_wcorr), 1.0)
+    if ratio is not None:
         # fator ~ 1 + K*(ratio-1), com clamp
         f = 1.0 + SEED_RATIO_K * (ratio - 1.0)
         f = max(SEED_RATIO_MIN_FACTOR, min(SEED_RATIO_MAX_FACTOR, f))
@@ -1047,12 +1430,15 @@ def seed_with_guard(pubkey, cache, state, cid):
     Retorna (seed_usado, raw_p65, p95, flags)
     Aplica guardas: p95-cap, jump vs seed anterior e teto absoluto.
     """
-    vals = amboss_seed_series_7d(pubkey, cache)
-    if not vals:
+    return seed_guard_from_summary(seed_summary(pubkey, cache), (state.get(cid) or {}).get("last_seed", None))
+
+def seed_guard_from_summary(summ, prev_seed):
+    """seed_with_guard a partir de um seed_summary() já calculado."""
+    if not summ["n"]:
         return 200.0, None, None, []  # fallback conservador
 
-    raw_p65 = _percentile(vals, 0.65)
-    p95     = _percentile(vals, 0.95)
+    raw_p65 = summ["p65"]
+    p95     = summ["p95"]
     seed    = raw_p65
     flags   = []
 
@@ -1061,7 +1447,6 @@ def seed_with_guard(pubkey, cache, state, cid):
             seed = p95
             flags.append("p95")
 
-        prev_seed = (state.get(cid) or {}).get("last_seed", None)
         if prev_seed and prev_seed > 0:
             cap_prev = prev_seed * (1.0 + SEED_GUARD_MAX_JUMP)
             if seed > cap_prev:
@@ -1131,6 +1516,24 @@ def fee_update_method(pubkey, chan_point):
         return "BOS"
     return "UNKNOWN"
 
+def apply_policy_updates(updates):
+    """
+    Aplica a lista de updates de política gerada pelo loop de decisão.
+    Cada update: {cid, pubkey, chan_point, ppm, inbound_discount_ppm, base_fee_msat}.
+    Retorna, na mesma ordem, {"method": label|None, "error": str|None}.
+    """
+    results = []
+    for upd in updates:
+        try:
+            method_label = set_channel_fees(
+                upd["pubkey"], upd["chan_point"], upd["ppm"], upd["inbound_discount_ppm"],
+                base_fee_msat=upd["base_fee_msat"],
+            )
+            results.append({"method": method_label, "error": None})
+        except Exception as e:
+            results.append({"method": None, "error": str(e)})
+    return results
+
 # ========== STATE ==========
 def get_state():
     return load_json(STATE_PATH, {})
@@ -1543,1640 +1946,1923 @@ def _clear_explorer_state(st: dict, cid: str):
         ch.pop("explorer", None)
     st[cid] = ch
 
-# ========== PIPELINE ==========
-def main(dry_run=False):
-    logger.info("Iniciando AutoFee")
-    global EXCL_DRY_VERBOSE,ASSISTED_DIAG_ENABLE
+# ========== DECISÃO POR CANAL ==========
+# decide_channel() calcula a política de UM canal só a partir de dados já carregados:
+# não lê DB/LND/Amboss, não mexe no state/cache da execução e não escreve no relatório.
+# main() é o driver: monta os ChannelInputs, chama decide_channel() p/ cada canal e
+# depois persiste estado/cache, aplica os updates e monta o relatório na mesma ordem.
+# Os parâmetros de ajuste (STEP_CAP, COOLDOWN_*, ...) seguem como globais do módulo,
+# onde os overrides e o tuner já os alteram.
+
+@dataclass(frozen=True, slots=True)
+class ChannelInputs:
+    """Dados de um canal numa execução (somente leitura)."""
+    cid: str
+    alias: str
+    local_ppm: int
+    remote_ppm: int
+    pubkey: Optional[str]
+    chan_point: Optional[str]
+    is_excluded: bool
+    in_shard: bool
+    active: Optional[bool]            # None = sem snapshot do LND
+    capacity: int
+    local_balance: int
+    initiator: Optional[bool]
+    status_prev: dict                 # entrada anterior do cache de status (on/offline)
+    out_fee_sat: int
+    out_amt_sat: int
+    out_count: int
+    out_amt_sat_1d: int
+    in_amt_sat: int
+    in_count: int
+    peer_incoming_msat: int           # entrada 7d do peer (todos os canais dele)
+    rebal_value_sat: int
+    rebal_cost_ppm: Optional[float]   # custo de rebal 7d do canal; None = sem amostra mínima
+    seed_summary: Optional[dict]      # seed_summary() do peer; None em canal pulado
+
+@dataclass(frozen=True, slots=True)
+class DecisionParams:
+    """Contexto da execução, igual para todos os canais."""
+    dry_run: bool
+    shard_slot: Optional[int]
+    total_incoming_msat: int
+    avg_share: float
+    total_out_fee_sat: int
+    rebal_cost_ppm_global: float
+    neg_margin_global: bool
+
+@dataclass(frozen=True, slots=True)
+class Decision:
+    """Resultado de decide_channel()."""
+    cid: str
+    lines: tuple                          # linhas do relatório, na ordem
+    state: Optional[dict]                 # estado novo do canal (None = canal sem estado)
+    status: Optional[dict]                # entrada nova do cache de status (None = fora do shard)
+    counts: dict                          # incrementos dos contadores do resumo
+    symptoms: tuple                       # chaves de SYMPTOM_TAGS (e cb_trigger) vistas no canal
+    update: Optional[dict] = None         # update p/ apply_policy_updates()
+    update_line: Optional[tuple] = None   # (cabeça, cauda) da linha que espera o apply
+    update_ctx: Optional[dict] = None     # dados p/ gravar o estado depois do apply
+
+@dataclass(frozen=True, slots=True)
+class ChannelCore:
+    """Estágios que só dependem do ChannelInputs e do estado anterior do canal
+    (channel_core() em série ou fee_core_batch() em lote)."""
+    out_ratio: float
+    cap_frac: float          # dynamic_step_cap_frac()
+    rebal_floor_ppm: int     # rebal_cost_floor() do custo do canal (7d ou memória); MIN_PPM sem custo
+
+def _chan_rebal_cost(inputs, prev_state):
+    """Custo de rebal do canal p/ o piso: o 7d do LNDg ou, sem amostra, o último memorizado."""
+    if inputs.rebal_cost_ppm is not None:
+        return float(inputs.rebal_cost_ppm or 0.0)
+    last = (prev_state or {}).get("last_rebal_cost_ppm") or 0
+    return float(last) if last > 0 else 0.0
+
+def channel_core(inputs, prev_state):
+    cap = inputs.capacity
+    out_ratio = (inputs.local_balance / cap) if cap > 0 else 0.5
+    chan_rebal = _chan_rebal_cost(inputs, prev_state)
+    return ChannelCore(
+        out_ratio=out_ratio,
+        cap_frac=dynamic_step_cap_frac(out_ratio, inputs.out_count),
+        rebal_floor_ppm=rebal_cost_floor(chan_rebal) if chan_rebal > 0 else MIN_PPM,
+    )
 
-    env_excl = os.getenv("EXCL_DRY_VERBOSE")
-    if env_excl is not None:
-        EXCL_DRY_VERBOSE = str(env_excl).strip().lower() in ("1","true","yes","on")
-    env_did = os.getenv("DIDACTIC_EXPLAIN")
-    if env_did is not None:
-        globals()["DIDACTIC_EXPLAIN_ENABLE"] = str(env_did).strip().lower() in ("1","true","yes","on")
+def _copy_state(obj):
+    """Cópia profunda do estado de um canal (só dict/list/escalares, como no JSON salvo)."""
+    if isinstance(obj, dict):
+        return {k: _copy_state(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy_state(v) for v in obj]
+    return obj
 
-    env_did_level = os.getenv("DIDACTIC_LEVEL")
-    if env_did_level and env_did_level.strip().lower() in ("basic","detailed"):
-        globals()["DIDACTIC_LEVEL"] = env_did_level.strip().lower()
+def decide_channel(inputs, params, prev_state, core=None):
+    """
+    Decide a política de um canal. ``prev_state`` é o estado salvo do canal (ou None)
+    e não é alterado: o estado novo volta em Decision.state. ``core`` são os estágios
+    já calculados em lote (fee_core_batch); sem ele, channel_core() calcula aqui.
+    """
+    cid = inputs.cid
+    state = {cid: _copy_state(prev_state)} if prev_state is not None else {}
+    rebal_cost_ppm_by_chan_use = {cid: inputs.rebal_cost_ppm} if inputs.rebal_cost_ppm is not None else {}
+    lines = []
+    counts = defaultdict(int)
+    symptoms = []
+    status_entry = None
+    update = update_line = update_ctx = None
+
+    def done(update=None, update_line=None, update_ctx=None):
+        return Decision(cid, tuple(lines), state.get(cid), status_entry, dict(counts), tuple(symptoms),
+                        update, update_line, update_ctx)
+
+    alias = inputs.alias
+    local_ppm = inputs.local_ppm
+    remote_ppm = inputs.remote_ppm   # NEW
+    floor_src = "none"
+
+    # opcional: helper para não repetir
+    fee_lr_str = f"💱 fee L/R {local_ppm}/{remote_ppm}ppm"  # NEW
+    extreme_turbo_applied = False
+
+    pubkey = inputs.pubkey
+    chan_point = inputs.chan_point
+    if not pubkey:
+        counts["unmatched"] += 1
 
-    env_diag = os.getenv("DID_ASSISTED")
-    if env_diag is not None:
-        ASSISTED_DIAG_ENABLE = str(env_diag).strip().lower() in ("1","true","yes","on")
+    # ==== EXCLUSION: vira DRY-RUN especial ====
+    is_excluded = inputs.is_excluded
 
+    # ---- SHARDING: pular canais não pertencentes ao slot atual ----
+    if SHARDING_ENABLE:
+        if not inputs.in_shard:
+            counts["shard_skips"] += 1
+            lines.append(f"⏭️🧩 {alias} ({cid}) skip (shard {params.shard_slot+1}/{SHARD_MOD})")
+            return done()
 
-    cache = load_json(CACHE_PATH, {})
-    state = get_state()
-    version_info = read_version_info(VERSIONS_FILE)
-    vstr = version_info.get("version", "0.0.0")
-    logger.info(f"Versão: {vstr}, dry_run={dry_run}")
+    # --- OFFLINE SKIP: detecta status e persiste em cache ---
+    now_ts = int(time.time())
+    active_flag = inputs.active
+    prev = inputs.status_prev or {}
+    prev_active = prev.get("active", None)
+    status_entry = {
+        "alias": alias,
+        "active": 1 if active_flag else 0 if active_flag is not None else None,
+        "last_seen": now_ts,
+        "last_online": prev.get("last_online"),
+        "last_offline": prev.get("last_offline"),
+    }
+    if active_flag is True:
+        status_entry["last_online"] = now_ts
+    elif active_flag is False:
+        status_entry["last_offline"] = status_entry.get("last_offline", now_ts)
+
+    # monta tag de status
+    status_tags = []
+    if active_flag is True:
+        status_tags.append("🟢on")
+        if prev_active == 0:
+            status_tags.append("🟢back")
+    elif active_flag is False:
+        status_tags.append("🔴off")
+
+    # Se sabemos que está offline, faz skip cedo
+    if OFFLINE_SKIP_ENABLE and active_flag is False:
+        counts["offline_skips"] += 1
+        if is_excluded and not EXCL_DRY_VERBOSE:
+            lines.append(f"⏭️🔌 {alias}: 🚷excl-dry")
+            return done()
+
+        since_off = fmt_duration(now_ts - (status_entry.get("last_offline") or now_ts))
+        last_on = status_entry.get("last_online")
+        last_on_ago = fmt_duration(now_ts - last_on) if last_on else "n/a"
+        extra = " 🚷excl-dry" if is_excluded else ""
+        lines.append(f"⏭️🔌 {alias} ({cid}) skip: canal offline ({since_off}) | last_on≈{last_on_ago} | local {local_ppm} ppm{extra}")
+        if (not params.dry_run) and (not is_excluded):
+            st = state.get(cid, {}).copy()
+            st["last_seed"] = float(st.get("last_seed", 0.0))
+            state[cid] = st
+        return done()
+
+    # prossegue normal (online ou status desconhecido)
+    if core is None:
+        core = channel_core(inputs, prev_state)
+    cap   = inputs.capacity
+    out_ratio = core.out_ratio
+    if out_ratio < PERSISTENT_LOW_THRESH:
+        counts["low_out"] += 1
+
+    # detecção de initiator (se o peer abriu, initiator=False)
+    initiator = inputs.initiator
+
+    out_ppm_7d = ppm(inputs.out_fee_sat, inputs.out_amt_sat)
+    fwd_count  = inputs.out_count
+    
+    # Fração do volume de saída 7d vs capacidade do canal (para critério do Explorer)
+    out_amt_7d = inputs.out_amt_sat  # em sat
+    out_amt_1d = inputs.out_amt_sat_1d
+    out_amt_frac_7d = (out_amt_7d / cap) if cap > 0 else 0.0
 
-    t1_epoch, t2_epoch = epoch_days_ago(LOOKBACK_DAYS)
-    start_dt = datetime.datetime.fromtimestamp(t1_epoch, datetime.timezone.utc)
-    end_dt   = datetime.datetime.fromtimestamp(t2_epoch, datetime.timezone.utc)
-    one_day_ago = end_dt - datetime.timedelta(days=1)
-    one_day_ago_naive = one_day_ago.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    # >>> PATCH: memorize per-channel rebal cost (21d fallback)
+    if cid in rebal_cost_ppm_by_chan_use:
+        st_m = state.get(cid, {}).copy()
+        st_m["last_rebal_cost_ppm"] = float(rebal_cost_ppm_by_chan_use.get(cid) or 0.0)
+        st_m["last_rebal_cost_ts"]  = int(time.time())
+        state[cid] = st_m
+    # >>> PATCH: memorize per-channel outrate (21d fallback)
+    if (out_ppm_7d or 0) > 0 and fwd_count >= OUTRATE_PEG_MIN_FWDS:
+        st_m = state.get(cid, {}).copy()
+        st_m["last_outrate_ppm"] = float(out_ppm_7d)
+        st_m["last_outrate_ts"]  = int(time.time())
+        state[cid] = st_m
+
+    # Flag local para marcar se aplicamos o lock global
+    global_neg_lock_applied = False
+    # in/out por canal p/ classificação
+    in_amt      = inputs.in_amt_sat
+    in_count    = inputs.in_count
+    out_amt     = inputs.out_amt_sat
+    out_cnt     = inputs.out_count
+    total_val   = in_amt + out_amt
+    total_fwds  = in_count + out_cnt
+
+    # Seed (Amboss) com guard
+    seed_used, seed_raw, seed_p95, seed_flags = seed_guard_from_summary(inputs.seed_summary, (state.get(cid) or {}).get("last_seed", None))
+    if seed_used is None:
+        seed_used = 200.0  # fallback
+        
+    # >>> ADD: seed híbrido (mediana/volatilidade/ratio)
+    seed_used, seed_adj_tags = enhance_seed_from_summary(pubkey, seed_used, inputs.seed_summary)
+
+    # Ponderação pelo volume de ENTRADA do peer
+    if params.total_incoming_msat > 0 and VOLUME_WEIGHT_ALPHA > 0 and pubkey:
+        share = inputs.peer_incoming_msat / params.total_incoming_msat
+        factor = 1.0 + VOLUME_WEIGHT_ALPHA * (share - params.avg_share)
+        seed_used *= max(0.7, min(1.3, factor))
+
+    # EMA leve no seed (suaviza saltos)
+    prev_seed_for_ema = (state.get(cid, {}) or {}).get("last_seed")
+    if SEED_EMA_ALPHA and SEED_EMA_ALPHA > 0 and prev_seed_for_ema and prev_seed_for_ema > 0:
+        seed_used = float(prev_seed_for_ema)*(1.0 - SEED_EMA_ALPHA) + float(seed_used)*SEED_EMA_ALPHA
+
+    # tags do guard do seed
+    seed_tags = []
+    for fl in (seed_flags or []):
+        if fl == "p95": seed_tags.append("🧬seedcap:p95")
+        elif fl.startswith("prev+"): seed_tags.append("🧬seedcap:" + fl)
+        elif fl == "abs": seed_tags.append("🧬seedcap:abs")
+    if not seed_flags and DEBUG_TAGS:
+        seed_tags.append("🧬seedcap:none")
+        
+    # >>> ADD: tags de debug dos novos ajustes
+    if DEBUG_TAGS and seed_adj_tags:
+        seed_tags.extend(seed_adj_tags)
+    
+    # Debug: mostrar p65/p95 também
+    if DEBUG_TAGS:
+        if seed_raw is not None:
+            seed_tags.append(f"🧬p65:{int(seed_raw)}")
+        if seed_p95 is not None:
+            seed_tags.append(f"🧬p95:{int(seed_p95)}")
 
-    conn = db_connect()
-    cur  = conn.cursor()
+        
+    # persistir last_seed cedo (só se não for excl-dry e não for --dry-run)
+    if (not params.dry_run) and (not is_excluded):
+        st_tmp = state.get(cid, {}).copy()
+        st_tmp.setdefault("first_seen_ts", int(time.time()))
+        st_tmp["last_seed"] = float(seed_used)
+        state[cid] = st_tmp
+
+    # --- Métricas de lucro p/ boosts ---
+    base_cost_for_margin = pick_rebal_cost_for_floor(cid, rebal_cost_ppm_by_chan_use, params.rebal_cost_ppm_global)
+    margin_ppm_7d = int(round(out_ppm_7d - (base_cost_for_margin * (1.0 + REBAL_FLOOR_MARGIN)))) if base_cost_for_margin else int(round(out_ppm_7d))
+    rev_share = (inputs.out_fee_sat / params.total_out_fee_sat) if params.total_out_fee_sat > 0 else 0.0
+
+
+    # --- Alvo BASE: seed + colchão ---
+    target_base = seed_used + COLCHAO_PPM
+    target = target_base
+
+    # ==== NEW INBOUND NORMALIZE (detecção) ====
+    st_prev = state.get(cid, {}) or {}
+    first_seen_ts = st_prev.get("first_seen_ts", int(time.time()))
+    hours_since_first = (int(time.time()) - first_seen_ts) / 3600 if first_seen_ts else 999
+
+    need_big_drop_vs_seed = (local_ppm >= max(seed_used*(1.0+NEW_INBOUND_MIN_DIFF_FRAC), seed_used + NEW_INBOUND_MIN_DIFF_PPM))
+    peer_opened = (initiator is False)  # se info disponível
+    new_inbound = (
+        NEW_INBOUND_NORMALIZE_ENABLE and
+        hours_since_first <= NEW_INBOUND_GRACE_HOURS and
+        out_ratio <= NEW_INBOUND_OUT_MAX and
+        (not fwd_count if NEW_INBOUND_REQUIRE_NO_FWDS else True) and
+        need_big_drop_vs_seed and
+        (peer_opened if initiator is not None else True)
+    )
+    # === Explorer: detecção de platô e ciclo de vida ===
+    explorer_active = False
+    explorer_armed = False
+    explorer_reason = ""
+    exp_st = _get_explorer_state(state, cid)
+
+    now_ts_local = int(time.time())
+    last_change_ts = (state.get(cid, {}) or {}).get("last_ts", 0)
+    days_since_change = (now_ts_local - last_change_ts) / 86400 if last_change_ts else 999
+
+    if EXPLORER_ENABLE:
+        # Condição para armar/ativar (canal cheio e parado)
+        if not exp_st.get("active", False):
+            cond_stale = (days_since_change >= EXPLORER_MIN_DAYS_STALE)
+            cond_full  = (out_ratio >= EXPLORER_OUT_MIN)
+            cond_idle  = (fwd_count <= EXPLORER_MAX_FWDS_7D) or (out_amt_frac_7d <= EXPLORER_MAX_AMT_FRAC_7D)
+            if cond_stale and cond_full and cond_idle:
+                explorer_armed = True
+                explorer_active = True
+                _set_explorer_state(
+                    state, cid,
+                    active=True,
+                    started_ts=now_ts_local,
+                    rounds=0,
+                    fwds_at_start=fwd_count,
+                    ppm_at_start=local_ppm,
+                    reason=f"stale{int(days_since_change)}d full{int(out_ratio*100)}% idle"
+                )
+                explorer_reason = "activate"
+        else:
+            explorer_active = True
+            # Critérios de saída: tráfego apareceu, timeout ou rounds excedidos
+            rounds = int(exp_st.get("rounds", 0))
+            fwds_since_start = max(0, fwd_count - int(exp_st.get("fwds_at_start", 0)))
+            hours_since_start = (now_ts_local - int(exp_st.get("started_ts", now_ts_local))) / 3600
+
+            if (fwds_since_start >= EXPLORER_EXIT_FWDS) or (hours_since_start >= EXPLORER_EXIT_HOURS) or (rounds >= EXPLORER_MAX_ROUNDS):
+                explorer_active = False
+                _clear_explorer_state(state, cid)
+                explorer_reason = "exit"
+                st_x = state.get(cid, {}).copy()
+                st_x["explorer_seen"] = True
+                st_x["explorer_last_exit_ts"] = now_ts_local
+                if not params.dry_run:
+                    state[cid] = st_x
+                elif params.dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
+                    state[cid] = st_x
+    if EXPLORER_ENABLE:
+        if explorer_armed:
+            # Mostra já o motivo "fresco" (mesma fórmula usada no _set_explorer_state)
+            reason_txt = f"stale{int(days_since_change)}d full{int(out_ratio*100)}% idle"
+            lines.append(f"🧭 {alias} ({cid}) explorer: ON — {reason_txt}")
+        elif explorer_reason == "exit":
+            lines.append(f"🧭 {alias} ({cid}) explorer: OFF (exit criteria met)")
+
+
+    # --- Classificação dinâmica sink/source/router ---
+    class_label = st_prev.get("class_label", "unknown")
+    class_conf  = float(st_prev.get("class_conf", 0.0))
+    bias_prev   = float(st_prev.get("bias_ema", 0.0))
+
+    bias_raw = 0.0
+    if total_val > 0:
+        bias_raw = (out_amt - in_amt) / float(total_val)  # [-1..1], >0 tende a sink, <0 tende a source
+    bias_ema = (1.0 - CLASS_BIAS_EMA_ALPHA) * bias_prev + CLASS_BIAS_EMA_ALPHA * bias_raw if CLASSIFY_ENABLE else bias_raw
+
+    # Decisão somente com amostra mínima e volume relevante
+    cand_label = "unknown"
+    cand_conf  = 0.0
+
+    if CLASSIFY_ENABLE and total_fwds >= CLASS_MIN_FWDS and total_val >= CLASS_MIN_VALUE_SAT:
+        if (bias_ema >= SINK_BIAS_MIN) and (out_ratio < SINK_OUTRATIO_MAX):
+            cand_label = "sink"
+            cand_conf  = min(1.0, (bias_ema - SINK_BIAS_MIN) / (1.0 - SINK_BIAS_MIN) + 0.3)
+        elif (bias_ema <= -SOURCE_BIAS_MIN) and (out_ratio > SOURCE_OUTRATIO_MIN):
+            cand_label = "source"
+            cand_conf  = min(1.0, ((-bias_ema) - SOURCE_BIAS_MIN) / (1.0 - SOURCE_BIAS_MIN) + 0.3)
+        elif abs(bias_ema) <= ROUTER_BIAS_MAX and in_count > 0 and out_cnt > 0:
+            cand_label = "router"
+            cand_conf  = min(1.0, (ROUTER_BIAS_MAX - abs(bias_ema)) / ROUTER_BIAS_MAX + 0.3)
+
+    # boosts conservadores pró-source
+    no_rebal_to_this_chan = (inputs.rebal_value_sat == 0)
+    if cand_label in ("unknown", "source") and no_rebal_to_this_chan and bias_ema <= -(SOURCE_BIAS_MIN - 0.05):
+        cand_label = "source"
+        cand_conf  = min(1.0, cand_conf + 0.20)
+
+    if pubkey and params.total_incoming_msat > 0:
+        share = inputs.peer_incoming_msat / params.total_incoming_msat
+        if share >= (params.avg_share * 1.8) and bias_ema <= - (SOURCE_BIAS_MIN - 0.03):
+            cand_label = "source"
+            cand_conf  = min(1.0, cand_conf + 0.10)
+
+    # Histerese de classe
+    if cand_label != "unknown":
+        if class_label == "unknown":
+            class_label, class_conf = cand_label, cand_conf
+        else:
+            if cand_label != class_label:
+                if cand_conf >= (class_conf + CLASS_CONF_HYSTERESIS):
+                    class_label, class_conf = cand_label, cand_conf
+            else:
+                class_conf = min(1.0, 0.5*class_conf + 0.5*cand_conf)
+
+    # --- Super-source (auto) ---
+    super_source_active = False
+    super_source_warm = False
+    super_source_like = False
+    ss_ratio_1d = 0.0
+    ss_ratio_7d = 0.0
+    ss_vol_1d = False
+    ss_vol_7d = False
+    if SUPER_SOURCE_ENABLE:
+        super_source_like = (class_label == "router")
+        ss_ratio_1d = (out_amt_1d / cap) if cap > 0 else 0.0
+        ss_ratio_7d = (out_amt_7d / cap) if cap > 0 else 0.0
+        ss_vol_1d = ss_ratio_1d >= SUPER_SOURCE_OUT_AMT_1D_MULT
+        ss_vol_7d = ss_ratio_7d >= SUPER_SOURCE_OUT_AMT_7D_MULT
+        ss_ok = (
+            class_label in ("source", "router") and
+            out_ratio >= SUPER_SOURCE_OUTRATIO_MIN and
+            cap > 0 and
+            (ss_vol_1d or ss_vol_7d) and
+            fwd_count >= SUPER_SOURCE_MIN_FWDS_7D
+        )
+        st_ss = state.get(cid, {}).copy()
+        ok_since = int(st_ss.get("ss_ok_since", 0) or 0)
+        bad_since = int(st_ss.get("ss_bad_since", 0) or 0)
+        active = bool(st_ss.get("ss_active", False))
+
+        if ss_ok:
+            bad_since = 0
+            if ok_since == 0:
+                ok_since = now_ts_local
+            if (now_ts_local - ok_since) >= SUPER_SOURCE_ENTER_HOURS * 3600:
+                active = True
+        else:
+            ok_since = 0
+            if bad_since == 0:
+                bad_since = now_ts_local
+            if active and (now_ts_local - bad_since) >= SUPER_SOURCE_EXIT_HOURS * 3600:
+                active = False
+
+        super_source_active = active
+        super_source_warm = ss_ok and not active
+
+        st_ss["ss_ok_since"] = int(ok_since or 0)
+        st_ss["ss_bad_since"] = int(bad_since or 0)
+        st_ss["ss_active"] = bool(active)
+        if not params.dry_run:
+            state[cid] = st_ss
+        elif params.dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
+            state[cid] = st_ss
+
+    # tags da classe (para relatório)
+    class_tags = []
+    if class_label == "sink":   class_tags.append(TAG_SINK)
+    if class_label == "source": class_tags.append(TAG_SOURCE)
+    if class_label == "router": class_tags.append(TAG_ROUTER)
+    if class_label == "unknown": class_tags.append(TAG_UNKNOWN)
+    if super_source_active:
+        class_tags.append(TAG_SUPER_SOURCE)
+        if super_source_like:
+            class_tags.append("super-source-like")
+    elif DEBUG_TAGS and super_source_warm:
+        class_tags.append("super-source:warm")
+        if super_source_like:
+            class_tags.append("super-source-like:warm")
+    if DEBUG_TAGS:
+        if SUPER_SOURCE_ENABLE:
+            class_tags.append(f"ssv1d{ss_ratio_1d:.2f}-v7d{ss_ratio_7d:.2f}-f{fwd_count}")
+        class_tags.append(f"🧭bias{bias_ema:+.2f}")
+        class_tags.append(f"🧭{class_label}:{class_conf:.2f}")
+    # --- [PATCH A] Base de custo p/ margem (consistente) ---
+    # Usa custo por canal se existir; caso contrário, em SOURCE/ROUTER usa out_ppm7d (com clamp+blend);
+    # para SINK ou quando faltar dado, cai no global cru.
+    rebal_cost_chan = float(rebal_cost_ppm_by_chan_use.get(cid, 0) or 0)
+
+    use_bounded   = (class_label or "").lower() in APPLY_BOUNDED_COST_CLASSES  # aplica só em source/router
+    use_out_cost  = False
+    base_cost_for_margin = 0.0
+
+    if rebal_cost_chan > 0:
+        # 1) custo por canal vence
+        base_cost_for_margin = rebal_cost_chan
+
+    elif use_bounded and (params.rebal_cost_ppm_global or 0) > 0 and (out_ppm_7d or 0) > 0:
+        # 2) SOURCE/ROUTER sem rebal por canal: clamp no global pelo preço "out"
+        lo = out_ppm_7d * REBAL_COST_GLOBAL_CLAMP_LOW
+        hi = out_ppm_7d * REBAL_COST_GLOBAL_CLAMP_HIGH
+        global_bounded = max(lo, min(float(params.rebal_cost_ppm_global), hi))
+
+        blended = REBAL_COST_BLEND_ALPHA * global_bounded + (1.0 - REBAL_COST_BLEND_ALPHA) * float(out_ppm_7d)
+
+        # Cap pró-margem: não permitir “custo” acima do que gerou venda com margem
+        if REBAL_FLOOR_MARGIN > 0:
+            cap_ok = float(out_ppm_7d) / (1.0 + REBAL_FLOOR_MARGIN)
+            blended = min(blended, cap_ok)
+
+        base_cost_for_margin = blended
+        use_out_cost = True
 
-    # Detecta se 'chan_point' existe no LNDg
-    if has_column(cur, "gui_channels", "chan_point"):
-        cur.execute("""
-            SELECT chan_id, chan_point, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open
-        FROM gui_channels
-        """)
-        meta_rows = cur.fetchall()
-        channels_meta = {}
-        open_cids = set()
-        for (chan_id, chan_point, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open) in meta_rows:
-            cid = str(chan_id)  # SCID DECIMAL
-            channels_meta[cid] = {
-                "chan_point": chan_point,
-                "alias": alias or "Unknown",
-                "local_ppm": int(local_fee_rate or 0),
-                "remote_fee_rate": int(remote_fee_rate or 0),
-                "ar_max_cost": float(ar_max_cost or 0),
-                "remote_pubkey": remote_pubkey,
-                "is_open": int(is_open or 0),
-            }
-            if int(is_open or 0) == 1:
-                open_cids.add(cid)
-        has_chan_point = True
     else:
-        cur.execute("""
-            SELECT chan_id, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open
-            FROM gui_channels
-        """)
-        meta_rows = cur.fetchall()
-        channels_meta = {}
-        open_cids = set()
-        for (chan_id, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open) in meta_rows:
-            cid = str(chan_id)
-            channels_meta[cid] = {
-                "chan_point": None,
-                "alias": alias or "Unknown",
-                "local_ppm": int(local_fee_rate or 0),
-                "remote_fee_rate": int(remote_fee_rate or 0),
-                "ar_max_cost": float(ar_max_cost or 0),
-                "remote_pubkey": remote_pubkey,
-                "is_open": int(is_open or 0),
-            }
-            if int(is_open or 0) == 1:
-                open_cids.add(cid)
-        has_chan_point = False
+        # 3) SINK (ou sem dados): global cru
+        base_cost_for_margin = float(params.rebal_cost_ppm_global or 0)
 
-    live = listchannels_snapshot()
-    live_by_scid  = live["by_scid_dec"]
-    live_by_cid   = live["by_cid_dec"]
-    live_by_point = live["by_point"]
+    base_cost_for_margin = max(float(base_cost_for_margin or 0), float(MIN_PPM))
+    margin_ppm_7d = int(round((out_ppm_7d or 0) - base_cost_for_margin * (1.0 + REBAL_FLOOR_MARGIN)))
+        
+    # === Diagnóstico passivo dos modos assistidos (LOG-ONLY) ===
+    if ASSISTED_DIAG_ENABLE:
+        fa_cand, nra_cand, fa_reason, nra_reason = assisted_diag_candidates(
+            cid,
+            out_ratio=out_ratio,
+            out_ppm7d=out_ppm_7d,
+            margin_ppm_7d=margin_ppm_7d,
+            rebal_cost_ppm_by_chan_use=rebal_cost_ppm_by_chan_use,
+            state=state,
+            fwd_count=fwd_count
+        )
+        if fa_cand:
+            class_tags.append(f"🧩FA-candidate")
+            if DEBUG_TAGS:
+                class_tags.append(f"ⓘFA:{fa_reason}")
+        if nra_cand:
+            class_tags.append(f"🧩NRA-candidate")
+            if DEBUG_TAGS:
+                class_tags.append(f"ⓘNRA:{nra_reason}")
 
-    # ---- Forwards (7d) ----
-    cur.execute(SQL_FORWARDS, (to_sqlite_str(start_dt), to_sqlite_str(end_dt)))
-    rows = cur.fetchall()
 
-    out_fee_sat = defaultdict(int)
-    out_amt_sat = defaultdict(int)
-    out_count   = defaultdict(int)
-    out_amt_sat_1d = defaultdict(int)
-    out_count_1d   = defaultdict(int)
+    # --- Escalada por persistência (ANTES do ajuste de liquidez) ---
+    streak = state.get(cid, {}).get("low_streak", 0)
+    if PERSISTENT_LOW_ENABLE:
+        if out_ratio < PERSISTENT_LOW_THRESH:
+            streak += 1
+        else:
+            streak = 0
+
+        if streak >= PERSISTENT_LOW_STREAK_MIN:
+            bump_acc = (streak - PERSISTENT_LOW_STREAK_MIN + 1) * PERSISTENT_LOW_BUMP
+            bump_acc = min(PERSISTENT_LOW_MAX, max(0.0, bump_acc))
+
+            # ⬇️ NOVO: não inflar em stale-drain (sem base)
+            baseline_val_persist = state.get(cid, {}).get("baseline_fwd7d", 0) or 0
+            if (streak >= EXTREME_DRAIN_STREAK) and (baseline_val_persist <= 2):
+                bump_acc = 0.0
+
+            bump_mult = 1.0 + bump_acc
+            bump_mode = "seed"
+            if PERSISTENT_LOW_OVER_CURRENT_ENABLE and target <= local_ppm:
+                target = max(
+                    target,
+                    int(math.ceil(local_ppm * bump_mult)),
+                    local_ppm + int(PERSISTENT_LOW_MIN_STEP_PPM or 0)
+                )
+                bump_mode = "over_current"
+            else:
+                target = int(math.ceil(target * bump_mult))
+
+            if new_inbound:
+                target = target_base
+            lines.append(f"📈 Persistência: {alias} ({cid}) streak {streak} ⇒ bump {bump_acc*100:.0f}% ({bump_mode})")
+
+    # --- Ajuste por liquidez ---
+    target = liquidity_adjust(target, out_ratio, fwd_count, new_inbound)
+
+    # Discovery hard-drop
+    st_prev2 = state.get(cid, {}) or {}
+    first_seen_ts2 = st_prev2.get("first_seen_ts", int(time.time()))
+    days_since_first = (int(time.time()) - first_seen_ts2) / 86400 if first_seen_ts2 else 999
+    st_disc = state.get(cid, {}) or {}
+    last_explorer_exit = int(st_disc.get("explorer_last_exit_ts", 0) or 0)
+    explorer_seen = bool(st_disc.get("explorer_seen", False))
+    min_disc_age = DISCOVERY_AFTER_EXPLORER_DAYS * 86400
+    discovery_gate_ok = (not DISCOVERY_REQUIRE_EXPLORER) or (explorer_seen and (now_ts_local - last_explorer_exit) >= min_disc_age)
+    discovery_hard = (
+        DISCOVERY_ENABLE and
+        discovery_gate_ok and
+        fwd_count <= DISCOVERY_FWDS_MAX and
+        out_ratio > DISCOVERY_OUT_MIN and
+        days_since_first >= DISCOVERY_HARDDROP_DAYS_NO_BASE and
+        (state.get(cid, {}).get("baseline_fwd7d", 0) or 0) == 0
+    )
+    if discovery_hard:
+        target_base = seed_used + DISCOVERY_HARDDROP_COLCHAO
+        target = min(target, target_base + (target - (seed_used + COLCHAO_PPM)) * 0.5)
+
+    # --- BOOSTS que RESPEITAM o step cap ---
+    surge_tag = ""
+    top_tag = ""
+    negm_tag = ""
+    boosted_target = target
+
+    if (not new_inbound) and SURGE_ENABLE and out_ratio < SURGE_LOW_OUT_THRESH:
+        lack = max(0.0, (SURGE_LOW_OUT_THRESH - out_ratio) / SURGE_LOW_OUT_THRESH)
+        surge_bump = min(SURGE_BUMP_MAX, SURGE_K * lack)
+        if surge_bump > 0:
+            boosted_target = max(boosted_target, int(math.ceil(target * (1.0 + surge_bump))))
+            surge_tag = f"⚡surge+{int(surge_bump*100)}%"
+
+    if TOP_REVENUE_SURGE_ENABLE and rev_share >= TOP_OUTFEE_SHARE and out_ratio < 0.30:
+        boosted_target = max(boosted_target, int(math.ceil(target * (1.0 + TOP_REVENUE_SURGE_BUMP))))
+        top_tag = f"👑top+{int(TOP_REVENUE_SURGE_BUMP*100)}%"
+
+    if NEG_MARGIN_SURGE_ENABLE and margin_ppm_7d < 0 and fwd_count >= NEG_MARGIN_MIN_FWDS:
+        boosted_target = max(boosted_target, int(math.ceil(target * (1.0 + NEG_MARGIN_SURGE_BUMP))))
+        negm_tag = f"💹negm+{int(NEG_MARGIN_SURGE_BUMP*100)}%"
+
+    # clamp do alvo e guarda "no-down while low"
+    target = clamp_ppm(boosted_target)
+    # >>> PATCH [B’]: viés de queda quando usamos out como custo (source/router sem rebal)
+    # Força o target a tender ao out_ppm observado sempre que não estivermos "low".
+    if use_out_cost and (out_ppm_7d or 0) > 0:
+        not_low = (out_ratio >= PERSISTENT_LOW_THRESH)  # com seu threshold = 0.10
+
+        # Caso 1: algum bump/persistência empurrou target >= taxa atual → puxa para ~0.9× out_ppm
+        if not_low and target >= local_ppm:
+            target = clamp_ppm(int(round(out_ppm_7d * 0.90)))
+
+        # Caso 2: mesmo não estando acima da taxa, se ficou acima do out_ppm, puxa para ~0.9×
+        elif target > out_ppm_7d:
+            target = clamp_ppm(int(round(out_ppm_7d * 0.90)))
+
+        # Em SOURCE, ainda respeite preferência por alvo mais baixo relativo ao seed
+        if class_label == "source":
+            target = min(target, clamp_ppm(int(seed_used * SOURCE_SEED_TARGET_FRAC)))
 
-    # ENTRADA p/ classificar sources/routers
-    in_amt_sat_by_cid  = defaultdict(int)
-    in_count_by_cid    = defaultdict(int)
 
-    # Mapa cid(LNDg/SCID) -> pubkey
-    chan_pubkey = {}
-    for scid, info in live_by_scid.items():
-        if info.get("remote_pubkey"):
-            chan_pubkey[scid] = info.get("remote_pubkey")
-    for cid, info in live_by_cid.items():
-        if info.get("remote_pubkey") and cid not in chan_pubkey:
-            chan_pubkey[cid] = info.get("remote_pubkey")
-    for cid, meta in channels_meta.items():
-        if cid not in chan_pubkey and meta.get("remote_pubkey"):
-            chan_pubkey[cid] = meta.get("remote_pubkey")
+    pl_tags = []
+    if (not new_inbound) and out_ratio < PERSISTENT_LOW_THRESH and target < local_ppm:
+        # Exceção: em source/router sem rebal por canal (use_out_cost),
+        # permita cair até o "preço observado" (outrate) com folga do PEG.
+        if use_out_cost and fwd_count >= OUTRATE_PEG_MIN_FWDS and (out_ppm_7d or 0) > 0:
+            peg_limit = clamp_ppm(int(round(out_ppm_7d * (1.0 + OUTRATE_PEG_HEADROOM))))
+            # não baixar abaixo do PEG; mantém ainda acima do floor
+            target = max(target, peg_limit)
+            if DEBUG_TAGS:
+                # 👇 em vez de diag_tags, empurre para pl_tags
+                pl_tags.append("🧲peg-except-low")
+        else:
+            target = local_ppm
+            pl_tags.append("🙅‍♂️no-down-low")
 
-    incoming_msat_by_pub = defaultdict(int)
-
-    for (cid_in, cid_out, amt_in_msat, amt_out_msat, fee_sat, fwd_date) in rows:
-        if cid_out:
-            k = str(cid_out)
-            out_fee_sat[k] += int(fee_sat or 0)
-            out_amt_sat[k] += int((amt_out_msat or 0)/1000)
-            out_count[k]   += 1
-            fwd_dt = parse_sqlite_dt(fwd_date)
-            if fwd_dt and fwd_dt >= one_day_ago_naive:
-                out_amt_sat_1d[k] += int((amt_out_msat or 0)/1000)
-                out_count_1d[k]   += 1
-        if cid_in:
-            k = str(cid_in)
-            in_amt_sat_by_cid[k] += int((amt_in_msat or 0)/1000)
-            in_count_by_cid[k]   += 1
-            pub = chan_pubkey.get(k)
-            if pub:
-                incoming_msat_by_pub[pub] += int(amt_in_msat or 0)
-
-    total_incoming_msat = sum(incoming_msat_by_pub.values())
-    peer_count = max(1, len(incoming_msat_by_pub))
-    avg_share = 1.0 / peer_count if peer_count > 0 else 0.0
-
-    # Receita total de fees de saída
-    total_out_fee_sat = sum(out_fee_sat.values())
-
-    # ---- Custo de rebal (7d) GLOBAL e POR CANAL ----
-    cur.execute(SQL_REBAL_PAYMENTS, (to_sqlite_str(start_dt), to_sqlite_str(end_dt)))
-    pay_rows = cur.fetchall()
-
-    rebal_value_sat_global = 0
-    rebal_fee_sat_global   = 0
-    perchan_value_sat = defaultdict(int)
-    perchan_fee_sat   = defaultdict(int)
 
-    for (rebal_chan, value, fee, creation_date) in pay_rows:
-        v = int(value or 0)
-        f = int(fee or 0)
-        rebal_value_sat_global += v
-        rebal_fee_sat_global   += f
-
-        rcid = _norm_scid(rebal_chan)  # ✅ usa só SCID DECIMAL
-        if rcid:
-            perchan_value_sat[rcid] += v
-            perchan_fee_sat[rcid]   += f
-
-    rebal_cost_ppm_global = ppm(rebal_fee_sat_global, rebal_value_sat_global)
-    rebal_cost_ppm_by_chan = {
-        cid: ppm(perchan_fee_sat[cid], perchan_value_sat[cid]) for cid in perchan_value_sat.keys()
-    }
+    if super_source_active:
+        target = MIN_PPM
+        if DEBUG_TAGS:
+            pl_tags.append("super-source:target0")
 
-    # --- Robustez: só usa custo por canal se teve volume mínimo ---
-    rebal_cost_ppm_by_chan_use = {}
-    for cid_k in set(list(perchan_value_sat.keys()) + list(rebal_cost_ppm_by_chan.keys())):
-        if perchan_value_sat.get(cid_k, 0) >= REBAL_PERCHAN_MIN_VALUE_SAT:
-            rebal_cost_ppm_by_chan_use[cid_k] = rebal_cost_ppm_by_chan.get(cid_k, 0)
-    # --- Margem global 7d (para travas defensivas)
-    out_ppm_total = ppm(sum(out_fee_sat.values()), sum(out_amt_sat.values()))
-    neg_margin_global = (
-        bool(rebal_cost_ppm_global) and bool(out_ppm_total) and out_ppm_total < rebal_cost_ppm_global
-    )
+    # ---- STEP CAP dinâmico ----
+    cap_frac = core.cap_frac
+    
     
 
-    # ==== SHARDING SLOT ====
+    # Discovery mode
+    discovery_hit = False
+    if DISCOVERY_ENABLE and discovery_gate_ok and fwd_count <= DISCOVERY_FWDS_MAX and out_ratio > DISCOVERY_OUT_MIN:
+        discovery_hit = True
+        cap_frac = max(cap_frac, STEP_CAP_IDLE_DOWN)
+        if discovery_hard and local_ppm > target:
+            cap_frac = max(cap_frac, DISCOVERY_HARDDROP_CAP_FRAC)
+            
+    # >>> FIX: lock só com base concreta local (sem depender de floor_src ainda não decidido)
+    st_m = state.get(cid, {}) or {}
+    ttl = 21 * 24 * 3600
     now_ts = int(time.time())
-    shard_slot = None
-    if SHARDING_ENABLE:
-        shard_slot = (now_ts // 3600) % SHARD_MOD
-
-    report = []
-    hdr = f"{'DRY-RUN ' if dry_run else ''}⚙️ AutoFee v{vstr} | janela {LOOKBACK_DAYS}d | rebal≈ {int(rebal_cost_ppm_global)} ppm (gui_payments)"
 
-    if SHARDING_ENABLE:
-        hdr += f" | shard {shard_slot+1}/{SHARD_MOD}"
-    report.append(hdr)
+    has_recent_rebal = (
+        (cid in rebal_cost_ppm_by_chan_use and (rebal_cost_ppm_by_chan_use.get(cid) or 0) > 0)
+        or (
+            (st_m.get("last_rebal_cost_ppm") or 0) > 0
+            and (now_ts - int(st_m.get("last_rebal_cost_ts") or 0) <= ttl)
+        )
+    )
 
-    # --- métricas p/ resumo ---
-    changed_up = changed_down = kept = 0
-    low_out_count = 0
-    unmatched = 0
-    offline_skips = 0
-    shard_skips = 0
-    excl_dry_up = excl_dry_down = excl_dry_kept = 0
-    max_hits = 0  # << telemetria: canais que ficaram no MAX_PPM
-    inbound_changed = 0  # 👈 novo contador: qualquer mudança de inbound
+    has_recent_outrate = (
+        ((out_ppm_7d or 0) > 0 and fwd_count >= OUTRATE_PEG_MIN_FWDS)
+        or (
+            (st_m.get("last_outrate_ppm") or 0) > 0
+            and (now_ts - int(st_m.get("last_outrate_ts") or 0) <= ttl)
+        )
+    )
 
-    chan_status_cache = cache.get(OFFLINE_STATUS_CACHE_KEY, {})
+    can_lock_globally = bool(has_recent_rebal or has_recent_outrate)
+
+    # NEW INBOUND: step cap maior só para reduzir
+    if new_inbound and local_ppm > target:
+        cap_frac = max(cap_frac, NEW_INBOUND_DOWN_STEPCAP_FRAC)
+
+    lock_skip_tag = None
+
+    # === Travamento quando a operação 7d está negativa (com suavização opcional) ===
+    if params.neg_margin_global:
+        if can_lock_globally:
+            allow_soften = False
+            if GLOBAL_NEG_LOCK_SOFTEN_ENABLE:
+                # Canal saudável: muita liquidez local e margem 7d do canal >= 0 (se exigido)
+                chan_ok = (out_ratio >= SOFTEN_MIN_OUT_RATIO)
+                if SOFTEN_REQUIRE_POS_CHAN_MARGIN:
+                    chan_ok = chan_ok and (margin_ppm_7d >= 0)
+                if chan_ok and (not discovery_hit) and (not new_inbound):
+                    allow_soften = True
+
+            # 🔹 EXCEÇÃO: não aplicar hard lock em SINK lucrativo
+            if class_label == "sink" and margin_ppm_7d > SINK_MIN_MARGIN:
+                # não faz nada aqui: o canal segue o fluxo normal, sem travar em local_ppm
+                lock_skip_tag = "🔓 sink-lucrativo-global-neg"
+                # opcional: reforça um step cap mínimo para evitar queda brusca
+                cap_frac = max(cap_frac, STEP_CAP)
+
+            elif (target < local_ppm) and (not discovery_hit) and (not new_inbound):
+                if allow_soften:
+                    # Permitir queda, mas limitada por PEG/FLOOR e step-cap
+                    # Se houver out_ppm_7d, não descer agressivamente abaixo dele
+                    if (out_ppm_7d or 0) > 0:
+                        peg_floor = int(round(out_ppm_7d * SOFTEN_MAX_DROP_TO_PEG_FRAC))
+                        target = max(target, peg_floor)
+                else:
+                    target = local_ppm  # mantém lock total
+                    global_neg_lock_applied = True
 
-    for cid in sorted(open_cids):
-        meta = channels_meta.get(cid, {})
-        alias = meta.get("alias", "Unknown")
-        local_ppm = meta.get("local_ppm", 0)
-        remote_ppm = int(meta.get("remote_fee_rate") or 0)   # NEW
-        floor_src = "none"
+            # Mais fôlego para subir quando o global está no vermelho
+            cap_frac = max(cap_frac, STEP_CAP + 0.05)
 
-        # opcional: helper para não repetir
-        fee_lr_str = f"💱 fee L/R {local_ppm}/{remote_ppm}ppm"  # NEW
+        else:
+            # Diagnóstico: lock global "skipado" por falta de base por canal
+            if (target < local_ppm) and (not discovery_hit) and (not new_inbound):
+                lock_skip_tag = "🛡️lock-skip(no-chan-rebal)"
+
+    # Extreme drain mode — acelera SUBIDAS
+    STEP_MIN_STEP_PPM_UP = STEP_MIN_STEP_PPM
+    if EXTREME_DRAIN_ENABLE:
+        low_streak_val = state.get(cid, {}).get("low_streak", 0)
+        baseline_val = state.get(cid, {}).get("baseline_fwd7d", 0) or 0
+        if (low_streak_val >= EXTREME_DRAIN_STREAK and
+            out_ratio < EXTREME_DRAIN_OUT_MAX and
+            baseline_val > 0 and
+            target > local_ppm):
+            cap_frac = max(cap_frac, EXTREME_DRAIN_STEP_CAP)
+            STEP_MIN_STEP_PPM_UP = max(STEP_MIN_STEP_PPM_UP, EXTREME_DRAIN_MIN_STEP_PPM)
+
+        # TURBO: streak MUITO alto + out ≤1%
+        if EXTREME_DRAIN_TURBO_ENABLE and target > local_ppm:
+            if (low_streak_val >= EXTREME_DRAIN_TURBO_STREAK_MIN and
+                out_ratio <= EXTREME_DRAIN_TURBO_OUT_MAX and
+                baseline_val > 0):
+                cap_frac = max(cap_frac, EXTREME_DRAIN_TURBO_STEP_CAP)
+                STEP_MIN_STEP_PPM_UP = max(STEP_MIN_STEP_PPM_UP, EXTREME_DRAIN_TURBO_MIN_STEP_PPM)
+                # marque no log
+                if DEBUG_TAGS:
+                    diag_tag_extreme = f"⚡surge+{int((EXTREME_DRAIN_TURBO_STEP_CAP-STEP_CAP)*100)}%"
+                    # evita duplicar se já existir surge; e adiciona sinalizador explícito:
+                    if diag_tag_extreme not in (surge_tag or ""):
+                        pass  # será adicionado abaixo via diag_tags
+                # coloque uma flag simples p/ inserir tag
+                extreme_turbo_applied = True
+    else:
+        STEP_MIN_STEP_PPM_UP = STEP_MIN_STEP_PPM
         extreme_turbo_applied = False
 
-        # snapshot
-        live_info = live_by_scid.get(cid)
-        if (not live_info) and has_chan_point:
-            cp = meta.get("chan_point")
-            if cp:
-                live_info = live_by_point.get(cp)
-        if not live_info:
-            # Fallback to chan_id mapping when scid is missing or not aligned.
-            live_info = live_by_cid.get(cid)
-
-        pubkey = (live_info or {}).get("remote_pubkey") or meta.get("remote_pubkey")
-        chan_point = (live_info or {}).get("chan_point") or meta.get("chan_point")
-        if not pubkey:
-            unmatched += 1
 
-        # ==== EXCLUSION: vira DRY-RUN especial ====
-        is_excluded = (pubkey in EXCLUSION_LIST) if pubkey else False
-
-        # ---- SHARDING: pular canais não pertencentes ao slot atual ----
-        if SHARDING_ENABLE:
-            try:
-                cid_int = int(cid)
-            except Exception:
-                digits = ''.join([c for c in cid if c.isdigit()])
-                cid_int = int(digits[-6:] or "0")
-            if (cid_int % SHARD_MOD) != shard_slot:
-                shard_skips += 1
-                report.append(f"⏭️🧩 {alias} ({cid}) skip (shard {shard_slot+1}/{SHARD_MOD})")
-                continue
-
-        # --- OFFLINE SKIP: detecta status e persiste em cache ---
-        now_ts = int(time.time())
-        active_flag = (live_info or {}).get("active", None)
-        prev = chan_status_cache.get(cid, {})
-        prev_active = prev.get("active", None)
-        status_entry = {
-            "alias": alias,
-            "active": 1 if active_flag else 0 if active_flag is not None else None,
-            "last_seen": now_ts,
-            "last_online": prev.get("last_online"),
-            "last_offline": prev.get("last_offline"),
-        }
-        if active_flag is True:
-            status_entry["last_online"] = now_ts
-        elif active_flag is False:
-            status_entry["last_offline"] = status_entry.get("last_offline", now_ts)
-        chan_status_cache[cid] = status_entry
-        cache[OFFLINE_STATUS_CACHE_KEY] = chan_status_cache
-
-        # monta tag de status
-        status_tags = []
-        if active_flag is True:
-            status_tags.append("🟢on")
-            if prev_active == 0:
-                status_tags.append("🟢back")
-        elif active_flag is False:
-            status_tags.append("🔴off")
-
-        # Se sabemos que está offline, faz skip cedo
-        if OFFLINE_SKIP_ENABLE and active_flag is False:
-            offline_skips += 1
-            if is_excluded and not EXCL_DRY_VERBOSE:
-                report.append(f"⏭️🔌 {alias}: 🚷excl-dry")
-                continue
+    # bônus leve de reatividade em ROUTER
+    if class_label == "router":
+        cap_frac = router_step_cap_frac(cap_frac)
+    
+    # >>> ITEM 6: TARGET/STEPCAP – quedas mais rápidas e com queda mínima
+    # Explorer acelera a queda e garante um drop mínimo por rodada
+    if EXPLORER_ENABLE and explorer_active and target < local_ppm:
+        # acelera a QUEDA: usa step-cap especial do Explorer (>= ao cap atual)
+        cap_frac = max(cap_frac, EXPLORER_STEP_CAP_DOWN)
+        # garante uma QUEDA MÍNIMA proporcional à taxa atual
+        min_drop_ppm = int(math.ceil(local_ppm * EXPLORER_MIN_DROP_FRAC))
+        target = min(target, local_ppm - min_drop_ppm)
+
+
+    raw_step_ppm = step_toward(local_ppm, target, cap_frac, STEP_MIN_STEP_PPM_UP)
+
+    # Circuit breaker
+    state_all = state.get(cid, {})
+    last_ppm  = state_all.get("last_ppm", local_ppm)
+    last_dir  = state_all.get("last_dir", "flat")
+    last_ts   = state_all.get("last_ts", 0)
+    baseline  = state_all.get("baseline_fwd7d", None)
+
+    if last_dir == "up" and (now_ts - last_ts) <= CB_GRACE_DAYS*24*3600 and baseline:
+        if baseline > 0 and fwd_count < baseline * CB_DROP_RATIO:
+            raw_step_ppm = clamp_ppm(int(raw_step_ppm * (1.0 - CB_REDUCE_STEP)))
+            lines.append(f"🧯 CB: {alias} ({cid}) fwd {fwd_count}<{int(baseline*CB_DROP_RATIO)} ⇒ recuo {int(CB_REDUCE_STEP*100)}%")
+            symptoms.append("cb_trigger")
+    
+    # Cálculo auxiliar: piso que viria do rebal por canal (para reforço em SINK)
+    rebal_floor_ppm = core.rebal_floor_ppm
 
-            since_off = fmt_duration(now_ts - (status_entry.get("last_offline") or now_ts))
-            last_on = status_entry.get("last_online")
-            last_on_ago = fmt_duration(now_ts - last_on) if last_on else "n/a"
-            extra = " 🚷excl-dry" if is_excluded else ""
-            report.append(f"⏭️🔌 {alias} ({cid}) skip: canal offline ({since_off}) | last_on≈{last_on_ago} | local {local_ppm} ppm{extra}")
-            if (not dry_run) and (not is_excluded):
-                st = state.get(cid, {}).copy()
-                st["last_seed"] = float(st.get("last_seed", 0.0))
-                state[cid] = st
-            continue
+    
+    # ---- Floor reasons (tracking)
+    floor_src = "none"
+    outrate_floor = None
+    outrate_peg_ppm = None
+    rebal_floor_ppm_track = MIN_PPM  # se precisar de uma variável “limpa” só para exibir
+    outrate_peg_active = False  # <- garante que exista em todos os caminhos
+
+    # Piso de rebal conforme REBAL_COST_MODE
+    # >>> PATCH: pure per-channel floor (no global)
+    if REBAL_FLOOR_ENABLE:
+        base_cost, base_src = pick_floor_base_per_channel(
+            cid, seed_used,
+            rebal_cost_ppm_by_chan_use=rebal_cost_ppm_by_chan_use,
+            out_ppm_7d=out_ppm_7d, fwd_count=fwd_count,
+            state=state, now_ts=int(time.time()),
+            outrate_fwds_min=OUTRATE_PEG_MIN_FWDS,
+            mem_ttl_days=21
+        )
 
-        # prossegue normal (online ou status desconhecido)
-        cap   = int((live_info or {}).get("capacity", 0))
-        local = int((live_info or {}).get("local_balance", 0))
-        remote= int((live_info or {}).get("remote_balance", 0))
-        out_ratio = (local / cap) if cap > 0 else 0.5
-        if out_ratio < PERSISTENT_LOW_THRESH:
-            low_out_count += 1
+        if base_src.startswith("rebal"):
+            # rebal → piso por custo de rebal com margem
+            floor_ppm = rebal_cost_floor(base_cost)
+        elif base_src.startswith("outrate"):
+            # outrate → peg natural com headroom
+            floor_ppm = clamp_ppm(math.ceil(base_cost * (1.0 + OUTRATE_PEG_HEADROOM)))
+        else:
+            # amboss/seed → referência mínima conservadora
+            floor_ppm = clamp_ppm(int(round(max(base_cost, MIN_PPM))))
 
-        # detecção de initiator (se o peer abriu, initiator=False)
-        initiator = (live_info or {}).get("initiator", None)
+        floor_src = base_src
+    else:
+        floor_ppm = MIN_PPM
+        floor_src = "none"
+    
+    # Custo REAL de rebal 7d por canal (sem fallback),
+    # vindo direto do LNDg (rebal_cost_ppm_by_chan_use)
+    rebal_ppm7d_real = int(round(rebal_cost_ppm_by_chan_use.get(cid, 0) or 0))
+
+    # --- Valor de rebal para exibição (7d) — agora que floor_src está definido ---
+    if floor_src == "rebal7d":
+        rebal_ppm7d_val = int(round(rebal_cost_ppm_by_chan_use.get(cid, 0) or 0))
+        rebal_ppm7d_str = f"{rebal_ppm7d_val}"
+    elif floor_src == "rebal21d":
+        rebal_ppm7d_val = int(round(state.get(cid, {}).get("last_rebal_cost_ppm", 0) or 0))
+        rebal_ppm7d_str = f"{rebal_ppm7d_val}(mem)"
+    elif floor_src == "outrate7d":
+        rebal_ppm7d_val = int(round(out_ppm_7d or 0))
+        rebal_ppm7d_str = f"{rebal_ppm7d_val}(out)"
+    elif floor_src == "outrate21d":
+        rebal_ppm7d_val = int(round(state.get(cid, {}).get("last_outrate_ppm", 0) or 0))
+        rebal_ppm7d_str = f"{rebal_ppm7d_val}(out-mem)"
+    else:
+        rebal_ppm7d_val = int(round(seed_used or 0))
+        rebal_ppm7d_str = f"{rebal_ppm7d_val}(amboss)"
+
+
+    # >>> PATCH: skip extra outrate-floor if base already outrate
+    if not floor_src.startswith("outrate"):
+        # Outrate floor dinâmico (só aumenta)
+        outrate_floor_active = OUTRATE_FLOOR_ENABLE
+        if EXPLORER_ENABLE and explorer_active and EXPLORER_BYPASS_OUTRATE:
+            outrate_floor_active = False
+        outrate_factor = OUTRATE_FLOOR_FACTOR
+        if OUTRATE_FLOOR_DYNAMIC_ENABLE:
+            if fwd_count < OUTRATE_FLOOR_DISABLE_BELOW_FWDS:
+                outrate_floor_active = False
+            elif fwd_count < 10:
+                outrate_factor = OUTRATE_FLOOR_FACTOR_LOW
+        if discovery_hit:
+            outrate_floor_active = False
+        if class_label == "source" and SOURCE_DISABLE_OUTRATE_FLOOR:
+            outrate_floor_active = False
+        if fwd_count == 0:
+            outrate_floor_active = False
+
+        if outrate_floor_active and fwd_count >= OUTRATE_FLOOR_MIN_FWDS and out_ppm_7d > 0:
+            outrate_floor = clamp_ppm(math.ceil(out_ppm_7d * outrate_factor))
+            prev_floor = floor_ppm
+            floor_ppm = max(floor_ppm, outrate_floor)
+            if floor_ppm != prev_floor:
+                floor_src = "outrate"
 
-        out_ppm_7d = ppm(out_fee_sat.get(cid, 0), out_amt_sat.get(cid, 0))
-        fwd_count  = out_count.get(cid, 0)
+    # >>> PATCH: skip extra PEG if base already outrate
+    if not floor_src.startswith("outrate"):
+        # >>> OUTRATE PEG — cola o piso no preço observado (independente do outrate_floor)
         
-        # Fração do volume de saída 7d vs capacidade do canal (para critério do Explorer)
-        out_amt_7d = out_amt_sat.get(cid, 0)  # em sat
-        out_amt_1d = out_amt_sat_1d.get(cid, 0)
-        out_amt_frac_7d = (out_amt_7d / cap) if cap > 0 else 0.0
-
-        # >>> PATCH: memorize per-channel rebal cost (21d fallback)
-        if cid in rebal_cost_ppm_by_chan_use:
-            st_m = state.get(cid, {}).copy()
-            st_m["last_rebal_cost_ppm"] = float(rebal_cost_ppm_by_chan_use.get(cid) or 0.0)
-            st_m["last_rebal_cost_ts"]  = int(time.time())
-            state[cid] = st_m
-        # >>> PATCH: memorize per-channel outrate (21d fallback)
-        if (out_ppm_7d or 0) > 0 and fwd_count >= OUTRATE_PEG_MIN_FWDS:
-            st_m = state.get(cid, {}).copy()
-            st_m["last_outrate_ppm"] = float(out_ppm_7d)
-            st_m["last_outrate_ts"]  = int(time.time())
-            state[cid] = st_m
-
-        # Flag local para marcar se aplicamos o lock global
-        global_neg_lock_applied = False
-        # in/out por canal p/ classificação
-        in_amt      = in_amt_sat_by_cid.get(cid, 0)
-        in_count    = in_count_by_cid.get(cid, 0)
-        out_amt     = out_amt_sat.get(cid, 0)
-        out_cnt     = out_count.get(cid, 0)
-        total_val   = in_amt + out_amt
-        total_fwds  = in_count + out_cnt
-
-        # Seed (Amboss) com guard
-        seed_used, seed_raw, seed_p95, seed_flags = seed_with_guard(pubkey, cache, state, cid)
-        if seed_used is None:
-            seed_used = 200.0  # fallback
+        if OUTRATE_PEG_ENABLE and fwd_count >= OUTRATE_PEG_MIN_FWDS and out_ppm_7d > 0:
+            if not (EXPLORER_ENABLE and explorer_active and EXPLORER_BYPASS_OUTRATE):
+                outrate_peg_active = True
+                outrate_peg_ppm = clamp_ppm(int(round(out_ppm_7d * (1.0 + OUTRATE_PEG_HEADROOM))))
             
-        # >>> ADD: seed híbrido (mediana/volatilidade/ratio)
-        seed_used, seed_adj_tags = build_enhanced_seed(pubkey, seed_used, cache)
-
-        # Ponderação pelo volume de ENTRADA do peer
-        if total_incoming_msat > 0 and VOLUME_WEIGHT_ALPHA > 0 and pubkey:
-            share = incoming_msat_by_pub.get(pubkey, 0) / total_incoming_msat
-            factor = 1.0 + VOLUME_WEIGHT_ALPHA * (share - avg_share)
-            seed_used *= max(0.7, min(1.3, factor))
-
-        # EMA leve no seed (suaviza saltos)
-        prev_seed_for_ema = (state.get(cid, {}) or {}).get("last_seed")
-        if SEED_EMA_ALPHA and SEED_EMA_ALPHA > 0 and prev_seed_for_ema and prev_seed_for_ema > 0:
-            seed_used = float(prev_seed_for_ema)*(1.0 - SEED_EMA_ALPHA) + float(seed_used)*SEED_EMA_ALPHA
-
-        # tags do guard do seed
-        seed_tags = []
-        for fl in (seed_flags or []):
-            if fl == "p95": seed_tags.append("🧬seedcap:p95")
-            elif fl.startswith("prev+"): seed_tags.append("🧬seedcap:" + fl)
-            elif fl == "abs": seed_tags.append("🧬seedcap:abs")
-        if not seed_flags and DEBUG_TAGS:
-            seed_tags.append("🧬seedcap:none")
+                prev_floor = floor_ppm
+                floor_ppm = max(floor_ppm, outrate_peg_ppm)
+                if floor_ppm != prev_floor:
+                    floor_src = "peg"
+
+
+    # SINK — reforço: nunca abaixo do piso de rebal por canal (com margem)
+    if class_label == "sink" and SINK_KEEP_FLOOR_AT_REBAL_COST:
+        prev_floor = floor_ppm
+        floor_ppm = max(floor_ppm, rebal_floor_ppm)
+        if floor_ppm != prev_floor and floor_src not in ("peg", "outrate"):
+            floor_src = "rebal"   # reforço do rebal para sink
+
+    # Regras extras existentes para SINK continuam válidas
+    if class_label == "sink":
+        extra = clamp_ppm(int(math.ceil((base_cost_for_margin or 0) * SINK_EXTRA_FLOOR_MARGIN)))
+        prev_floor = floor_ppm
+        floor_ppm = max(floor_ppm, extra)
+        if floor_ppm != prev_floor and floor_src not in ("peg", "outrate", "rebal"):
+            floor_src = "sink-extra"
+    # Cap do floor pelo seed — pulado em SINK se configurado
+    seed_cap_ppm = clamp_ppm(int(math.ceil(seed_used * REBAL_FLOOR_SEED_CAP_FACTOR)))
+    apply_seed_cap = True
+    if (class_label == "sink" and SINK_SKIP_SEED_CAP):
+        apply_seed_cap = False
+    if EXPLORER_ENABLE and explorer_active and EXPLORER_BYPASS_SEEDCAP:
+        apply_seed_cap = False
+
+    if apply_seed_cap:
+        prev_floor = floor_ppm
+        floor_ppm = min(floor_ppm, seed_cap_ppm)
+        if floor_ppm != prev_floor and floor_src not in ("peg", "outrate", "rebal", "sink-extra"):
+            floor_src = "seed-cap"
+
+
+    # ⬇️ NOVO: em discovery, desligar piso de rebal (deixa só o MIN_PPM)
+    if discovery_hit:
+        prev_floor = floor_ppm
+        floor_ppm = max(MIN_PPM, min(floor_ppm, MIN_PPM))
+        if floor_ppm != prev_floor:
+            floor_src = "none"
             
-        # >>> ADD: tags de debug dos novos ajustes
-        if DEBUG_TAGS and seed_adj_tags:
-            seed_tags.extend(seed_adj_tags)
-        
-        # Debug: mostrar p65/p95 também
-        if DEBUG_TAGS:
-            if seed_raw is not None:
-                seed_tags.append(f"🧬p65:{int(seed_raw)}")
-            if seed_p95 is not None:
-                seed_tags.append(f"🧬p95:{int(seed_p95)}")
+    # === EXPLORER 5.3: respeitar piso de rebal mesmo explorando ===
+    # Garante que, durante o Explorer, o floor nunca fique abaixo do custo de rebal por canal (com margem),
+    # mesmo se o Discovery tiver zerado o piso.
+    if EXPLORER_ENABLE and explorer_active and EXPLORER_RESPECT_REBAL_FLOOR:
+        if floor_ppm < rebal_floor_ppm:
+            floor_ppm = rebal_floor_ppm
+            if floor_src not in ("peg", "outrate"):
+                floor_src = "rebal"
+
+
+    # Cálculo final com piso
+    if super_source_active:
+        floor_ppm = MIN_PPM
+        floor_src = "super-source"
+
+    final_ppm = max(raw_step_ppm, floor_ppm)
+
+    # Revenue floor — piso adicional por tráfego (super-rotas)
+    if REVFLOOR_ENABLE and not super_source_active:
+        baseline_eff = state.get(cid, {}).get("baseline_fwd7d", 0) or 0
+        if baseline_eff >= REVFLOOR_BASELINE_THRESH:
+            revfloor_seed = clamp_ppm(int(max(seed_used * 0.40, REVFLOOR_MIN_PPM_ABS)))
+            final_ppm = max(final_ppm, revfloor_seed)
+
+    # SOURCE — preferir alvo mais baixo relativo ao seed (quando for QUEDA)
+    if class_label == "source" and final_ppm < local_ppm:
+        pref = clamp_ppm(int(seed_used * SOURCE_SEED_TARGET_FRAC))
+        final_ppm = min(final_ppm, pref)
+
+    # 1) Âncoras dinâmicas
+    base_ceiling = int(seed_used * SEED_CEILING_MULT)
+    seed_floor   = int(seed_used * SEED_FLOOR_MULT)
+    p95_floor    = int((seed_p95 or seed_used) * P65_BOOST)
+    
+    # 2) Teto base: NÃO usa final_ppm como âncora, só referências "de mercado"
+    local_max = min(
+        MAX_PPM,
+        max(MIN_SOFT_CEILING, base_ceiling, seed_floor, p95_floor)
+    )
 
-            
-        # persistir last_seed cedo (só se não for excl-dry e não for --dry-run)
-        if (not dry_run) and (not is_excluded):
-            st_tmp = state.get(cid, {}).copy()
-            st_tmp.setdefault("first_seen_ts", int(time.time()))
-            st_tmp["last_seed"] = float(seed_used)
-            state[cid] = st_tmp
-
-        # --- Métricas de lucro p/ boosts ---
-        base_cost_for_margin = pick_rebal_cost_for_floor(cid, rebal_cost_ppm_by_chan_use, rebal_cost_ppm_global)
-        margin_ppm_7d = int(round(out_ppm_7d - (base_cost_for_margin * (1.0 + REBAL_FLOOR_MARGIN)))) if base_cost_for_margin else int(round(out_ppm_7d))
-        rev_share = (out_fee_sat.get(cid, 0) / total_out_fee_sat) if total_out_fee_sat > 0 else 0.0
-
-
-        # --- Alvo BASE: seed + colchão ---
-        target_base = seed_used + COLCHAO_PPM
-        target = target_base
-
-        # ==== NEW INBOUND NORMALIZE (detecção) ====
-        st_prev = state.get(cid, {}) or {}
-        first_seen_ts = st_prev.get("first_seen_ts", int(time.time()))
-        hours_since_first = (int(time.time()) - first_seen_ts) / 3600 if first_seen_ts else 999
-
-        need_big_drop_vs_seed = (local_ppm >= max(seed_used*(1.0+NEW_INBOUND_MIN_DIFF_FRAC), seed_used + NEW_INBOUND_MIN_DIFF_PPM))
-        peer_opened = (initiator is False)  # se info disponível
-        new_inbound = (
-            NEW_INBOUND_NORMALIZE_ENABLE and
-            hours_since_first <= NEW_INBOUND_GRACE_HOURS and
-            out_ratio <= NEW_INBOUND_OUT_MAX and
-            (not fwd_count if NEW_INBOUND_REQUIRE_NO_FWDS else True) and
-            need_big_drop_vs_seed and
-            (peer_opened if initiator is not None else True)
+    # 3) Turbo para SINK super drenado e com margem ≥ 0  (mantém igual)
+    if class_label == "sink" and out_ratio < PERSISTENT_LOW_THRESH and margin_ppm_7d >= SINK_MIN_MARGIN:
+        local_max = MAX_PPM
+    else:
+        # Exceções de demanda: se há demanda real, não estrangular pelo teto
+        demand_exception = (
+            (OUTRATE_PEG_ENABLE and fwd_count >= OUTRATE_PEG_MIN_FWDS and out_ppm_7d >= seed_used * OUTRATE_PEG_SEED_MULT)
+            or (out_ratio < PERSISTENT_LOW_THRESH)  # drenado: não forçar queda por teto
         )
-        # === Explorer: detecção de platô e ciclo de vida ===
-        explorer_active = False
-        explorer_armed = False
-        explorer_reason = ""
-        exp_st = _get_explorer_state(state, cid)
-
-        now_ts_local = int(time.time())
-        last_change_ts = (state.get(cid, {}) or {}).get("last_ts", 0)
-        days_since_change = (now_ts_local - last_change_ts) / 86400 if last_change_ts else 999
-
-        if EXPLORER_ENABLE:
-            # Condição para armar/ativar (canal cheio e parado)
-            if not exp_st.get("active", False):
-                cond_stale = (days_since_change >= EXPLORER_MIN_DAYS_STALE)
-                cond_full  = (out_ratio >= EXPLORER_OUT_MIN)
-                cond_idle  = (fwd_count <= EXPLORER_MAX_FWDS_7D) or (out_amt_frac_7d <= EXPLORER_MAX_AMT_FRAC_7D)
-                if cond_stale and cond_full and cond_idle:
-                    explorer_armed = True
-                    explorer_active = True
-                    _set_explorer_state(
-                        state, cid,
-                        active=True,
-                        started_ts=now_ts_local,
-                        rounds=0,
-                        fwds_at_start=fwd_count,
-                        ppm_at_start=local_ppm,
-                        reason=f"stale{int(days_since_change)}d full{int(out_ratio*100)}% idle"
-                    )
-                    explorer_reason = "activate"
-            else:
-                explorer_active = True
-                # Critérios de saída: tráfego apareceu, timeout ou rounds excedidos
-                rounds = int(exp_st.get("rounds", 0))
-                fwds_since_start = max(0, fwd_count - int(exp_st.get("fwds_at_start", 0)))
-                hours_since_start = (now_ts_local - int(exp_st.get("started_ts", now_ts_local))) / 3600
-
-                if (fwds_since_start >= EXPLORER_EXIT_FWDS) or (hours_since_start >= EXPLORER_EXIT_HOURS) or (rounds >= EXPLORER_MAX_ROUNDS):
-                    explorer_active = False
-                    _clear_explorer_state(state, cid)
-                    explorer_reason = "exit"
-                    st_x = state.get(cid, {}).copy()
-                    st_x["explorer_seen"] = True
-                    st_x["explorer_last_exit_ts"] = now_ts_local
-                    if not dry_run:
-                        state[cid] = st_x
-                    elif dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
-                        state[cid] = st_x
-        if EXPLORER_ENABLE:
-            if explorer_armed:
-                # Mostra já o motivo "fresco" (mesma fórmula usada no _set_explorer_state)
-                reason_txt = f"stale{int(days_since_change)}d full{int(out_ratio*100)}% idle"
-                report.append(f"🧭 {alias} ({cid}) explorer: ON — {reason_txt}")
-            elif explorer_reason == "exit":
-                report.append(f"🧭 {alias} ({cid}) explorer: OFF (exit criteria met)")
-
-
-        # --- Classificação dinâmica sink/source/router ---
-        class_label = st_prev.get("class_label", "unknown")
-        class_conf  = float(st_prev.get("class_conf", 0.0))
-        bias_prev   = float(st_prev.get("bias_ema", 0.0))
-
-        bias_raw = 0.0
-        if total_val > 0:
-            bias_raw = (out_amt - in_amt) / float(total_val)  # [-1..1], >0 tende a sink, <0 tende a source
-        bias_ema = (1.0 - CLASS_BIAS_EMA_ALPHA) * bias_prev + CLASS_BIAS_EMA_ALPHA * bias_raw if CLASSIFY_ENABLE else bias_raw
-
-        # Decisão somente com amostra mínima e volume relevante
-        cand_label = "unknown"
-        cand_conf  = 0.0
-
-        if CLASSIFY_ENABLE and total_fwds >= CLASS_MIN_FWDS and total_val >= CLASS_MIN_VALUE_SAT:
-            if (bias_ema >= SINK_BIAS_MIN) and (out_ratio < SINK_OUTRATIO_MAX):
-                cand_label = "sink"
-                cand_conf  = min(1.0, (bias_ema - SINK_BIAS_MIN) / (1.0 - SINK_BIAS_MIN) + 0.3)
-            elif (bias_ema <= -SOURCE_BIAS_MIN) and (out_ratio > SOURCE_OUTRATIO_MIN):
-                cand_label = "source"
-                cand_conf  = min(1.0, ((-bias_ema) - SOURCE_BIAS_MIN) / (1.0 - SOURCE_BIAS_MIN) + 0.3)
-            elif abs(bias_ema) <= ROUTER_BIAS_MAX and in_count > 0 and out_cnt > 0:
-                cand_label = "router"
-                cand_conf  = min(1.0, (ROUTER_BIAS_MAX - abs(bias_ema)) / ROUTER_BIAS_MAX + 0.3)
-
-        # boosts conservadores pró-source
-        no_rebal_to_this_chan = (perchan_value_sat.get(cid, 0) == 0)
-        if cand_label in ("unknown", "source") and no_rebal_to_this_chan and bias_ema <= -(SOURCE_BIAS_MIN - 0.05):
-            cand_label = "source"
-            cand_conf  = min(1.0, cand_conf + 0.20)
-
-        if pubkey and total_incoming_msat > 0:
-            share = incoming_msat_by_pub.get(pubkey, 0) / total_incoming_msat
-            in_p65 = cache.get(f"incoming_p65_7d:{pubkey}")
-            if in_p65 is None:
-                series_entry = cache.get(f"incoming_series_7d:{pubkey}")
-                if isinstance(series_entry, dict) and series_entry.get("vals"):
-                    vs = sorted(series_entry["vals"])
-                    pos = 0.65 * (len(vs) - 1)
-                    lo, hi = int(pos), int(math.ceil(pos))
-                    in_p65 = vs[lo] if lo == hi else vs[lo]*(hi - pos) + vs[hi]*(pos - lo)
-                    cache[f"incoming_p65_7d:{pubkey}"] = in_p65
-            if share >= (avg_share * 1.8) and bias_ema <= - (SOURCE_BIAS_MIN - 0.03):
-                cand_label = "source"
-                cand_conf  = min(1.0, cand_conf + 0.10)
-
-        # Histerese de classe
-        if cand_label != "unknown":
-            if class_label == "unknown":
-                class_label, class_conf = cand_label, cand_conf
-            else:
-                if cand_label != class_label:
-                    if cand_conf >= (class_conf + CLASS_CONF_HYSTERESIS):
-                        class_label, class_conf = cand_label, cand_conf
-                else:
-                    class_conf = min(1.0, 0.5*class_conf + 0.5*cand_conf)
-
-        # --- Super-source (auto) ---
-        super_source_active = False
-        super_source_warm = False
-        super_source_like = False
-        ss_ratio_1d = 0.0
-        ss_ratio_7d = 0.0
-        ss_vol_1d = False
-        ss_vol_7d = False
-        if SUPER_SOURCE_ENABLE:
-            super_source_like = (class_label == "router")
-            ss_ratio_1d = (out_amt_1d / cap) if cap > 0 else 0.0
-            ss_ratio_7d = (out_amt_7d / cap) if cap > 0 else 0.0
-            ss_vol_1d = ss_ratio_1d >= SUPER_SOURCE_OUT_AMT_1D_MULT
-            ss_vol_7d = ss_ratio_7d >= SUPER_SOURCE_OUT_AMT_7D_MULT
-            ss_ok = (
-                class_label in ("source", "router") and
-                out_ratio >= SUPER_SOURCE_OUTRATIO_MIN and
-                cap > 0 and
-                (ss_vol_1d or ss_vol_7d) and
-                fwd_count >= SUPER_SOURCE_MIN_FWDS_7D
-            )
-            st_ss = state.get(cid, {}).copy()
-            ok_since = int(st_ss.get("ss_ok_since", 0) or 0)
-            bad_since = int(st_ss.get("ss_bad_since", 0) or 0)
-            active = bool(st_ss.get("ss_active", False))
-
-            if ss_ok:
-                bad_since = 0
-                if ok_since == 0:
-                    ok_since = now_ts_local
-                if (now_ts_local - ok_since) >= SUPER_SOURCE_ENTER_HOURS * 3600:
-                    active = True
-            else:
-                ok_since = 0
-                if bad_since == 0:
-                    bad_since = now_ts_local
-                if active and (now_ts_local - bad_since) >= SUPER_SOURCE_EXIT_HOURS * 3600:
-                    active = False
-
-            super_source_active = active
-            super_source_warm = ss_ok and not active
-
-            st_ss["ss_ok_since"] = int(ok_since or 0)
-            st_ss["ss_bad_since"] = int(bad_since or 0)
-            st_ss["ss_active"] = bool(active)
-            if not dry_run:
-                state[cid] = st_ss
-            elif dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
-                state[cid] = st_ss
-
-        # tags da classe (para relatório)
-        class_tags = []
-        if class_label == "sink":   class_tags.append(TAG_SINK)
-        if class_label == "source": class_tags.append(TAG_SOURCE)
-        if class_label == "router": class_tags.append(TAG_ROUTER)
-        if class_label == "unknown": class_tags.append(TAG_UNKNOWN)
-        if super_source_active:
-            class_tags.append(TAG_SUPER_SOURCE)
-            if super_source_like:
-                class_tags.append("super-source-like")
-        elif DEBUG_TAGS and super_source_warm:
-            class_tags.append("super-source:warm")
-            if super_source_like:
-                class_tags.append("super-source-like:warm")
-        if DEBUG_TAGS:
-            if SUPER_SOURCE_ENABLE:
-                class_tags.append(f"ssv1d{ss_ratio_1d:.2f}-v7d{ss_ratio_7d:.2f}-f{fwd_count}")
-            class_tags.append(f"🧭bias{bias_ema:+.2f}")
-            class_tags.append(f"🧭{class_label}:{class_conf:.2f}")
-        # --- [PATCH A] Base de custo p/ margem (consistente) ---
-        # Usa custo por canal se existir; caso contrário, em SOURCE/ROUTER usa out_ppm7d (com clamp+blend);
-        # para SINK ou quando faltar dado, cai no global cru.
-        rebal_cost_chan = float(rebal_cost_ppm_by_chan_use.get(cid, 0) or 0)
-
-        use_bounded   = (class_label or "").lower() in APPLY_BOUNDED_COST_CLASSES  # aplica só em source/router
-        use_out_cost  = False
-        base_cost_for_margin = 0.0
-
-        if rebal_cost_chan > 0:
-            # 1) custo por canal vence
-            base_cost_for_margin = rebal_cost_chan
-
-        elif use_bounded and (rebal_cost_ppm_global or 0) > 0 and (out_ppm_7d or 0) > 0:
-            # 2) SOURCE/ROUTER sem rebal por canal: clamp no global pelo preço "out"
-            lo = out_ppm_7d * REBAL_COST_GLOBAL_CLAMP_LOW
-            hi = out_ppm_7d * REBAL_COST_GLOBAL_CLAMP_HIGH
-            global_bounded = max(lo, min(float(rebal_cost_ppm_global), hi))
-
-            blended = REBAL_COST_BLEND_ALPHA * global_bounded + (1.0 - REBAL_COST_BLEND_ALPHA) * float(out_ppm_7d)
-
-            # Cap pró-margem: não permitir “custo” acima do que gerou venda com margem
-            if REBAL_FLOOR_MARGIN > 0:
-                cap_ok = float(out_ppm_7d) / (1.0 + REBAL_FLOOR_MARGIN)
-                blended = min(blended, cap_ok)
-
-            base_cost_for_margin = blended
-            use_out_cost = True
-
-        else:
-            # 3) SINK (ou sem dados): global cru
-            base_cost_for_margin = float(rebal_cost_ppm_global or 0)
-
-        base_cost_for_margin = max(float(base_cost_for_margin or 0), float(MIN_PPM))
-        margin_ppm_7d = int(round((out_ppm_7d or 0) - base_cost_for_margin * (1.0 + REBAL_FLOOR_MARGIN)))
-            
-        # === Diagnóstico passivo dos modos assistidos (LOG-ONLY) ===
-        if ASSISTED_DIAG_ENABLE:
-            fa_cand, nra_cand, fa_reason, nra_reason = assisted_diag_candidates(
-                cid,
-                out_ratio=out_ratio,
-                out_ppm7d=out_ppm_7d,
-                margin_ppm_7d=margin_ppm_7d,
-                rebal_cost_ppm_by_chan_use=rebal_cost_ppm_by_chan_use,
-                state=state,
-                fwd_count=fwd_count
+        if demand_exception:
+            # Libera mais espaço: respeita demanda observada
+            local_max = min(
+                MAX_PPM,
+                max(local_max, int(seed_used * OUTRATE_PEG_SEED_MULT), int(out_ppm_7d or 0))
             )
-            if fa_cand:
-                class_tags.append(f"🧩FA-candidate")
-                if DEBUG_TAGS:
-                    class_tags.append(f"ⓘFA:{fa_reason}")
-            if nra_cand:
-                class_tags.append(f"🧩NRA-candidate")
-                if DEBUG_TAGS:
-                    class_tags.append(f"ⓘNRA:{nra_reason}")
-
-
-        # --- Escalada por persistência (ANTES do ajuste de liquidez) ---
-        streak = state.get(cid, {}).get("low_streak", 0)
-        if PERSISTENT_LOW_ENABLE:
-            if out_ratio < PERSISTENT_LOW_THRESH:
-                streak += 1
-            else:
-                streak = 0
-
-            if streak >= PERSISTENT_LOW_STREAK_MIN:
-                bump_acc = (streak - PERSISTENT_LOW_STREAK_MIN + 1) * PERSISTENT_LOW_BUMP
-                bump_acc = min(PERSISTENT_LOW_MAX, max(0.0, bump_acc))
-
-                # ⬇️ NOVO: não inflar em stale-drain (sem base)
-                baseline_val_persist = state.get(cid, {}).get("baseline_fwd7d", 0) or 0
-                if (streak >= EXTREME_DRAIN_STREAK) and (baseline_val_persist <= 2):
-                    bump_acc = 0.0
-
-                bump_mult = 1.0 + bump_acc
-                bump_mode = "seed"
-                if PERSISTENT_LOW_OVER_CURRENT_ENABLE and target <= local_ppm:
-                    target = max(
-                        target,
-                        int(math.ceil(local_ppm * bump_mult)),
-                        local_ppm + int(PERSISTENT_LOW_MIN_STEP_PPM or 0)
-                    )
-                    bump_mode = "over_current"
-                else:
-                    target = int(math.ceil(target * bump_mult))
-
-                if new_inbound:
-                    target = target_base
-                report.append(f"📈 Persistência: {alias} ({cid}) streak {streak} ⇒ bump {bump_acc*100:.0f}% ({bump_mode})")
-
-        # --- Ajuste por liquidez ---
-        if out_ratio < LOW_OUTBOUND_THRESH:
-            if not new_inbound:
-                target *= (1.0 + LOW_OUTBOUND_BUMP)
-        elif out_ratio > HIGH_OUTBOUND_THRESH:
-            target *= (1.0 - HIGH_OUTBOUND_CUT)
-            if fwd_count == 0 and out_ratio > 0.60:
-                target *= (1.0 - IDLE_EXTRA_CUT)
-
-        # Discovery hard-drop
-        st_prev2 = state.get(cid, {}) or {}
-        first_seen_ts2 = st_prev2.get("first_seen_ts", int(time.time()))
-        days_since_first = (int(time.time()) - first_seen_ts2) / 86400 if first_seen_ts2 else 999
-        st_disc = state.get(cid, {}) or {}
-        last_explorer_exit = int(st_disc.get("explorer_last_exit_ts", 0) or 0)
-        explorer_seen = bool(st_disc.get("explorer_seen", False))
-        min_disc_age = DISCOVERY_AFTER_EXPLORER_DAYS * 86400
-        discovery_gate_ok = (not DISCOVERY_REQUIRE_EXPLORER) or (explorer_seen and (now_ts_local - last_explorer_exit) >= min_disc_age)
-        discovery_hard = (
-            DISCOVERY_ENABLE and
-            discovery_gate_ok and
-            fwd_count <= DISCOVERY_FWDS_MAX and
-            out_ratio > DISCOVERY_OUT_MIN and
-            days_since_first >= DISCOVERY_HARDDROP_DAYS_NO_BASE and
-            (state.get(cid, {}).get("baseline_fwd7d", 0) or 0) == 0
-        )
-        if discovery_hard:
-            target_base = seed_used + DISCOVERY_HARDDROP_COLCHAO
-            target = min(target, target_base + (target - (seed_used + COLCHAO_PPM)) * 0.5)
-
-        # --- BOOSTS que RESPEITAM o step cap ---
-        surge_tag = ""
-        top_tag = ""
-        negm_tag = ""
-        boosted_target = target
-
-        if (not new_inbound) and SURGE_ENABLE and out_ratio < SURGE_LOW_OUT_THRESH:
-            lack = max(0.0, (SURGE_LOW_OUT_THRESH - out_ratio) / SURGE_LOW_OUT_THRESH)
-            surge_bump = min(SURGE_BUMP_MAX, SURGE_K * lack)
-            if surge_bump > 0:
-                boosted_target = max(boosted_target, int(math.ceil(target * (1.0 + surge_bump))))
-                surge_tag = f"⚡surge+{int(surge_bump*100)}%"
-
-        if TOP_REVENUE_SURGE_ENABLE and rev_share >= TOP_OUTFEE_SHARE and out_ratio < 0.30:
-            boosted_target = max(boosted_target, int(math.ceil(target * (1.0 + TOP_REVENUE_SURGE_BUMP))))
-            top_tag = f"👑top+{int(TOP_REVENUE_SURGE_BUMP*100)}%"
-
-        if NEG_MARGIN_SURGE_ENABLE and margin_ppm_7d < 0 and fwd_count >= NEG_MARGIN_MIN_FWDS:
-            boosted_target = max(boosted_target, int(math.ceil(target * (1.0 + NEG_MARGIN_SURGE_BUMP))))
-            negm_tag = f"💹negm+{int(NEG_MARGIN_SURGE_BUMP*100)}%"
-
-        # clamp do alvo e guarda "no-down while low"
-        target = clamp_ppm(boosted_target)
-        # >>> PATCH [B’]: viés de queda quando usamos out como custo (source/router sem rebal)
-        # Força o target a tender ao out_ppm observado sempre que não estivermos "low".
-        if use_out_cost and (out_ppm_7d or 0) > 0:
-            not_low = (out_ratio >= PERSISTENT_LOW_THRESH)  # com seu threshold = 0.10
-
-            # Caso 1: algum bump/persistência empurrou target >= taxa atual → puxa para ~0.9× out_ppm
-            if not_low and target >= local_ppm:
-                target = clamp_ppm(int(round(out_ppm_7d * 0.90)))
-
-            # Caso 2: mesmo não estando acima da taxa, se ficou acima do out_ppm, puxa para ~0.9×
-            elif target > out_ppm_7d:
-                target = clamp_ppm(int(round(out_ppm_7d * 0.90)))
-
-            # Em SOURCE, ainda respeite preferência por alvo mais baixo relativo ao seed
-            if class_label == "source":
-                target = min(target, clamp_ppm(int(seed_used * SOURCE_SEED_TARGET_FRAC)))
-
-
-        pl_tags = []
-        if (not new_inbound) and out_ratio < PERSISTENT_LOW_THRESH and target < local_ppm:
-            # Exceção: em source/router sem rebal por canal (use_out_cost),
-            # permita cair até o "preço observado" (outrate) com folga do PEG.
-            if use_out_cost and fwd_count >= OUTRATE_PEG_MIN_FWDS and (out_ppm_7d or 0) > 0:
-                peg_limit = clamp_ppm(int(round(out_ppm_7d * (1.0 + OUTRATE_PEG_HEADROOM))))
-                # não baixar abaixo do PEG; mantém ainda acima do floor
-                target = max(target, peg_limit)
-                if DEBUG_TAGS:
-                    # 👇 em vez de diag_tags, empurre para pl_tags
-                    pl_tags.append("🧲peg-except-low")
-            else:
-                target = local_ppm
-                pl_tags.append("🙅‍♂️no-down-low")
 
+    # 3b) Teto especial para SOURCE: não faz sentido virar MAX_PPM se é "source"
+    if class_label == "source":
+        # cap básico: perto do seed (ex.: 1.1x seed)
+        src_cap = int(seed_used * 1.10)
+        # se já temos out_ppm observado, não subir muito acima disso
+        if (out_ppm_7d or 0) > 0:
+            src_cap = min(src_cap, int(out_ppm_7d * 1.10))
+
+        # garante que o teto do source seja bem abaixo de MAX_PPM
+        local_max = min(local_max, clamp_ppm(src_cap))
+
+
+    # ⛏️ FIX: primeiro clamp no teto, depois REAPLICA o step-cap para não “degolar” em 1 rodada
+    final_ppm_preclamp = int(round(final_ppm))
+    final_ppm_clamped  = max(MIN_PPM, min(local_max, final_ppm_preclamp))
+    final_ppm = apply_step_cap2(
+        local_ppm,
+        final_ppm_clamped,
+        cap_frac,
+        STEP_MIN_STEP_PPM if final_ppm_clamped <= local_ppm else STEP_MIN_STEP_PPM_UP
+    )
 
-        if super_source_active:
-            target = MIN_PPM
-            if DEBUG_TAGS:
-                pl_tags.append("super-source:target0")
-
-        # ---- STEP CAP dinâmico ----
-        cap_frac = STEP_CAP
-        if DYNAMIC_STEP_CAP_ENABLE:
-            if out_ratio < 0.03:
-                cap_frac = max(cap_frac, STEP_CAP_LOW_005)
-            elif out_ratio < 0.05:
-                cap_frac = max(cap_frac, STEP_CAP_LOW_010)
-            if fwd_count == 0 and out_ratio > 0.60:
-                cap_frac = max(cap_frac, STEP_CAP_IDLE_DOWN)
+    # [PATCH 3]: garantir floor após clamp e step-cap
+    if REBAL_FLOOR_ENABLE and final_ppm < floor_ppm:
+        final_ppm = floor_ppm
+        # opcional: marque o motivo; a tag é criada mais abaixo, mas se quiser
+        # pode setar um flag para incluir "🧱floor-lock".
+    # Sufixo textual indicando a origem do piso, para o log
+    floor_src_tag = "" if not floor_src else f"({floor_src})"
+
+    # Telemetria: bateu no MAX_PPM global?
+    if final_ppm == MAX_PPM:
+        counts["max_hits"] += 1
+
+    # Diagnóstico
+    diag_tags = []
+    if global_neg_lock_applied:
+        diag_tags.append("🛡️global-neg-lock")
+    if raw_step_ppm != target:
+        dir_same = ((target > local_ppm and raw_step_ppm > local_ppm) or
+                    (target < local_ppm and raw_step_ppm < local_ppm))
+        if dir_same:
+            diag_tags.append("⛔stepcap")
+
+    if final_ppm == floor_ppm and target != floor_ppm:
+        diag_tags.append("🧱floor-lock")
+
+    if final_ppm == local_ppm and target != local_ppm and floor_ppm <= local_ppm:
+        diag_tags.append("⛔stepcap-lock")
         
+    if lock_skip_tag:
+        diag_tags.append(lock_skip_tag)
+        
+    if extreme_turbo_applied:
+        diag_tags.append("🚀extreme-drain+")
+    
+    if EXPLORER_ENABLE and explorer_active:
+        diag_tags.append(EXPLORER_TAG)
+
+
+
+    # marcações de contexto
+    discovery_hit and diag_tags.append("🧪discovery")
+    for t in (surge_tag, top_tag, negm_tag):
+        if t: diag_tags.append(t)
+    if new_inbound:
+        diag_tags.append(NEW_INBOUND_TAG)
+
+    if REVFLOOR_ENABLE and not super_source_active and (state.get(cid, {}).get("baseline_fwd7d", 0) or 0) >= REVFLOOR_BASELINE_THRESH:
+        if final_ppm < max(int(seed_used * 0.90), int(max(seed_used * 0.40, REVFLOOR_MIN_PPM_ABS))):
+            diag_tags.append("⚠️subprice")
+    if (state.get(cid, {}).get("low_streak", 0) or 0) >= EXTREME_DRAIN_STREAK and (state.get(cid, {}).get("baseline_fwd7d", 0) or 0) <= 2:
+        diag_tags.append("💤stale-drain")
+    # >>> PATCH: tag de diagnóstico quando o PEG ficou ativo
+    if OUTRATE_PEG_ENABLE and outrate_peg_active:
+        diag_tags.append("🧲peg")
+    if DEBUG_TAGS:
+        diag_tags.append(f"🔍t{target}/r{raw_step_ppm}/f{floor_ppm}")
+    # garantir que pl_tags (no-down-low) apareçam nas tags finais
+    for t in pl_tags:
+        diag_tags.append(t)
+    status_tags = status_tags  # já montado lá em cima (🟢on/🔴off)
+    all_tags = status_tags + class_tags + seed_tags + diag_tags
+
+    # --- Cálculo do inbound discount (rebate) ---
+    prev_inb_discount = int((state.get(cid, {}) or {}).get("last_inbound_discount_ppm", 0))
+
+    # Valor padrão: sem desconto
+    inbound_discount_ppm = 0
+    inbound_reason = "disabled"
+
+    if INBOUND_FEE_ENABLE:
         
 
-        # Discovery mode
-        discovery_hit = False
-        if DISCOVERY_ENABLE and discovery_gate_ok and fwd_count <= DISCOVERY_FWDS_MAX and out_ratio > DISCOVERY_OUT_MIN:
-            discovery_hit = True
-            cap_frac = max(cap_frac, STEP_CAP_IDLE_DOWN)
-            if discovery_hard and local_ppm > target:
-                cap_frac = max(cap_frac, DISCOVERY_HARDDROP_CAP_FRAC)
-                
-        # >>> FIX: lock só com base concreta local (sem depender de floor_src ainda não decidido)
-        st_m = state.get(cid, {}) or {}
-        ttl = 21 * 24 * 3600
-        now_ts = int(time.time())
-
-        has_recent_rebal = (
-            (cid in rebal_cost_ppm_by_chan_use and (rebal_cost_ppm_by_chan_use.get(cid) or 0) > 0)
-            or (
-                (st_m.get("last_rebal_cost_ppm") or 0) > 0
-                and (now_ts - int(st_m.get("last_rebal_cost_ts") or 0) <= ttl)
-            )
+        inbound_discount_ppm, inbound_reason = compute_inbound_discount_ppm(
+            class_label=class_label,
+            out_ratio=out_ratio,
+            fwd_count=fwd_count,
+            margin_ppm_7d=margin_ppm_7d,
+            price_ppm=final_ppm,
+            base_cost_for_margin=base_cost_for_margin,
+            rebal_floor_ppm=rebal_floor_ppm,
+            discovery_hit=bool(discovery_hit),
+            new_inbound=bool(new_inbound),
+            rebal_ppm_7d=int(rebal_ppm7d_val or 0),
+            rebal_ppm_7d_real=int(rebal_ppm7d_real or 0),
         )
 
-        has_recent_outrate = (
-            ((out_ppm_7d or 0) > 0 and fwd_count >= OUTRATE_PEG_MIN_FWDS)
-            or (
-                (st_m.get("last_outrate_ppm") or 0) > 0
-                and (now_ts - int(st_m.get("last_outrate_ts") or 0) <= ttl)
-            )
-        )
+        if inbound_discount_ppm > 0:
+            all_tags.append(f"💸inb{inbound_discount_ppm}")
+            if DEBUG_TAGS:
+                all_tags.append(f"ⓘinb:{inbound_reason}")
 
-        can_lock_globally = bool(has_recent_rebal or has_recent_outrate)
+    # delta do inbound (para saber se vale a pena aplicar update)
+    inbound_delta = abs(inbound_discount_ppm - prev_inb_discount)
+    inbound_push_needed = (
+        INBOUND_FEE_ENABLE and
+        inbound_delta >= INBOUND_FEE_PUSH_MIN_ABS_PPM
+    )
 
-        # NEW INBOUND: step cap maior só para reduzir
-        if new_inbound and local_ppm > target:
-            cap_frac = max(cap_frac, NEW_INBOUND_DOWN_STEPCAP_FRAC)
+    # net fee de inbound (somente para log)
+    if INBOUND_FEE_ENABLE and inbound_discount_ppm > 0:
+        net_inbound_ppm = max(final_ppm - inbound_discount_ppm, 0)
+    else:
+        net_inbound_ppm = final_ppm
+    # String amigável para log sobre inbound discount
+    if INBOUND_FEE_ENABLE and inbound_discount_ppm > 0:
+          inb_str = f" | inb {prev_inb_discount}→{inbound_discount_ppm}ppm (net≈{net_inbound_ppm})"
+    else:
+        inb_str = ""
 
-        lock_skip_tag = None
+    # ====== MÍNIMO REAL: sanear local < MIN_PPM ======
+    # Fazemos antes do gate de microupdate/cooldown.
+    if local_ppm < MIN_PPM:
+        # Vamos forçar aplicação do mínimo, sem segurar por cooldown/microupdate.
+        final_ppm = max(final_ppm, MIN_PPM)
+        all_tags.append("🩹min-fix")
 
-        # === Travamento quando a operação 7d está negativa (com suavização opcional) ===
-        if neg_margin_global:
-            if can_lock_globally:
-                allow_soften = False
-                if GLOBAL_NEG_LOCK_SOFTEN_ENABLE:
-                    # Canal saudável: muita liquidez local e margem 7d do canal >= 0 (se exigido)
-                    chan_ok = (out_ratio >= SOFTEN_MIN_OUT_RATIO)
-                    if SOFTEN_REQUIRE_POS_CHAN_MARGIN:
-                        chan_ok = chan_ok and (margin_ppm_7d >= 0)
-                    if chan_ok and (not discovery_hit) and (not new_inbound):
-                        allow_soften = True
-
-                # 🔹 EXCEÇÃO: não aplicar hard lock em SINK lucrativo
-                if class_label == "sink" and margin_ppm_7d > SINK_MIN_MARGIN:
-                    # não faz nada aqui: o canal segue o fluxo normal, sem travar em local_ppm
-                    lock_skip_tag = "🔓 sink-lucrativo-global-neg"
-                    # opcional: reforça um step cap mínimo para evitar queda brusca
-                    cap_frac = max(cap_frac, STEP_CAP)
-
-                elif (target < local_ppm) and (not discovery_hit) and (not new_inbound):
-                    if allow_soften:
-                        # Permitir queda, mas limitada por PEG/FLOOR e step-cap
-                        # Se houver out_ppm_7d, não descer agressivamente abaixo dele
-                        if (out_ppm_7d or 0) > 0:
-                            peg_floor = int(round(out_ppm_7d * SOFTEN_MAX_DROP_TO_PEG_FRAC))
-                            target = max(target, peg_floor)
-                    else:
-                        target = local_ppm  # mantém lock total
-                        global_neg_lock_applied = True
+    new_ppm = final_ppm
 
-                # Mais fôlego para subir quando o global está no vermelho
-                cap_frac = max(cap_frac, STEP_CAP + 0.05)
+    base_fee_msat = SUPER_SOURCE_BASE_FEE_MSAT if super_source_active else BASE_FEE_MSAT
+    prev_base_fee_msat = int((state.get(cid, {}) or {}).get("last_base_fee_msat", BASE_FEE_MSAT))
+    base_fee_push_needed = bool(
+        USE_LNCLI_UPDATECHANPOLICY and chan_point and base_fee_msat != prev_base_fee_msat
+    )
 
-            else:
-                # Diagnóstico: lock global "skipado" por falta de base por canal
-                if (target < local_ppm) and (not discovery_hit) and (not new_inbound):
-                    lock_skip_tag = "🛡️lock-skip(no-chan-rebal)"
+    # Aplica/relata
+    seed_note_parts = [str(int(seed_used))]
+    if seed_raw is not None:
+        seed_note_parts.append(f"p65:{int(seed_raw)}")
+    if seed_p95 is not None:
+        seed_note_parts.append(f"p95:{int(seed_p95)}")
+    seed_note = " ".join(seed_note_parts) + (" (cap)" if seed_flags else "")
+
+    dir_for_emoji = "up" if new_ppm > local_ppm else ("down" if new_ppm < local_ppm else "flat")
+    emo = "🔺" if dir_for_emoji == "up" else ("🔻" if dir_for_emoji == "down" else "⏸️")
+
+    # Gate anti-microupdate
+    push_forced_by_floor = (floor_ppm > local_ppm and new_ppm > local_ppm)
+    will_push = True
+    if new_ppm != local_ppm and not push_forced_by_floor:
+        delta_ppm = abs(new_ppm - local_ppm)
+        rel = delta_ppm / max(1, local_ppm)
+        if delta_ppm < BOS_PUSH_MIN_ABS_PPM and rel < BOS_PUSH_MIN_REL_FRAC:
+            will_push = False
+            all_tags.append("🧘hold-small")
+
+    # se estamos corrigindo MIN_PPM, força push
+    if local_ppm < MIN_PPM and new_ppm >= MIN_PPM:
+        will_push = True
+    if inbound_push_needed:
+        will_push = True
+    if base_fee_push_needed:
+        will_push = True
+        
+    # === COOLDOWN / HISTERÉSE ===
+    st_prev  = state.get(cid, {})
+    last_ts  = st_prev.get("last_ts", 0)
+    hours_since = (int(time.time()) - last_ts) / 3600 if last_ts else 999
+    fwds_at_change = st_prev.get("fwds_at_change", 0)
+    fwds_since = max(0, fwd_count - fwds_at_change)
+    cooldown_blocked = False
+    if APPLY_COOLDOWN_ENABLE and new_ppm != local_ppm and not push_forced_by_floor:
+        # Explorer: ignorar cooldown para quedas, se configurado
+        if (EXPLORER_ENABLE and explorer_active and EXPLORER_SKIP_COOLDOWN_DOWN
+            and new_ppm != local_ppm and new_ppm < local_ppm
+            and not push_forced_by_floor):
+            # anula qualquer bloqueio prévio de cooldown
+            will_push = True
+            cooldown_blocked = False
+            # remove tags de cooldown adicionadas antes (se houver)
+            all_tags = [t for t in all_tags if not t.startswith("⏳cooldown")]
+        # em discovery e QUEDA, não aplicar cooldown
+        if discovery_hit and new_ppm < local_ppm:
+            pass
+        elif not (new_inbound and new_ppm < local_ppm):
+            need = COOLDOWN_HOURS_UP if new_ppm > local_ppm else COOLDOWN_HOURS_DOWN
+            if hours_since < need and fwds_since < COOLDOWN_FWDS_MIN:
+                will_push = False
+                cooldown_blocked = True
+                all_tags.append(f"⏳cooldown{int(need)}h")
+            if (COOLDOWN_PROFIT_DOWN_ENABLE and new_ppm < local_ppm):
+                if (margin_ppm_7d > COOLDOWN_PROFIT_MARGIN_MIN and fwd_count >= COOLDOWN_PROFIT_FWDS_MIN):
+                    need2 = max(need, COOLDOWN_HOURS_DOWN)
+                    if hours_since < need2:
+                        will_push = False
+                        cooldown_blocked = True
+                        all_tags.append(f"⏳cooldown-profit{int(need2)}h")
+        # >>> PATCH: OUTRATE PEG — queda abaixo do outrate só após GRACE_HOURS
+        if new_ppm < local_ppm and OUTRATE_PEG_ENABLE and outrate_peg_active:
+            # se a nova taxa ficaria abaixo do 'preço observado', exija janela de graça maior
+            peg_limit = clamp_ppm(int(round(out_ppm_7d * (1.0 + OUTRATE_PEG_HEADROOM))))
+            if new_ppm < peg_limit:
+                need_peg = max(COOLDOWN_HOURS_DOWN, OUTRATE_PEG_GRACE_HOURS)
+                if hours_since < need_peg:
+                    will_push = False
+                    cooldown_blocked = True
+                    all_tags.append(f"⏳cooldown{int(need_peg)}h-outrate")
+    # ===== Previsão (depois de avaliar cooldown/stepcap e antes de report.append) =====
+    cooldown_needed_hours = None
+    if APPLY_COOLDOWN_ENABLE and new_ppm != local_ppm and not push_forced_by_floor:
+        # Se cooldown ativo segurou a mudança, informe janela prevista restante
+        need = COOLDOWN_HOURS_UP if new_ppm > local_ppm else COOLDOWN_HOURS_DOWN
+        # pode ter sido elevado por regras de profit ou peg grace; use o maior já aplicado
+        try:
+            candidates = []
+            for t in all_tags:
+                if t.startswith("⏳cooldown") and "h" in t:
+                    x = t.replace("⏳cooldown", "")
+                    x = x.replace("-outrate", "").replace("-profit", "").replace("h", "")
+                    x = int(x) if x.isdigit() else None
+                    if x:
+                        candidates.append(x)
+            if candidates:
+                need = max([need] + candidates)
+        except Exception:
+            pass
 
-        # Extreme drain mode — acelera SUBIDAS
-        STEP_MIN_STEP_PPM_UP = STEP_MIN_STEP_PPM
-        if EXTREME_DRAIN_ENABLE:
-            low_streak_val = state.get(cid, {}).get("low_streak", 0)
-            baseline_val = state.get(cid, {}).get("baseline_fwd7d", 0) or 0
-            if (low_streak_val >= EXTREME_DRAIN_STREAK and
-                out_ratio < EXTREME_DRAIN_OUT_MAX and
-                baseline_val > 0 and
-                target > local_ppm):
-                cap_frac = max(cap_frac, EXTREME_DRAIN_STEP_CAP)
-                STEP_MIN_STEP_PPM_UP = max(STEP_MIN_STEP_PPM_UP, EXTREME_DRAIN_MIN_STEP_PPM)
-
-            # TURBO: streak MUITO alto + out ≤1%
-            if EXTREME_DRAIN_TURBO_ENABLE and target > local_ppm:
-                if (low_streak_val >= EXTREME_DRAIN_TURBO_STREAK_MIN and
-                    out_ratio <= EXTREME_DRAIN_TURBO_OUT_MAX and
-                    baseline_val > 0):
-                    cap_frac = max(cap_frac, EXTREME_DRAIN_TURBO_STEP_CAP)
-                    STEP_MIN_STEP_PPM_UP = max(STEP_MIN_STEP_PPM_UP, EXTREME_DRAIN_TURBO_MIN_STEP_PPM)
-                    # marque no log
-                    if DEBUG_TAGS:
-                        diag_tag_extreme = f"⚡surge+{int((EXTREME_DRAIN_TURBO_STEP_CAP-STEP_CAP)*100)}%"
-                        # evita duplicar se já existir surge; e adiciona sinalizador explícito:
-                        if diag_tag_extreme not in (surge_tag or ""):
-                            pass  # será adicionado abaixo via diag_tags
-                    # coloque uma flag simples p/ inserir tag
-                    extreme_turbo_applied = True
+        if hours_since < need:
+            cooldown_needed_hours = max(0, int(round(need - hours_since)))
+        
+        if cooldown_blocked:
+            # acrescente o sufixo "(blocked)" na(s) tag(s) de cooldown
+            for i, t in enumerate(list(all_tags)):
+                if t.startswith("⏳cooldown"):
+                    if "(blocked)" not in t:
+                        all_tags[i] = t + "(blocked)"
+
+    for key, tag in SYMPTOM_TAGS.items():
+        if tag in all_tags:
+            symptoms.append(key)
+    
+    prediction_msg = build_prediction(
+        out_ratio=out_ratio,
+        margin_ppm_7d=margin_ppm_7d,
+        target=target,
+        local_ppm=local_ppm,
+        new_ppm=new_ppm,
+        fwd_count=fwd_count,
+        neg_margin_global=params.neg_margin_global,
+        discovery_hit=bool(discovery_hit),   # ← usar a variável booleana já calculada
+        cooldown_needed_hours=cooldown_needed_hours
+    )
+    if EXPLORER_ENABLE and explorer_active and new_ppm < local_ppm:
+        prediction_msg = prediction_msg.replace("previsão:", "previsão (explorer):")
+
+
+
+    # ===== DRY RUN / EXCLUIR =====
+    # DRY context: --dry-run ou excluido
+    act_dry = params.dry_run or is_excluded
+
+    # Persistência de classificação/bias no STATE
+    if not params.dry_run:  # em execução real, sempre persiste classe (mesmo excluído)
+        st_for_save = state.get(cid, {}).copy()
+        st_for_save["bias_ema"]    = float(bias_ema)
+        st_for_save["class_label"] = class_label
+        st_for_save["class_conf"]  = float(class_conf)
+        state[cid] = st_for_save
+    elif params.dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
+        # Em dry-run, persistir SOMENTE campos de classe (sem mexer em last_ppm/ts/etc.)
+        st_for_save = state.get(cid, {}).copy()
+        st_for_save.setdefault("first_seen_ts", int(time.time()))
+        st_for_save["bias_ema"]    = float(bias_ema)
+        st_for_save["class_label"] = class_label
+        st_for_save["class_conf"]  = float(class_conf)
+        state[cid] = st_for_save
+
+    if (new_ppm != local_ppm or inbound_push_needed or base_fee_push_needed) and will_push:
+        delta = new_ppm - local_ppm
+        if new_ppm != local_ppm and local_ppm > 0:
+            pct = (abs(delta) / local_ppm * 100.0)
+            dstr = f"{'+' if delta>0 else ''}{delta} ({pct:.1f}%)"
         else:
-            STEP_MIN_STEP_PPM_UP = STEP_MIN_STEP_PPM
-            extreme_turbo_applied = False
+            # nenhuma mudança de outbound; alteração só de inbound
+            dstr = "0 (0.0%) [inb only]"
 
 
-        # bônus leve de reatividade em ROUTER
-        if class_label == "router":
-            cap_frac = min(0.50, cap_frac + ROUTER_STEP_CAP_BONUS)
-        
-        # >>> ITEM 6: TARGET/STEPCAP – quedas mais rápidas e com queda mínima
-        # Explorer acelera a queda e garante um drop mínimo por rodada
-        if EXPLORER_ENABLE and explorer_active and target < local_ppm:
-            # acelera a QUEDA: usa step-cap especial do Explorer (>= ao cap atual)
-            cap_frac = max(cap_frac, EXPLORER_STEP_CAP_DOWN)
-            # garante uma QUEDA MÍNIMA proporcional à taxa atual
-            min_drop_ppm = int(math.ceil(local_ppm * EXPLORER_MIN_DROP_FRAC))
-            target = min(target, local_ppm - min_drop_ppm)
-
-
-        raw_step_ppm = target if local_ppm == 0 else apply_step_cap2(
-            local_ppm, target, cap_frac,
-            STEP_MIN_STEP_PPM if target <= local_ppm else STEP_MIN_STEP_PPM_UP
-        )
+        if act_dry:
+            if is_excluded and not EXCL_DRY_VERBOSE:
+                lines.append(f"✅{emo} {alias}: 🚷excl-dry")
+                # Explorer: contabiliza round de queda aplicada
+                if EXPLORER_ENABLE and explorer_active and new_ppm < local_ppm:
+                    rounds = int(_get_explorer_state(state, cid).get("rounds", 0)) + 1
+                    _set_explorer_state(state, cid, rounds=rounds)
+                if new_ppm > local_ppm: counts["excl_dry_up"] += 1
+                else: counts["excl_dry_down"] += 1
+            else:
+                method_label = fee_update_method(pubkey, chan_point)
+                method_tag = f" ({method_label})" if method_label else ""
+                action = f"DRY set {local_ppm}→{new_ppm} ppm{method_tag} {dstr}"
+                new_dir = dir_for_emoji
+                excl_note = " 🚷excl-dry" if is_excluded else ""
+                # 👉 conta mudança de inbound (qualquer alteração, mesmo com outbound)
+                try:
+                    prev_inb = int(prev_inb_discount)
+                except Exception:
+                    prev_inb = 0
+                try:
+                    cur_inb = int(inbound_discount_ppm) if inbound_discount_ppm is not None else 0
+                except Exception:
+                    cur_inb = 0
 
-        # Circuit breaker
-        state_all = state.get(cid, {})
-        last_ppm  = state_all.get("last_ppm", local_ppm)
-        last_dir  = state_all.get("last_dir", "flat")
-        last_ts   = state_all.get("last_ts", 0)
-        baseline  = state_all.get("baseline_fwd7d", None)
-
-        if last_dir == "up" and (now_ts - last_ts) <= CB_GRACE_DAYS*24*3600 and baseline:
-            if baseline > 0 and fwd_count < baseline * CB_DROP_RATIO:
-                raw_step_ppm = clamp_ppm(int(raw_step_ppm * (1.0 - CB_REDUCE_STEP)))
-                report.append(f"🧯 CB: {alias} ({cid}) fwd {fwd_count}<{int(baseline*CB_DROP_RATIO)} ⇒ recuo {int(CB_REDUCE_STEP*100)}%")
-        
-        # Cálculo auxiliar: piso que viria do rebal por canal (para reforço em SINK)
-        rebal_floor_ppm = MIN_PPM
-        _chan_rebal = None
-        if cid in rebal_cost_ppm_by_chan_use:
-            _chan_rebal = float(rebal_cost_ppm_by_chan_use.get(cid) or 0.0)
-        elif (state.get(cid, {}).get("last_rebal_cost_ppm") or 0) > 0:
-            _chan_rebal = float(state[cid]["last_rebal_cost_ppm"])
-        if _chan_rebal and _chan_rebal > 0:
-            rebal_floor_ppm = clamp_ppm(math.ceil(_chan_rebal * (1.0 + REBAL_FLOOR_MARGIN)))
+                if INBOUND_FEE_ENABLE and cur_inb != prev_inb:
+                    counts["inbound_changed"] += 1
+                lines.append(
+                    f"✅{emo} {alias}:{excl_note} {action} {inb_str} | alvo {target} | out_ratio {out_ratio:.2f} | "
+                    f"out_ppm7d≈{int(out_ppm_7d)} | rebal_ppm7d≈{rebal_ppm7d_str} | seed≈{seed_note} | floor≥{floor_ppm}{floor_src_tag} | marg≈{margin_ppm_7d} | "
+                    f"rev_share≈{rev_share:.2f} | {' '.join(all_tags)} | {fee_lr_str}"   # NEW
+                    + (
+                        ("\n   " + build_didactic_explanation(
+                            local_ppm=local_ppm,
+                            target=target,
+                            final_ppm=new_ppm if 'new_ppm' in locals() else local_ppm,
+                            floor_ppm=floor_ppm,
+                            out_ratio=out_ratio,
+                            fwd_count=fwd_count,
+                            margin_ppm_7d=margin_ppm_7d,
+                            class_label=class_label,
+                            neg_margin_global=params.neg_margin_global,
+                            new_inbound=bool(new_inbound),
+                            discovery_hit=bool(discovery_hit),
+                            seed_used=float(seed_used),
+                            out_ppm_7d=float(out_ppm_7d or 0),
+                            base_cost_for_margin=float(base_cost_for_margin or 0),
+                            global_neg_lock_applied=bool(global_neg_lock_applied),
+                            all_tags=all_tags,
+                            will_push=bool(will_push)
+                        )) if DIDACTIC_EXPLAIN_ENABLE else ""
+                    )
+                    + "\n   " + prediction_msg
 
-        
-        # ---- Floor reasons (tracking)
-        floor_src = "none"
-        outrate_floor = None
-        outrate_peg_ppm = None
-        rebal_floor_ppm_track = MIN_PPM  # se precisar de uma variável “limpa” só para exibir
-        outrate_peg_active = False  # <- garante que exista em todos os caminhos
-
-        # Piso de rebal conforme REBAL_COST_MODE
-        # >>> PATCH: pure per-channel floor (no global)
-        if REBAL_FLOOR_ENABLE:
-            base_cost, base_src = pick_floor_base_per_channel(
-                cid, seed_used,
-                rebal_cost_ppm_by_chan_use=rebal_cost_ppm_by_chan_use,
-                out_ppm_7d=out_ppm_7d, fwd_count=fwd_count,
-                state=state, now_ts=int(time.time()),
-                outrate_fwds_min=OUTRATE_PEG_MIN_FWDS,
-                mem_ttl_days=21
+                )
+
+                if is_excluded:
+                    if new_ppm > local_ppm: counts["excl_dry_up"] += 1
+                    else: counts["excl_dry_down"] += 1
+                else:
+                    if new_ppm > local_ppm:
+                        counts["changed_up"] += 1
+                    elif new_ppm < local_ppm:
+                        counts["changed_down"] += 1
+                    else:
+                        counts["kept"] += 1   # outbound igual, mudamos só inbound
+        else:
+            excl_note = " 🚷excl-dry" if is_excluded else ""
+            line_head = f"✅{emo} {alias}:{excl_note} "
+            line_tail = (
+                f" {inb_str} | alvo {target} | out_ratio {out_ratio:.2f} | "
+                f"out_ppm7d≈{int(out_ppm_7d)} | rebal_ppm7d≈{rebal_ppm7d_str} | seed≈{seed_note} | floor≥{floor_ppm}{floor_src_tag} | marg≈{margin_ppm_7d} | "
+                f"rev_share≈{rev_share:.2f} | {' '.join(all_tags)} | {fee_lr_str}"   # NEW
+                + (
+                        ("\n   " + build_didactic_explanation(
+                            local_ppm=local_ppm,
+                            target=target,
+                            final_ppm=new_ppm if 'new_ppm' in locals() else local_ppm,
+                            floor_ppm=floor_ppm,
+                            out_ratio=out_ratio,
+                            fwd_count=fwd_count,
+                            margin_ppm_7d=margin_ppm_7d,
+                            class_label=class_label,
+                            neg_margin_global=params.neg_margin_global,
+                            new_inbound=bool(new_inbound),
+                            discovery_hit=bool(discovery_hit),
+                            seed_used=float(seed_used),
+                            out_ppm_7d=float(out_ppm_7d or 0),
+                            base_cost_for_margin=float(base_cost_for_margin or 0),
+                            global_neg_lock_applied=bool(global_neg_lock_applied),
+                            all_tags=all_tags,
+                            will_push=bool(will_push)
+                        )) if DIDACTIC_EXPLAIN_ENABLE else ""
+                    )
+                    + "\n   " + prediction_msg
             )
+            if pubkey or chan_point:
+                update = {
+                    "cid": cid,
+                    "pubkey": pubkey,
+                    "chan_point": chan_point,
+                    "ppm": final_ppm,
+                    # comportamento antigo (INBOUND_FEE_ENABLE=False): só setar out_ppm
+                    "inbound_discount_ppm": inbound_discount_ppm if INBOUND_FEE_ENABLE else None,
+                    "base_fee_msat": base_fee_msat,
+                }
+                update_line = (line_head, line_tail)
+                update_ctx = {
+                    "local_ppm": local_ppm,
+                    "new_ppm": new_ppm,
+                    "dstr": dstr,
+                    "new_dir": dir_for_emoji,
+                    "prev_inb_discount": prev_inb_discount,
+                    "inbound_discount_ppm": inbound_discount_ppm,
+                    "base_fee_msat": base_fee_msat,
+                    "explorer_round": bool(EXPLORER_ENABLE and explorer_active and new_ppm < local_ppm),
+                    "fwd_count": fwd_count,
+                    "streak": streak,
+                    "seed_used": seed_used,
+                    "bias_ema": bias_ema,
+                    "class_label": class_label,
+                    "class_conf": class_conf,
+                }
+            else:
+                action = "❌ sem pubkey/chan_point p/ aplicar"
+                lines.append(line_head + action + line_tail)
 
-            if base_src.startswith("rebal"):
-                # rebal → piso por custo de rebal com margem
-                floor_ppm = clamp_ppm(math.ceil(base_cost * (1.0 + REBAL_FLOOR_MARGIN)))
-            elif base_src.startswith("outrate"):
-                # outrate → peg natural com headroom
-                floor_ppm = clamp_ppm(math.ceil(base_cost * (1.0 + OUTRATE_PEG_HEADROOM)))
+            if is_excluded:
+                if new_ppm > local_ppm: counts["excl_dry_up"] += 1
+                else: counts["excl_dry_down"] += 1
             else:
-                # amboss/seed → referência mínima conservadora
-                floor_ppm = clamp_ppm(int(round(max(base_cost, MIN_PPM))))
+                if new_ppm > local_ppm:
+                    counts["changed_up"] += 1
+                elif new_ppm < local_ppm:
+                    counts["changed_down"] += 1
+                else:
+                    counts["kept"] += 1   # outbound igual, mudamos só inbound
 
-            floor_src = base_src
-        else:
-            floor_ppm = MIN_PPM
-            floor_src = "none"
-        
-        # Custo REAL de rebal 7d por canal (sem fallback),
-        # vindo direto do LNDg (rebal_cost_ppm_by_chan_use)
-        rebal_ppm7d_real = int(round(rebal_cost_ppm_by_chan_use.get(cid, 0) or 0))
-
-        # --- Valor de rebal para exibição (7d) — agora que floor_src está definido ---
-        if floor_src == "rebal7d":
-            rebal_ppm7d_val = int(round(rebal_cost_ppm_by_chan_use.get(cid, 0) or 0))
-            rebal_ppm7d_str = f"{rebal_ppm7d_val}"
-        elif floor_src == "rebal21d":
-            rebal_ppm7d_val = int(round(state.get(cid, {}).get("last_rebal_cost_ppm", 0) or 0))
-            rebal_ppm7d_str = f"{rebal_ppm7d_val}(mem)"
-        elif floor_src == "outrate7d":
-            rebal_ppm7d_val = int(round(out_ppm_7d or 0))
-            rebal_ppm7d_str = f"{rebal_ppm7d_val}(out)"
-        elif floor_src == "outrate21d":
-            rebal_ppm7d_val = int(round(state.get(cid, {}).get("last_outrate_ppm", 0) or 0))
-            rebal_ppm7d_str = f"{rebal_ppm7d_val}(out-mem)"
+    else:
+        # mantém (ou micro-update/cooldown segurou)
+        if not params.dry_run:  # em execução real, sempre persiste campos de classe
+            st = state.get(cid, {}).copy()
+            st.setdefault("first_seen_ts", int(time.time()))
+            st["low_streak"] = streak if PERSISTENT_LOW_ENABLE else 0
+            st["last_seed"] = float(seed_used)
+            st["bias_ema"] = float(bias_ema)
+            st["class_label"] = class_label
+            st["class_conf"] = float(class_conf)
+            state[cid] = st
+        elif params.dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
+            st = state.get(cid, {}).copy()
+            st.setdefault("first_seen_ts", int(time.time()))
+            st["bias_ema"] = float(bias_ema)
+            st["class_label"] = class_label
+            st["class_conf"] = float(class_conf)
+            state[cid] = st
+
+        if is_excluded and not EXCL_DRY_VERBOSE:
+            lines.append(f"🫤⏸️ {alias}: 🚷excl-dry")
+            counts["excl_dry_kept"] += 1
         else:
-            rebal_ppm7d_val = int(round(seed_used or 0))
-            rebal_ppm7d_str = f"{rebal_ppm7d_val}(amboss)"
+            excl_note = " 🚷excl-dry" if is_excluded else ""
+            lines.append(
+                f"🫤⏸️ {alias}:{excl_note} mantém {local_ppm} ppm {inb_str} | alvo {target} | out_ratio {out_ratio:.2f} | "
+                f"out_ppm7d≈{int(out_ppm_7d)} | rebal_ppm7d≈{rebal_ppm7d_str} | seed≈{seed_note} | floor≥{floor_ppm}{floor_src_tag} | marg≈{margin_ppm_7d} | "
+                f"rev_share≈{rev_share:.2f} | {' '.join(all_tags)} | {fee_lr_str}"   # NEW
+                    + (
+                        ("\n   " + build_didactic_explanation(
+                            local_ppm=local_ppm,
+                            target=target,
+                            final_ppm=new_ppm if 'new_ppm' in locals() else local_ppm,
+                            floor_ppm=floor_ppm,
+                            out_ratio=out_ratio,
+                            fwd_count=fwd_count,
+                            margin_ppm_7d=margin_ppm_7d,
+                            class_label=class_label,
+                            neg_margin_global=params.neg_margin_global,
+                            new_inbound=bool(new_inbound),
+                            discovery_hit=bool(discovery_hit),
+                            seed_used=float(seed_used),
+                            out_ppm_7d=float(out_ppm_7d or 0),
+                            base_cost_for_margin=float(base_cost_for_margin or 0),
+                            global_neg_lock_applied=bool(global_neg_lock_applied),
+                            all_tags=all_tags,
+                            will_push=bool(will_push)
+                        )) if DIDACTIC_EXPLAIN_ENABLE else ""
+                    )
+                    + "\n   " + prediction_msg
+            )
 
+            if is_excluded:
+                counts["excl_dry_kept"] += 1
+            else:
+                counts["kept"] += 1
 
-        # >>> PATCH: skip extra outrate-floor if base already outrate
-        if not floor_src.startswith("outrate"):
-            # Outrate floor dinâmico (só aumenta)
-            outrate_floor_active = OUTRATE_FLOOR_ENABLE
-            if EXPLORER_ENABLE and explorer_active and EXPLORER_BYPASS_OUTRATE:
-                outrate_floor_active = False
-            outrate_factor = OUTRATE_FLOOR_FACTOR
-            if OUTRATE_FLOOR_DYNAMIC_ENABLE:
-                if fwd_count < OUTRATE_FLOOR_DISABLE_BELOW_FWDS:
-                    outrate_floor_active = False
-                elif fwd_count < 10:
-                    outrate_factor = OUTRATE_FLOOR_FACTOR_LOW
-            if discovery_hit:
-                outrate_floor_active = False
-            if class_label == "source" and SOURCE_DISABLE_OUTRATE_FLOOR:
-                outrate_floor_active = False
-            if fwd_count == 0:
-                outrate_floor_active = False
+    return done(update, update_line, update_ctx)
 
-            if outrate_floor_active and fwd_count >= OUTRATE_FLOOR_MIN_FWDS and out_ppm_7d > 0:
-                outrate_floor = clamp_ppm(math.ceil(out_ppm_7d * outrate_factor))
-                prev_floor = floor_ppm
-                floor_ppm = max(floor_ppm, outrate_floor)
-                if floor_ppm != prev_floor:
-                    floor_src = "outrate"
+# ---- Kernel NumPy (opcional, FEE_KERNEL_NUMPY / --numpy-kernel) ----
+# Calcula o ChannelCore de todos os canais de uma vez, com máscaras no lugar dos ifs.
+# Tem de dar exatamente o mesmo que channel_core() (tools/fee_kernel_parity.py).
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def dynamic_step_cap_frac_arrays(np, out_ratio, fwd_count):
+    cap_frac = np.full(out_ratio.shape, float(STEP_CAP))
+    if DYNAMIC_STEP_CAP_ENABLE:
+        cap_frac = np.where(out_ratio < 0.03, np.maximum(cap_frac, STEP_CAP_LOW_005),
+                   np.where(out_ratio < 0.05, np.maximum(cap_frac, STEP_CAP_LOW_010), cap_frac))
+        idle = (fwd_count == 0) & (out_ratio > 0.60)
+        cap_frac = np.where(idle, np.maximum(cap_frac, STEP_CAP_IDLE_DOWN), cap_frac)
+    return cap_frac
+
+def clamp_ppm_arrays(np, v):
+    # round() do Python e np.rint arredondam meio p/ par: mesmo resultado que clamp_ppm
+    return np.clip(np.rint(v), MIN_PPM, MAX_PPM).astype(np.int64)
+
+def rebal_cost_floor_arrays(np, cost_ppm):
+    return clamp_ppm_arrays(np, np.ceil(cost_ppm * (1.0 + REBAL_FLOOR_MARGIN)))
+
+def fee_core_batch(channel_list, prev_states):
+    """ChannelCore de cada canal (na ordem) via NumPy; None se numpy não estiver instalado."""
+    np = _numpy()
+    if np is None:
+        return None
+    n = len(channel_list)
+    cap = np.fromiter((c.capacity for c in channel_list), dtype=np.float64, count=n)
+    local = np.fromiter((c.local_balance for c in channel_list), dtype=np.float64, count=n)
+    fwd_count = np.fromiter((c.out_count for c in channel_list), dtype=np.int64, count=n)
+    chan_rebal = np.fromiter((_chan_rebal_cost(c, p) for c, p in zip(channel_list, prev_states)),
+                             dtype=np.float64, count=n)
+    out_ratio = np.divide(local, cap, out=np.full(n, 0.5), where=cap > 0)
+    cap_frac = dynamic_step_cap_frac_arrays(np, out_ratio, fwd_count)
+    floor = np.where(chan_rebal > 0, rebal_cost_floor_arrays(np, chan_rebal), MIN_PPM)
+    return [ChannelCore(r, f, fl) for r, f, fl in zip(out_ratio.tolist(), cap_frac.tolist(), floor.tolist())]
+
+# ---- Avaliação em processos (--workers N) ----
+# Cada worker recebe uma vez (initializer) os DecisionParams e os globais de ajuste
+# (overrides/presets já aplicados); por tarefa vão só o ChannelInputs e o estado
+# anterior do canal, e volta o Decision. pool.map preserva a ordem dos canais.
+_WORKER_PARAMS = None
+_SETTING_TYPES = (bool, int, float, str, list, tuple, dict, set, frozenset, type(None))
+
+def _decision_settings():
+    return {k: v for k, v in globals().items()
+            if k.isupper() and not k.startswith("_") and isinstance(v, _SETTING_TYPES)}
+
+def _decision_worker_init(params, settings):
+    global _WORKER_PARAMS
+    globals().update(settings)
+    _WORKER_PARAMS = params
+
+def _decide_in_worker(inputs, prev_state, core=None):
+    return decide_channel(inputs, _WORKER_PARAMS, prev_state, core)
+
+def _decide_parallel(channel_list, params, prev_states, workers, cores):
+    # as funções vão por referência (módulo.nome): o script precisa estar em sys.modules
+    # (standalone é __main__; via importlib só se quem carregou registrou o módulo)
+    if getattr(sys.modules.get(__name__), "_decide_in_worker", None) is not _decide_in_worker:
+        raise RuntimeError(f"módulo {__name__} não registrado em sys.modules")
+    # fork: o filho herda o script já carregado, mesmo quando veio de importlib
+    ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    chunksize = max(1, len(channel_list) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_decision_worker_init,
+                             initargs=(params, _decision_settings())) as pool:
+        return list(pool.map(_decide_in_worker, channel_list, prev_states, cores, chunksize=chunksize))
+
+def decide_channels(channel_list, params, prev_states, workers=None):
+    """
+    decide_channel() p/ cada canal, na ordem de channel_list. Com workers > 1 (padrão:
+    DECISION_WORKERS) e canais suficientes, distribui entre processos; se o pool falhar,
+    refaz tudo em série (decide_channel não tem efeitos colaterais). Com FEE_KERNEL_NUMPY,
+    os ChannelCore saem antes, em lote (fee_core_batch).
+    """
+    cores = None
+    if FEE_KERNEL_NUMPY and channel_list:
+        cores = fee_core_batch(channel_list, prev_states)
+        if cores is None:
+            logger.warning("FEE_KERNEL_NUMPY ligado, mas numpy não está instalado; seguindo sem o kernel")
+    if cores is None:
+        cores = [None] * len(channel_list)
+    workers = DECISION_WORKERS if workers is None else workers
+    workers = max(1, min(int(workers or 1), len(channel_list)))
+    if workers > 1 and len(channel_list) >= DECISION_WORKERS_MIN_CHANNELS:
+        try:
+            return _decide_parallel(channel_list, params, prev_states, workers, cores)
+        except Exception as e:
+            logger.warning(f"Avaliação em {workers} processos falhou ({e}); seguindo em série")
+    return [decide_channel(inputs, params, prev, core)
+            for inputs, prev, core in zip(channel_list, prev_states, cores)]
 
-        # >>> PATCH: skip extra PEG if base already outrate
-        if not floor_src.startswith("outrate"):
-            # >>> OUTRATE PEG — cola o piso no preço observado (independente do outrate_floor)
-            
-            if OUTRATE_PEG_ENABLE and fwd_count >= OUTRATE_PEG_MIN_FWDS and out_ppm_7d > 0:
-                if not (EXPLORER_ENABLE and explorer_active and EXPLORER_BYPASS_OUTRATE):
-                    outrate_peg_active = True
-                    outrate_peg_ppm = clamp_ppm(int(round(out_ppm_7d * (1.0 + OUTRATE_PEG_HEADROOM))))
-                
-                    prev_floor = floor_ppm
-                    floor_ppm = max(floor_ppm, outrate_peg_ppm)
-                    if floor_ppm != prev_floor:
-                        floor_src = "peg"
-
-
-        # SINK — reforço: nunca abaixo do piso de rebal por canal (com margem)
-        if class_label == "sink" and SINK_KEEP_FLOOR_AT_REBAL_COST:
-            prev_floor = floor_ppm
-            floor_ppm = max(floor_ppm, rebal_floor_ppm)
-            if floor_ppm != prev_floor and floor_src not in ("peg", "outrate"):
-                floor_src = "rebal"   # reforço do rebal para sink
+# ========== PIPELINE ==========
+def main(dry_run=False):
+    logger.info("Iniciando AutoFee")
+    run_t0 = time.time()
+    stage_secs = {}
+    global EXCL_DRY_VERBOSE,ASSISTED_DIAG_ENABLE
 
-        # Regras extras existentes para SINK continuam válidas
-        if class_label == "sink":
-            extra = clamp_ppm(int(math.ceil((base_cost_for_margin or 0) * SINK_EXTRA_FLOOR_MARGIN)))
-            prev_floor = floor_ppm
-            floor_ppm = max(floor_ppm, extra)
-            if floor_ppm != prev_floor and floor_src not in ("peg", "outrate", "rebal"):
-                floor_src = "sink-extra"
-        # Cap do floor pelo seed — pulado em SINK se configurado
-        seed_cap_ppm = clamp_ppm(int(math.ceil(seed_used * REBAL_FLOOR_SEED_CAP_FACTOR)))
-        apply_seed_cap = True
-        if (class_label == "sink" and SINK_SKIP_SEED_CAP):
-            apply_seed_cap = False
-        if EXPLORER_ENABLE and explorer_active and EXPLORER_BYPASS_SEEDCAP:
-            apply_seed_cap = False
-
-        if apply_seed_cap:
-            prev_floor = floor_ppm
-            floor_ppm = min(floor_ppm, seed_cap_ppm)
-            if floor_ppm != prev_floor and floor_src not in ("peg", "outrate", "rebal", "sink-extra"):
-                floor_src = "seed-cap"
+    env_excl = os.getenv("EXCL_DRY_VERBOSE")
+    if env_excl is not None:
+        EXCL_DRY_VERBOSE = str(env_excl).strip().lower() in ("1","true","yes","on")
+    env_did = os.getenv("DIDACTIC_EXPLAIN")
+    if env_did is not None:
+        globals()["DIDACTIC_EXPLAIN_ENABLE"] = str(env_did).strip().lower() in ("1","true","yes","on")
 
+    env_did_level = os.getenv("DIDACTIC_LEVEL")
+    if env_did_level and env_did_level.strip().lower() in ("basic","detailed"):
+        globals()["DIDACTIC_LEVEL"] = env_did_level.strip().lower()
 
-        # ⬇️ NOVO: em discovery, desligar piso de rebal (deixa só o MIN_PPM)
-        if discovery_hit:
-            prev_floor = floor_ppm
-            floor_ppm = max(MIN_PPM, min(floor_ppm, MIN_PPM))
-            if floor_ppm != prev_floor:
-                floor_src = "none"
-                
-        # === EXPLORER 5.3: respeitar piso de rebal mesmo explorando ===
-        # Garante que, durante o Explorer, o floor nunca fique abaixo do custo de rebal por canal (com margem),
-        # mesmo se o Discovery tiver zerado o piso.
-        if EXPLORER_ENABLE and explorer_active and EXPLORER_RESPECT_REBAL_FLOOR:
-            if floor_ppm < rebal_floor_ppm:
-                floor_ppm = rebal_floor_ppm
-                if floor_src not in ("peg", "outrate"):
-                    floor_src = "rebal"
-
-
-        # Cálculo final com piso
-        if super_source_active:
-            floor_ppm = MIN_PPM
-            floor_src = "super-source"
-
-        final_ppm = max(raw_step_ppm, floor_ppm)
-
-        # Revenue floor — piso adicional por tráfego (super-rotas)
-        if REVFLOOR_ENABLE and not super_source_active:
-            baseline_eff = state.get(cid, {}).get("baseline_fwd7d", 0) or 0
-            if baseline_eff >= REVFLOOR_BASELINE_THRESH:
-                revfloor_seed = clamp_ppm(int(max(seed_used * 0.40, REVFLOOR_MIN_PPM_ABS)))
-                final_ppm = max(final_ppm, revfloor_seed)
-
-        # SOURCE — preferir alvo mais baixo relativo ao seed (quando for QUEDA)
-        if class_label == "source" and final_ppm < local_ppm:
-            pref = clamp_ppm(int(seed_used * SOURCE_SEED_TARGET_FRAC))
-            final_ppm = min(final_ppm, pref)
-
-        # 1) Âncoras dinâmicas
-        base_ceiling = int(seed_used * SEED_CEILING_MULT)
-        seed_floor   = int(seed_used * SEED_FLOOR_MULT)
-        p95_floor    = int((seed_p95 or seed_used) * P65_BOOST)
-        
-        # 2) Teto base: NÃO usa final_ppm como âncora, só referências "de mercado"
-        local_max = min(
-            MAX_PPM,
-            max(MIN_SOFT_CEILING, base_ceiling, seed_floor, p95_floor)
-        )
+    env_diag = os.getenv("DID_ASSISTED")
+    if env_diag is not None:
+        ASSISTED_DIAG_ENABLE = str(env_diag).strip().lower() in ("1","true","yes","on")
 
-        # 3) Turbo para SINK super drenado e com margem ≥ 0  (mantém igual)
-        if class_label == "sink" and out_ratio < PERSISTENT_LOW_THRESH and margin_ppm_7d >= SINK_MIN_MARGIN:
-            local_max = MAX_PPM
-        else:
-            # Exceções de demanda: se há demanda real, não estrangular pelo teto
-            demand_exception = (
-                (OUTRATE_PEG_ENABLE and fwd_count >= OUTRATE_PEG_MIN_FWDS and out_ppm_7d >= seed_used * OUTRATE_PEG_SEED_MULT)
-                or (out_ratio < PERSISTENT_LOW_THRESH)  # drenado: não forçar queda por teto
-            )
-            if demand_exception:
-                # Libera mais espaço: respeita demanda observada
-                local_max = min(
-                    MAX_PPM,
-                    max(local_max, int(seed_used * OUTRATE_PEG_SEED_MULT), int(out_ppm_7d or 0))
-                )
 
-        # 3b) Teto especial para SOURCE: não faz sentido virar MAX_PPM se é "source"
-        if class_label == "source":
-            # cap básico: perto do seed (ex.: 1.1x seed)
-            src_cap = int(seed_used * 1.10)
-            # se já temos out_ppm observado, não subir muito acima disso
-            if (out_ppm_7d or 0) > 0:
-                src_cap = min(src_cap, int(out_ppm_7d * 1.10))
-
-            # garante que o teto do source seja bem abaixo de MAX_PPM
-            local_max = min(local_max, clamp_ppm(src_cap))
-
-
-        # ⛏️ FIX: primeiro clamp no teto, depois REAPLICA o step-cap para não “degolar” em 1 rodada
-        final_ppm_preclamp = int(round(final_ppm))
-        final_ppm_clamped  = max(MIN_PPM, min(local_max, final_ppm_preclamp))
-        final_ppm = apply_step_cap2(
-            local_ppm,
-            final_ppm_clamped,
-            cap_frac,
-            STEP_MIN_STEP_PPM if final_ppm_clamped <= local_ppm else STEP_MIN_STEP_PPM_UP
-        )
+    cache = load_json(CACHE_PATH, {})
+    state = get_state()
+    version_info = read_version_info(VERSIONS_FILE)
+    vstr = version_info.get("version", "0.0.0")
+    logger.info(f"Versão: {vstr}, dry_run={dry_run}")
 
-        # [PATCH 3]: garantir floor após clamp e step-cap
-        if REBAL_FLOOR_ENABLE and final_ppm < floor_ppm:
-            final_ppm = floor_ppm
-            # opcional: marque o motivo; a tag é criada mais abaixo, mas se quiser
-            # pode setar um flag para incluir "🧱floor-lock".
-        # Sufixo textual indicando a origem do piso, para o log
-        floor_src_tag = "" if not floor_src else f"({floor_src})"
-
-        # Telemetria: bateu no MAX_PPM global?
-        if final_ppm == MAX_PPM:
-            max_hits += 1
-
-        # Diagnóstico
-        diag_tags = []
-        if global_neg_lock_applied:
-            diag_tags.append("🛡️global-neg-lock")
-        if raw_step_ppm != target:
-            dir_same = ((target > local_ppm and raw_step_ppm > local_ppm) or
-                        (target < local_ppm and raw_step_ppm < local_ppm))
-            if dir_same:
-                diag_tags.append("⛔stepcap")
-
-        if final_ppm == floor_ppm and target != floor_ppm:
-            diag_tags.append("🧱floor-lock")
-
-        if final_ppm == local_ppm and target != local_ppm and floor_ppm <= local_ppm:
-            diag_tags.append("⛔stepcap-lock")
-            
-        if lock_skip_tag:
-            diag_tags.append(lock_skip_tag)
-            
-        if extreme_turbo_applied:
-            diag_tags.append("🚀extreme-drain+")
-        
-        if EXPLORER_ENABLE and explorer_active:
-            diag_tags.append(EXPLORER_TAG)
-
-
-
-        # marcações de contexto
-        discovery_hit and diag_tags.append("🧪discovery")
-        for t in (surge_tag, top_tag, negm_tag):
-            if t: diag_tags.append(t)
-        if new_inbound:
-            diag_tags.append(NEW_INBOUND_TAG)
-
-        if REVFLOOR_ENABLE and not super_source_active and (state.get(cid, {}).get("baseline_fwd7d", 0) or 0) >= REVFLOOR_BASELINE_THRESH:
-            if final_ppm < max(int(seed_used * 0.90), int(max(seed_used * 0.40, REVFLOOR_MIN_PPM_ABS))):
-                diag_tags.append("⚠️subprice")
-        if (state.get(cid, {}).get("low_streak", 0) or 0) >= EXTREME_DRAIN_STREAK and (state.get(cid, {}).get("baseline_fwd7d", 0) or 0) <= 2:
-            diag_tags.append("💤stale-drain")
-        # >>> PATCH: tag de diagnóstico quando o PEG ficou ativo
-        if OUTRATE_PEG_ENABLE and outrate_peg_active:
-            diag_tags.append("🧲peg")
-        if DEBUG_TAGS:
-            diag_tags.append(f"🔍t{target}/r{raw_step_ppm}/f{floor_ppm}")
-        # garantir que pl_tags (no-down-low) apareçam nas tags finais
-        for t in pl_tags:
-            diag_tags.append(t)
-        status_tags = status_tags  # já montado lá em cima (🟢on/🔴off)
-        all_tags = status_tags + class_tags + seed_tags + diag_tags
+    t1_epoch, t2_epoch = epoch_days_ago(LOOKBACK_DAYS)
+    start_dt = datetime.datetime.fromtimestamp(t1_epoch, datetime.timezone.utc)
+    end_dt   = datetime.datetime.fromtimestamp(t2_epoch, datetime.timezone.utc)
+    one_day_ago = end_dt - datetime.timedelta(days=1)
+    one_day_ago_naive = one_day_ago.astimezone(datetime.timezone.utc).replace(tzinfo=None)
 
-        # --- Cálculo do inbound discount (rebate) ---
-        prev_inb_discount = int((state.get(cid, {}) or {}).get("last_inbound_discount_ppm", 0))
+    conn = db_connect()
+    cur  = conn.cursor()
 
-        # Valor padrão: sem desconto
-        inbound_discount_ppm = 0
-        inbound_reason = "disabled"
+    # Detecta se 'chan_point' existe no LNDg
+    if has_column(cur, "gui_channels", "chan_point"):
+        cur.execute("""
+            SELECT chan_id, chan_point, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open
+        FROM gui_channels
+        """)
+        meta_rows = cur.fetchall()
+        channels_meta = {}
+        open_cids = set()
+        for (chan_id, chan_point, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open) in meta_rows:
+            cid = str(chan_id)  # SCID DECIMAL
+            channels_meta[cid] = {
+                "chan_point": chan_point,
+                "alias": alias or "Unknown",
+                "local_ppm": int(local_fee_rate or 0),
+                "remote_fee_rate": int(remote_fee_rate or 0),
+                "ar_max_cost": float(ar_max_cost or 0),
+                "remote_pubkey": remote_pubkey,
+                "is_open": int(is_open or 0),
+            }
+            if int(is_open or 0) == 1:
+                open_cids.add(cid)
+        has_chan_point = True
+    else:
+        cur.execute("""
+            SELECT chan_id, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open
+            FROM gui_channels
+        """)
+        meta_rows = cur.fetchall()
+        channels_meta = {}
+        open_cids = set()
+        for (chan_id, alias, local_fee_rate, remote_fee_rate, ar_max_cost, remote_pubkey, is_open) in meta_rows:
+            cid = str(chan_id)
+            channels_meta[cid] = {
+                "chan_point": None,
+                "alias": alias or "Unknown",
+                "local_ppm": int(local_fee_rate or 0),
+                "remote_fee_rate": int(remote_fee_rate or 0),
+                "ar_max_cost": float(ar_max_cost or 0),
+                "remote_pubkey": remote_pubkey,
+                "is_open": int(is_open or 0),
+            }
+            if int(is_open or 0) == 1:
+                open_cids.add(cid)
+        has_chan_point = False
 
-        if INBOUND_FEE_ENABLE:
-            
+    live = listchannels_snapshot()
+    live_by_scid  = live["by_scid_dec"]
+    live_by_cid   = live["by_cid_dec"]
+    live_by_point = live["by_point"]
 
-            inbound_discount_ppm, inbound_reason = compute_inbound_discount_ppm(
-                class_label=class_label,
-                out_ratio=out_ratio,
-                fwd_count=fwd_count,
-                margin_ppm_7d=margin_ppm_7d,
-                price_ppm=final_ppm,
-                base_cost_for_margin=base_cost_for_margin,
-                rebal_floor_ppm=rebal_floor_ppm,
-                discovery_hit=bool(discovery_hit),
-                new_inbound=bool(new_inbound),
-                rebal_ppm_7d=int(rebal_ppm7d_val or 0),
-                rebal_ppm_7d_real=int(rebal_ppm7d_real or 0),
-            )
+    # ---- Forwards (7d) ----
+    fwd_agg = load_forward_aggregates(cur, start_dt, end_dt, one_day_ago_naive)
+    out_fee_sat = defaultdict(int, fwd_agg["out_fee_sat"])
+    out_amt_sat = defaultdict(int, fwd_agg["out_amt_sat"])
+    out_count   = defaultdict(int, fwd_agg["out_count"])
+    out_amt_sat_1d = defaultdict(int, fwd_agg["out_amt_sat_1d"])
 
-            if inbound_discount_ppm > 0:
-                all_tags.append(f"💸inb{inbound_discount_ppm}")
-                if DEBUG_TAGS:
-                    all_tags.append(f"ⓘinb:{inbound_reason}")
+    # ENTRADA p/ classificar sources/routers
+    in_amt_sat_by_cid  = defaultdict(int, fwd_agg["in_amt_sat_by_cid"])
+    in_count_by_cid    = defaultdict(int, fwd_agg["in_count_by_cid"])
 
-        # delta do inbound (para saber se vale a pena aplicar update)
-        inbound_delta = abs(inbound_discount_ppm - prev_inb_discount)
-        inbound_push_needed = (
-            INBOUND_FEE_ENABLE and
-            inbound_delta >= INBOUND_FEE_PUSH_MIN_ABS_PPM
-        )
+    # Mapa cid(LNDg/SCID) -> pubkey
+    chan_pubkey = {}
+    for scid, info in live_by_scid.items():
+        if info.get("remote_pubkey"):
+            chan_pubkey[scid] = info.get("remote_pubkey")
+    for cid, info in live_by_cid.items():
+        if info.get("remote_pubkey") and cid not in chan_pubkey:
+            chan_pubkey[cid] = info.get("remote_pubkey")
+    for cid, meta in channels_meta.items():
+        if cid not in chan_pubkey and meta.get("remote_pubkey"):
+            chan_pubkey[cid] = meta.get("remote_pubkey")
 
-        # net fee de inbound (somente para log)
-        if INBOUND_FEE_ENABLE and inbound_discount_ppm > 0:
-            net_inbound_ppm = max(final_ppm - inbound_discount_ppm, 0)
-        else:
-            net_inbound_ppm = final_ppm
-        # String amigável para log sobre inbound discount
-        if INBOUND_FEE_ENABLE and inbound_discount_ppm > 0:
-              inb_str = f" | inb {prev_inb_discount}→{inbound_discount_ppm}ppm (net≈{net_inbound_ppm})"
-        else:
-            inb_str = ""
+    incoming_msat_by_pub = defaultdict(int)
+    for k, amt_msat in fwd_agg["in_amt_msat_by_cid"].items():
+        pub = chan_pubkey.get(k)
+        if pub:
+            incoming_msat_by_pub[pub] += int(amt_msat or 0)
 
-        # ====== MÍNIMO REAL: sanear local < MIN_PPM ======
-        # Fazemos antes do gate de microupdate/cooldown.
-        if local_ppm < MIN_PPM:
-            # Vamos forçar aplicação do mínimo, sem segurar por cooldown/microupdate.
-            final_ppm = max(final_ppm, MIN_PPM)
-            all_tags.append("🩹min-fix")
+    total_incoming_msat = sum(incoming_msat_by_pub.values())
+    peer_count = max(1, len(incoming_msat_by_pub))
+    avg_share = 1.0 / peer_count if peer_count > 0 else 0.0
 
-        new_ppm = final_ppm
+    # Receita total de fees de saída
+    total_out_fee_sat = sum(out_fee_sat.values())
 
-        base_fee_msat = SUPER_SOURCE_BASE_FEE_MSAT if super_source_active else BASE_FEE_MSAT
-        prev_base_fee_msat = int((state.get(cid, {}) or {}).get("last_base_fee_msat", BASE_FEE_MSAT))
-        base_fee_push_needed = bool(
-            USE_LNCLI_UPDATECHANPOLICY and chan_point and base_fee_msat != prev_base_fee_msat
-        )
+    # ---- Custo de rebal (7d) GLOBAL e POR CANAL ----
+    rebal_agg = load_rebal_aggregates(cur, start_dt, end_dt)
+    rebal_value_sat_global = rebal_agg["value_sat_global"]
+    rebal_fee_sat_global   = rebal_agg["fee_sat_global"]
+    perchan_value_sat = defaultdict(int, rebal_agg["perchan_value_sat"])
+    perchan_fee_sat   = defaultdict(int, rebal_agg["perchan_fee_sat"])
 
-        # Aplica/relata
-        seed_note_parts = [str(int(seed_used))]
-        if seed_raw is not None:
-            seed_note_parts.append(f"p65:{int(seed_raw)}")
-        if seed_p95 is not None:
-            seed_note_parts.append(f"p95:{int(seed_p95)}")
-        seed_note = " ".join(seed_note_parts) + (" (cap)" if seed_flags else "")
+    rebal_cost_ppm_global = ppm(rebal_fee_sat_global, rebal_value_sat_global)
+    rebal_cost_ppm_by_chan = {
+        cid: ppm(perchan_fee_sat[cid], perchan_value_sat[cid]) for cid in perchan_value_sat.keys()
+    }
 
-        dir_for_emoji = "up" if new_ppm > local_ppm else ("down" if new_ppm < local_ppm else "flat")
-        emo = "🔺" if dir_for_emoji == "up" else ("🔻" if dir_for_emoji == "down" else "⏸️")
+    # --- Robustez: só usa custo por canal se teve volume mínimo ---
+    rebal_cost_ppm_by_chan_use = {}
+    for cid_k in set(list(perchan_value_sat.keys()) + list(rebal_cost_ppm_by_chan.keys())):
+        if perchan_value_sat.get(cid_k, 0) >= REBAL_PERCHAN_MIN_VALUE_SAT:
+            rebal_cost_ppm_by_chan_use[cid_k] = rebal_cost_ppm_by_chan.get(cid_k, 0)
+    # --- Margem global 7d (para travas defensivas)
+    out_ppm_total = ppm(sum(out_fee_sat.values()), sum(out_amt_sat.values()))
+    neg_margin_global = (
+        bool(rebal_cost_ppm_global) and bool(out_ppm_total) and out_ppm_total < rebal_cost_ppm_global
+    )
+    
 
-        # Gate anti-microupdate
-        push_forced_by_floor = (floor_ppm > local_ppm and new_ppm > local_ppm)
-        will_push = True
-        if new_ppm != local_ppm and not push_forced_by_floor:
-            delta_ppm = abs(new_ppm - local_ppm)
-            rel = delta_ppm / max(1, local_ppm)
-            if delta_ppm < BOS_PUSH_MIN_ABS_PPM and rel < BOS_PUSH_MIN_REL_FRAC:
-                will_push = False
-                all_tags.append("🧘hold-small")
+    # ==== SHARDING SLOT ====
+    now_ts = int(time.time())
+    shard_slot = None
+    if SHARDING_ENABLE:
+        shard_slot = (now_ts // 3600) % SHARD_MOD
 
-        # se estamos corrigindo MIN_PPM, força push
-        if local_ppm < MIN_PPM and new_ppm >= MIN_PPM:
-            will_push = True
-        if inbound_push_needed:
-            will_push = True
-        if base_fee_push_needed:
-            will_push = True
-            
-        # === COOLDOWN / HISTERÉSE ===
-        st_prev  = state.get(cid, {})
-        last_ts  = st_prev.get("last_ts", 0)
-        hours_since = (int(time.time()) - last_ts) / 3600 if last_ts else 999
-        fwds_at_change = st_prev.get("fwds_at_change", 0)
-        fwds_since = max(0, fwd_count - fwds_at_change)
-        cooldown_blocked = False
-        if APPLY_COOLDOWN_ENABLE and new_ppm != local_ppm and not push_forced_by_floor:
-            # Explorer: ignorar cooldown para quedas, se configurado
-            if (EXPLORER_ENABLE and explorer_active and EXPLORER_SKIP_COOLDOWN_DOWN
-                and new_ppm != local_ppm and new_ppm < local_ppm
-                and not push_forced_by_floor):
-                # anula qualquer bloqueio prévio de cooldown
-                will_push = True
-                cooldown_blocked = False
-                # remove tags de cooldown adicionadas antes (se houver)
-                all_tags = [t for t in all_tags if not t.startswith("⏳cooldown")]
-            # em discovery e QUEDA, não aplicar cooldown
-            if discovery_hit and new_ppm < local_ppm:
-                pass
-            elif not (new_inbound and new_ppm < local_ppm):
-                need = COOLDOWN_HOURS_UP if new_ppm > local_ppm else COOLDOWN_HOURS_DOWN
-                if hours_since < need and fwds_since < COOLDOWN_FWDS_MIN:
-                    will_push = False
-                    cooldown_blocked = True
-                    all_tags.append(f"⏳cooldown{int(need)}h")
-                if (COOLDOWN_PROFIT_DOWN_ENABLE and new_ppm < local_ppm):
-                    if (margin_ppm_7d > COOLDOWN_PROFIT_MARGIN_MIN and fwd_count >= COOLDOWN_PROFIT_FWDS_MIN):
-                        need2 = max(need, COOLDOWN_HOURS_DOWN)
-                        if hours_since < need2:
-                            will_push = False
-                            cooldown_blocked = True
-                            all_tags.append(f"⏳cooldown-profit{int(need2)}h")
-            # >>> PATCH: OUTRATE PEG — queda abaixo do outrate só após GRACE_HOURS
-            if new_ppm < local_ppm and OUTRATE_PEG_ENABLE and outrate_peg_active:
-                # se a nova taxa ficaria abaixo do 'preço observado', exija janela de graça maior
-                peg_limit = clamp_ppm(int(round(out_ppm_7d * (1.0 + OUTRATE_PEG_HEADROOM))))
-                if new_ppm < peg_limit:
-                    need_peg = max(COOLDOWN_HOURS_DOWN, OUTRATE_PEG_GRACE_HOURS)
-                    if hours_since < need_peg:
-                        will_push = False
-                        cooldown_blocked = True
-                        all_tags.append(f"⏳cooldown{int(need_peg)}h-outrate")
-        # ===== Previsão (depois de avaliar cooldown/stepcap e antes de report.append) =====
-        cooldown_needed_hours = None
-        if APPLY_COOLDOWN_ENABLE and new_ppm != local_ppm and not push_forced_by_floor:
-            # Se cooldown ativo segurou a mudança, informe janela prevista restante
-            need = COOLDOWN_HOURS_UP if new_ppm > local_ppm else COOLDOWN_HOURS_DOWN
-            # pode ter sido elevado por regras de profit ou peg grace; use o maior já aplicado
-            try:
-                candidates = []
-                for t in all_tags:
-                    if t.startswith("⏳cooldown") and "h" in t:
-                        x = t.replace("⏳cooldown", "")
-                        x = x.replace("-outrate", "").replace("-profit", "").replace("h", "")
-                        x = int(x) if x.isdigit() else None
-                        if x:
-                            candidates.append(x)
-                if candidates:
-                    need = max([need] + candidates)
-            except Exception:
-                pass
+    report = StreamingReport(make_report_sinks(dry_run))
+    # updates de política acumulados no loop e aplicados de uma vez depois dele;
+    # cada um reserva sua linha no report (slot) até o resultado do apply
+    pending_updates = []
+    pending_ctx = []
+    hdr = f"{'DRY-RUN ' if dry_run else ''}⚙️ AutoFee v{vstr} | janela {LOOKBACK_DAYS}d | rebal≈ {int(rebal_cost_ppm_global)} ppm (gui_payments)"
 
-            if hours_since < need:
-                cooldown_needed_hours = max(0, int(round(need - hours_since)))
-            
-            if cooldown_blocked:
-                # acrescente o sufixo "(blocked)" na(s) tag(s) de cooldown
-                for i, t in enumerate(list(all_tags)):
-                    if t.startswith("⏳cooldown"):
-                        if "(blocked)" not in t:
-                            all_tags[i] = t + "(blocked)"
-        
-        prediction_msg = build_prediction(
-            out_ratio=out_ratio,
-            margin_ppm_7d=margin_ppm_7d,
-            target=target,
-            local_ppm=local_ppm,
-            new_ppm=new_ppm,
-            fwd_count=fwd_count,
-            neg_margin_global=neg_margin_global,
-            discovery_hit=bool(discovery_hit),   # ← usar a variável booleana já calculada
-            cooldown_needed_hours=cooldown_needed_hours
-        )
-        if EXPLORER_ENABLE and explorer_active and new_ppm < local_ppm:
-            prediction_msg = prediction_msg.replace("previsão:", "previsão (explorer):")
-
-
-
-        # ===== DRY RUN / EXCLUIR =====
-        # DRY context: --dry-run ou excluido
-        act_dry = dry_run or is_excluded
-
-        # Persistência de classificação/bias no STATE
-        if not dry_run:  # em execução real, sempre persiste classe (mesmo excluído)
-            st_for_save = state.get(cid, {}).copy()
-            st_for_save["bias_ema"]    = float(bias_ema)
-            st_for_save["class_label"] = class_label
-            st_for_save["class_conf"]  = float(class_conf)
-            state[cid] = st_for_save
-        elif dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
-            # Em dry-run, persistir SOMENTE campos de classe (sem mexer em last_ppm/ts/etc.)
-            st_for_save = state.get(cid, {}).copy()
-            st_for_save.setdefault("first_seen_ts", int(time.time()))
-            st_for_save["bias_ema"]    = float(bias_ema)
-            st_for_save["class_label"] = class_label
-            st_for_save["class_conf"]  = float(class_conf)
-            state[cid] = st_for_save
-
-        if (new_ppm != local_ppm or inbound_push_needed or base_fee_push_needed) and will_push:
-            delta = new_ppm - local_ppm
-            if new_ppm != local_ppm and local_ppm > 0:
-                pct = (abs(delta) / local_ppm * 100.0)
-                dstr = f"{'+' if delta>0 else ''}{delta} ({pct:.1f}%)"
-            else:
-                # nenhuma mudança de outbound; alteração só de inbound
-                dstr = "0 (0.0%) [inb only]"
-
-
-            if act_dry:
-                if is_excluded and not EXCL_DRY_VERBOSE:
-                    report.append(f"✅{emo} {alias}: 🚷excl-dry")
-                    # Explorer: contabiliza round de queda aplicada
-                    if EXPLORER_ENABLE and explorer_active and new_ppm < local_ppm:
-                        rounds = int(_get_explorer_state(state, cid).get("rounds", 0)) + 1
-                        _set_explorer_state(state, cid, rounds=rounds)
-                    if new_ppm > local_ppm: excl_dry_up += 1
-                    else: excl_dry_down += 1
-                else:
-                    method_label = fee_update_method(pubkey, chan_point)
-                    method_tag = f" ({method_label})" if method_label else ""
-                    action = f"DRY set {local_ppm}→{new_ppm} ppm{method_tag} {dstr}"
-                    new_dir = dir_for_emoji
-                    excl_note = " 🚷excl-dry" if is_excluded else ""
-                    # 👉 conta mudança de inbound (qualquer alteração, mesmo com outbound)
-                    try:
-                        prev_inb = int(prev_inb_discount)
-                    except Exception:
-                        prev_inb = 0
-                    try:
-                        cur_inb = int(inbound_discount_ppm) if inbound_discount_ppm is not None else 0
-                    except Exception:
-                        cur_inb = 0
-
-                    if INBOUND_FEE_ENABLE and cur_inb != prev_inb:
-                        inbound_changed += 1
-                    report.append(
-                        f"✅{emo} {alias}:{excl_note} {action} {inb_str} | alvo {target} | out_ratio {out_ratio:.2f} | "
-                        f"out_ppm7d≈{int(out_ppm_7d)} | rebal_ppm7d≈{rebal_ppm7d_str} | seed≈{seed_note} | floor≥{floor_ppm}{floor_src_tag} | marg≈{margin_ppm_7d} | "
-                        f"rev_share≈{rev_share:.2f} | {' '.join(all_tags)} | {fee_lr_str}"   # NEW
-                        + (
-                            ("\n   " + build_didactic_explanation(
-                                local_ppm=local_ppm,
-                                target=target,
-                                final_ppm=new_ppm if 'new_ppm' in locals() else local_ppm,
-                                floor_ppm=floor_ppm,
-                                out_ratio=out_ratio,
-                                fwd_count=fwd_count,
-                                margin_ppm_7d=margin_ppm_7d,
-                                class_label=class_label,
-                                neg_margin_global=neg_margin_global,
-                                new_inbound=bool(new_inbound),
-                                discovery_hit=bool(discovery_hit),
-                                seed_used=float(seed_used),
-                                out_ppm_7d=float(out_ppm_7d or 0),
-                                base_cost_for_margin=float(base_cost_for_margin or 0),
-                                global_neg_lock_applied=bool(global_neg_lock_applied),
-                                all_tags=all_tags,
-                                will_push=bool(will_push)
-                            )) if DIDACTIC_EXPLAIN_ENABLE else ""
-                        )
-                        + "\n   " + prediction_msg
+    if SHARDING_ENABLE:
+        hdr += f" | shard {shard_slot+1}/{SHARD_MOD}"
+    report.append(hdr)
 
-                    )
+    # --- métricas p/ resumo (somadas a partir das decisões por canal) ---
+    counts = Counter()
+    symptoms = {key: 0 for key in SYMPTOM_TAGS}
+    symptoms["cb_trigger"] = 0
 
-                    if is_excluded:
-                        if new_ppm > local_ppm: excl_dry_up += 1
-                        else: excl_dry_down += 1
-                    else:
-                        if new_ppm > local_ppm:
-                            changed_up += 1
-                        elif new_ppm < local_ppm:
-                            changed_down += 1
-                        else:
-                            kept += 1   # outbound igual, mudamos só inbound
-            else:
-                try:
-                    if pubkey or chan_point:
-                        if INBOUND_FEE_ENABLE:
-                            method_label = set_channel_fees(pubkey, chan_point, final_ppm, inbound_discount_ppm, base_fee_msat=base_fee_msat)
-                        else:
-                            # comportamento antigo: só setar out_ppm
-                            method_label = set_channel_fees(pubkey, chan_point, final_ppm, None, base_fee_msat=base_fee_msat)
-                        method_tag = f" ({method_label})" if method_label else ""
-                        action = f"set {local_ppm}→{new_ppm} ppm{method_tag} {dstr}"
-                        new_dir = dir_for_emoji
-                        # 👉 conta mudança de inbound (qualquer alteração, mesmo com outbound)
-                        try:
-                            prev_inb = int(prev_inb_discount)
-                        except Exception:
-                            prev_inb = 0
-                        try:
-                            cur_inb = int(inbound_discount_ppm) if inbound_discount_ppm is not None else 0
-                        except Exception:
-                            cur_inb = 0
-
-                        if INBOUND_FEE_ENABLE and cur_inb != prev_inb:
-                            inbound_changed += 1
-                        # baseline EMA (70/30) se houver amostra >0
-                        st = state.get(cid, {}).copy()
-                        # Explorer: contabiliza round de queda aplicada
-                        if EXPLORER_ENABLE and explorer_active and new_ppm < local_ppm:
-                            rounds = int(_get_explorer_state(state, cid).get("rounds", 0)) + 1
-                            _set_explorer_state(state, cid, rounds=rounds)
-                        old_base = st.get("baseline_fwd7d", 0)
-                        if fwd_count > 0:
-                            if old_base and old_base > 0:
-                                new_base = int(round(0.7*old_base + 0.3*fwd_count))
-                            else:
-                                new_base = fwd_count
-                        else:
-                            new_base = old_base
-                        # grava o último desconto de inbound aplicado (ou zero se desativado)
-                        st["last_inbound_discount_ppm"] = int(inbound_discount_ppm if INBOUND_FEE_ENABLE else 0)
-                        st.update({
-                            "last_ppm": new_ppm,
-                            "last_base_fee_msat": int(base_fee_msat),
-                            "last_dir": new_dir,
-                            "last_ts":  int(time.time()),
-                            "baseline_fwd7d": new_base,
-                            "low_streak": streak if PERSISTENT_LOW_ENABLE else 0,
-                            "last_seed": float(seed_used),
-                            "fwds_at_change": fwd_count,
-                            # garantir persistência da classificação
-                            "bias_ema": float(bias_ema),
-                            "class_label": class_label,
-                            "class_conf": float(class_conf),
-                        })
-                        state[cid] = st
-                    else:
-                        action = "❌ sem pubkey/chan_point p/ aplicar"
-                        new_dir = "flat"
-                except Exception as e:
-                    action = f"❌ erro ao setar: {e}"
-                    new_dir = "flat"
+    chan_status_cache = cache.get(OFFLINE_STATUS_CACHE_KEY, {})
 
-                excl_note = " 🚷excl-dry" if is_excluded else ""
-                report.append(
-                    f"✅{emo} {alias}:{excl_note} {action} {inb_str} | alvo {target} | out_ratio {out_ratio:.2f} | "
-                    f"out_ppm7d≈{int(out_ppm_7d)} | rebal_ppm7d≈{rebal_ppm7d_str} | seed≈{seed_note} | floor≥{floor_ppm}{floor_src_tag} | marg≈{margin_ppm_7d} | "
-                    f"rev_share≈{rev_share:.2f} | {' '.join(all_tags)} | {fee_lr_str}"   # NEW
-                    + (
-                            ("\n   " + build_didactic_explanation(
-                                local_ppm=local_ppm,
-                                target=target,
-                                final_ppm=new_ppm if 'new_ppm' in locals() else local_ppm,
-                                floor_ppm=floor_ppm,
-                                out_ratio=out_ratio,
-                                fwd_count=fwd_count,
-                                margin_ppm_7d=margin_ppm_7d,
-                                class_label=class_label,
-                                neg_margin_global=neg_margin_global,
-                                new_inbound=bool(new_inbound),
-                                discovery_hit=bool(discovery_hit),
-                                seed_used=float(seed_used),
-                                out_ppm_7d=float(out_ppm_7d or 0),
-                                base_cost_for_margin=float(base_cost_for_margin or 0),
-                                global_neg_lock_applied=bool(global_neg_lock_applied),
-                                all_tags=all_tags,
-                                will_push=bool(will_push)
-                            )) if DIDACTIC_EXPLAIN_ENABLE else ""
-                        )
-                        + "\n   " + prediction_msg
-                )
+    def resolve_live_info(cid, meta):
+        live_info = live_by_scid.get(cid)
+        if (not live_info) and has_chan_point:
+            cp = meta.get("chan_point")
+            if cp:
+                live_info = live_by_point.get(cp)
+        if not live_info:
+            # Fallback to chan_id mapping when scid is missing or not aligned.
+            live_info = live_by_cid.get(cid)
+        return live_info
 
-                if is_excluded:
-                    if new_ppm > local_ppm: excl_dry_up += 1
-                    else: excl_dry_down += 1
-                else:
-                    if new_ppm > local_ppm:
-                        changed_up += 1
-                    elif new_ppm < local_ppm:
-                        changed_down += 1
-                    else:
-                        kept += 1   # outbound igual, mudamos só inbound
+    def in_shard(cid):
+        try:
+            cid_int = int(cid)
+        except Exception:
+            digits = ''.join([c for c in cid if c.isdigit()])
+            cid_int = int(digits[-6:] or "0")
+        return (cid_int % SHARD_MOD) == shard_slot
 
-        else:
-            # mantém (ou micro-update/cooldown segurou)
-            if not dry_run:  # em execução real, sempre persiste campos de classe
-                st = state.get(cid, {}).copy()
-                st.setdefault("first_seen_ts", int(time.time()))
-                st["low_streak"] = streak if PERSISTENT_LOW_ENABLE else 0
-                st["last_seed"] = float(seed_used)
-                st["bias_ema"] = float(bias_ema)
-                st["class_label"] = class_label
-                st["class_conf"] = float(class_conf)
-                state[cid] = st
-            elif dry_run and DRYRUN_SAVE_CLASS and not is_excluded:
-                st = state.get(cid, {}).copy()
-                st.setdefault("first_seen_ts", int(time.time()))
-                st["bias_ema"] = float(bias_ema)
-                st["class_label"] = class_label
-                st["class_conf"] = float(class_conf)
-                state[cid] = st
+    # --- Prefetch Amboss: peers que chegam ao seed (fora de shard/offline não contam)
+    prefetch_pubkeys = set()
+    for cid in open_cids:
+        meta = channels_meta.get(cid, {})
+        live_info = resolve_live_info(cid, meta)
+        pk = (live_info or {}).get("remote_pubkey") or meta.get("remote_pubkey")
+        if not pk or (SHARDING_ENABLE and not in_shard(cid)):
+            continue
+        if OFFLINE_SKIP_ENABLE and (live_info or {}).get("active", None) is False:
+            continue
+        prefetch_pubkeys.add(pk)
+    stage_t0 = time.time()
+    stage_secs["load"] = stage_t0 - run_t0
+    amboss_prefetch(prefetch_pubkeys, cache)
+    stage_secs["amboss_prefetch"] = time.time() - stage_t0
+    stage_t0 = time.time()
+
+    # ---- Decisões por canal: entradas -> decide_channel() -> persistência/relatório ----
+    params = DecisionParams(
+        dry_run=bool(dry_run),
+        shard_slot=shard_slot,
+        total_incoming_msat=total_incoming_msat,
+        avg_share=avg_share,
+        total_out_fee_sat=total_out_fee_sat,
+        rebal_cost_ppm_global=rebal_cost_ppm_global,
+        neg_margin_global=neg_margin_global,
+    )
 
-            if is_excluded and not EXCL_DRY_VERBOSE:
-                report.append(f"🫤⏸️ {alias}: 🚷excl-dry")
-                excl_dry_kept += 1
-            else:
-                excl_note = " 🚷excl-dry" if is_excluded else ""
-                report.append(
-                    f"🫤⏸️ {alias}:{excl_note} mantém {local_ppm} ppm {inb_str} | alvo {target} | out_ratio {out_ratio:.2f} | "
-                    f"out_ppm7d≈{int(out_ppm_7d)} | rebal_ppm7d≈{rebal_ppm7d_str} | seed≈{seed_note} | floor≥{floor_ppm}{floor_src_tag} | marg≈{margin_ppm_7d} | "
-                    f"rev_share≈{rev_share:.2f} | {' '.join(all_tags)} | {fee_lr_str}"   # NEW
-                        + (
-                            ("\n   " + build_didactic_explanation(
-                                local_ppm=local_ppm,
-                                target=target,
-                                final_ppm=new_ppm if 'new_ppm' in locals() else local_ppm,
-                                floor_ppm=floor_ppm,
-                                out_ratio=out_ratio,
-                                fwd_count=fwd_count,
-                                margin_ppm_7d=margin_ppm_7d,
-                                class_label=class_label,
-                                neg_margin_global=neg_margin_global,
-                                new_inbound=bool(new_inbound),
-                                discovery_hit=bool(discovery_hit),
-                                seed_used=float(seed_used),
-                                out_ppm_7d=float(out_ppm_7d or 0),
-                                base_cost_for_margin=float(base_cost_for_margin or 0),
-                                global_neg_lock_applied=bool(global_neg_lock_applied),
-                                all_tags=all_tags,
-                                will_push=bool(will_push)
-                            )) if DIDACTIC_EXPLAIN_ENABLE else ""
-                        )
-                        + "\n   " + prediction_msg
-                )
+    def channel_inputs(cid):
+        meta = channels_meta.get(cid, {})
+        live_info = resolve_live_info(cid, meta) or {}
+        pubkey = live_info.get("remote_pubkey") or meta.get("remote_pubkey")
+        active = live_info.get("active", None)
+        chan_in_shard = (not SHARDING_ENABLE) or in_shard(cid)
+        # seed só p/ quem passa do shard/offline skip (o prefetch também só buscou esses)
+        needs_seed = chan_in_shard and not (OFFLINE_SKIP_ENABLE and active is False)
+        return ChannelInputs(
+            cid=cid,
+            alias=meta.get("alias", "Unknown"),
+            local_ppm=meta.get("local_ppm", 0),
+            remote_ppm=int(meta.get("remote_fee_rate") or 0),
+            pubkey=pubkey,
+            chan_point=live_info.get("chan_point") or meta.get("chan_point"),
+            is_excluded=(pubkey in EXCLUSION_LIST) if pubkey else False,
+            in_shard=chan_in_shard,
+            active=active,
+            capacity=int(live_info.get("capacity", 0) or 0),
+            local_balance=int(live_info.get("local_balance", 0) or 0),
+            initiator=live_info.get("initiator", None),
+            status_prev=chan_status_cache.get(cid, {}),
+            out_fee_sat=out_fee_sat.get(cid, 0),
+            out_amt_sat=out_amt_sat.get(cid, 0),
+            out_count=out_count.get(cid, 0),
+            out_amt_sat_1d=out_amt_sat_1d.get(cid, 0),
+            in_amt_sat=in_amt_sat_by_cid.get(cid, 0),
+            in_count=in_count_by_cid.get(cid, 0),
+            peer_incoming_msat=incoming_msat_by_pub.get(pubkey, 0) if pubkey else 0,
+            rebal_value_sat=perchan_value_sat.get(cid, 0),
+            rebal_cost_ppm=rebal_cost_ppm_by_chan_use[cid] if cid in rebal_cost_ppm_by_chan_use else None,
+            seed_summary=seed_summary(pubkey, cache) if needs_seed else None,
+        )
 
-                if is_excluded:
-                    excl_dry_kept += 1
+    channel_list = [channel_inputs(cid) for cid in sorted(open_cids)]
+    decide_t0 = time.time()
+    decisions = decide_channels(channel_list, params, [state.get(inputs.cid) for inputs in channel_list])
+    stage_secs["decide"] = time.time() - decide_t0
+
+    # aplica as decisões na ordem dos canais (mesma ordem do relatório)
+    for d in decisions:
+        if d.status is not None:
+            chan_status_cache[d.cid] = d.status
+            cache[OFFLINE_STATUS_CACHE_KEY] = chan_status_cache
+        if d.state is not None:
+            state[d.cid] = d.state
+        counts.update(d.counts)
+        for key in d.symptoms:
+            symptoms[key] += 1
+        for line in d.lines:
+            report.append(line)
+        if d.update is not None:
+            pending_updates.append(d.update)
+            pending_ctx.append(dict(d.update_ctx, slot=report.reserve(*d.update_line)))
+
+    changed_up, changed_down, kept = counts["changed_up"], counts["changed_down"], counts["kept"]
+    low_out_count, unmatched, max_hits = counts["low_out"], counts["unmatched"], counts["max_hits"]
+    offline_skips, shard_skips, inbound_changed = counts["offline_skips"], counts["shard_skips"], counts["inbound_changed"]
+    excl_dry_up, excl_dry_down, excl_dry_kept = counts["excl_dry_up"], counts["excl_dry_down"], counts["excl_dry_kept"]
+
+    stage_secs["channels"] = time.time() - stage_t0
+
+    # ===== APPLY: updates de política decididos no loop =====
+    apply_secs = 0.0
+    apply_errors = 0
+    if pending_updates:
+        apply_t0 = time.time()
+        apply_results = apply_policy_updates(pending_updates)
+        apply_secs = time.time() - apply_t0
+        apply_results = list(apply_results or [])
+        for i, (upd, ctx) in enumerate(zip(pending_updates, pending_ctx)):
+            cid = upd["cid"]
+            res = apply_results[i] if i < len(apply_results) else {"error": "sem resultado do apply"}
+            err = (res or {}).get("error")
+            if err is None:
+                method_label = (res or {}).get("method")
+                method_tag = f" ({method_label})" if method_label else ""
+                action = f"set {ctx['local_ppm']}→{ctx['new_ppm']} ppm{method_tag} {ctx['dstr']}"
+                # baseline EMA (70/30) se houver amostra >0
+                st = state.get(cid, {}).copy()
+                # Explorer: contabiliza round de queda aplicada
+                if ctx["explorer_round"]:
+                    rounds = int(_get_explorer_state(state, cid).get("rounds", 0)) + 1
+                    _set_explorer_state(state, cid, rounds=rounds)
+                fwd_count = ctx["fwd_count"]
+                old_base = st.get("baseline_fwd7d", 0)
+                if fwd_count > 0:
+                    if old_base and old_base > 0:
+                        new_base = int(round(0.7*old_base + 0.3*fwd_count))
+                    else:
+                        new_base = fwd_count
                 else:
-                    kept += 1
+                    new_base = old_base
+                # grava o último desconto de inbound aplicado (ou zero se desativado)
+                st["last_inbound_discount_ppm"] = int(ctx["inbound_discount_ppm"] if INBOUND_FEE_ENABLE else 0)
+                st.update({
+                    "last_ppm": ctx["new_ppm"],
+                    "last_base_fee_msat": int(ctx["base_fee_msat"]),
+                    "last_dir": ctx["new_dir"],
+                    "last_ts":  int(time.time()),
+                    "baseline_fwd7d": new_base,
+                    "low_streak": ctx["streak"] if PERSISTENT_LOW_ENABLE else 0,
+                    "last_seed": float(ctx["seed_used"]),
+                    "fwds_at_change": fwd_count,
+                    # garantir persistência da classificação
+                    "bias_ema": float(ctx["bias_ema"]),
+                    "class_label": ctx["class_label"],
+                    "class_conf": float(ctx["class_conf"]),
+                })
+                state[cid] = st
+                # 👉 conta mudança de inbound (qualquer alteração, mesmo com outbound)
+                try:
+                    prev_inb = int(ctx["prev_inb_discount"])
+                except Exception:
+                    prev_inb = 0
+                try:
+                    cur_inb = int(ctx["inbound_discount_ppm"]) if ctx["inbound_discount_ppm"] is not None else 0
+                except Exception:
+                    cur_inb = 0
+                if INBOUND_FEE_ENABLE and cur_inb != prev_inb:
+                    inbound_changed += 1
+            else:
+                apply_errors += 1
+                action = f"❌ erro ao setar: {err}"
+            report.fill(ctx["slot"], action)
+        report.append(
+            f"⚡ apply: {len(pending_updates)} update(s) em {apply_secs:.2f}s"
+            + (f" | erros {apply_errors}" if apply_errors else "")
+        )
 
     # resumo na 2ª linha do relatório
     summary = f"📊 up {changed_up} | down {changed_down} | flat {kept} | low_out {low_out_count} | offline {offline_skips} | max_hits {max_hits}"
@@ -3187,7 +3873,7 @@ def main(dry_run=False):
     # 👉 adiciona o contador de mudanças de inbound
     if inbound_changed > 0:
         summary += f" | inb_changed {inbound_changed}"
-    report.insert(1, summary)
+    report.set_summary(summary)
     
     # Telemetria: quantos SCIDs de custo por canal batem com canais abertos
     try:
@@ -3206,11 +3892,29 @@ def main(dry_run=False):
     if (not dry_run) or DRYRUN_SAVE_CLASS:
         save_json(STATE_PATH, state)
 
-    msg = "\n".join(report)
-    print(msg)
-    if not dry_run:
-        tg_msg = _format_telegram_report(report)
-        tg_send_big(tg_msg)
+    stage_secs["apply"] = apply_secs
+    stage_secs["total"] = time.time() - run_t0
+    emit_run_metrics({
+        "ts": int(time.time()),
+        "version": vstr,
+        "dry_run": bool(dry_run),
+        "channels": len(open_cids),
+        "changed_up": changed_up,
+        "changed_down": changed_down,
+        "kept": kept,
+        "low_out": low_out_count,
+        "offline_skips": offline_skips,
+        "shard_skips": shard_skips,
+        "max_hits": max_hits,
+        "inbound_changed": inbound_changed,
+        "excl_dry": {"up": excl_dry_up, "down": excl_dry_down, "kept": excl_dry_kept},
+        "apply_updates": len(pending_updates),
+        "apply_errors": apply_errors,
+        "symptoms": symptoms,
+        "timings": {k: round(v, 3) for k, v in stage_secs.items()},
+    })
+
+    report.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -3237,6 +3941,17 @@ if __name__ == "__main__":
     excl = parser.add_mutually_exclusive_group()
     excl.add_argument("--excl-dry-verbose", action="store_true", help="Mostra detalhes completos nos canais excluídos (padrão).")
     excl.add_argument("--excl-dry-tag-only", action="store_true", help="Mostra somente a tag 🚷excl-dry (sem métricas).")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help=f"Processos para avaliar os canais (padrão {DECISION_WORKERS}; só com >= {DECISION_WORKERS_MIN_CHANNELS} canais)."
+    )
+    parser.add_argument(
+        "--numpy-kernel",
+        action="store_true",
+        help="Calcula os estágios por canal que não dependem da decisão (out_ratio, step cap base, piso de rebal) em lote com NumPy (requer numpy)."
+    )
     args = parser.parse_args()
 
     # aplica flags de CLI (prioridade maior que variável de ambiente)
@@ -3249,6 +3964,10 @@ if __name__ == "__main__":
     if args.didactic_detailed:
         DIDACTIC_EXPLAIN_ENABLE = True
         DIDACTIC_LEVEL = "detailed"
+    if args.workers is not None:
+        DECISION_WORKERS = max(1, args.workers)
+    if args.numpy_kernel:
+        FEE_KERNEL_NUMPY = True
 
     logger.info("Executando AutoFee standalone")
     main(dry_run=args.dry_run)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import argparse
+import datetime
 import json
 import sys
 import time
@@ -10,13 +11,19 @@ from typing import Any, Dict, Optional
 
 from .engines.autofee import AutoFeeEngine
 from .engines.ar import ARTriggerEngine
+from .engines.replay import AutoFeeReplay
 from .engines.tuner import ParamTunerEngine
 from .services.amboss import AmbossService
 from .services.bos import BosService
+from .services.channel_snapshot import ChannelSnapshotProvider
+from .services.http import log_cycle_stats
 from .services.lnd_rest import LndRestService
 from .services.lndg_api import LNDgAPI
+from .services.lndg_db import LNDgDatabase
+from .services.lndg_rollup import LNDgRollupService
 from .services.lncli import LncliService
 from .services.telegram import TelegramService
+from .scheduler import EngineJob, Scheduler, output_lock
 from .storage import Storage
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -28,6 +35,16 @@ logger = get_logger("app")
 APP_VERSION = "0.4.16"
 APP_VERSION_DESC = "AutoFee Integrado - Melhoria Lógica de Update de Taxa para modo Rest API"
 DEFAULT_DB_PATH = Path("brln_orchestrator.sqlite3")
+
+# AR Trigger lê e regrava o estado do AutoFee (cooldown): nunca em paralelo com ele,
+# e quando os dois vencem juntos o AutoFee roda primeiro. O Tuner lê as métricas da
+# última rodada do AutoFee, então espera uma rodada em andamento terminar.
+ENGINE_CONSTRAINTS: Dict[str, Dict[str, Any]] = {
+    "autofee": {"exclusive": ("ar",)},
+    "ar": {"after": ("autofee",)},
+    "tuner": {"after": ("autofee",)},
+}
+
 DEFAULT_SETTINGS = {
     "mode": "conservador",
     "monthly_profit_goal_ppm": None,
@@ -40,6 +57,14 @@ DEFAULT_SETTINGS = {
     "dry_run_tuner": False,
     "didactic_explain": False,
     "didactic_detailed": False,
+    "amboss_batch_size": 24,
+    "amboss_stale_while_revalidate": True,
+    "amboss_max_stale_sec": 24 * 3600,
+    "lnd_rest_max_parallel": 8,
+    "telemetry_retention_days": 30,
+    "telemetry_max_rows": 50000,
+    "autofee_report_path": None,
+    "autofee_numpy_kernel": False,
 }
 
 
@@ -123,6 +148,26 @@ def build_parser() -> argparse.ArgumentParser:
 
     show_cmd = sub.add_parser("show-config", help="Mostra configuracao atual")
 
+    state_cmd = sub.add_parser("channel-state", help="Mostra o estado por canal do AutoFee")
+    state_cmd.add_argument("--class", dest="class_label", help="Filtra por class_label (ex.: sink, source, router)")
+    state_cmd.add_argument("--since-hours", type=float, help="Só canais atualizados nas últimas N horas")
+    state_cmd.add_argument("--limit", type=int)
+
+    runs_cmd = sub.add_parser("engine-stats", help="Duração/overruns por engine (tabela engine_runs)")
+    runs_cmd.add_argument("--since-hours", type=float, default=24.0, help="Janela em horas (padrão 24)")
+
+    replay_cmd = sub.add_parser("replay", help="Backtest do AutoFee sobre o histórico do LNDg (não aplica nada)")
+    replay_cmd.add_argument("--days", type=float, default=30.0, help="Dias simulados (padrão 30; ignorado com --start)")
+    replay_cmd.add_argument("--start", help="Início em UTC (AAAA-MM-DD[ HH:MM])")
+    replay_cmd.add_argument("--end", help="Fim em UTC (padrão: último forward do LNDg)")
+    replay_cmd.add_argument("--step-min", type=int, default=10, help="Passo simulado em minutos (padrão 10)")
+    replay_cmd.add_argument("--mode", choices=["conservador", "moderado", "agressivo"])
+    replay_cmd.add_argument("--set", dest="overrides", action="append", default=[], metavar="PARAM=VALOR",
+                            help="Sobrescreve um parâmetro do AutoFee só no replay (ex.: STEP_CAP=0.08); repetível")
+    replay_cmd.add_argument("--lndg-db", dest="lndg_db", help="db.sqlite3 do LNDg (padrão: lndg_db_path dos segredos)")
+    replay_cmd.add_argument("--json", dest="json_path", help="Grava o resultado completo (trajetórias, por dia) em JSON")
+    replay_cmd.add_argument("--top", type=int, default=20, help="Canais na tabela (por volume; padrão 20)")
+
     run_cmd = sub.add_parser("run", help="Executa os mdulos")
     run_cmd.add_argument("--mode", choices=["conservador", "moderado", "agressivo"])
     run_cmd.add_argument("--monthly-profit-ppm", type=int)
@@ -130,6 +175,7 @@ def build_parser() -> argparse.ArgumentParser:
     run_cmd.add_argument("--loop-interval-autofee", type=int)
     run_cmd.add_argument("--loop-interval-ar", type=int)
     run_cmd.add_argument("--loop-interval-tuner", type=int)
+    run_cmd.add_argument("--amboss-batch-size", type=int, help="Séries Amboss por requisição GraphQL (1 = sem lote)")
     run_cmd.set_defaults(dry_run_autofee=None, dry_run_ar=None, dry_run_tuner=None)
     autofee_dry = run_cmd.add_mutually_exclusive_group()
     autofee_dry.add_argument("--dry-run-autofee", dest="dry_run_autofee", action="store_true")
@@ -288,11 +334,119 @@ def handle_show_config(storage: Storage) -> None:
         print(f"  {key}: {value}")
 
 
+def handle_channel_state(storage: Storage, args: argparse.Namespace) -> None:
+    since = int(time.time() - args.since_hours * 3600) if args.since_hours else None
+    rows = storage.list_channel_state(class_label=args.class_label, updated_since=since, limit=args.limit)
+    if not rows:
+        print("(vazio)")
+        return
+    print(f"{'cid':<20} {'classe':<8} {'conf':>5} {'bias':>6} {'ppm':>6} {'seed':>7} {'atualizado':<16}")
+    for row in rows:
+        conf = f"{row['class_conf']:.2f}" if row["class_conf"] is not None else "-"
+        bias = f"{row['bias_ema']:+.2f}" if row["bias_ema"] is not None else "-"
+        ppm = str(row["last_ppm"]) if row["last_ppm"] is not None else "-"
+        seed = f"{row['last_seed']:.0f}" if row["last_seed"] is not None else "-"
+        updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["updated_at"] or 0))
+        print(f"{row['cid']:<20} {row['class_label'] or '-':<8} {conf:>5} {bias:>6} {ppm:>6} {seed:>7} {updated:<16}")
+
+
+def handle_engine_stats(storage: Storage, args: argparse.Namespace) -> None:
+    since = int(time.time() - args.since_hours * 3600) if args.since_hours else None
+    rows = storage.engine_run_stats(since_ts=since)
+    if not rows:
+        print("(vazio)")
+        return
+    print(f"{'engine':<8} {'runs':>5} {'erros':>5} {'overrun':>7} {'média':>8} {'máx':>8} {'atraso':>7} {'última':<16}")
+    for row in rows:
+        last = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["last_ts"] or 0))
+        print(
+            f"{row['engine']:<8} {row['runs']:>5} {row['errors'] or 0:>5} {row['overruns'] or 0:>7} "
+            f"{row['avg_sec'] or 0:>7.1f}s {row['max_sec'] or 0:>7.1f}s {row['avg_lag_sec'] or 0:>6.1f}s {last:<16}"
+        )
+
+
+def _parse_utc(value: str) -> int:
+    dt = datetime.datetime.fromisoformat(value.strip())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp())
+
+
+def _parse_override(item: str) -> tuple:
+    key, sep, raw = item.partition("=")
+    if not sep or not key.strip():
+        raise ValueError(f"--set espera PARAM=VALOR: {item}")
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        value = raw
+    return key.strip(), value
+
+
+def handle_replay(storage: Storage, args: argparse.Namespace) -> None:
+    settings = load_settings(storage)
+    lndg_db_path = args.lndg_db or storage.get_secrets().get("lndg_db_path")
+    if not lndg_db_path:
+        raise RuntimeError("Caminho do banco do LNDg não configurado. Use --lndg-db ou set-secret --lndg-db-path ...")
+    overrides = dict(_parse_override(item) for item in args.overrides)
+    mode = args.mode or settings.get("mode") or "conservador"
+    replay = AutoFeeReplay(
+        storage,
+        lndg_db_path,
+        Path(__file__).resolve().parent.parent / "brln-autofee.py",
+        step_sec=max(1, args.step_min) * 60,
+    )
+    end_ts = _parse_utc(args.end) if args.end else replay.last_forward_ts()
+    if end_ts is None:
+        print("(sem forwards no LNDg)")
+        return
+    start_ts = _parse_utc(args.start) if args.start else int(end_ts - args.days * 86400)
+    if start_ts >= end_ts:
+        raise ValueError("--start precisa ser anterior a --end")
+    try:
+        result = replay.run(start_ts, end_ts, mode=mode, overrides=overrides)
+    finally:
+        LNDgDatabase.close_all()
+
+    totals = result["totals"]
+    delta = totals["fee_sim_sat"] - totals["fee_real_sat"]
+    pct = f" ({delta / totals['fee_real_sat'] * 100:+.1f}%)" if totals["fee_real_sat"] else ""
+    print(
+        f"Replay AutoFee ({mode}) {result['start']} → {result['end']} | {result['steps']} passos de "
+        f"{result['step_sec'] // 60}min | {result['channels']} canais | {result['elapsed_sec']:.1f}s"
+    )
+    if overrides:
+        print("Parâmetros: " + ", ".join(f"{k}={v}" for k, v in overrides.items()))
+    print(
+        f"Receita real {totals['fee_real_sat']} sat | simulada {totals['fee_sim_sat']} sat | Δ {delta:+d} sat{pct} "
+        f"| volume {totals['out_amt_sat']} sat em {totals['forwards']} forwards"
+    )
+    print(
+        f"Mudanças de fee {totals['fee_changes']} (up {totals['changed_up']} / down {totals['changed_down']}) "
+        f"| rebal {totals['rebalances']} pagamentos, custo {totals['rebal_fee_sat']} sat"
+    )
+    rows = result["per_channel"][: max(0, args.top)]
+    if rows:
+        print(f"\n{'cid':<20} {'alias':<20} {'ppm ini→fim':>12} {'mín/máx':>11} {'mud':>4} {'volume':>12} {'real':>8} {'sim':>8} {'Δ':>8}")
+        for row in rows:
+            span = f"{row['ppm_start']}→{row['ppm_end']}"
+            bounds = f"{row['ppm_min']}/{row['ppm_max']}"
+            diff = row["fee_sim_sat"] - row["fee_real_sat"]
+            print(
+                f"{row['cid']:<20} {row['alias'][:20]:<20} {span:>12} {bounds:>11} {row['changes']:>4} "
+                f"{row['out_amt_sat']:>12} {row['fee_real_sat']:>8} {row['fee_sim_sat']:>8} {diff:>+8d}"
+            )
+    if args.json_path:
+        Path(args.json_path).expanduser().write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nResultado completo em {args.json_path}")
+
+
 def build_services(storage: Storage) -> Dict[str, Any]:
     logger.info("Inicializando serviços")
     secrets = storage.get_secrets()
     lncli = LncliService(secrets.get("lncli_path") or "lncli")
 
+    settings = load_settings(storage)
     use_lnd_rest = bool(secrets.get("use_lnd_rest"))
     fee_service = None
     lnd_rest = None
@@ -303,6 +457,7 @@ def build_services(storage: Storage) -> Dict[str, Any]:
                 rest_host=secrets.get("lnd_rest_host") or "localhost:8080",
                 macaroon_path=secrets.get("lnd_macaroon_path"),
                 tls_cert_path=secrets.get("lnd_tls_cert_path"),
+                max_parallel=int(settings.get("lnd_rest_max_parallel") or 1),
             )
             fee_service = lnd_rest
             logger.info("LND REST API inicializada com sessão persistente")
@@ -315,20 +470,34 @@ def build_services(storage: Storage) -> Dict[str, Any]:
         logger.info("Usando LNCLI updatechanpolicy para fees (BOS legado como fallback)")
         fee_service = BosService(secrets.get("bos_path") or "bos")
 
-    telegram = TelegramService(secrets.get("telegram_token"), secrets.get("telegram_chat"))
+    telegram = TelegramService(secrets.get("telegram_token"), secrets.get("telegram_chat"), storage)
     lndg_url = secrets.get("lndg_url")
     lndg_api = None
     if lndg_url:
         lndg_api = LNDgAPI(lndg_url, secrets.get("lndg_user"), secrets.get("lndg_pass"))
     amboss_token = secrets.get("amboss_token") or ""
-    amboss = AmbossService(storage, amboss_token) if amboss_token else None
+    amboss = None
+    if amboss_token:
+        amboss = AmbossService(
+            storage,
+            amboss_token,
+            batch_size=int(settings.get("amboss_batch_size") or 1),
+            stale_while_revalidate=bool(settings.get("amboss_stale_while_revalidate")),
+            max_stale_sec=int(settings.get("amboss_max_stale_sec") or 0),
+        )
+        amboss.start_refresher()
+    lndg_db_path = secrets.get("lndg_db_path")
+    lndg_rollup = LNDgRollupService(storage, lndg_db_path) if lndg_db_path else None
+    channels = ChannelSnapshotProvider(lncli, lnd_rest)
     return {
         "lncli": lncli,
+        "channels": channels,
         "bos": fee_service,
         "lnd_rest": lnd_rest,
         "telegram": telegram,
         "lndg_api": lndg_api,
         "amboss": amboss,
+        "lndg_rollup": lndg_rollup,
     }
 
 
@@ -341,6 +510,8 @@ def instantiate_engines(storage: Storage, services: Dict[str, Any]) -> Dict[str,
         amboss=services["amboss"],
         telegram=services["telegram"],
         legacy_path=root / "brln-autofee.py",
+        rollup=services.get("lndg_rollup"),
+        channels=services.get("channels"),
     )
     ar_engine = None
     if services["lndg_api"] is not None:
@@ -349,11 +520,13 @@ def instantiate_engines(storage: Storage, services: Dict[str, Any]) -> Dict[str,
             lndg_api=services["lndg_api"],
             telegram=services["telegram"],
             legacy_path=root / "lndg_AR_trigger.py",
+            rollup=services.get("lndg_rollup"),
         )
     tuner_engine = ParamTunerEngine(
         storage=storage,
         telegram=services["telegram"],
         legacy_path=root / "ai_param_tuner.py",
+        rollup=services.get("lndg_rollup"),
     )
     return {
         "autofee": autofee_engine,
@@ -362,7 +535,7 @@ def instantiate_engines(storage: Storage, services: Dict[str, Any]) -> Dict[str,
     }
 
 
-def run_module(func, label: str, *, storage: Storage) -> None:
+def run_module(func, label: str, *, storage: Storage) -> bool:
     logger.debug(f"Executando módulo: {label}")
     start_time = time.time()
     try:
@@ -370,14 +543,19 @@ def run_module(func, label: str, *, storage: Storage) -> None:
         elapsed = time.time() - start_time
         logger.info(f"Módulo {label} executado em {elapsed:.2f}s")
         if output:
-            print(output.strip())
+            # engines rodam em paralelo: cada saída sai inteira
+            with output_lock:
+                print(output.strip())
             storage.log(label, "INFO", output.strip(), None)
+        return True
     except Exception as exc:
         elapsed = time.time() - start_time
         tb = traceback.format_exc().strip()
         logger.error(f"Módulo {label} falhou após {elapsed:.2f}s: {exc}")
         storage.log(label, "ERROR", str(exc), {"traceback": tb})
-        print(f"[{label}] erro: {exc}\n{tb}", file=sys.stderr)
+        with output_lock:
+            print(f"[{label}] erro: {exc}\n{tb}", file=sys.stderr)
+        return False
 
 
 def handle_run(storage: Storage, args: argparse.Namespace) -> None:
@@ -403,10 +581,17 @@ def handle_run(storage: Storage, args: argparse.Namespace) -> None:
         "dry_run_tuner": resolve_toggle(args.dry_run_tuner, "dry_run_tuner"),
         "didactic_explain": bool(args.didactic_explain or settings.get("didactic_explain")),
         "didactic_detailed": bool(args.didactic_detailed or settings.get("didactic_detailed")),
+        "amboss_batch_size": args.amboss_batch_size or settings.get("amboss_batch_size", 24),
     }
-    save_settings(storage, updates)
+    save_settings(storage, {**settings, **updates})
+    storage.configure_telemetry(
+        retention_days=settings.get("telemetry_retention_days"),
+        max_rows=settings.get("telemetry_max_rows"),
+    )
 
     services = build_services(storage)
+    # entrega do Telegram em background: os engines só enfileiram (telegram_outbox)
+    services["telegram"].start_worker()
     engines = instantiate_engines(storage, services)
 
     if engines["ar"] is None and not updates["dry_run_ar"] and not args.no_ar:
@@ -423,52 +608,49 @@ def handle_run(storage: Storage, args: argparse.Namespace) -> None:
         "ar": updates["loop_interval_ar"],
         "tuner": updates["loop_interval_tuner"],
     }
-    next_run = {name: 0.0 for name in intervals.keys()}
+
+    funcs = {
+        "autofee": lambda: engines["autofee"].run(
+            mode=updates["mode"],
+            dry_run=updates["dry_run_autofee"],
+            didactic_explain=updates["didactic_explain"],
+            didactic_detailed=updates["didactic_detailed"],
+            report_path=settings.get("autofee_report_path"),
+            numpy_kernel=bool(settings.get("autofee_numpy_kernel")),
+        ),
+        "ar": lambda: engines["ar"].run(  # type: ignore
+            mode=updates["mode"],
+            dry_run=updates["dry_run_ar"],
+            no_telegram_when_no_changes=args.no_ar_no_telegram,
+        ),
+        "tuner": lambda: engines["tuner"].run(
+            dry_run=updates["dry_run_tuner"],
+            force_telegram=False,
+            no_telegram=False,
+        ),
+    }
+    jobs = [
+        EngineJob(
+            name,
+            (lambda name=name: run_module(funcs[name], name, storage=storage)),
+            intervals[name],
+            **ENGINE_CONSTRAINTS.get(name, {}),
+        )
+        for name in ("autofee", "ar", "tuner")
+        if loop_enabled[name]
+    ]
+
+    def after_engine(_job: EngineJob) -> None:
+        http_line = log_cycle_stats()
+        if http_line:
+            storage.log("http", "INFO", http_line, None)
+        storage.prune_logs()
 
     once = args.once
     logger.info(f"Módulos habilitados: autofee={loop_enabled['autofee']}, ar={loop_enabled['ar']}, tuner={loop_enabled['tuner']}")
     logger.info(f"Intervalos: autofee={intervals['autofee']}s, ar={intervals['ar']}s, tuner={intervals['tuner']}s")
     try:
-        while True:
-            now = time.time()
-            if loop_enabled["autofee"] and now >= next_run["autofee"]:
-                run_module(
-                    lambda: engines["autofee"].run(
-                        mode=updates["mode"],
-                        dry_run=updates["dry_run_autofee"],
-                        didactic_explain=updates["didactic_explain"],
-                        didactic_detailed=updates["didactic_detailed"],
-                    ),
-                    "autofee",
-                    storage=storage,
-                )
-                next_run["autofee"] = now + intervals["autofee"]
-            if loop_enabled["ar"] and now >= next_run["ar"]:
-                run_module(
-                    lambda: engines["ar"].run(
-                        mode=updates["mode"],
-                        dry_run=updates["dry_run_ar"],
-                        no_telegram_when_no_changes=args.no_ar_no_telegram,
-                    ),  # type: ignore
-                    "ar",
-                    storage=storage,
-                )
-                next_run["ar"] = now + intervals["ar"]
-            if loop_enabled["tuner"] and now >= next_run["tuner"]:
-                run_module(
-                    lambda: engines["tuner"].run(
-                        dry_run=updates["dry_run_tuner"],
-                        force_telegram=False,
-                        no_telegram=False,
-                    ),
-                    "tuner",
-                    storage=storage,
-                )
-                next_run["tuner"] = now + intervals["tuner"]
-
-            if once:
-                break
-            time.sleep(1)
+        Scheduler(jobs, storage=storage, once=once, on_finish=after_engine).run()
     except KeyboardInterrupt:
         print("Encerrado pelo usuário.")
     finally:
@@ -477,6 +659,17 @@ def handle_run(storage: Storage, args: argparse.Namespace) -> None:
                 services["lnd_rest"].close()
             except Exception:
                 pass
+        if services.get("amboss"):
+            services["amboss"].stop_refresher()
+        if services.get("telegram"):
+            services["telegram"].stop_worker()
+        for key in ("amboss", "telegram", "lndg_api"):
+            if services.get(key):
+                try:
+                    services[key].close()
+                except Exception:
+                    pass
+        LNDgDatabase.close_all()
 
 
 def main(argv: Optional[list[str]] = None) -> None:
@@ -501,6 +694,12 @@ def main(argv: Optional[list[str]] = None) -> None:
         elif args.command == "show-config":
             ensure_version(storage)
             handle_show_config(storage)
+        elif args.command == "channel-state":
+            handle_channel_state(storage, args)
+        elif args.command == "engine-stats":
+            handle_engine_stats(storage, args)
+        elif args.command == "replay":
+            handle_replay(storage, args)
         elif args.command == "run":
             handle_run(storage, args)
         else:
@@ -1,21 +1,37 @@
 from __future__ import annotations
 
 import asyncio
-import contextlib
+import datetime
 import importlib.util
 import io
 import json
 import sqlite3
+import sys
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 from ..presets import get_mode_presets
+from ..scheduler import capture_stdout
 from ..services.lndg_api import LNDgAPI
 from ..services.lndg_db import LNDgDatabase
+from ..services.lndg_rollup import LNDgRollupService
 from ..services.telegram import TelegramService
 from ..storage import Storage
 
 
+# Campos do estado do AutoFee que o AR Trigger lê/escreve (ver "AutoFee state helpers")
+AR_STATE_FIELDS = (
+    "class_label",
+    "baseline_fwd7d",
+    "last_seed",
+    "bias_ema",
+    "last_rebal_cost_ppm",
+    "last_rebal_cost_ts",
+    "ar_last_switch_ts",
+    "ar_last_state",
+)
+
+
 def _load_legacy(path: Path):
     spec = importlib.util.spec_from_file_location("legacy_ar", path)
     module = importlib.util.module_from_spec(spec)
@@ -32,11 +48,14 @@ class ARTriggerEngine:
         lndg_api: LNDgAPI,
         telegram: TelegramService,
         legacy_path: Path,
+        rollup: Optional[LNDgRollupService] = None,
     ) -> None:
         self.storage = storage
         self.lndg_api = lndg_api
         self.telegram = telegram
+        self.rollup = rollup
         self.legacy = _load_legacy(legacy_path)
+        self._legacy_load_rebal_costs = self.legacy.load_rebal_costs
         self._legacy_load_autofee_params = None
         self._autofee_param_overrides: Dict[str, float] = {}
         self._dry_run = False
@@ -47,8 +66,9 @@ class ARTriggerEngine:
         if name == self.legacy.CACHE_PATH:
             return self.storage.load_json("legacy_autofee_cache", {})
         if name == self.legacy.STATE_PATH:
-            # AR Trigger expects same state as AutoFee
-            return self.storage.load_autofee_state()
+            # AR Trigger lê o estado do AutoFee, mas só os campos que usa;
+            # o save faz merge desses campos no registro completo
+            return self.storage.load_autofee_state_fields(AR_STATE_FIELDS)
         return self.storage.load_json(name, {})
 
     def _save_json(self, name: str, data: Dict[str, Any]) -> None:
@@ -94,14 +114,32 @@ class ARTriggerEngine:
         merged.update(overrides)
         return merged
 
+    def _load_rebal_costs(self, db_path: str, lookback_days: int = 7):
+        """load_rebal_costs do legado, lido do rollup compartilhado de rebal."""
+        start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=lookback_days)
+        try:
+            agg = self.rollup.rebal_aggregates(start)  # type: ignore[union-attr]
+        except sqlite3.Error as exc:
+            print(f"[ar] rollup de rebal indisponivel, usando SQL direto: {exc}", file=sys.stderr)
+            return self._legacy_load_rebal_costs(db_path, lookback_days)
+        ppm = self.legacy.ppm
+        per_value = agg["per_value"]
+        per_cost_ppm = {cid: ppm(agg["per_fee"].get(cid, 0), v) for cid, v in per_value.items()}
+        global_cost_ppm = ppm(agg["total_fee"], agg["total_value"])
+        return per_cost_ppm, global_cost_ppm, per_value, agg["per_count"]
+
     def _patch_rebal_sql(self) -> None:
+        if self.rollup is not None:
+            self.legacy.load_rebal_costs = self._load_rebal_costs  # type: ignore
+            return
+        self.legacy.load_rebal_costs = self._legacy_load_rebal_costs  # type: ignore
         secrets = self.storage.get_secrets()
         db_path = secrets.get("lndg_db_path")
         if not db_path:
             return
-        helper = LNDgDatabase(db_path)
+        helper = LNDgDatabase.shared(db_path)
         if not helper.table_exists("gui_payments") and helper.table_exists("payments"):
-            self.legacy.load_rebal_costs = _wrap_load_rebal_costs(self.legacy.load_rebal_costs, "payments")  # type: ignore
+            self.legacy.load_rebal_costs = _wrap_load_rebal_costs(self._legacy_load_rebal_costs, "payments")  # type: ignore
 
     def run(self, *, dry_run: bool, mode: str = "conservador", no_telegram_when_no_changes: bool = False) -> str:
         legacy = self.legacy
@@ -165,7 +203,7 @@ class ARTriggerEngine:
         self._patch_rebal_sql()
 
         buf = io.StringIO()
-        with contextlib.redirect_stdout(buf):
+        with capture_stdout(buf):
             asyncio.run(legacy.main())  # legacy main already respects dry-run via state flags
         legacy_output = buf.getvalue().strip()
 
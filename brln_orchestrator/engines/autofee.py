@@ -1,25 +1,29 @@
 from __future__ import annotations
 
-import contextlib
 import importlib.util
 import io
 import json
-import re
 import sqlite3
 import string
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 from ..services.amboss import AmbossService
 from ..services.bos import BosService
+from ..services.channel_snapshot import ChannelSnapshotProvider
 from ..services.lnd_rest import LndRestService
 from ..services.lndg_db import LNDgDatabase
+from ..services.lndg_rollup import LNDgRollupService
 from ..services.lncli import LncliService
-from ..services.telegram import TelegramService
+from ..services.telegram import MAX_MESSAGE_LEN, TelegramService
 
 FeeService = BosService | LndRestService
 from ..presets import get_mode_presets
+from ..report import LockedStdoutReportSink, StorageReportSink
+from ..scheduler import capture_stdout, output_lock, real_stdout
 from ..storage import Storage
 
 
@@ -32,55 +36,6 @@ def _load_legacy(path: Path):
     return module
 
 
-SYMPTOM_KEYS = ("floor_lock", "no_down_low", "hold_small", "cb_trigger", "discovery")
-SYMPTOM_HEADER_RE = re.compile(r"(?:DRY[-\s]*RUN\s*)?[\u2699\uFE0F\u200D\uFE0F]*\s*AutoFee\s*\|\s*janela\s*\d+d", re.IGNORECASE)
-SYMPTOM_DICT_RE = re.compile(r"Symptoms:\s*\{([^}]*)\}", re.IGNORECASE)
-SYMPTOM_TOKEN_PATTERNS = {
-    "floor_lock": re.compile(r"floor[-_\s]*lock", re.IGNORECASE),
-    "no_down_low": re.compile(r"no[-_\s]*down[-_\s]*low", re.IGNORECASE),
-    "hold_small": re.compile(r"hold[-_\s]*small", re.IGNORECASE),
-    "cb_trigger": re.compile(r"(?:cb[-_\s]*trigger|cb\s*[:=])", re.IGNORECASE),
-    "discovery": re.compile(r"discovery", re.IGNORECASE),
-}
-
-
-def _extract_symptoms_from_text(text: Optional[str]) -> Optional[Dict[str, int]]:
-    if not text:
-        return None
-    block = str(text)
-    hits = list(SYMPTOM_HEADER_RE.finditer(block))
-    if hits:
-        block = block[hits[-1].start():]
-    counts = {key: 0 for key in SYMPTOM_KEYS}
-    found = False
-    match = SYMPTOM_DICT_RE.search(block)
-    if match:
-        payload = "{" + match.group(1) + "}"
-        payload = payload.replace("'", '"')
-        try:
-            parsed = json.loads(payload)
-        except (json.JSONDecodeError, TypeError):
-            parsed = None
-        if isinstance(parsed, dict):
-            for key in SYMPTOM_KEYS:
-                if key in parsed:
-                    value = parsed.get(key)
-                    if isinstance(value, (int, float)) and not isinstance(value, bool):
-                        counts[key] = int(value)
-                        found = True
-                    elif isinstance(value, str):
-                        value = value.strip()
-                        if value.isdigit():
-                            counts[key] = int(value)
-                            found = True
-    for key, pattern in SYMPTOM_TOKEN_PATTERNS.items():
-        matches = pattern.findall(block)
-        if matches:
-            counts[key] += len(matches)
-            found = True
-    return counts if found else None
-
-
 class AutoFeeEngine:
     def __init__(
         self,
@@ -90,26 +45,31 @@ class AutoFeeEngine:
         amboss: Optional[AmbossService],
         telegram: TelegramService,
         legacy_path: Path,
+        rollup: Optional[LNDgRollupService] = None,
+        channels: Optional[ChannelSnapshotProvider] = None,
     ) -> None:
         self.storage = storage
         self.lncli = lncli
         self.bos = bos
         self.amboss = amboss
         self.telegram = telegram
+        self.rollup = rollup
+        if channels is None:
+            channels = ChannelSnapshotProvider(lncli, bos if isinstance(bos, LndRestService) else None)
+        self.channels = channels
         self.legacy = _load_legacy(legacy_path)
+        self._legacy_load_forward_aggregates = self.legacy.load_forward_aggregates
+        self._legacy_load_rebal_aggregates = self.legacy.load_rebal_aggregates
 
     # ------------------------------------------------------------------ #
     # Helpers injected into legacy module
     # ------------------------------------------------------------------ #
 
-    def _store_last_symptoms(self, text: str) -> None:
-        counts = _extract_symptoms_from_text(text)
-        if counts is None:
-            return
+    def _emit_run_metrics(self, metrics: Dict[str, Any]) -> None:
         try:
-            self.storage.save_json("legacy_autofee_last_symptoms", counts)
-        except Exception:
-            pass
+            self.storage.record_run_metrics(metrics)
+        except Exception as exc:
+            print(f"[autofee] erro ao gravar métricas da execução: {exc}", file=sys.stderr)
 
     def _load_json(self, name: str, default: Any) -> Any:
         if name == self.legacy.CACHE_PATH:
@@ -135,40 +95,43 @@ class AutoFeeEngine:
         db_path = secrets.get("lndg_db_path")
         if not db_path:
             raise RuntimeError("LNDg database path not configured (set-secret --lndg-db-path ...)")
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return LNDgDatabase.shared(db_path).connect()
+
+    def _load_forward_aggregates(self, cur, start_dt, end_dt, one_day_ago_naive) -> Dict[str, Any]:
+        if self.rollup is not None:
+            try:
+                return self.rollup.forward_aggregates(start_dt, one_day_ago_naive)
+            except sqlite3.Error as exc:
+                print(f"[autofee] rollup de forwards indisponivel, usando SQL direto: {exc}", file=sys.stderr)
+        return self._legacy_load_forward_aggregates(cur, start_dt, end_dt, one_day_ago_naive)
+
+    def _load_rebal_aggregates(self, cur, start_dt, end_dt) -> Dict[str, Any]:
+        if self.rollup is not None:
+            try:
+                agg = self.rollup.rebal_aggregates(start_dt)
+            except sqlite3.Error as exc:
+                print(f"[autofee] rollup de rebal indisponivel, usando SQL direto: {exc}", file=sys.stderr)
+            else:
+                perchan_value: Dict[str, int] = {}
+                perchan_fee: Dict[str, int] = {}
+                for raw, value in agg["per_value"].items():
+                    rcid = self.legacy._norm_scid(raw)
+                    if rcid:
+                        perchan_value[rcid] = perchan_value.get(rcid, 0) + value
+                        perchan_fee[rcid] = perchan_fee.get(rcid, 0) + agg["per_fee"].get(raw, 0)
+                return {
+                    "value_sat_global": agg["total_value"],
+                    "fee_sat_global": agg["total_fee"],
+                    "perchan_value_sat": perchan_value,
+                    "perchan_fee_sat": perchan_fee,
+                }
+        return self._legacy_load_rebal_aggregates(cur, start_dt, end_dt)
 
     def _lncli_listchannels(self) -> Dict[str, Any]:
-        return self.lncli.listchannels()
+        return self.channels.listchannels()
 
     def _listchannels_snapshot(self):
-        data = self._lncli_listchannels()
-        if not isinstance(data, dict):
-            raise RuntimeError("lncli listchannels returned invalid payload")
-        by_scid_dec: Dict[str, Any] = {}
-        by_cid_dec: Dict[str, Any] = {}
-        by_point: Dict[str, Any] = {}
-        for ch in data.get("channels", []):
-            scid = ch.get("scid")
-            cid = ch.get("chan_id")
-            point = ch.get("channel_point")
-            info = {
-                "capacity": int(ch.get("capacity", 0)),
-                "local_balance": int(ch.get("local_balance", 0)),
-                "remote_balance": int(ch.get("remote_balance", 0)),
-                "remote_pubkey": ch.get("remote_pubkey"),
-                "chan_point": point,
-                "active": bool(ch.get("active", False)),
-                "initiator": ch.get("initiator"),
-            }
-            if scid is not None and str(scid).isdigit():
-                by_scid_dec[str(scid)] = info
-            if cid is not None and str(cid).isdigit():
-                by_cid_dec[str(cid)] = info
-            if point:
-                by_point[point] = info
-        return {"by_scid_dec": by_scid_dec, "by_cid_dec": by_cid_dec, "by_point": by_point}
+        return self.channels.snapshot()
 
     def _bos_set_fees(self, pubkey: str, ppm: int, inbound_discount_ppm: Optional[int], dry_run: bool) -> None:
         self.bos.set_fee(pubkey, ppm, inbound_discount_ppm=inbound_discount_ppm, dry_run=dry_run)
@@ -234,6 +197,39 @@ class AutoFeeEngine:
         self.bos.set_fee(pubkey, ppm, inbound_discount_ppm=inbound_discount_ppm, dry_run=dry_run)
         return "BOS"
 
+    def _apply_policy_updates(self, updates: List[Dict[str, Any]], dry_run: bool) -> List[Dict[str, Any]]:
+        """apply_policy_updates do legado: via REST, os updates vão em paralelo pelo pool da sessão."""
+
+        def _apply_one(upd: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                method = self._set_channel_fees(
+                    upd.get("pubkey"),
+                    upd.get("chan_point"),
+                    upd["ppm"],
+                    upd.get("inbound_discount_ppm"),
+                    dry_run,
+                    base_fee_msat=upd.get("base_fee_msat"),
+                )
+                return {"method": method, "error": None}
+            except Exception as exc:
+                return {"method": None, "error": str(exc)}
+
+        workers = self.bos.max_parallel if isinstance(self.bos, LndRestService) else 1
+        workers = max(1, min(workers, len(updates)))
+        started = time.monotonic()
+        if workers == 1:
+            results = [_apply_one(upd) for upd in updates]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fee-apply") as pool:
+                results = list(pool.map(_apply_one, updates))
+        errors = sum(1 for res in results if res["error"])
+        print(
+            f"[autofee] apply: {len(updates)} update(s), {errors} erro(s), {workers} em paralelo, "
+            f"{time.monotonic() - started:.2f}s",
+            file=sys.stderr,
+        )
+        return results
+
     def _fee_update_method(self, pubkey: Optional[str], chan_point: Optional[str]) -> str:
         if isinstance(self.bos, LndRestService):
             return "REST"
@@ -263,8 +259,17 @@ class AutoFeeEngine:
 
     # ------------------------------------------------------------------ #
 
-    def run(self, *, dry_run: bool, mode: str = "conservador", didactic_explain: bool, didactic_detailed: bool) -> str:
-        """Execute the legacy AutoFee main, capturing stdout."""
+    def run(
+        self,
+        *,
+        dry_run: bool,
+        mode: str = "conservador",
+        didactic_explain: bool,
+        didactic_detailed: bool,
+        report_path: Optional[str] = None,
+        numpy_kernel: bool = False,
+    ) -> str:
+        """Execute the legacy AutoFee main; the report streams to stdout/Telegram/Storage."""
         legacy = self.legacy
 
         self._apply_mode_presets(mode or "conservador", legacy)
@@ -323,13 +328,17 @@ class AutoFeeEngine:
         legacy.load_json = self._load_json  # type: ignore
         legacy.save_json = self._save_json  # type: ignore
         legacy.db_connect = self._db_connect  # type: ignore
+        legacy.load_forward_aggregates = self._load_forward_aggregates  # type: ignore
+        legacy.load_rebal_aggregates = self._load_rebal_aggregates  # type: ignore
         legacy.listchannels_snapshot = self._listchannels_snapshot  # type: ignore
         legacy.bos_set_fees = lambda pubkey, ppm_value, inbound_discount_ppm=None: self._bos_set_fees(pubkey, ppm_value, inbound_discount_ppm, dry_run)  # type: ignore
         legacy.bos_set_fee_ppm = lambda pubkey, ppm_value: self._bos_set_fees(pubkey, ppm_value, None, dry_run)  # type: ignore
         legacy.set_channel_fees = lambda pubkey, chan_point, ppm_value, inbound_discount_ppm=None, base_fee_msat=None: self._set_channel_fees(pubkey, chan_point, ppm_value, inbound_discount_ppm, dry_run, base_fee_msat=base_fee_msat)  # type: ignore
+        legacy.apply_policy_updates = lambda updates: self._apply_policy_updates(updates, dry_run)  # type: ignore
         legacy.fee_update_method = lambda pubkey, chan_point: self._fee_update_method(pubkey, chan_point)  # type: ignore
         legacy.tg_send_big = self._tg_send  # type: ignore
         legacy.read_version_info = self._read_version_info  # type: ignore
+        legacy.emit_run_metrics = self._emit_run_metrics  # type: ignore
         legacy.run = self._run_command  # type: ignore
         legacy.load_overrides = _load_overrides  # type: ignore
         legacy.load_overrides()
@@ -337,11 +346,15 @@ class AutoFeeEngine:
         # Fallback for LNDg schema differences
         lndg_db_path = secrets.get("lndg_db_path")
         if lndg_db_path:
-            db_helper = LNDgDatabase(lndg_db_path)
+            db_helper = LNDgDatabase.shared(lndg_db_path)
             if not db_helper.table_exists("gui_payments") and db_helper.table_exists("payments"):
-                legacy.SQL_REBAL_PAYMENTS = legacy.SQL_REBAL_PAYMENTS.replace("FROM gui_payments", "FROM payments")
+                legacy.SQL_REBAL_AGG = legacy.SQL_REBAL_AGG.replace("FROM gui_payments", "FROM payments")
             if not db_helper.table_exists("gui_forwards") and db_helper.table_exists("forwards"):
-                legacy.SQL_FORWARDS = legacy.SQL_FORWARDS.replace("FROM gui_forwards", "FROM forwards")
+                legacy.SQL_FORWARDS_OUT_AGG = legacy.SQL_FORWARDS_OUT_AGG.replace("FROM gui_forwards", "FROM forwards")
+                legacy.SQL_FORWARDS_IN_AGG = legacy.SQL_FORWARDS_IN_AGG.replace("FROM gui_forwards", "FROM forwards")
+
+        # estágios por canal em lote (NumPy); sem numpy o legado segue no caminho escalar
+        legacy.FEE_KERNEL_NUMPY = bool(numpy_kernel)
 
         # Didactic flags
         legacy.DIDACTIC_EXPLAIN_ENABLE = didactic_explain or didactic_detailed
@@ -352,68 +365,147 @@ class AutoFeeEngine:
             cache_ttl = int(getattr(legacy, "AMBOSS_CACHE_TTL_SEC", 3 * 3600))
             lookback_days = int(getattr(legacy, "LOOKBACK_DAYS", 7))
 
+            # amboss_series (Storage) é o único armazenamento das séries: cada chave é
+            # lida sob demanda e memorizada só durante esta execução; nada vai para o
+            # cache legado (autofee_cache). Valores e estatísticas vêm da mesma leitura,
+            # então um refresh em background entre duas leituras não os mistura.
+            seed_series = ("incoming_fee_rate_metrics", "weighted_corrected_mean")
+            series_memo: Dict[Tuple[str, str, str], Optional[Tuple[List[float], Optional[Dict[str, Any]]]]] = {}
+            summary_memo: Dict[str, Dict[str, Any]] = {}
+
+            def _from_date() -> str:
+                return (legacy.now_utc() - legacy.datetime.timedelta(days=lookback_days)).strftime("%Y-%m-%d")
+
+            def _memo_entry(entry: Optional[tuple]) -> Optional[Tuple[List[float], Optional[Dict[str, Any]]]]:
+                if entry is None:
+                    return None
+                series, stats = entry
+                return [float(v) for v in series or [] if v is not None], stats
+
+            def _series_entry(pubkey: str, metric: str, submetric: str):
+                key = (pubkey, metric, submetric)
+                if key not in series_memo:
+                    try:
+                        entry = self.amboss.historical_series(
+                            pubkey,
+                            metric,
+                            submetric,
+                            from_date=_from_date(),
+                            ttl=cache_ttl,
+                            with_stats=True,
+                        ) or ([], None)
+                    except Exception:
+                        entry = None
+                    series_memo[key] = _memo_entry(entry)
+                return series_memo[key]
+
+            def _series(pubkey: str, metric: str, submetric: str) -> Optional[List[float]]:
+                entry = _series_entry(pubkey, metric, submetric)
+                return entry[0] if entry else None
+
             def _amboss_seed_series_7d(pubkey: str, cache: Dict[str, Any]):
                 if not pubkey:
                     return None
-                key = f"incoming_series_7d:{pubkey}"
-                now = int(legacy.time.time())
-                cache_dict = cache if isinstance(cache, dict) else None
-                if cache_dict:
-                    entry = cache_dict.get(key) or {}
-                    ts = entry.get("ts")
-                    if ts and now - int(ts) < cache_ttl:
-                        return entry.get("vals")
-                from_date = (legacy.now_utc() - legacy.datetime.timedelta(days=lookback_days)).strftime("%Y-%m-%d")
-                try:
-                    series = self.amboss.historical_series(
-                        pubkey,
-                        "incoming_fee_rate_metrics",
-                        "weighted_corrected_mean",
-                        from_date=from_date,
-                        ttl=cache_ttl,
-                    ) or []
-                except Exception:
-                    return None
-                vals = [float(v) for v in series if v is not None]
-                if not vals:
-                    return None
-                if cache_dict is not None:
-                    cache_dict[key] = {"ts": now, "vals": vals}
-                return vals
+                return _series(pubkey, *seed_series) or None
 
             def _amboss_series_generic(pubkey: str, metric: str, submetric: str, cache: Dict[str, Any]):
                 if not pubkey:
                     return []
-                key = f"series7d:{metric}:{submetric}:{pubkey}"
-                now = int(legacy.time.time())
-                cache_dict = cache if isinstance(cache, dict) else None
-                if cache_dict:
-                    entry = cache_dict.get(key) or {}
-                    ts = entry.get("ts")
-                    if ts and now - int(ts) < cache_ttl:
-                        return entry.get("vals") or []
-                from_date = (legacy.now_utc() - legacy.datetime.timedelta(days=lookback_days)).strftime("%Y-%m-%d")
-                try:
-                    series = self.amboss.historical_series(
-                        pubkey,
-                        metric,
-                        submetric,
-                        from_date=from_date,
-                        ttl=cache_ttl,
-                    ) or []
-                except Exception:
-                    return []
-                vals = [float(v) for v in series if v is not None]
-                if cache_dict is not None:
-                    cache_dict[key] = {"ts": now, "vals": vals}
-                return vals
+                return _series(pubkey, metric, submetric) or []
 
+            def _series_stats(pubkey: str, metric: str, submetric: str) -> Optional[Dict[str, Any]]:
+                # n/mean/p65/p95 gravados junto da série (amboss_series); calcula só sem resumo
+                entry = _series_entry(pubkey, metric, submetric)
+                if not entry or not entry[0]:
+                    return None
+                vals, stats = entry
+                if stats:
+                    return stats
+                p65, p95 = legacy._percentiles(vals, (0.65, 0.95))
+                return {"n": len(vals), "mean": legacy._avg(vals), "p65": p65, "p95": p95}
+
+            def _seed_summary(pubkey: str, cache: Dict[str, Any]) -> Dict[str, Any]:
+                if pubkey not in summary_memo:
+                    seed = _series_stats(pubkey, *seed_series) if pubkey else None
+                    means: Dict[str, Optional[float]] = {}
+                    if legacy.SEED_ADJUST_ENABLE and pubkey:
+                        for name, metric, submetric in legacy.SEED_SUMMARY_SERIES:
+                            stats = _series_stats(pubkey, metric, submetric)
+                            means[name] = stats["mean"] if stats else None
+                    summary_memo[pubkey] = legacy.make_seed_summary(
+                        seed["n"] if seed else 0,
+                        seed["p65"] if seed else None,
+                        seed["p95"] if seed else None,
+                        means,
+                    )
+                return summary_memo[pubkey]
+
+            def _incoming_p65_7d(pubkey: str, cache: Dict[str, Any]) -> Optional[float]:
+                # como no legado: só usa a série se ela já foi lida nesta execução
+                if pubkey in summary_memo:
+                    return summary_memo[pubkey]["p65"]
+                if (pubkey, *seed_series) not in series_memo:
+                    return None
+                seed = _series_stats(pubkey, *seed_series)
+                return seed["p65"] if seed else None
+
+            def _amboss_prefetch(pubkeys, cache: Dict[str, Any]) -> int:
+                series_memo.clear()
+                summary_memo.clear()
+                if not getattr(legacy, "AMBOSS_PREFETCH_ENABLE", True):
+                    return 0
+                # o AmbossService é a fonte da verdade (TTL com jitter + stale-while-revalidate)
+                jobs = legacy.amboss_prefetch_jobs(pubkeys, {})
+                items = list(dict.fromkeys(
+                    (pk, *((metric, submetric) if metric else seed_series)) for pk, metric, submetric in jobs
+                ))
+                if not items:
+                    return 0
+                results = self.amboss.prefetch_series(
+                    items,
+                    from_date=_from_date(),
+                    ttl=cache_ttl,
+                    max_workers=int(getattr(legacy, "AMBOSS_PREFETCH_WORKERS", 8) or 1),
+                    with_stats=True,
+                )
+                for item in items:
+                    series_memo[item] = _memo_entry(results.get(item))
+                return len(items)
+
+            legacy.amboss_prefetch = _amboss_prefetch  # type: ignore
             legacy.amboss_seed_series_7d = _amboss_seed_series_7d  # type: ignore
             legacy.amboss_series_generic = _amboss_series_generic  # type: ignore
+            legacy.incoming_p65_7d = _incoming_p65_7d  # type: ignore
+            legacy.seed_summary = _seed_summary  # type: ignore
+
+        # o relatório vai direto para o stdout real (fora da captura), Telegram e
+        # telemetry_log (só cabeçalho + resumo); a captura fica com o resto da saída.
+        # O stdout segura output_lock do início ao fim do relatório (engines em paralelo)
+        report_stream = real_stdout()
+        stdout_sinks: List[LockedStdoutReportSink] = []
+
+        def _report_sinks(run_dry: bool) -> List[Any]:
+            stdout_sinks.append(LockedStdoutReportSink(report_stream, output_lock))
+            sinks: List[Any] = [
+                stdout_sinks[-1],
+                StorageReportSink(self.storage, "autofee"),
+            ]
+            if report_path:
+                sinks.append(legacy.FileReportSink(str(Path(report_path).expanduser())))
+            if not run_dry and self.telegram.enabled():
+                sinks.append(legacy.TelegramReportSink(self._tg_send, max_len=MAX_MESSAGE_LEN))
+            return sinks
+
+        legacy.make_report_sinks = _report_sinks  # type: ignore
 
         buf = io.StringIO()
-        with contextlib.redirect_stdout(buf):
-            legacy.main(dry_run=dry_run)
+        try:
+            with capture_stdout(buf):
+                legacy.main(dry_run=dry_run)
+        finally:
+            # main() que falha antes de report.close() não pode deixar o lock preso
+            for sink in stdout_sinks:
+                sink.close()
 
         legacy_output = buf.getvalue().strip()
         segments = []
@@ -421,11 +513,7 @@ class AutoFeeEngine:
             segments.append("\n".join(prelude))
         if legacy_output:
             segments.append(legacy_output)
-        combined_output = "\n\n".join(segments)
-        text_for_symptoms = combined_output or legacy_output
-        if text_for_symptoms:
-            self._store_last_symptoms(text_for_symptoms)
-        return combined_output
+        return "\n\n".join(segments)
 
     def _apply_mode_presets(self, mode: str, legacy) -> None:
         presets = get_mode_presets(mode)
@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import sqlite3
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from ..presets import get_mode_presets
+from ..services.lndg_db import LNDgDatabase
+from ..storage import Storage
+from .autofee import AutoFeeEngine, _load_legacy
+
+SEED_SERIES = ("incoming_fee_rate_metrics", "weighted_corrected_mean")
+
+
+def _sqlite_str(ts: float) -> str:
+    dt = datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(sep=" ", timespec="seconds")
+
+
+class _ReplayClock:
+    """Substitui o módulo time do legado: time() devolve o instante simulado."""
+
+    def __init__(self, now: float) -> None:
+        self.now = float(now)
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, _secs: float) -> None:
+        pass
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(time, name)
+
+
+class _WindowSums:
+    """Somas por chave de eventos que entram em ordem de data e saem pela borda
+    inferior da janela. ``sums[key] = [count, v1, v2, ...]``; a chave some quando
+    o último evento dela sai (como o GROUP BY do legado)."""
+
+    def __init__(self) -> None:
+        self.sums: Dict[str, List[int]] = {}
+        self._events: Deque[Tuple[str, str, Tuple[int, ...]]] = deque()
+
+    def add(self, date: str, key: str, values: Tuple[int, ...]) -> None:
+        self._events.append((date, key, values))
+        acc = self.sums.get(key)
+        if acc is None:
+            acc = self.sums[key] = [0] * (len(values) + 1)
+        acc[0] += 1
+        for i, value in enumerate(values, 1):
+            acc[i] += value
+
+    def evict(self, before: str) -> None:
+        events = self._events
+        while events and events[0][0] < before:
+            _date, key, values = events.popleft()
+            acc = self.sums[key]
+            acc[0] -= 1
+            if not acc[0]:
+                del self.sums[key]
+                continue
+            for i, value in enumerate(values, 1):
+                acc[i] -= value
+
+
+class _RowStream:
+    """Cursor ordenado por data com uma linha de lookahead."""
+
+    def __init__(self, cursor: Iterator[Any]) -> None:
+        self._rows = iter(cursor)
+        self._next = next(self._rows, None)
+
+    def until(self, end: str) -> Iterator[Any]:
+        while self._next is not None and self._next[0] <= end:
+            row = self._next
+            self._next = next(self._rows, None)
+            yield row
+
+
+class AutoFeeReplay:
+    """Backtest do AutoFee sobre o histórico do LNDg.
+
+    Roda o main() legado a cada ``step_sec`` de tempo simulado. Forwards e rebals
+    são lidos uma vez, em ordem de data, e as janelas 7d/1d que o legado pede
+    (load_forward_aggregates/load_rebal_aggregates) são mantidas por somas que
+    só recebem o que entrou e descontam o que saiu desde o passo anterior.
+
+    Premissas: os canais são os abertos hoje no gui_channels, com a fee atual como
+    ponto de partida; o saldo inicial é o atual menos os fluxos (forwards e rebals)
+    posteriores ao início; o volume de cada forward não muda com a fee simulada;
+    o seed usa as séries da Amboss já salvas no Storage (sem rede; peer sem série
+    cai no seed padrão do legado).
+    """
+
+    def __init__(
+        self,
+        storage: Optional[Storage],
+        lndg_db_path: str,
+        legacy_path: Path,
+        *,
+        step_sec: int = 600,
+    ) -> None:
+        self.storage = storage
+        self.db = LNDgDatabase.shared(lndg_db_path)
+        self.legacy = _load_legacy(legacy_path)
+        self.step_sec = max(60, int(step_sec))
+
+    # ------------------------------------------------------------------ #
+    # Configuração do legado
+    # ------------------------------------------------------------------ #
+
+    def _configure(self, mode: str, overrides: Dict[str, Any]) -> None:
+        legacy = self.legacy
+        for attr, value in get_mode_presets(mode or "conservador").get("autofee", {}).items():
+            if hasattr(legacy, attr):
+                setattr(legacy, attr, dict(value) if isinstance(value, dict) else value)
+        exclusions: Dict[str, str] = {}
+        if self.storage is not None:
+            stored = self.storage.load_overrides("autofee")
+            if stored:
+                legacy._apply_overrides(legacy.__dict__, stored)
+            for identifier, note in self.storage.list_exclusions().items():
+                norm = AutoFeeEngine._normalize_identifier(identifier)
+                if norm:
+                    exclusions[norm] = note or ""
+        unknown = sorted(key for key in overrides if not hasattr(legacy, key))
+        if unknown:
+            raise ValueError(f"parâmetro(s) desconhecido(s) no AutoFee: {', '.join(unknown)}")
+        legacy._apply_overrides(legacy.__dict__, overrides)
+        legacy.EXCLUSION_LIST = exclusions
+        legacy.DIDACTIC_EXPLAIN_ENABLE = False
+        # processos não ajudam aqui: o módulo não está em sys.modules e cada passo é pequeno
+        legacy.DECISION_WORKERS = 1
+
+    def _load_channels(self) -> Dict[str, Dict[str, Any]]:
+        cols = self.db.columns("gui_channels")
+
+        def col(name: str, default: str = "NULL") -> str:
+            return name if name in cols else default
+
+        rows = self.db.query(
+            f"SELECT chan_id, {col('chan_point')}, alias, local_fee_rate, {col('remote_fee_rate', '0')}, "
+            f"{col('ar_max_cost', '0')}, remote_pubkey, {col('capacity', '0')}, {col('local_balance', '0')}, "
+            f"{col('initiator')}, {col('local_inbound_fee_rate', '0')} FROM gui_channels WHERE is_open = 1"
+        )
+        channels: Dict[str, Dict[str, Any]] = {}
+        for (chan_id, chan_point, alias, local_ppm, remote_ppm, ar_max_cost, pubkey, capacity, local_balance,
+             initiator, inbound_rate) in rows:
+            channels[str(chan_id)] = {
+                "chan_point": chan_point,
+                "alias": alias or "Unknown",
+                "local_fee_rate": int(local_ppm or 0),
+                "remote_fee_rate": int(remote_ppm or 0),
+                "ar_max_cost": float(ar_max_cost or 0),
+                "remote_pubkey": pubkey,
+                "capacity": int(capacity or 0),
+                "local_msat": int(local_balance or 0) * 1000,
+                "initiator": bool(initiator) if initiator is not None else None,
+                # inbound negativo no LND = desconto no legado
+                "inbound_discount_ppm": max(0, -int(inbound_rate or 0)),
+            }
+        return channels
+
+    def last_forward_ts(self) -> Optional[int]:
+        """Data do forward mais recente no LNDg (fim padrão do replay)."""
+        rows = self.db.query(f"SELECT MAX(forward_date) FROM {self.db.forwards_table()}")
+        dt = self.legacy.parse_sqlite_dt(rows[0][0]) if rows and rows[0][0] else None
+        return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp()) if dt else None
+
+    # ------------------------------------------------------------------ #
+    # Execução
+    # ------------------------------------------------------------------ #
+
+    def run(self, start_ts: int, end_ts: int, *, mode: str = "conservador", overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Simula [start_ts, end_ts] e devolve o resumo (totais, por dia e por canal)."""
+        legacy = self.legacy
+        overrides = dict(overrides or {})
+        self._configure(mode, overrides)
+        started = time.monotonic()
+        lookback_sec = int(legacy.LOOKBACK_DAYS) * 86400
+        start_s = _sqlite_str(start_ts)
+
+        channels = self._load_channels()
+        flows = self.db.local_flows_since(start_s)
+        for cid, ch in channels.items():
+            cap_msat = ch["capacity"] * 1000
+            ch["local_msat"] = min(max(ch["local_msat"] - flows.get(cid, 0), 0), cap_msat) if cap_msat else 0
+
+        # gui_channels lido pelo main(): só local_fee_rate muda (fee simulada)
+        meta_db = sqlite3.connect(":memory:")
+        meta_db.execute(
+            "CREATE TABLE gui_channels (chan_id TEXT, chan_point TEXT, alias TEXT, local_fee_rate INTEGER, "
+            "remote_fee_rate INTEGER, ar_max_cost REAL, remote_pubkey TEXT, is_open INTEGER)"
+        )
+        meta_db.executemany(
+            "INSERT INTO gui_channels VALUES (?,?,?,?,?,?,?,1)",
+            [
+                (cid, ch["chan_point"], ch["alias"], ch["local_fee_rate"], ch["remote_fee_rate"],
+                 ch["ar_max_cost"], ch["remote_pubkey"])
+                for cid, ch in channels.items()
+            ],
+        )
+
+        live: Dict[str, Dict[str, Any]] = {}
+        by_point: Dict[str, Dict[str, Any]] = {}
+        for cid, ch in channels.items():
+            live[cid] = {
+                "capacity": ch["capacity"],
+                "local_balance": ch["local_msat"] // 1000,
+                "remote_balance": ch["capacity"] - ch["local_msat"] // 1000,
+                "remote_pubkey": ch["remote_pubkey"],
+                "chan_point": ch["chan_point"],
+                "active": True,
+                "initiator": ch["initiator"],
+            }
+            if ch["chan_point"]:
+                by_point[ch["chan_point"]] = live[cid]
+        snapshot = {"by_scid_dec": live, "by_cid_dec": live, "by_point": by_point}
+
+        fees = {cid: ch["local_fee_rate"] for cid, ch in channels.items()}
+        inbound = {cid: ch["inbound_discount_ppm"] for cid, ch in channels.items()}
+        base_fee = {cid: int(getattr(legacy, "BASE_FEE_MSAT", 0) or 0) for cid in channels}
+        stats = {
+            cid: {
+                "forwards": 0, "out_amt_sat": 0, "fee_real_msat": 0, "fee_sim_msat": 0,
+                "changes": 0, "up": 0, "down": 0,
+                "ppm_min": fees[cid], "ppm_max": fees[cid], "trajectory": [[int(start_ts), fees[cid]]],
+            }
+            for cid in channels
+        }
+        daily: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])   # out_amt_sat, fee_real_msat, fee_sim_msat
+        totals = defaultdict(int)
+        touched: set = set()
+
+        out_7d, out_1d, in_7d, rebal_7d = _WindowSums(), _WindowSums(), _WindowSums(), _WindowSums()
+        window_start = _sqlite_str(start_ts - lookback_sec)
+        fwd_rows = _RowStream(self.db.forwards_between(window_start, _sqlite_str(end_ts)))
+        rebal_rows = _RowStream(self.db.rebalances_between(window_start, _sqlite_str(end_ts)))
+        clock = _ReplayClock(start_ts)
+
+        def move(cid: str, msat: int) -> None:
+            ch = channels.get(cid)
+            if ch is not None and ch["capacity"]:
+                ch["local_msat"] = min(max(ch["local_msat"] + msat, 0), ch["capacity"] * 1000)
+                touched.add(cid)
+
+        def advance(upto: str) -> None:
+            """Incorpora forwards/rebals até ``upto``; os posteriores ao início movem saldo e receita."""
+            for date, cid_in, cid_out, in_sat, out_sat, in_msat, out_msat, fee_sat, fee_raw in fwd_rows.until(upto):
+                replayed = date > start_s
+                kin = str(cid_in) if cid_in is not None and cid_in != "" else None
+                kout = str(cid_out) if cid_out is not None and cid_out != "" else None
+                if kout is not None:
+                    out_7d.add(date, kout, (int(fee_sat), int(out_sat)))
+                    out_1d.add(date, kout, (int(out_sat),))
+                if kin is not None:
+                    in_7d.add(date, kin, (int(in_sat), int(in_msat)))
+                if not replayed:
+                    continue
+                real_msat = int(round(float(fee_raw) * 1000))
+                sim_msat = real_msat
+                if kout in fees:
+                    sim_msat = base_fee[kout] + int(out_msat) * fees[kout] // 1_000_000
+                    if kin in inbound:
+                        sim_msat = max(0, sim_msat - int(out_msat) * inbound[kin] // 1_000_000)
+                    st = stats[kout]
+                    st["forwards"] += 1
+                    st["out_amt_sat"] += int(out_msat) // 1000
+                    st["fee_real_msat"] += real_msat
+                    st["fee_sim_msat"] += sim_msat
+                day = daily[date[:10]]
+                day[0] += int(out_msat) // 1000
+                day[1] += real_msat
+                day[2] += sim_msat
+                totals["forwards"] += 1
+                if kout is not None:
+                    move(kout, -int(out_msat))
+                if kin is not None:
+                    move(kin, int(in_msat))
+            for date, rebal_chan, chan_out, value_sat, fee_sat, value_raw, fee_raw, status in rebal_rows.until(upto):
+                rebal_7d.add(date, str(rebal_chan), (int(value_sat), int(fee_sat)))
+                if date > start_s and int(status or 0) == 2:
+                    totals["rebalances"] += 1
+                    totals["rebal_fee_msat"] += int(round(float(fee_raw) * 1000))
+                    move(str(rebal_chan), int(round(float(value_raw) * 1000)))
+                    move(str(chan_out), -int(round((float(value_raw) + float(fee_raw)) * 1000)))
+
+        # --- Hooks do legado ---
+
+        store: Dict[str, Any] = {}
+
+        def _forward_aggregates(cur, start_dt, end_dt, one_day_ago_naive) -> Dict[str, Any]:
+            advance(legacy.to_sqlite_str(end_dt))
+            out_7d.evict(legacy.to_sqlite_str(start_dt))
+            out_1d.evict(legacy.to_sqlite_str(one_day_ago_naive))
+            in_7d.evict(legacy.to_sqlite_str(start_dt))
+            return {
+                "out_fee_sat": defaultdict(int, {k: acc[1] for k, acc in out_7d.sums.items()}),
+                "out_amt_sat": defaultdict(int, {k: acc[2] for k, acc in out_7d.sums.items()}),
+                "out_count": defaultdict(int, {k: acc[0] for k, acc in out_7d.sums.items()}),
+                "out_amt_sat_1d": defaultdict(int, {k: acc[1] for k, acc in out_1d.sums.items()}),
+                "out_count_1d": defaultdict(int, {k: acc[0] for k, acc in out_1d.sums.items()}),
+                "in_amt_sat_by_cid": defaultdict(int, {k: acc[1] for k, acc in in_7d.sums.items()}),
+                "in_count_by_cid": defaultdict(int, {k: acc[0] for k, acc in in_7d.sums.items()}),
+                "in_amt_msat_by_cid": defaultdict(int, {k: acc[2] for k, acc in in_7d.sums.items()}),
+            }
+
+        def _rebal_aggregates(cur, start_dt, end_dt) -> Dict[str, Any]:
+            advance(legacy.to_sqlite_str(end_dt))
+            rebal_7d.evict(legacy.to_sqlite_str(start_dt))
+            perchan_value: Dict[str, int] = defaultdict(int)
+            perchan_fee: Dict[str, int] = defaultdict(int)
+            value_global = fee_global = 0
+            for raw, (_count, value, fee) in rebal_7d.sums.items():
+                value_global += value
+                fee_global += fee
+                rcid = legacy._norm_scid(raw)
+                if rcid:
+                    perchan_value[rcid] += value
+                    perchan_fee[rcid] += fee
+            return {
+                "value_sat_global": value_global,
+                "fee_sat_global": fee_global,
+                "perchan_value_sat": perchan_value,
+                "perchan_fee_sat": perchan_fee,
+            }
+
+        def _apply_policy_updates(updates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            now = int(clock.now)
+            for upd in updates:
+                cid = upd["cid"]
+                new_ppm = int(upd["ppm"])
+                if upd.get("inbound_discount_ppm") is not None:
+                    inbound[cid] = max(0, int(upd["inbound_discount_ppm"]))
+                if upd.get("base_fee_msat") is not None:
+                    base_fee[cid] = int(upd["base_fee_msat"])
+                st = stats.get(cid)
+                if st is None or new_ppm == fees[cid]:
+                    fees[cid] = new_ppm
+                    continue
+                st["changes"] += 1
+                st["up" if new_ppm > fees[cid] else "down"] += 1
+                st["ppm_min"] = min(st["ppm_min"], new_ppm)
+                st["ppm_max"] = max(st["ppm_max"], new_ppm)
+                st["trajectory"].append([now, new_ppm])
+                fees[cid] = new_ppm
+                totals["fee_changes"] += 1
+            meta_db.executemany(
+                "UPDATE gui_channels SET local_fee_rate=? WHERE chan_id=?",
+                [(fees[upd["cid"]], upd["cid"]) for upd in updates if upd["cid"] in fees],
+            )
+            return [{"method": "REPLAY", "error": None} for _upd in updates]
+
+        seed_memo: Dict[str, Dict[str, Any]] = {}
+
+        def _series_stats(pubkey: str, metric: str, submetric: str) -> Optional[Dict[str, Any]]:
+            if self.storage is None:
+                return None
+            stats_row = self.storage.get_amboss_summary(pubkey, metric, submetric)
+            return stats_row if stats_row and stats_row.get("n") else None
+
+        def _seed_summary(pubkey: str, cache: Dict[str, Any]) -> Dict[str, Any]:
+            if pubkey not in seed_memo:
+                seed = _series_stats(pubkey, *SEED_SERIES) if pubkey else None
+                means: Dict[str, Optional[float]] = {}
+                if legacy.SEED_ADJUST_ENABLE and pubkey:
+                    for name, metric, submetric in legacy.SEED_SUMMARY_SERIES:
+                        series = _series_stats(pubkey, metric, submetric)
+                        means[name] = series["mean"] if series else None
+                seed_memo[pubkey] = legacy.make_seed_summary(
+                    seed["n"] if seed else 0,
+                    seed["p65"] if seed else None,
+                    seed["p95"] if seed else None,
+                    means,
+                )
+            return seed_memo[pubkey]
+
+        def _run_metrics(metrics: Dict[str, Any]) -> None:
+            totals["runs"] += 1
+            totals["changed_up"] += int(metrics.get("changed_up") or 0)
+            totals["changed_down"] += int(metrics.get("changed_down") or 0)
+
+        def _unsupported(cmd: str) -> str:
+            raise RuntimeError(f"replay: comando não suportado: {cmd}")
+
+        legacy.time = clock  # type: ignore
+        legacy.now_utc = lambda: datetime.datetime.fromtimestamp(clock.now, datetime.timezone.utc)  # type: ignore
+        legacy.load_json = lambda name, default: store.get(name, default)  # type: ignore
+        legacy.save_json = store.__setitem__  # type: ignore
+        legacy.db_connect = lambda: meta_db  # type: ignore
+        legacy.load_forward_aggregates = _forward_aggregates  # type: ignore
+        legacy.load_rebal_aggregates = _rebal_aggregates  # type: ignore
+        legacy.listchannels_snapshot = lambda: snapshot  # type: ignore
+        legacy.apply_policy_updates = _apply_policy_updates  # type: ignore
+        legacy.fee_update_method = lambda pubkey, chan_point: "REPLAY"  # type: ignore
+        legacy.amboss_prefetch = lambda pubkeys, cache: 0  # type: ignore
+        legacy.amboss_seed_series_7d = lambda pubkey, cache: None  # type: ignore
+        legacy.amboss_series_generic = lambda pubkey, metric, submetric, cache: []  # type: ignore
+        legacy.incoming_p65_7d = lambda pubkey, cache: _seed_summary(pubkey, cache)["p65"]  # type: ignore
+        legacy.seed_summary = _seed_summary  # type: ignore
+        legacy.make_report_sinks = lambda dry_run: []  # type: ignore
+        legacy.tg_send_big = lambda text: None  # type: ignore
+        legacy.read_version_info = lambda path: {"version": "replay"}  # type: ignore
+        legacy.emit_run_metrics = _run_metrics  # type: ignore
+        legacy.run = _unsupported  # type: ignore
+
+        # o main() loga a cada passo; no replay só avisos/erros interessam
+        legacy_logger = legacy.logger
+        prev_level = legacy_logger.level
+        legacy_logger.setLevel(logging.WARNING)
+        steps = 0
+        try:
+            ts = int(start_ts)
+            while ts <= end_ts:
+                clock.now = float(ts)
+                advance(_sqlite_str(ts))
+                for cid in touched:
+                    info = live[cid]
+                    info["local_balance"] = channels[cid]["local_msat"] // 1000
+                    info["remote_balance"] = info["capacity"] - info["local_balance"]
+                touched.clear()
+                legacy.main(dry_run=False)
+                steps += 1
+                ts += self.step_sec
+        finally:
+            legacy_logger.setLevel(prev_level)
+            meta_db.close()
+
+        per_channel = []
+        for cid, ch in channels.items():
+            st = stats[cid]
+            per_channel.append({
+                "cid": cid,
+                "alias": ch["alias"],
+                "ppm_start": ch["local_fee_rate"],
+                "ppm_end": fees[cid],
+                "ppm_min": st["ppm_min"],
+                "ppm_max": st["ppm_max"],
+                "changes": st["changes"],
+                "up": st["up"],
+                "down": st["down"],
+                "forwards": st["forwards"],
+                "out_amt_sat": st["out_amt_sat"],
+                "fee_real_sat": st["fee_real_msat"] // 1000,
+                "fee_sim_sat": st["fee_sim_msat"] // 1000,
+                "trajectory": st["trajectory"],
+            })
+        per_channel.sort(key=lambda row: (-row["out_amt_sat"], row["cid"]))
+        fee_real = sum(day[1] for day in daily.values()) // 1000
+        fee_sim = sum(day[2] for day in daily.values()) // 1000
+        return {
+            "start": _sqlite_str(start_ts),
+            "end": _sqlite_str(end_ts),
+            "step_sec": self.step_sec,
+            "steps": steps,
+            "mode": mode,
+            "overrides": overrides,
+            "elapsed_sec": round(time.monotonic() - started, 2),
+            "channels": len(channels),
+            "totals": {
+                "forwards": totals["forwards"],
+                "out_amt_sat": sum(day[0] for day in daily.values()),
+                "fee_real_sat": fee_real,
+                "fee_sim_sat": fee_sim,
+                "rebalances": totals["rebalances"],
+                "rebal_fee_sat": totals["rebal_fee_msat"] // 1000,
+                "fee_changes": totals["fee_changes"],
+                "changed_up": totals["changed_up"],
+                "changed_down": totals["changed_down"],
+            },
+            "daily": [
+                {"day": day, "out_amt_sat": vals[0], "fee_real_sat": vals[1] // 1000, "fee_sim_sat": vals[2] // 1000}
+                for day, vals in sorted(daily.items())
+            ],
+            "per_channel": per_channel,
+        }
@@ -1,18 +1,19 @@
 from __future__ import annotations
 
-import contextlib
 import datetime
 import importlib.util
 import io
 import json
-import re
 import sqlite3
+import sys
 import time
 from collections import defaultdict
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+from ..scheduler import capture_stdout
 from ..services.lndg_db import LNDgDatabase
+from ..services.lndg_rollup import LNDgRollupService
 from ..services.telegram import TelegramService
 from ..storage import Storage
 
@@ -27,15 +28,6 @@ def _load_legacy(path: Path):
 
 
 SYMPTOM_KEYS = ("floor_lock", "no_down_low", "hold_small", "cb_trigger", "discovery")
-SYMPTOM_HEADER_RE = re.compile(r"(?:DRY[-\s]*RUN\s*)?[\u2699\uFE0F\u200D\uFE0F]*\s*AutoFee\s*\|\s*janela\s*\d+d", re.IGNORECASE)
-SYMPTOM_DICT_RE = re.compile(r"Symptoms:\s*\{([^}]*)\}", re.IGNORECASE)
-SYMPTOM_TOKEN_PATTERNS = {
-    "floor_lock": re.compile(r"floor[-_\s]*lock", re.IGNORECASE),
-    "no_down_low": re.compile(r"no[-_\s]*down[-_\s]*low", re.IGNORECASE),
-    "hold_small": re.compile(r"hold[-_\s]*small", re.IGNORECASE),
-    "cb_trigger": re.compile(r"(?:cb[-_\s]*trigger|cb\s*[:=])", re.IGNORECASE),
-    "discovery": re.compile(r"discovery", re.IGNORECASE),
-}
 
 
 class ParamTunerEngine:
@@ -44,9 +36,11 @@ class ParamTunerEngine:
         storage: Storage,
         telegram: TelegramService,
         legacy_path: Path,
+        rollup: Optional[LNDgRollupService] = None,
     ) -> None:
         self.storage = storage
         self.telegram = telegram
+        self.rollup = rollup
         self.legacy = _load_legacy(legacy_path)
         self._legacy_load_meta = self.legacy.load_meta  # type: ignore
         self._legacy_save_meta = self.legacy.save_meta  # type: ignore
@@ -127,15 +121,24 @@ class ParamTunerEngine:
         db_path = secrets.get("lndg_db_path")
         if not db_path:
             raise RuntimeError("LNDg database path not configured (set-secret --lndg-db-path ...)")
-        helper = LNDgDatabase(db_path)
+        helper = LNDgDatabase.shared(db_path)
         forwards = "gui_forwards" if helper.table_exists("gui_forwards") else "forwards"
         payments = "gui_payments" if helper.table_exists("gui_payments") else "payments"
         return {"db_path": db_path, "forwards": forwards, "payments": payments}
 
     def _connect(self, db_path: str) -> sqlite3.Connection:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return LNDgDatabase.shared(db_path).connect()
+
+    def _scan_7d_totals(self, db_path: str, forwards_table: str, payments_table: str, t1, t2):
+        to_sql = self.legacy.to_sqlite_str
+        helper = LNDgDatabase.shared(db_path)
+        out = helper.forward_out_totals(to_sql(t1), to_sql(t2), table=forwards_table)
+        rebal_value = 0
+        rebal_fee = 0
+        for row in helper.rebal_sums(to_sql(t1), to_sql(t2), table=payments_table):
+            rebal_value += int(row["value_sat"] or 0)
+            rebal_fee += int(row["fee_sat"] or 0)
+        return out["out_amt_sat"], out["out_fee_sat"], rebal_value, rebal_fee
 
     def _get_7d_kpis(self) -> Dict[str, Any]:
         tables = self._select_tables()
@@ -145,32 +148,19 @@ class ParamTunerEngine:
         lookback = self.legacy.LOOKBACK_DAYS
         t2 = datetime.datetime.now(datetime.timezone.utc)
         t1 = t2 - datetime.timedelta(days=lookback)
-        to_sql = self.legacy.to_sqlite_str
         ppm = self.legacy.ppm
 
-        with self._connect(db_path) as conn:
-            cur = conn.cursor()
-            cur.execute(
-                f"SELECT amt_out_msat, fee FROM {forwards_table} WHERE forward_date BETWEEN ? AND ?",
-                (to_sql(t1), to_sql(t2)),
-            )
-            rows = cur.fetchall()
-            out_amt_sat = 0
-            out_fee_sat = 0
-            for amt_msat, fee in rows:
-                out_amt_sat += int((amt_msat or 0) / 1000)
-                out_fee_sat += int(fee or 0)
-
-            cur.execute(
-                f"SELECT value, fee FROM {payments_table} WHERE rebal_chan IS NOT NULL AND chan_out IS NOT NULL AND creation_date BETWEEN ? AND ?",
-                (to_sql(t1), to_sql(t2)),
-            )
-            pay_rows = cur.fetchall()
-            rebal_value = 0
-            rebal_fee = 0
-            for value, fee in pay_rows:
-                rebal_value += int(value or 0)
-                rebal_fee += int(fee or 0)
+        totals = None
+        if self.rollup is not None:
+            try:
+                out = self.rollup.out_totals(t1)
+                rebal = self.rollup.rebal_aggregates(t1)
+                totals = (out["out_amt_sat"], out["out_fee_sat"], rebal["total_value"], rebal["total_fee"])
+            except sqlite3.Error as exc:
+                print(f"[tuner] rollup indisponivel, usando SQL direto: {exc}", file=sys.stderr)
+        if totals is None:
+            totals = self._scan_7d_totals(db_path, forwards_table, payments_table, t1, t2)
+        out_amt_sat, out_fee_sat, rebal_value, rebal_fee = totals
 
         out_ppm = ppm(out_fee_sat, out_amt_sat)
         rebal_ppm = ppm(rebal_fee, rebal_value)
@@ -258,56 +248,20 @@ class ParamTunerEngine:
     def _empty_symptom_counts() -> Dict[str, int]:
         return {key: 0 for key in SYMPTOM_KEYS}
 
-    def _extract_symptoms_from_text(self, text: Optional[str]) -> Optional[Dict[str, int]]:
-        if not text:
-            return None
-        block = str(text)
-        hits = list(SYMPTOM_HEADER_RE.finditer(block))
-        if hits:
-            block = block[hits[-1].start():]
-        counts = self._empty_symptom_counts()
-        found = False
-        match = SYMPTOM_DICT_RE.search(block)
-        if match:
-            payload = "{" + match.group(1) + "}"
-            payload = payload.replace("'", '"')
-            try:
-                parsed = json.loads(payload)
-            except (json.JSONDecodeError, TypeError):
-                parsed = None
-            if isinstance(parsed, dict):
-                for key in SYMPTOM_KEYS:
-                    if key in parsed:
-                        value = parsed.get(key)
-                        if isinstance(value, (int, float)) and not isinstance(value, bool):
-                            counts[key] = int(value)
-                            found = True
-                        elif isinstance(value, str):
-                            value = value.strip()
-                            if value.isdigit():
-                                counts[key] = int(value)
-                                found = True
-        for key, pattern in SYMPTOM_TOKEN_PATTERNS.items():
-            matches = pattern.findall(block)
-            if matches:
-                counts[key] += len(matches)
-                found = True
-        return counts if found else None
-
     def _read_symptoms_from_telemetry(self) -> Dict[str, int]:
+        # registro estruturado gravado pelo AutoFee a cada execução (autofee_run_metrics)
         try:
-            rows = list(self.storage.recent_logs("autofee", limit=20))
+            metrics = self.storage.latest_run_metrics()
         except Exception:
-            rows = []
-        for row in rows:
-            msg = None
-            try:
-                msg = row["msg"]
-            except Exception:
-                msg = None
-            parsed = self._extract_symptoms_from_text(msg)
-            if parsed:
-                return parsed
+            metrics = None
+        if isinstance(metrics, dict) and isinstance(metrics.get("symptoms"), dict):
+            normalized = self._empty_symptom_counts()
+            for key in SYMPTOM_KEYS:
+                value = metrics["symptoms"].get(key)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    normalized[key] = int(value)
+            return normalized
+        # bancos anteriores ao registro estruturado
         try:
             stored = self.storage.load_json("legacy_autofee_last_symptoms", None)
         except Exception:
@@ -372,6 +326,6 @@ class ParamTunerEngine:
         legacy.MONTHLY_PROFIT_GOAL_SAT_7D = goals.get("sat_7d")  # type: ignore
 
         buf = io.StringIO()
-        with contextlib.redirect_stdout(buf):
+        with capture_stdout(buf):
             legacy.main(dry_run=dry_run, verbose=True, force_telegram=force_telegram, no_telegram=no_telegram)
         return buf.getvalue()
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import threading
+from typing import List, Optional, TextIO
+
+from .storage import Storage
+
+
+class StorageReportSink:
+    """Sink do relatório legado que registra no telemetry_log só as primeiras linhas
+    (cabeçalho + resumo), com o tamanho do relatório; o texto completo só passa por ele."""
+
+    def __init__(self, storage: Storage, component: str, *, head_lines: int = 2) -> None:
+        self.storage = storage
+        self.component = component
+        self.head_lines = head_lines
+        self._head: List[str] = []
+        self._lines = 0
+        self._bytes = 0
+
+    def write(self, line: Optional[str]) -> None:
+        line = line or ""
+        if len(self._head) < self.head_lines:
+            self._head.append(line)
+        self._lines += 1
+        self._bytes += len(line.encode("utf-8")) + 1
+
+    def close(self) -> None:
+        if not self._lines:
+            return
+        self.storage.log(
+            self.component,
+            "INFO",
+            "\n".join(self._head),
+            {"report_lines": self._lines, "report_bytes": self._bytes},
+        )
+
+
+class LockedStdoutReportSink:
+    """Sink de stdout que segura ``lock`` da primeira linha até o close, para o
+    relatório sair inteiro mesmo com outro engine imprimindo em paralelo."""
+
+    def __init__(self, stream: TextIO, lock: threading.Lock) -> None:
+        self.stream = stream
+        self._lock = lock
+        self._held = False
+
+    def write(self, line: Optional[str]) -> None:
+        if not self._held:
+            self._lock.acquire()
+            self._held = True
+        try:
+            print(line, file=self.stream)
+        except Exception:
+            # o StreamingReport descarta o sink sem chamar close: solta o lock antes
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._held:
+            self._held = False
+            self._lock.release()
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import contextlib
+import heapq
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from logging_config import get_logger
+
+logger = get_logger("scheduler")
+
+from .storage import Storage
+
+
+# ---------------------------------------------------------------------- #
+# stdout por thread
+# ---------------------------------------------------------------------- #
+
+class _ThreadStdout:
+    """Substitui sys.stdout: cada thread escreve no buffer que registrou (capture_stdout)
+    ou, sem buffer, no stdout original. contextlib.redirect_stdout troca o stdout do
+    processo inteiro e misturaria a saída de engines rodando em paralelo."""
+
+    def __init__(self, stream: TextIO) -> None:
+        self.stream = stream
+        self._local = threading.local()
+
+    def _target(self) -> TextIO:
+        return getattr(self._local, "buf", None) or self.stream
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+_stdout_lock = threading.Lock()
+
+
+def _thread_stdout() -> _ThreadStdout:
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        return sys.stdout
+
+
+# engines rodam em paralelo: quem escreve direto no stdout real segura este lock
+# pelo bloco inteiro (saída de um engine nunca sai no meio da de outro)
+output_lock = threading.Lock()
+
+
+def real_stdout() -> TextIO:
+    """stdout do processo, fora de qualquer captura."""
+    stdout = sys.stdout
+    return stdout.stream if isinstance(stdout, _ThreadStdout) else stdout
+
+
+@contextlib.contextmanager
+def capture_stdout(buf: TextIO) -> Iterator[TextIO]:
+    """Como contextlib.redirect_stdout, mas só para a thread atual."""
+    proxy = _thread_stdout()
+    prev = getattr(proxy._local, "buf", None)
+    proxy._local.buf = buf
+    try:
+        yield buf
+    finally:
+        proxy._local.buf = prev
+
+
+# ---------------------------------------------------------------------- #
+# Scheduler
+# ---------------------------------------------------------------------- #
+
+class EngineJob:
+    """Engine agendado. ``func`` executa uma rodada e devolve True (ok) ou False (erro).
+
+    ``after``: engines que precisam terminar antes (se estiverem rodando ou vencidos,
+    este espera). ``exclusive``: engines com os quais este nunca roda em paralelo.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], bool],
+        interval: float,
+        *,
+        after: Sequence[str] = (),
+        exclusive: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.interval = max(float(interval), 1.0)
+        self.after = tuple(after)
+        self.exclusive = tuple(exclusive)
+        self.running = False
+        self.runs = 0
+
+
+class Scheduler:
+    """Heap de deadlines (time.monotonic) + uma thread de trabalho por engine.
+
+    A thread principal só despacha: tira do heap os engines vencidos cujas restrições
+    permitem rodar e entrega cada um à sua thread. O próximo deadline é início +
+    intervalo (como no loop antigo); uma rodada mais longa que o intervalo é
+    registrada como overrun e o engine volta a rodar assim que terminar.
+    """
+
+    def __init__(
+        self,
+        jobs: Sequence[EngineJob],
+        *,
+        storage: Optional[Storage] = None,
+        once: bool = False,
+        on_finish: Optional[Callable[[EngineJob], None]] = None,
+    ) -> None:
+        self.jobs: Dict[str, EngineJob] = {job.name: job for job in jobs}
+        self.storage = storage
+        self.once = once
+        self.on_finish = on_finish
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._heap: List[Tuple[float, int, str]] = []
+        self._order = {job.name: idx for idx, job in enumerate(jobs)}
+        self._queues: Dict[str, "queue.Queue[Optional[float]]"] = {}
+        self._workers: Dict[str, threading.Thread] = {}
+
+    def run(self) -> None:
+        now = time.monotonic()
+        for name in self.jobs:
+            heapq.heappush(self._heap, (now, self._order[name], name))
+            self._queues[name] = queue.Queue()
+            worker = threading.Thread(target=self._worker_loop, args=(self.jobs[name],), name=f"engine-{name}", daemon=True)
+            self._workers[name] = worker
+            worker.start()
+        try:
+            self._dispatch_loop()
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            workers = list(self._workers.items())
+            self._workers.clear()
+        for name, _worker in workers:
+            self._queues[name].put(None)
+        for name, worker in workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.warning(f"Engine {name} ainda em execução ao encerrar o scheduler")
+
+    def _dispatch_loop(self) -> None:
+        with self._cond:
+            while not self._stopping:
+                if self.once and not self._heap and not any(job.running for job in self.jobs.values()):
+                    return
+                now = time.monotonic()
+                due: List[Tuple[float, int, str]] = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+                pending = {name: deadline for deadline, _order, name in due}
+                for entry in due:
+                    job = self.jobs[entry[2]]
+                    if self._blocked(job, entry[0], pending):
+                        heapq.heappush(self._heap, entry)
+                        continue
+                    del pending[job.name]
+                    job.running = True
+                    self._queues[job.name].put(entry[0])
+                future = [deadline for deadline, _order, _name in self._heap if deadline > now]
+                # engines vencidos mas bloqueados acordam quando outro termina (notify)
+                self._cond.wait(max(min(future) - now, 0.0) if future else None)
+
+    def _blocked(self, job: EngineJob, deadline: float, pending: Dict[str, float]) -> bool:
+        for name in job.after:
+            peer = self.jobs.get(name)
+            if peer is None:
+                continue
+            # só espera um peer vencido antes (ou junto); um peer em overrun que
+            # acabou de vencer de novo não passa na frente de quem já esperava
+            if peer.running or pending.get(name, float("inf")) <= deadline:
+                return True
+        for name in job.exclusive:
+            peer = self.jobs.get(name)
+            if peer is not None and peer.running:
+                return True
+        return False
+
+    def _worker_loop(self, job: EngineJob) -> None:
+        q = self._queues[job.name]
+        while True:
+            deadline = q.get()
+            if deadline is None:
+                return
+            started_mono = time.monotonic()
+            started_at = time.time()
+            try:
+                ok = bool(job.func())
+            except Exception as exc:  # pragma: no cover - run_module já captura
+                logger.error(f"Engine {job.name} falhou: {exc}")
+                ok = False
+            duration = time.monotonic() - started_mono
+            lag = max(started_mono - deadline, 0.0)
+            overrun = duration > job.interval
+            if overrun:
+                logger.warning(
+                    f"Engine {job.name} excedeu o intervalo: {duration:.1f}s > {job.interval:g}s "
+                    "(próxima rodada sai logo em seguida)"
+                )
+            if self.storage is not None:
+                try:
+                    self.storage.record_engine_run(
+                        job.name,
+                        started_at=started_at,
+                        duration_sec=duration,
+                        lag_sec=lag,
+                        ok=ok,
+                        overrun=overrun,
+                    )
+                except Exception as exc:  # pragma: no cover - defensive
+                    logger.error(f"Falha ao gravar métricas do engine {job.name}: {exc}")
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception as exc:  # pragma: no cover - defensive
+                    logger.error(f"Pós-execução do engine {job.name} falhou: {exc}")
+            with self._cond:
+                job.running = False
+                job.runs += 1
+                if not self.once:
+                    heapq.heappush(self._heap, (started_mono + job.interval, self._order[job.name], job.name))
+                self._cond.notify_all()
@@ -1,56 +1,182 @@
 from __future__ import annotations
 
+import queue
 import sys
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import requests
-from requests.exceptions import ConnectionError, Timeout
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 from logging_config import get_logger
 
 logger = get_logger("services.amboss")
 
-from ..storage import Storage
+from ..storage import Storage, series_stats
+from .http import build_session
 
-MAX_RETRIES = 3
-INITIAL_BACKOFF = 1.0
-BACKOFF_MULTIPLIER = 2.0
+DEFAULT_PREFETCH_WORKERS = 8
+DEFAULT_BATCH_SIZE = 24  # séries por POST (aliases de getNodeMetrics/historical_series)
+DEFAULT_MAX_STALE_SEC = 24 * 3600  # acima disso a série volta a ser buscada de forma síncrona
+DEFAULT_TTL_JITTER = 0.25  # cada série expira em [ttl*(1-jitter), ttl], estável por chave
+
+SeriesKey = Tuple[str, str, str]
+SeriesWithStats = Tuple[list, Optional[Dict[str, Any]]]  # (valores, n/mean/median/p65/p95/std)
 
 
 class AmbossService:
-    def __init__(self, storage: Storage, token: str, url: str = "https://api.amboss.space/graphql") -> None:
+    def __init__(
+        self,
+        storage: Storage,
+        token: str,
+        url: str = "https://api.amboss.space/graphql",
+        *,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        stale_while_revalidate: bool = False,
+        max_stale_sec: int = DEFAULT_MAX_STALE_SEC,
+        ttl_jitter: float = DEFAULT_TTL_JITTER,
+    ) -> None:
         self._storage = storage
         self._token = token
         self._url = url
+        self._batch_size = max(1, int(batch_size or 1))
+        # GraphQL aqui é só leitura: POST pode ser repetido em 5xx/429
+        self._session = build_session(
+            "amboss",
+            pool_maxsize=DEFAULT_PREFETCH_WORKERS,
+            retry_methods=("POST",),
+            headers=self._headers(),
+        )
+        self._swr = bool(stale_while_revalidate)
+        self._max_stale_sec = int(max_stale_sec)
+        self._ttl_jitter = min(max(float(ttl_jitter), 0.0), 0.9)
+        self._refresh_queue: "queue.Queue[Optional[Tuple[SeriesKey, str]]]" = queue.Queue()
+        self._refresh_pending: set = set()
+        self._refresh_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
         logger.info("Amboss Service inicializado")
 
-    def _cached_series(self, pubkey: str, metric: str, submetric: str, ttl: int) -> Optional[list]:
+    def _effective_ttl(self, key: SeriesKey, ttl: int) -> int:
+        """TTL com jitter determinístico por série, para espalhar as expirações."""
+        frac = zlib.crc32("|".join(key).encode()) / 0xFFFFFFFF
+        return int(ttl * (1.0 - self._ttl_jitter * frac))
+
+    def _cached_series(
+        self, pubkey: str, metric: str, submetric: str, ttl: int, from_date: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Linha do cache (data + stats da mesma leitura) ou None se ausente/vencida."""
         row = self._storage.get_amboss_series(pubkey, metric, submetric)
         if not row:
             return None
         if row["updated_at"] and ttl > 0:
-            if int(time.time()) - int(row["updated_at"]) > ttl:
-                return None
-        return row["data"]
-
-    def _post_with_retry(self, headers: dict, payload: dict) -> requests.Response:
-        backoff = INITIAL_BACKOFF
-        last_error: Optional[Exception] = None
-
-        for attempt in range(MAX_RETRIES):
-            try:
-                return requests.post(self._url, headers=headers, json=payload, timeout=30)
-            except (ConnectionError, Timeout) as e:
-                last_error = e
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(backoff)
-                    backoff *= BACKOFF_MULTIPLIER
-                continue
+            key = (pubkey, metric, submetric)
+            age = int(time.time()) - int(row["updated_at"])
+            if age > self._effective_ttl(key, ttl):
+                # stale-while-revalidate: devolve o valor vencido e agenda o refresh em background
+                if not (self._swr and from_date and self.refresher_running() and age <= self._max_stale_sec):
+                    return None
+                self._schedule_refresh(key, from_date)
+        return row if row["data"] is not None else None
+
+    @staticmethod
+    def _with_stats(data: Any, stats: Optional[Dict[str, Any]] = None) -> Optional[SeriesWithStats]:
+        # série recém-buscada ou JSON antigo: mesmas estatísticas que a escrita grava
+        if data is None:
+            return None
+        if stats is None and isinstance(data, list):
+            stats = series_stats([float(v) for v in data if v is not None])
+        return data, stats
+
+    # --- Refresh em background (stale-while-revalidate) -------------------
+
+    def refresher_running(self) -> bool:
+        return self._refresher is not None and self._refresher.is_alive()
+
+    def start_refresher(self) -> None:
+        if not self._swr or self.refresher_running():
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, name="amboss-refresh", daemon=True)
+        self._refresher.start()
+        logger.info("Refresh em background do cache Amboss iniciado")
+
+    def stop_refresher(self, timeout: float = 30.0) -> None:
+        """Encerra o worker depois de esvaziar a fila (limitado por ``timeout``)."""
+        thread = self._refresher
+        if thread is None:
+            return
+        self._refresh_queue.put(None)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f"Refresh Amboss ainda com {self._refresh_queue.qsize()} série(s) na fila ao encerrar")
+        self._refresher = None
+
+    def _schedule_refresh(self, key: SeriesKey, from_date: str) -> None:
+        with self._refresh_lock:
+            if key in self._refresh_pending:
+                return
+            self._refresh_pending.add(key)
+        self._refresh_queue.put((key, from_date))
 
-        raise ConnectionError(f"Amboss API: {last_error}") from last_error
+    def _refresh_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._refresh_queue.get()
+            batch: List[Tuple[SeriesKey, str]] = []
+            while True:
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if len(batch) >= self._batch_size:
+                    break
+                try:
+                    item = self._refresh_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if stopping:
+                # drena o que ainda estiver na fila antes de sair
+                while True:
+                    try:
+                        item = self._refresh_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        batch.append(item)
+            if batch:
+                self._refresh_batch(batch)
+
+    def _refresh_batch(self, batch: List[Tuple[SeriesKey, str]]) -> None:
+        by_from: Dict[str, List[SeriesKey]] = {}
+        for key, from_date in batch:
+            by_from.setdefault(from_date, []).append(key)
+        for from_date, keys in by_from.items():
+            for chunk in self._chunks(keys, None):
+                try:
+                    results = self._fetch_batch(chunk, from_date=from_date)
+                except Exception as exc:  # pragma: no cover - defensive
+                    logger.error(f"Refresh Amboss falhou: {exc}")
+                    results = {}
+                ok = sum(1 for key in chunk if results.get(key) is not None)
+                logger.debug(f"Refresh Amboss: {ok}/{len(chunk)} série(s) atualizadas")
+        with self._refresh_lock:
+            for key, _from_date in batch:
+                self._refresh_pending.discard(key)
+
+    def _headers(self) -> dict:
+        return {
+            "content-type": "application/json",
+            "Authorization": f"Bearer {self._token}",
+        }
+
+    def _post(self, payload: dict) -> requests.Response:
+        return self._session.post(self._url, json=payload, timeout=30)
+
+    def close(self) -> None:
+        self._session.close()
 
     def historical_series(
         self,
@@ -60,17 +186,164 @@ class AmbossService:
         *,
         from_date: str,
         ttl: int,
-    ) -> Optional[list]:
-        cached = self._cached_series(pubkey, metric, submetric, ttl)
+        with_stats: bool = False,
+    ) -> Any:
+        """Série (lista de floats); com ``with_stats`` devolve (valores, stats) da mesma leitura."""
+        cached = self._cached_series(pubkey, metric, submetric, ttl, from_date)
         if cached is not None:
             logger.debug(f"Cache hit para {metric}/{submetric} pubkey={pubkey[:16]}...")
-            return cached
+            return self._with_stats(cached["data"], cached["stats"]) if with_stats else cached["data"]
+        series = self._fetch_series(pubkey, metric, submetric, from_date=from_date)
+        return self._with_stats(series) if with_stats else series
+
+    def historical_series_batch(
+        self,
+        items: Iterable[SeriesKey],
+        *,
+        from_date: str,
+        ttl: int,
+        batch_size: Optional[int] = None,
+        with_stats: bool = False,
+    ) -> Dict[SeriesKey, Any]:
+        """Várias séries (pubkey, metric, submetric) em poucos POSTs.
+
+        Hits do cache são lidos direto; os misses vão em queries com aliases, até
+        ``batch_size`` séries por POST. Falhas viram ``None``. ``with_stats`` como
+        em historical_series.
+        """
+        results, misses = self._split_cached(items, ttl, from_date, with_stats)
+        for chunk in self._chunks(misses, batch_size):
+            fetched = self._fetch_batch(chunk, from_date=from_date)
+            results.update({key: self._with_stats(val) for key, val in fetched.items()} if with_stats else fetched)
+        return results
+
+    def prefetch_series(
+        self,
+        items: Iterable[SeriesKey],
+        *,
+        from_date: str,
+        ttl: int,
+        max_workers: int = DEFAULT_PREFETCH_WORKERS,
+        batch_size: Optional[int] = None,
+        with_stats: bool = False,
+    ) -> Dict[SeriesKey, Any]:
+        """Como historical_series_batch, com até ``max_workers`` POSTs em paralelo."""
+        results, misses = self._split_cached(items, ttl, from_date, with_stats)
+        if not misses:
+            return results
+
+        chunks = self._chunks(misses, batch_size)
+        workers = max(1, min(int(max_workers or 1), len(chunks)))
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="amboss") as pool:
+            for partial in pool.map(lambda chunk: self._fetch_batch(chunk, from_date=from_date), chunks):
+                results.update({key: self._with_stats(val) for key, val in partial.items()} if with_stats else partial)
+        failed = sum(1 for key in misses if results.get(key) is None)
+        logger.info(
+            f"Prefetch Amboss: {len(misses)} série(s) buscadas em {len(chunks)} POST(s), "
+            f"{len(results) - len(misses)} em cache, {failed} falha(s) em {time.monotonic() - started:.1f}s"
+        )
+        return results
+
+    def _split_cached(
+        self, items: Iterable[SeriesKey], ttl: int, from_date: str, with_stats: bool = False
+    ) -> Tuple[Dict[SeriesKey, Any], List[SeriesKey]]:
+        results: Dict[SeriesKey, Any] = {}
+        misses: List[SeriesKey] = []
+        for key in dict.fromkeys(items):
+            cached = self._cached_series(*key, ttl, from_date)
+            if cached is not None:
+                results[key] = self._with_stats(cached["data"], cached["stats"]) if with_stats else cached["data"]
+            else:
+                misses.append(key)
+        return results, misses
+
+    def _chunks(self, keys: List[SeriesKey], batch_size: Optional[int]) -> List[List[SeriesKey]]:
+        size = max(1, int(batch_size or self._batch_size))
+        return [keys[i:i + size] for i in range(0, len(keys), size)]
+
+    @staticmethod
+    def _batch_payload(keys: List[SeriesKey], from_date: str) -> Tuple[dict, Dict[SeriesKey, Tuple[str, str]]]:
+        """Monta a query com um alias n<i> por pubkey e h<k> por série."""
+        by_pubkey: Dict[str, List[int]] = {}
+        for k, (pubkey, _metric, _submetric) in enumerate(keys):
+            by_pubkey.setdefault(pubkey, []).append(k)
+        decls = ["$from: String!"]
+        nodes = []
+        variables: Dict[str, Any] = {"from": from_date}
+        paths: Dict[SeriesKey, Tuple[str, str]] = {}
+        for i, (pubkey, idxs) in enumerate(by_pubkey.items()):
+            decls.append(f"$p{i}: String!")
+            variables[f"p{i}"] = pubkey
+            fields = []
+            for k in idxs:
+                _pubkey, metric, submetric = keys[k]
+                decls.append(f"$m{k}: NodeMetricsKeys!")
+                decls.append(f"$s{k}: ChannelMetricsKeys")
+                variables[f"m{k}"] = metric
+                variables[f"s{k}"] = submetric
+                fields.append(f"h{k}: historical_series(from: $from, metric: $m{k}, submetric: $s{k})")
+                paths[keys[k]] = (f"n{i}", f"h{k}")
+            nodes.append(f"n{i}: getNodeMetrics(pubkey: $p{i}) {{ {' '.join(fields)} }}")
+        query = f"query GetNodeMetricsBatch({', '.join(decls)}) {{ {' '.join(nodes)} }}"
+        return {"query": query, "variables": variables}, paths
+
+    def _fetch_batch(self, keys: List[SeriesKey], *, from_date: str) -> Dict[SeriesKey, Optional[list]]:
+        """Um POST para o lote; erros parciais são repetidos em lotes menores (metade).
 
+        Falha do request inteiro (conexão, status HTTP, corpo inválido ou sem ``data``)
+        não divide o lote: com a Amboss fora do ar, dividir só multiplicaria os POSTs.
+        """
+        results: Dict[SeriesKey, Optional[list]] = {key: None for key in keys}
+        payload, paths = self._batch_payload(keys, from_date)
+        try:
+            resp = self._post(payload)
+            resp.raise_for_status()
+            body = resp.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Lote Amboss com {len(keys)} série(s) falhou: {e}")
+            return results
+
+        data = body.get("data") if isinstance(body, dict) else None
+        if not isinstance(data, dict):
+            errors = body.get("errors") if isinstance(body, dict) else None
+            logger.warning(f"Lote Amboss com {len(keys)} série(s) sem dados: {str(errors)[:200]}")
+            return results
+        errored = set()
+        for err in body.get("errors") or []:
+            path = err.get("path") if isinstance(err, dict) else None
+            if path:
+                errored.add(tuple(path[:2]))
+
+        failed: List[SeriesKey] = []
+        for key in keys:
+            node_alias, field_alias = paths[key]
+            node = data.get(node_alias)
+            # erro no campo ou no nó inteiro (nó nulo)
+            if (node_alias, field_alias) in errored or not isinstance(node, dict) or field_alias not in node:
+                failed.append(key)
+                continue
+            series = node.get(field_alias) or []
+            cleaned = [float(entry[1]) for entry in series if isinstance(entry, list) and len(entry) == 2]
+            self._storage.set_amboss_series(*key, cleaned)
+            results[key] = cleaned
+
+        # só divide erro parcial: parte do lote voltou ou os erros apontam o alias
+        partial = len(failed) < len(keys) or bool(errored)
+        if failed and len(keys) > 1 and partial:
+            mid = max(1, len(failed) // 2)
+            for part in (failed[:mid], failed[mid:]):
+                if part:
+                    results.update(self._fetch_batch(part, from_date=from_date))
+        elif failed:
+            logger.debug(f"Série Amboss indisponível: {failed[0][1]}/{failed[0][2]} pubkey={failed[0][0][:16]}... "
+                         f"({len(failed)} no lote)")
+        if len(keys) > 1:
+            logger.debug(f"Lote Amboss: {len(keys) - len(failed)}/{len(keys)} série(s) no primeiro POST")
+        return results
+
+    def _fetch_series(self, pubkey: str, metric: str, submetric: str, *, from_date: str) -> list:
         logger.debug(f"Buscando métricas Amboss: {metric}/{submetric} pubkey={pubkey[:16]}...")
-        headers = {
-            "content-type": "application/json",
-            "Authorization": f"Bearer {self._token}",
-        }
         payload = {
             "query": """
             query GetNodeMetrics($from: String!, $metric: NodeMetricsKeys!, $pubkey: String!, $submetric: ChannelMetricsKeys) {
@@ -87,7 +360,7 @@ class AmbossService:
             },
         }
         try:
-            resp = requests.post(self._url, headers=headers, json=payload, timeout=30)
+            resp = self._post(payload)
             resp.raise_for_status()
             data = resp.json()
             series = data["data"]["getNodeMetrics"]["historical_series"] or []
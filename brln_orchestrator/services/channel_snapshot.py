@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from logging_config import get_logger
+
+logger = get_logger("services.channel_snapshot")
+
+from .lnd_rest import LndRestService
+from .lncli import LncliService
+
+DEFAULT_TTL_SEC = 30
+
+
+class ChannelSnapshotProvider:
+    """Snapshot de listchannels compartilhado dentro de um ciclo.
+
+    Usa a sessão do LndRestService (/v1/channels) quando a REST está configurada
+    e o lncli como fallback. O payload e os índices (scid, chan_id, chan_point)
+    ficam em cache por ``ttl`` segundos.
+    """
+
+    def __init__(self, lncli: LncliService, lnd_rest: Optional[LndRestService] = None, *, ttl: int = DEFAULT_TTL_SEC) -> None:
+        self._lncli = lncli
+        self._lnd_rest = lnd_rest
+        self._ttl = int(ttl)
+        self._lock = threading.Lock()
+        self._payload: Optional[Dict[str, Any]] = None
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+        self._fetched_at = 0.0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._payload = None
+            self._index = None
+        if self._lnd_rest is not None:
+            self._lnd_rest.invalidate_channels()
+
+    def _fresh(self) -> bool:
+        return self._payload is not None and time.monotonic() - self._fetched_at < self._ttl
+
+    def _fetch(self) -> Dict[str, Any]:
+        if self._lnd_rest is not None:
+            try:
+                return {"channels": self._lnd_rest.list_channels()}
+            except Exception as exc:
+                logger.warning(f"listchannels via REST falhou, usando lncli: {exc}")
+        data = self._lncli.listchannels()
+        if not isinstance(data, dict):
+            raise RuntimeError("lncli listchannels returned invalid payload")
+        return data
+
+    def listchannels(self) -> Dict[str, Any]:
+        """Payload no formato do ``lncli listchannels`` ({"channels": [...]})."""
+        with self._lock:
+            if not self._fresh():
+                self._payload = self._fetch()
+                self._index = None
+                self._fetched_at = time.monotonic()
+            return self._payload  # type: ignore[return-value]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Mesmo formato de listchannels_snapshot() do legado."""
+        data = self.listchannels()
+        with self._lock:
+            if self._index is not None and self._payload is data:
+                return self._index
+            by_scid_dec: Dict[str, Any] = {}
+            by_cid_dec: Dict[str, Any] = {}
+            by_point: Dict[str, Any] = {}
+            for ch in data.get("channels", []):
+                scid = ch.get("scid")
+                cid = ch.get("chan_id")
+                point = ch.get("channel_point")
+                info = {
+                    "capacity": int(ch.get("capacity", 0)),
+                    "local_balance": int(ch.get("local_balance", 0)),
+                    "remote_balance": int(ch.get("remote_balance", 0)),
+                    "remote_pubkey": ch.get("remote_pubkey"),
+                    "chan_point": point,
+                    "active": bool(ch.get("active", False)),
+                    "initiator": ch.get("initiator"),
+                }
+                if scid is not None and str(scid).isdigit():
+                    by_scid_dec[str(scid)] = info
+                if cid is not None and str(cid).isdigit():
+                    by_cid_dec[str(cid)] = info
+                if point:
+                    by_point[point] = info
+            self._index = {"by_scid_dec": by_scid_dec, "by_cid_dec": by_cid_dec, "by_point": by_point}
+            return self._index
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from logging_config import get_logger
+
+logger = get_logger("services.http")
+
+# Retry/backoff compartilhado entre os serviços HTTP (erros de conexão sempre
+# são repetidos; status 5xx/429 só nos métodos de ``retry_methods``).
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+DEFAULT_POOL_MAXSIZE = 4
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter que conta requisições e conexões novas (handshakes TCP/TLS).
+
+    A diferença entre as duas é o número de handshakes evitados pelo keep-alive.
+    """
+
+    def __init__(self, name: str, **kwargs: Any) -> None:
+        self.name = name
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._pools: Dict[int, Any] = {}
+        super().__init__(**kwargs)
+
+    def _track(self, pool: Any) -> Any:
+        with self._stats_lock:
+            self._pools.setdefault(id(pool), pool)
+        return pool
+
+    def get_connection_with_tls_context(self, *args: Any, **kwargs: Any):  # requests >= 2.32
+        return self._track(super().get_connection_with_tls_context(*args, **kwargs))
+
+    def get_connection(self, *args: Any, **kwargs: Any):  # requests < 2.32
+        return self._track(super().get_connection(*args, **kwargs))
+
+    def send(self, request, *args: Any, **kwargs: Any):
+        with self._stats_lock:
+            self._requests += 1
+        return super().send(request, *args, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            connections = sum(int(getattr(pool, "num_connections", 0) or 0) for pool in self._pools.values())
+            return {"requests": self._requests, "connections": connections}
+
+
+_adapters: Dict[str, CountingHTTPAdapter] = {}
+_adapters_lock = threading.Lock()
+_last_snapshot: Dict[str, Dict[str, int]] = {}
+
+
+def build_session(
+    name: str,
+    *,
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+    pool_block: bool = False,
+    retry_methods: Iterable[str] = ("GET", "PUT", "PATCH"),
+    headers: Optional[Dict[str, str]] = None,
+) -> requests.Session:
+    """Sessão ``requests`` de longa duração com keep-alive, pool e retry compartilhado."""
+    session = requests.Session()
+    session.headers.update({"Connection": "keep-alive"})
+    if headers:
+        session.headers.update(headers)
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=list(RETRY_STATUS),
+        allowed_methods=frozenset(m.upper() for m in retry_methods),
+        raise_on_status=False,
+    )
+    adapter = CountingHTTPAdapter(
+        name,
+        max_retries=retry,
+        pool_connections=1,
+        pool_maxsize=max(1, int(pool_maxsize)),
+        pool_block=pool_block,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    with _adapters_lock:
+        # sessão recriada com o mesmo nome: o adapter novo começa do zero
+        _adapters[name] = adapter
+        _last_snapshot.pop(name, None)
+    return session
+
+
+def connection_stats() -> Dict[str, Dict[str, int]]:
+    """Totais acumulados por sessão: requisições, conexões novas e handshakes evitados."""
+    with _adapters_lock:
+        adapters = dict(_adapters)
+    result: Dict[str, Dict[str, int]] = {}
+    for name, adapter in adapters.items():
+        stats = adapter.stats()
+        stats["reused"] = max(0, stats["requests"] - stats["connections"])
+        result[name] = stats
+    return result
+
+
+def cycle_stats() -> Dict[str, Dict[str, int]]:
+    """Deltas desde a última chamada (um ciclo do orquestrador)."""
+    current = connection_stats()
+    deltas: Dict[str, Dict[str, int]] = {}
+    with _adapters_lock:
+        for name, stats in current.items():
+            prev = _last_snapshot.get(name, {})
+            delta = {key: stats[key] - int(prev.get(key, 0)) for key in stats}
+            if delta["requests"]:
+                deltas[name] = delta
+            _last_snapshot[name] = stats
+    return deltas
+
+
+def log_cycle_stats() -> Optional[str]:
+    deltas = cycle_stats()
+    if not deltas:
+        return None
+    parts = [
+        f"{name}={d['requests']} req/{d['connections']} conn"
+        for name, d in sorted(deltas.items())
+    ]
+    reused = sum(d["reused"] for d in deltas.values())
+    line = f"HTTP keep-alive: {reused} handshake(s) evitados no ciclo ({', '.join(parts)})"
+    logger.info(line)
+    return line
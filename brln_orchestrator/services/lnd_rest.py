@@ -4,17 +4,19 @@ import codecs
 import json
 import ssl
 import sys
+import threading
+import time
 from pathlib import Path
 from typing import Optional, Dict, Any, List
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 from logging_config import get_logger
 
 logger = get_logger("services.lnd_rest")
 
+from .http import build_session
+
 
 class LndRestService:
     def __init__(
@@ -22,6 +24,8 @@ class LndRestService:
         rest_host: str = "localhost:8080",
         macaroon_path: Optional[str] = None,
         tls_cert_path: Optional[str] = None,
+        max_parallel: int = 8,
+        channels_ttl: float = 30.0,
     ) -> None:
         self.rest_host = rest_host.replace("http://", "").replace("https://", "")
         self.base_url = f"https://{self.rest_host}"
@@ -35,12 +39,20 @@ class LndRestService:
         )
 
         self.macaroon_hex = self._load_macaroon()
+        # updates de política em paralelo (AutoFee) compartilham o mesmo pool
+        self.max_parallel = max(1, int(max_parallel or 1))
 
         self.session = self._create_session()
         logger.info(f"LND REST Service inicializado: {self.base_url}")
 
         self._chan_point_cache: Dict[str, List[str]] = {}
         self._channels_loaded = False
+        self._channels_lock = threading.Lock()
+        # /v1/channels em cache curto: AutoFee, snapshot e apply dividem um fetch por ciclo
+        self.channels_ttl = float(channels_ttl)
+        self._channels_raw: Optional[List[Dict[str, Any]]] = None
+        self._channels_raw_at = 0.0
+        self._channels_raw_lock = threading.Lock()
 
     def _load_macaroon(self) -> str:
         if not self.macaroon_path.exists():
@@ -52,58 +64,46 @@ class LndRestService:
         return codecs.encode(macaroon_bytes, "hex").decode("ascii")
 
     def _create_session(self) -> requests.Session:
-        session = requests.Session()
-
-        session.headers.update({
-            "Grpc-Metadata-macaroon": self.macaroon_hex,
-            "Content-Type": "application/json",
-            "Connection": "keep-alive",
-        })
-
-        session.verify = str(self.tls_cert_path)
-
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=0.5,
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods=["GET", "POST"],
-        )
-        adapter = HTTPAdapter(
-            max_retries=retry_strategy,
-            pool_connections=1,
-            pool_maxsize=1,
+        session = build_session(
+            "lnd_rest",
+            pool_maxsize=self.max_parallel,
             pool_block=True,
+            retry_methods=("GET", "POST"),
+            headers={
+                "Grpc-Metadata-macaroon": self.macaroon_hex,
+                "Content-Type": "application/json",
+            },
         )
-        session.mount("https://", adapter)
-
+        session.verify = str(self.tls_cert_path)
         return session
 
     def _load_channels(self) -> None:
+        with self._channels_lock:
+            self._load_channels_locked()
+
+    def _load_channels_locked(self) -> None:
         if self._channels_loaded:
             return
 
-        url = f"{self.base_url}/v1/channels"
         logger.debug("Carregando lista de canais")
         try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-
-            channel_count = 0
-            for channel in data.get("channels", []):
-                pubkey = channel.get("remote_pubkey")
-                chan_point = channel.get("channel_point")
-                if pubkey and chan_point:
-                    bucket = self._chan_point_cache.setdefault(pubkey, [])
-                    if chan_point not in bucket:
-                        bucket.append(chan_point)
-                        channel_count += 1
-
-            self._channels_loaded = True
-            logger.info(f"Canais carregados: {channel_count} canais ({len(self._chan_point_cache)} peers)")
-        except requests.exceptions.RequestException as exc:
-            logger.error(f"Erro ao listar canais: {exc}")
-            raise RuntimeError(f"Erro ao listar canais: {exc}") from exc
+            channels = self.list_channels()
+        except RuntimeError as exc:
+            logger.error(str(exc))
+            raise
+
+        channel_count = 0
+        for channel in channels:
+            pubkey = channel.get("remote_pubkey")
+            chan_point = channel.get("channel_point")
+            if pubkey and chan_point:
+                bucket = self._chan_point_cache.setdefault(pubkey, [])
+                if chan_point not in bucket:
+                    bucket.append(chan_point)
+                    channel_count += 1
+
+        self._channels_loaded = True
+        logger.info(f"Canais carregados: {channel_count} canais ({len(self._chan_point_cache)} peers)")
 
     def _get_chan_points_for_pubkey(self, pubkey: str) -> List[str]:
         if not self._channels_loaded:
@@ -114,10 +114,16 @@ class LndRestService:
         points = self._get_chan_points_for_pubkey(pubkey)
         return points[0] if points else None
 
+    def invalidate_channels(self) -> None:
+        with self._channels_raw_lock:
+            self._channels_raw = None
+
     def refresh_channels(self) -> None:
-        self._channels_loaded = False
-        self._chan_point_cache.clear()
-        self._load_channels()
+        self.invalidate_channels()
+        with self._channels_lock:
+            self._channels_loaded = False
+            self._chan_point_cache.clear()
+            self._load_channels_locked()
 
     def _build_policy_payload(
         self,
@@ -235,15 +241,21 @@ class LndRestService:
         except requests.exceptions.RequestException as exc:
             raise RuntimeError(f"Erro ao obter info: {exc}") from exc
 
-    def list_channels(self) -> List[Dict[str, Any]]:
-        url = f"{self.base_url}/v1/channels"
-        try:
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("channels", [])
-        except requests.exceptions.RequestException as exc:
-            raise RuntimeError(f"Erro ao listar canais: {exc}") from exc
+    def list_channels(self, *, max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+        ttl = self.channels_ttl if max_age is None else float(max_age)
+        with self._channels_raw_lock:
+            if self._channels_raw is not None and time.monotonic() - self._channels_raw_at < ttl:
+                return self._channels_raw
+            url = f"{self.base_url}/v1/channels"
+            try:
+                response = self.session.get(url, timeout=30)
+                response.raise_for_status()
+                data = response.json()
+            except requests.exceptions.RequestException as exc:
+                raise RuntimeError(f"Erro ao listar canais: {exc}") from exc
+            self._channels_raw = data.get("channels", [])
+            self._channels_raw_at = time.monotonic()
+            return self._channels_raw
 
     def close(self) -> None:
         if self.session:
@@ -1,30 +1,278 @@
 from __future__ import annotations
 
 import sqlite3
+import threading
+import time
+from collections import defaultdict
 from pathlib import Path
-from typing import Any, Iterable, Optional, Sequence
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+# Agregações empurradas para o SQLite: uma linha por canal (ou canal x bucket)
+# em vez de materializar todos os forwards/pagamentos da janela no Python.
+# As conversões replicam o legado linha a linha: int(fee), int(amt_msat/1000).
+_OUT_AMT_SAT = "CAST(COALESCE(amt_out_msat, 0) / 1000.0 AS INTEGER)"
+_IN_AMT_SAT = "CAST(COALESCE(amt_in_msat, 0) / 1000.0 AS INTEGER)"
+_FEE_SAT = "CAST(COALESCE(fee, 0) AS INTEGER)"
+_VALUE_SAT = "CAST(COALESCE(value, 0) AS INTEGER)"
+
+
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_KIB = 32 * 1024
+SCHEMA_CACHE_TTL = 3600
 
 
 class LNDgDatabase:
-    def __init__(self, path: str) -> None:
+    """Acesso somente-leitura ao db.sqlite3 do LNDg.
+
+    As conexões são abertas uma vez por thread em modo ``mode=ro`` (URI) com
+    ``query_only``/``mmap_size``/``cache_size`` e reaproveitadas entre ciclos;
+    use ``LNDgDatabase.shared(path)`` para compartilhar o pool no processo.
+    Probes de schema (table_exists/columns) ficam em cache.
+    """
+
+    _shared: Dict[str, "LNDgDatabase"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str, *, mmap_size: int = DEFAULT_MMAP_SIZE, cache_size_kib: int = DEFAULT_CACHE_KIB) -> None:
         self._path = Path(path)
+        self._mmap_size = int(mmap_size)
+        self._cache_size_kib = int(cache_size_kib)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: List[sqlite3.Connection] = []
+        self._schema_cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
 
-    def connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self._path)
+    @classmethod
+    def shared(cls, path: str) -> "LNDgDatabase":
+        key = str(Path(path).expanduser().resolve())
+        with cls._shared_lock:
+            db = cls._shared.get(key)
+            if db is None:
+                db = cls(path)
+                cls._shared[key] = db
+            return db
+
+    @classmethod
+    def close_all(cls) -> None:
+        with cls._shared_lock:
+            dbs = list(cls._shared.values())
+            cls._shared.clear()
+        for db in dbs:
+            db.close()
+
+    def _open(self) -> sqlite3.Connection:
+        # mode=ro não cria o arquivo nem disputa locks de escrita com o LNDg;
+        # autocommit evita transações de leitura abertas entre consultas
+        uri = f"file:{quote(str(self._path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, isolation_level=None)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {self._mmap_size}")
+        conn.execute(f"PRAGMA cache_size = -{self._cache_size_kib}")
+        return conn
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
         return conn
 
+    def close(self) -> None:
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._schema_cache.clear()
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def _schema_probe(self, kind: str, name: str, probe) -> Any:
+        key = (kind, name)
+        now = time.monotonic()
+        with self._lock:
+            hit = self._schema_cache.get(key)
+            if hit is not None and now - hit[0] < SCHEMA_CACHE_TTL:
+                return hit[1]
+        value = probe()
+        with self._lock:
+            self._schema_cache[key] = (now, value)
+        return value
+
     def table_exists(self, name: str) -> bool:
-        with self.connect() as conn:
-            row = conn.execute(
+        def probe() -> bool:
+            row = self.connect().execute(
                 "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
                 (name,),
             ).fetchone()
             return row is not None
 
+        return self._schema_probe("table", name, probe)
+
+    def columns(self, table: str) -> frozenset:
+        return self._schema_probe(
+            "columns",
+            table,
+            lambda: frozenset(row[1] for row in self.connect().execute(f"PRAGMA table_info({table})").fetchall()),
+        )
+
     def query(self, sql: str, params: Sequence[Any] = ()) -> Iterable[sqlite3.Row]:
-        with self.connect() as conn:
-            cur = conn.execute(sql, params)
-            rows = cur.fetchall()
+        return self.connect().execute(sql, params).fetchall()
+
+    # --- Tabelas (gui_* no LNDg atual, sem prefixo em versões antigas) -----
+
+    def forwards_table(self) -> str:
+        if not self.table_exists("gui_forwards") and self.table_exists("forwards"):
+            return "forwards"
+        return "gui_forwards"
+
+    def payments_table(self) -> str:
+        if not self.table_exists("gui_payments") and self.table_exists("payments"):
+            return "payments"
+        return "gui_payments"
+
+    def _fetch(self, sql: str, params: Sequence[Any]) -> List[sqlite3.Row]:
+        return self.connect().execute(sql, params).fetchall()
+
+    # --- Agregações ------------------------------------------------------
+
+    def forward_out_totals(self, start: str, end: str, *, table: Optional[str] = None) -> Dict[str, int]:
+        table = table or self.forwards_table()
+        rows = self._fetch(
+            f"SELECT SUM({_OUT_AMT_SAT}), SUM({_FEE_SAT}) FROM {table} WHERE forward_date BETWEEN ? AND ?",
+            (start, end),
+        )
+        amt_sat, fee_sat = rows[0] if rows else (0, 0)
+        return {"out_amt_sat": int(amt_sat or 0), "out_fee_sat": int(fee_sat or 0)}
+
+    def rebal_sums(self, start: str, end: str, *, table: Optional[str] = None) -> List[sqlite3.Row]:
+        """value/fee/count de rebalanceamentos por rebal_chan (chave crua) na janela."""
+        table = table or self.payments_table()
+        return self._fetch(
+            f"SELECT rebal_chan, SUM({_VALUE_SAT}) AS value_sat, SUM({_FEE_SAT}) AS fee_sat, COUNT(*) AS count "
+            f"FROM {table} WHERE rebal_chan IS NOT NULL AND chan_out IS NOT NULL "
+            "AND creation_date BETWEEN ? AND ? GROUP BY rebal_chan",
+            (start, end),
+        )
+
+    # --- Buckets para rollups incrementais -------------------------------
+
+    def max_rowid(self, table: str) -> int:
+        rows = self._fetch(f"SELECT MAX(rowid) FROM {table}", ())
+        return int(rows[0][0] or 0) if rows else 0
+
+    def forward_buckets(self, table: str, after_rowid: int, upto_rowid: int, since: str, bucket_sec: int) -> List[sqlite3.Row]:
+        """Forwards com rowid em (after, upto] somados por (bucket, canal, direção)."""
+        bucket = f"CAST(strftime('%s', forward_date) AS INTEGER) / {int(bucket_sec)} * {int(bucket_sec)}"
+        window = "rowid > ? AND rowid <= ? AND forward_date >= ? AND strftime('%s', forward_date) IS NOT NULL"
+        return self._fetch(
+            f"SELECT {bucket} AS bucket_ts, chan_id_out AS chan_id, 'out' AS direction, "
+            f"SUM({_OUT_AMT_SAT}) AS amt_sat, SUM(COALESCE(amt_out_msat, 0)) AS amt_msat, "
+            f"SUM({_FEE_SAT}) AS fee_sat, COUNT(*) AS count "
+            f"FROM {table} WHERE {window} AND chan_id_out IS NOT NULL AND chan_id_out <> '' "
+            "GROUP BY bucket_ts, chan_id_out "
+            "UNION ALL "
+            f"SELECT {bucket} AS bucket_ts, chan_id_in AS chan_id, 'in' AS direction, "
+            f"SUM({_IN_AMT_SAT}) AS amt_sat, SUM(COALESCE(amt_in_msat, 0)) AS amt_msat, "
+            "0 AS fee_sat, COUNT(*) AS count "
+            f"FROM {table} WHERE {window} AND chan_id_in IS NOT NULL AND chan_id_in <> '' "
+            "GROUP BY bucket_ts, chan_id_in",
+            (after_rowid, upto_rowid, since, after_rowid, upto_rowid, since),
+        )
+
+    def rebal_buckets(self, table: str, after_rowid: int, upto_rowid: int, since: str, bucket_sec: int) -> List[sqlite3.Row]:
+        """Rebalanceamentos com rowid em (after, upto] somados por (bucket, rebal_chan), sem os em voo."""
+        bucket = f"CAST(strftime('%s', creation_date) AS INTEGER) / {int(bucket_sec)} * {int(bucket_sec)}"
+        settled = "AND COALESCE(status, 0) <> 1 " if "status" in self.columns(table) else ""
+        return self._fetch(
+            f"SELECT {bucket} AS bucket_ts, rebal_chan, SUM({_VALUE_SAT}) AS value_sat, "
+            f"SUM({_FEE_SAT}) AS fee_sat, COUNT(*) AS count "
+            f"FROM {table} WHERE rowid > ? AND rowid <= ? AND creation_date >= ? "
+            "AND strftime('%s', creation_date) IS NOT NULL "
+            f"AND rebal_chan IS NOT NULL AND chan_out IS NOT NULL {settled}"
+            "GROUP BY bucket_ts, rebal_chan",
+            (after_rowid, upto_rowid, since),
+        )
+
+    def inflight_rebal_rows(self, table: str, after_rowid: int, upto_rowid: int, since: str, bucket_sec: int) -> List[sqlite3.Row]:
+        """Rebalanceamentos em voo (status=1) com rowid em (after, upto], uma linha por pagamento."""
+        if "status" not in self.columns(table):
+            return []
+        bucket = f"CAST(strftime('%s', creation_date) AS INTEGER) / {int(bucket_sec)} * {int(bucket_sec)}"
+        return self._fetch(
+            f"SELECT rowid AS rowid, status, {bucket} AS bucket_ts, rebal_chan, {_VALUE_SAT} AS value_sat, "
+            f"{_FEE_SAT} AS fee_sat FROM {table} WHERE rowid > ? AND rowid <= ? AND status = 1 "
+            "AND creation_date >= ? AND strftime('%s', creation_date) IS NOT NULL "
+            "AND rebal_chan IS NOT NULL AND chan_out IS NOT NULL",
+            (after_rowid, upto_rowid, since),
+        )
+
+    def rebal_rows(self, table: str, rowids: Sequence[int], bucket_sec: int) -> List[sqlite3.Row]:
+        """Estado atual (status, bucket, value/fee) dos rebalanceamentos em ``rowids``."""
+        bucket = f"CAST(strftime('%s', creation_date) AS INTEGER) / {int(bucket_sec)} * {int(bucket_sec)}"
+        status = "status" if "status" in self.columns(table) else "2"
+        rows: List[sqlite3.Row] = []
+        ids = list(rowids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows.extend(self._fetch(
+                f"SELECT rowid AS rowid, {status} AS status, {bucket} AS bucket_ts, rebal_chan, "
+                f"{_VALUE_SAT} AS value_sat, {_FEE_SAT} AS fee_sat FROM {table} "
+                f"WHERE rowid IN ({','.join('?' * len(chunk))})",
+                tuple(chunk),
+            ))
         return rows
 
+    # --- Leitura em ordem cronológica (replay) ----------------------------
+
+    def forwards_between(self, start: str, end: str, *, table: Optional[str] = None) -> sqlite3.Cursor:
+        """Cursor dos forwards em [start, end] ordenados por forward_date (conversões do legado por linha)."""
+        table = table or self.forwards_table()
+        return self.connect().execute(
+            f"SELECT forward_date, chan_id_in, chan_id_out, {_IN_AMT_SAT}, {_OUT_AMT_SAT}, "
+            f"COALESCE(amt_in_msat, 0), COALESCE(amt_out_msat, 0), {_FEE_SAT}, COALESCE(fee, 0) "
+            f"FROM {table} WHERE forward_date BETWEEN ? AND ? ORDER BY forward_date",
+            (start, end),
+        )
+
+    def rebalances_between(self, start: str, end: str, *, table: Optional[str] = None) -> sqlite3.Cursor:
+        """Cursor dos pagamentos de rebal em [start, end] ordenados por creation_date."""
+        table = table or self.payments_table()
+        status = "status" if "status" in self.columns(table) else "2"
+        return self.connect().execute(
+            f"SELECT creation_date, rebal_chan, chan_out, {_VALUE_SAT}, {_FEE_SAT}, "
+            f"COALESCE(value, 0), COALESCE(fee, 0), {status} "
+            f"FROM {table} WHERE rebal_chan IS NOT NULL AND chan_out IS NOT NULL "
+            "AND creation_date BETWEEN ? AND ? ORDER BY creation_date",
+            (start, end),
+        )
+
+    def local_flows_since(self, since: str) -> Dict[str, int]:
+        """Variação do saldo local (msat) por canal depois de ``since``: forwards e rebals liquidados."""
+        flows: Dict[str, int] = defaultdict(int)
+        fwd = self.forwards_table()
+        for cid, msat in self._fetch(
+            f"SELECT chan_id_out, SUM(COALESCE(amt_out_msat, 0)) FROM {fwd} WHERE forward_date > ? GROUP BY chan_id_out",
+            (since,),
+        ):
+            flows[str(cid)] -= int(msat or 0)
+        for cid, msat in self._fetch(
+            f"SELECT chan_id_in, SUM(COALESCE(amt_in_msat, 0)) FROM {fwd} WHERE forward_date > ? GROUP BY chan_id_in",
+            (since,),
+        ):
+            flows[str(cid)] += int(msat or 0)
+        pay = self.payments_table()
+        settled = "AND status = 2 " if "status" in self.columns(pay) else ""
+        where = f"WHERE rebal_chan IS NOT NULL AND chan_out IS NOT NULL AND creation_date > ? {settled}"
+        for cid, sat in self._fetch(f"SELECT rebal_chan, SUM(COALESCE(value, 0)) FROM {pay} {where}GROUP BY rebal_chan", (since,)):
+            flows[str(cid)] += int(round(float(sat or 0) * 1000))
+        for cid, sat in self._fetch(
+            f"SELECT chan_out, SUM(COALESCE(value, 0) + COALESCE(fee, 0)) FROM {pay} {where}GROUP BY chan_out", (since,)
+        ):
+            flows[str(cid)] -= int(round(float(sat or 0) * 1000))
+        return flows
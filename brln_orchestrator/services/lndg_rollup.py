@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import datetime
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from logging_config import get_logger
+
+logger = get_logger("services.lndg_rollup")
+
+from ..storage import Storage
+from .lndg_db import LNDgDatabase
+
+BUCKET_SEC = 3600
+DEFAULT_RETENTION_DAYS = 7
+
+
+def _epoch(dt: datetime.datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp())
+
+
+def _bucket(ts: int) -> int:
+    return ts - ts % BUCKET_SEC
+
+
+def _sqlite_str(ts: int) -> str:
+    dt = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(sep=" ", timespec="seconds")
+
+
+class LNDgRollupService:
+    """Rollups incrementais (canal x hora) sobre o banco do LNDg.
+
+    Cada sync lê apenas as linhas com rowid acima do high-water mark salvo no
+    Storage, soma nos buckets horários e descarta os buckets fora da retenção.
+    As bordas das janelas (7d/1d) têm granularidade de 1 hora. O mesmo rollup
+    é compartilhado por AutoFee, AR Trigger e Param Tuner.
+    """
+
+    def __init__(self, storage: Storage, db_path: str, *, retention_days: int = DEFAULT_RETENTION_DAYS) -> None:
+        self._storage = storage
+        self._db_path = str(db_path)
+        self._db = LNDgDatabase.shared(db_path)
+        self._retention_sec = int(retention_days) * 86400
+        self._lock = threading.Lock()
+        # pagamentos de rebal em voo no último sync: (bucket_ts, rebal_chan, value_sat, fee_sat)
+        self._inflight: List[Tuple[int, str, int, int]] = []
+
+    def _prepare(self, name: str, table: str, since_ts: int, max_rowid: int, reset) -> Tuple[str, int, int]:
+        """Resolve (source, last_rowid, coverage_start), reconstruindo o rollup se preciso."""
+        now = int(time.time())
+        # janelas maiores que a retenção atual passam a valer como retenção
+        self._retention_sec = max(self._retention_sec, now - int(since_ts))
+        coverage = _bucket(min(int(since_ts), now - self._retention_sec))
+        source = f"{self._db_path}:{table}"
+        cursor = self._storage.get_rollup_cursor(name)
+        if (
+            cursor is None
+            or cursor["source"] != source
+            or int(cursor["last_rowid"] or 0) > max_rowid
+            or int(cursor["since_ts"] or 0) > _bucket(int(since_ts))
+        ):
+            if cursor is not None:
+                logger.info(f"Rollup '{name}' reconstruído (origem={source})")
+            reset()
+            return source, 0, coverage
+        return source, int(cursor["last_rowid"] or 0), max(coverage, int(cursor["since_ts"] or 0))
+
+    # --- Forwards ---------------------------------------------------------
+
+    def sync_forwards(self, since_ts: int) -> int:
+        """Incorpora forwards novos ao rollup e poda buckets fora da retenção."""
+        with self._lock:
+            table = self._db.forwards_table()
+            max_rowid = self._db.max_rowid(table)
+            source, last_rowid, coverage = self._prepare(
+                "forwards", table, since_ts, max_rowid, self._storage.reset_forward_rollup
+            )
+            buckets: Dict[Tuple[int, str, str], List[int]] = {}
+            folded = 0
+            if max_rowid > last_rowid:
+                rows = self._db.forward_buckets(table, last_rowid, max_rowid, _sqlite_str(coverage), BUCKET_SEC)
+                for row in rows:
+                    acc = buckets.setdefault((int(row["bucket_ts"]), str(row["chan_id"]), row["direction"]), [0, 0, 0, 0])
+                    acc[0] += int(row["amt_sat"] or 0)
+                    acc[1] += int(row["amt_msat"] or 0)
+                    acc[2] += int(row["fee_sat"] or 0)
+                    acc[3] += int(row["count"] or 0)
+                    if row["direction"] == "out":
+                        folded += int(row["count"] or 0)
+            self._storage.fold_forward_rollup(buckets, source=source, last_rowid=max_rowid, since_ts=coverage)
+            self._storage.prune_forward_rollup(coverage)
+        if folded:
+            logger.debug(f"Rollup de forwards: +{folded} forwards de saída (rowid<={max_rowid})")
+        return folded
+
+    def forward_aggregates(self, start_dt: datetime.datetime, one_day_ago: datetime.datetime) -> Dict[str, Any]:
+        """Mesmo formato de legacy.load_forward_aggregates, lido do rollup."""
+        since_ts = _epoch(start_dt)
+        self.sync_forwards(since_ts)
+        result: Dict[str, Any] = {
+            "out_fee_sat": defaultdict(int),
+            "out_amt_sat": defaultdict(int),
+            "out_count": defaultdict(int),
+            "out_amt_sat_1d": defaultdict(int),
+            "out_count_1d": defaultdict(int),
+            "in_amt_sat_by_cid": defaultdict(int),
+            "in_count_by_cid": defaultdict(int),
+            "in_amt_msat_by_cid": defaultdict(int),
+        }
+        rows = self._storage.load_forward_rollup(_bucket(since_ts), _bucket(_epoch(one_day_ago)))
+        for row in rows:
+            cid = row["chan_id"]
+            if row["direction"] == "out":
+                result["out_fee_sat"][cid] += int(row["fee_sat"] or 0)
+                result["out_amt_sat"][cid] += int(row["amt_sat"] or 0)
+                result["out_count"][cid] += int(row["count"] or 0)
+                if row["count_1d"]:
+                    result["out_amt_sat_1d"][cid] += int(row["amt_sat_1d"] or 0)
+                    result["out_count_1d"][cid] += int(row["count_1d"] or 0)
+            else:
+                result["in_amt_sat_by_cid"][cid] += int(row["amt_sat"] or 0)
+                result["in_count_by_cid"][cid] += int(row["count"] or 0)
+                result["in_amt_msat_by_cid"][cid] += int(row["amt_msat"] or 0)
+        return result
+
+    # --- Rebalances ---------------------------------------------------------
+
+    def sync_rebalances(self, since_ts: int) -> int:
+        """Incorpora pagamentos de rebal novos ao rollup (value/fee por rebal_chan e hora).
+
+        O cursor avança mesmo sobre pagamentos em voo (status=1): como o LNDg ainda
+        atualiza essas linhas, elas ficam num conjunto de pendentes relido a cada
+        sync e só entram nos buckets ao sair de status=1. Enquanto isso, são somadas
+        com os valores atuais em rebal_aggregates (como o SQL do legado, sem filtro
+        de status).
+        """
+        with self._lock:
+            table = self._db.payments_table()
+            max_rowid = self._db.max_rowid(table)
+            source, last_rowid, coverage = self._prepare(
+                "rebal", table, since_ts, max_rowid, self._storage.reset_rebal_rollup
+            )
+            buckets: Dict[Tuple[int, str], List[int]] = {}
+            folded = 0
+
+            def _add(bucket_ts: int, rebal_chan: Any, value_sat: Any, fee_sat: Any, count: Any) -> None:
+                acc = buckets.setdefault((int(bucket_ts), str(rebal_chan)), [0, 0, 0])
+                acc[0] += int(value_sat or 0)
+                acc[1] += int(fee_sat or 0)
+                acc[2] += int(count or 0)
+
+            inflight: List[Tuple[int, str, int, int]] = []
+            pending: List[int] = []
+            # pendentes de syncs anteriores: liquidados/falhos entram nos buckets
+            for row in self._db.rebal_rows(table, self._storage.load_rebal_pending(), BUCKET_SEC):
+                if row["bucket_ts"] is None or int(row["bucket_ts"]) < coverage:
+                    continue
+                if row["status"] == 1:
+                    pending.append(int(row["rowid"]))
+                    inflight.append((int(row["bucket_ts"]), str(row["rebal_chan"]), int(row["value_sat"] or 0), int(row["fee_sat"] or 0)))
+                    continue
+                _add(row["bucket_ts"], row["rebal_chan"], row["value_sat"], row["fee_sat"], 1)
+                folded += 1
+            if max_rowid > last_rowid:
+                since = _sqlite_str(coverage)
+                for row in self._db.rebal_buckets(table, last_rowid, max_rowid, since, BUCKET_SEC):
+                    _add(row["bucket_ts"], row["rebal_chan"], row["value_sat"], row["fee_sat"], row["count"])
+                    folded += int(row["count"] or 0)
+                for row in self._db.inflight_rebal_rows(table, last_rowid, max_rowid, since, BUCKET_SEC):
+                    pending.append(int(row["rowid"]))
+                    inflight.append((int(row["bucket_ts"]), str(row["rebal_chan"]), int(row["value_sat"] or 0), int(row["fee_sat"] or 0)))
+            self._storage.fold_rebal_rollup(
+                buckets, source=source, last_rowid=max(last_rowid, max_rowid), since_ts=coverage, pending=pending
+            )
+            self._storage.prune_rebal_rollup(coverage)
+            self._inflight = inflight
+        if folded:
+            logger.debug(f"Rollup de rebal: +{folded} pagamentos (rowid<={max_rowid}, {len(pending)} em voo)")
+        return folded
+
+    def rebal_aggregates(self, start_dt: datetime.datetime) -> Dict[str, Any]:
+        """Somatórios de rebal por rebal_chan (chave crua do LNDg) + totais globais."""
+        since_ts = _epoch(start_dt)
+        self.sync_rebalances(since_ts)
+        per_value: Dict[str, int] = defaultdict(int)
+        per_fee: Dict[str, int] = defaultdict(int)
+        per_count: Dict[str, int] = defaultdict(int)
+        for row in self._storage.load_rebal_rollup(_bucket(since_ts)):
+            cid = row["rebal_chan"]
+            per_value[cid] += int(row["value_sat"] or 0)
+            per_fee[cid] += int(row["fee_sat"] or 0)
+            per_count[cid] += int(row["count"] or 0)
+        with self._lock:
+            inflight = list(self._inflight)
+        for bucket_ts, cid, value_sat, fee_sat in inflight:
+            if bucket_ts >= _bucket(since_ts):
+                per_value[cid] += value_sat
+                per_fee[cid] += fee_sat
+                per_count[cid] += 1
+        return {
+            "per_value": dict(per_value),
+            "per_fee": dict(per_fee),
+            "per_count": dict(per_count),
+            "total_value": sum(per_value.values()),
+            "total_fee": sum(per_fee.values()),
+        }
+
+    def out_totals(self, start_dt: datetime.datetime) -> Dict[str, int]:
+        """Totais de saída (amt/fee) da janela, para KPIs globais."""
+        since_ts = _epoch(start_dt)
+        self.sync_forwards(since_ts)
+        out_amt_sat = 0
+        out_fee_sat = 0
+        for row in self._storage.load_forward_rollup(_bucket(since_ts), _bucket(since_ts)):
+            if row["direction"] == "out":
+                out_amt_sat += int(row["amt_sat"] or 0)
+                out_fee_sat += int(row["fee_sat"] or 0)
+        return {"out_amt_sat": out_amt_sat, "out_fee_sat": out_fee_sat}
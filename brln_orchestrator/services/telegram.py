@@ -1,52 +1,199 @@
 from __future__ import annotations
 
 import sys
+import threading
+import time
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Deque, List, Optional, Sequence, Tuple
 
 import requests
-from requests.exceptions import ConnectionError, Timeout
-
-MAX_RETRIES = 3
-INITIAL_BACKOFF = 1.0
-BACKOFF_MULTIPLIER = 2.0
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
 from logging_config import get_logger
 
 logger = get_logger("services.telegram")
 
+from ..storage import Storage
+from .http import build_session
+
+MAX_MESSAGE_LEN = 3900
+# limites por chat do Telegram: ~1 msg/s e 20 msgs/min (grupos)
+MIN_SEND_INTERVAL_SEC = 1.0
+MAX_SENDS_PER_MINUTE = 20
+# espera após o primeiro chunk novo p/ juntar o que o mesmo ciclo ainda enfileira
+COALESCE_WINDOW_SEC = 2.0
+RETRY_BASE_SEC = 30
+RETRY_MAX_SEC = 3600
+MAX_ATTEMPTS = 10
+IDLE_POLL_SEC = 30.0
+
+SEND_OK = "ok"
+SEND_RETRY = "retry"
+SEND_DROP = "drop"
+
 
 class TelegramService:
-    def __init__(self, token: Optional[str], chat_id: Optional[str]) -> None:
+    def __init__(self, token: Optional[str], chat_id: Optional[str], storage: Optional[Storage] = None) -> None:
         self._token = token
         self._chat_id = chat_id
+        self._storage = storage
+        # sendMessage não é idempotente: só erros de conexão são repetidos
+        self._session = build_session("telegram", pool_maxsize=2, retry_methods=())
+        self._sent_at: Deque[float] = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def close(self) -> None:
+        self._session.close()
 
     def enabled(self) -> bool:
         return bool(self._token and self._chat_id)
 
+    def worker_running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def start_worker(self) -> None:
+        """Entrega em background via telegram_outbox; sem worker, send() é síncrono."""
+        if self._storage is None or not self.enabled() or self.worker_running():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._worker_loop, name="telegram-outbox", daemon=True)
+        self._worker.start()
+        pending = self._storage.telegram_outbox_size()
+        logger.info(f"Fila de entrega do Telegram iniciada ({pending} chunk(s) pendentes)")
+
+    def stop_worker(self, timeout: float = 30.0) -> None:
+        """Encerra o worker depois de tentar entregar o que já venceu (limitado por ``timeout``)."""
+        thread = self._worker
+        if thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning("Worker do Telegram ainda entregando ao encerrar")
+        self._worker = None
+        if self._storage is not None:
+            pending = self._storage.telegram_outbox_size()
+            if pending:
+                logger.info(f"{pending} chunk(s) do Telegram ficam no outbox para a próxima execução")
+
     def send(self, message: str, *, parse_mode: Optional[str] = None) -> None:
         if not self.enabled():
             logger.debug("Telegram desabilitado, mensagem não enviada")
             return
-        url = f"https://api.telegram.org/bot{self._token}/sendMessage"
-        chunks = chunk_text(message, 3900)
+        chunks = chunk_text(message, MAX_MESSAGE_LEN)
+        if self.worker_running():
+            self._storage.enqueue_telegram(chunks, parse_mode)  # type: ignore[union-attr]
+            self._wake.set()
+            logger.debug(f"Mensagem Telegram enfileirada ({len(chunks)} chunks)")
+            return
         logger.debug(f"Enviando mensagem Telegram ({len(chunks)} chunks)")
         for i, chunk in enumerate(chunks):
-            payload = {
-                "chat_id": self._chat_id,
-                "text": chunk,
-            }
-            if parse_mode:
-                payload["parse_mode"] = parse_mode
+            self._throttle()
+            status, _retry_after, error = self._post(chunk, parse_mode)
+            if status == SEND_OK:
+                logger.debug(f"Chunk {i+1}/{len(chunks)} enviado com sucesso")
+            else:
+                logger.warning(f"Falha ao enviar chunk {i+1}/{len(chunks)} ao Telegram: {error}")
+
+    # ------------------------------------------------------------------ #
+    # Entrega
+    # ------------------------------------------------------------------ #
+
+    def _post(self, text: str, parse_mode: Optional[str]) -> Tuple[str, float, str]:
+        url = f"https://api.telegram.org/bot{self._token}/sendMessage"
+        payload = {
+            "chat_id": self._chat_id,
+            "text": text,
+        }
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        try:
+            resp = self._session.post(url, timeout=15, json=payload)
+        except requests.RequestException as e:
+            return SEND_RETRY, 0.0, f"erro de conexão: {e}"
+        if resp.status_code == 200:
+            return SEND_OK, 0.0, ""
+        error = f"status {resp.status_code}: {resp.text[:200]}"
+        if resp.status_code == 429:
             try:
-                resp = requests.post(url, timeout=15, json=payload)
-                if resp.status_code == 200:
-                    logger.debug(f"Chunk {i+1}/{len(chunks)} enviado com sucesso")
-                else:
-                    logger.warning(f"Telegram retornou status {resp.status_code}: {resp.text[:200]}")
-            except requests.RequestException as e:
-                logger.error(f"Erro ao enviar mensagem Telegram: {e}")
+                retry_after = float(resp.json().get("parameters", {}).get("retry_after") or 0)
+            except (ValueError, AttributeError):
+                retry_after = 0.0
+            return SEND_RETRY, retry_after, error
+        if resp.status_code >= 500:
+            return SEND_RETRY, 0.0, error
+        # 4xx: repetir o mesmo payload não adianta
+        return SEND_DROP, 0.0, error
+
+    def _throttle(self) -> None:
+        now = time.monotonic()
+        while self._sent_at and now - self._sent_at[0] >= 60:
+            self._sent_at.popleft()
+        wait = 0.0
+        if self._sent_at:
+            wait = self._sent_at[-1] + MIN_SEND_INTERVAL_SEC - now
+        if len(self._sent_at) >= MAX_SENDS_PER_MINUTE:
+            wait = max(wait, self._sent_at[0] + 60 - now)
+        if wait > 0:
+            time.sleep(wait)
+        self._sent_at.append(time.monotonic())
+
+    def _worker_loop(self) -> None:
+        while True:
+            stopping = self._stop.is_set()
+            try:
+                self._deliver_due()
+            except Exception as exc:  # pragma: no cover - defensive
+                logger.error(f"Worker do Telegram falhou: {exc}")
+            if stopping:
+                break
+            next_at = self._storage.next_telegram_attempt()  # type: ignore[union-attr]
+            timeout = IDLE_POLL_SEC if next_at is None else min(max(next_at - time.time(), 0.0), IDLE_POLL_SEC)
+            if self._wake.wait(timeout):
+                self._wake.clear()
+                self._stop.wait(COALESCE_WINDOW_SEC)
+
+    def _deliver_due(self) -> None:
+        storage = self._storage
+        if storage is None:
+            return
+        while True:
+            rows = storage.due_telegram()
+            if not rows:
+                return
+            for ids, text, parse_mode, attempts in coalesce_chunks(rows, MAX_MESSAGE_LEN):
+                self._throttle()
+                status, retry_after, error = self._post(text, parse_mode)
+                if status == SEND_OK:
+                    storage.ack_telegram(ids)
+                    continue
+                attempts += 1
+                if status == SEND_DROP or attempts >= MAX_ATTEMPTS:
+                    logger.error(f"Telegram: descartando {len(ids)} chunk(s) após {attempts} tentativa(s): {error}")
+                    storage.ack_telegram(ids)
+                    continue
+                delay = max(retry_after, min(RETRY_BASE_SEC * 2 ** (attempts - 1), RETRY_MAX_SEC))
+                storage.retry_telegram(ids, int(time.time() + delay), error)
+                logger.warning(f"Telegram: {len(ids)} chunk(s) reagendados em {delay:.0f}s ({error})")
+                return  # mantém a ordem: o resto espera este chunk
+
+
+def coalesce_chunks(rows: Sequence, max_len: int) -> List[Tuple[List[int], str, Optional[str], int]]:
+    """Junta chunks consecutivos (mesmo parse_mode) numa só mensagem enquanto couberem em max_len."""
+    batches: List[Tuple[List[int], str, Optional[str], int]] = []
+    for row in rows:
+        text = row["text"]
+        if batches:
+            ids, prev_text, prev_mode, attempts = batches[-1]
+            if prev_mode == row["parse_mode"] and len(prev_text) + 2 + len(text) <= max_len:
+                batches[-1] = (ids + [row["id"]], f"{prev_text}\n\n{text}", prev_mode, max(attempts, row["attempts"]))
+                continue
+        batches.append(([row["id"]], text, row["parse_mode"], row["attempts"]))
+    return batches
 
 
 def chunk_text(text: str, max_len: int) -> list[str]:
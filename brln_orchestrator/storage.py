@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 import json
+import math
 import sqlite3
 import sys
 import threading
 import time
+from array import array
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from logging_config import get_logger
@@ -14,6 +16,233 @@ from logging_config import get_logger
 logger = get_logger("storage")
 
 
+_MISSING = object()
+
+
+class TrackedDict(dict):
+    """dict que registra as chaves tocadas desde o load (ou o último flush).
+
+    Guarda também o JSON de cada linha como foi lido, para que o flush grave
+    só as chaves tocadas cujo conteúdo mudou de fato.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        data: Dict[str, Any],
+        baseline: Dict[str, str],
+        *,
+        encode: Callable[[Any], str] = json.dumps,
+        partial: bool = False,
+    ) -> None:
+        super().__init__(data)
+        self.table = table
+        # partial=True: cada valor traz só um subconjunto dos campos (merge no save)
+        self.partial = partial
+        self._encode = encode
+        self._baseline = baseline
+        self._touched: set = set()
+        self._cleared = False
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        super().__setitem__(key, value)
+        self._touched.add(key)
+
+    def __delitem__(self, key: str) -> None:
+        super().__delitem__(key)
+        self._touched.add(key)
+
+    def pop(self, key: str, default: Any = _MISSING) -> Any:
+        self._touched.add(key)
+        if default is _MISSING:
+            return super().pop(key)
+        return super().pop(key, default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._touched.add(key)
+        return key, value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        self._touched.add(key)
+        return super().setdefault(key, default)
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        other = dict(*args, **kwargs)
+        super().update(other)
+        self._touched.update(other.keys())
+
+    def __ior__(self, other: Any) -> "TrackedDict":
+        self.update(other)
+        return self
+
+    def clear(self) -> None:
+        super().clear()
+        self._cleared = True
+        self._touched.clear()
+
+    def pending(self) -> Tuple[Dict[str, str], List[str], bool]:
+        """(upserts {key: json}, deletes, full_rewrite) desde o último flush."""
+        if self._cleared:
+            return {key: self._encode(value) for key, value in self.items()}, [], True
+        upserts: Dict[str, str] = {}
+        deletes: List[str] = []
+        for key in self._touched:
+            if key in self:
+                payload = self._encode(self[key])
+                if self._baseline.get(key) != payload:
+                    upserts[key] = payload
+            elif key in self._baseline:
+                deletes.append(key)
+        return upserts, deletes, False
+
+    def mark_flushed(self, upserts: Dict[str, str], deletes: List[str], full: bool) -> None:
+        if full:
+            self._baseline = dict(upserts)
+        else:
+            self._baseline.update(upserts)
+            for key in deletes:
+                self._baseline.pop(key, None)
+        self._touched.clear()
+        self._cleared = False
+
+
+# Campos "quentes" do estado por canal do AutoFee, com coluna própria em
+# autofee_channel_state. O restante do registro vai para a coluna JSON ``extra``.
+STATE_COLUMNS: Tuple[Tuple[str, type], ...] = (
+    ("class_label", str),
+    ("class_conf", float),
+    ("bias_ema", float),
+    ("last_seed", float),
+    ("last_ppm", int),
+    ("last_dir", str),
+    ("low_streak", int),
+    ("baseline_fwd7d", int),
+    ("last_rebal_cost_ppm", float),
+    ("last_rebal_cost_ts", int),
+    ("last_outrate_ppm", float),
+    ("last_outrate_ts", int),
+    ("last_ts", int),
+    ("last_online", int),
+    ("last_offline", int),
+    ("ar_last_switch_ts", int),
+)
+_STATE_SQL_TYPES = {str: "TEXT", float: "REAL", int: "INTEGER"}
+_STATE_HOT = {name for name, _ in STATE_COLUMNS}
+
+
+def _encode_state(record: Any) -> str:
+    return json.dumps(record, sort_keys=True)
+
+
+def _state_row(cid: str, record: Any, now: int) -> Tuple[Any, ...]:
+    """Registro -> linha de autofee_channel_state.
+
+    Um campo quente só vai para a coluna quando o tipo Python bate exatamente
+    (ex.: last_seed=500 int fica no ``extra``); assim o load devolve o mesmo
+    registro, com os mesmos tipos, que o legado gravou.
+    """
+    if not isinstance(record, dict):
+        return (cid,) + (None,) * len(STATE_COLUMNS) + (json.dumps({"__value__": record}), now)
+    extra = dict(record)
+    values: List[Any] = []
+    for name, kind in STATE_COLUMNS:
+        value = extra.get(name)
+        if value is not None and type(value) is kind:
+            values.append(extra.pop(name))
+        else:
+            values.append(None)
+    return (cid, *values, json.dumps(extra) if extra else None, now)
+
+
+def _state_record(row: sqlite3.Row) -> Any:
+    record: Dict[str, Any] = {}
+    for name, _ in STATE_COLUMNS:
+        value = row[name]
+        if value is not None:
+            record[name] = value
+    if row["extra"]:
+        try:
+            extra = json.loads(row["extra"])
+        except (json.JSONDecodeError, TypeError):
+            extra = {}
+        if set(extra) == {"__value__"}:
+            return extra["__value__"]
+        record.update(extra)
+    return record
+
+
+# Séries da Amboss: float64 little-endian num BLOB + estatísticas calculadas na escrita
+SERIES_STATS = ("n", "mean", "median", "p65", "p95", "std")
+
+
+def pack_series(vals: Sequence[float]) -> bytes:
+    arr = array("d", vals)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def unpack_series(blob: bytes) -> List[float]:
+    arr = array("d")
+    arr.frombytes(blob)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tolist()
+
+
+def _percentile_sorted(vs: Sequence[float], q: float) -> float:
+    # mesma interpolação linear de _percentile() do brln-autofee.py
+    if len(vs) == 1:
+        return float(vs[0])
+    pos = q * (len(vs) - 1)
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    if lo == hi:
+        return float(vs[lo])
+    return vs[lo] * (hi - pos) + vs[hi] * (pos - lo)
+
+
+def series_stats(vals: Sequence[float]) -> Dict[str, Any]:
+    """n, mean, median, p65, p95 e std (populacional) de uma série; None se vazia."""
+    if not vals:
+        return {"n": 0, "mean": None, "median": None, "p65": None, "p95": None, "std": None}
+    vs = sorted(vals)
+    n = len(vs)
+    mean = sum(vals) / n
+    return {
+        "n": n,
+        "mean": mean,
+        "median": _percentile_sorted(vs, 0.5),
+        "p65": _percentile_sorted(vs, 0.65),
+        "p95": _percentile_sorted(vs, 0.95),
+        "std": math.sqrt(sum((v - mean) ** 2 for v in vs) / n),
+    }
+
+
+def _series_row(data: Any) -> Tuple[Any, ...]:
+    """(data_json, vals_blob, n, mean, median, p65, p95, std) para amboss_series."""
+    if isinstance(data, list) and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in data):
+        vals = [float(v) for v in data]
+        stats = series_stats(vals)
+        return (None, pack_series(vals), *(stats[key] for key in SERIES_STATS))
+    # formato inesperado: mantém JSON, sem estatísticas
+    return (json.dumps(data), None) + (None,) * len(SERIES_STATS)
+
+
+# telemetry_log: lote de escrita, retenção e rollups
+TELEMETRY_BATCH_SIZE = 50
+TELEMETRY_FLUSH_INTERVAL_SEC = 30
+TELEMETRY_RETENTION_DAYS = 30
+TELEMETRY_MAX_ROWS = 50_000
+TELEMETRY_HOURLY_RETENTION_DAYS = 90
+TELEMETRY_PRUNE_INTERVAL_SEC = 3600
+
+SYMPTOM_KEYS = ("floor_lock", "no_down_low", "hold_small", "cb_trigger", "discovery")
+RUN_METRICS_RETENTION_DAYS = 90
+ENGINE_RUNS_RETENTION_DAYS = 90
+
+
 class Storage:
     """SQLite-backed persistence for AutoFee/AR/Tuner state."""
 
@@ -23,11 +252,20 @@ class Storage:
         logger.info(f"Inicializando Storage: {self._path}")
         self._conn = sqlite3.connect(self._path, check_same_thread=False)
         self._conn.row_factory = sqlite3.Row
+        # telemetry_log: linhas acumuladas em memória e gravadas em lote
+        self._log_buffer: List[Tuple[int, str, str, str, Optional[str]]] = []
+        self._log_batch_size = TELEMETRY_BATCH_SIZE
+        self._log_flush_interval = TELEMETRY_FLUSH_INTERVAL_SEC
+        self._log_last_flush = time.monotonic()
+        self._log_retention_days = TELEMETRY_RETENTION_DAYS
+        self._log_max_rows = TELEMETRY_MAX_ROWS
+        self._log_last_prune = 0.0
         self._init_schema()
         logger.debug("Schema do banco inicializado")
 
     def close(self) -> None:
         with self._lock:
+            self.flush_logs()
             self._conn.close()
 
     def _init_schema(self) -> None:
@@ -68,11 +306,6 @@ class Storage:
                     updated_at INTEGER
                 );
 
-                CREATE TABLE IF NOT EXISTS autofee_state (
-                    cid TEXT PRIMARY KEY,
-                    data TEXT,
-                    updated_at INTEGER
-                );
 
                 CREATE TABLE IF NOT EXISTS telemetry_log (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -83,6 +316,64 @@ class Storage:
                     extra TEXT
                 );
                 CREATE INDEX IF NOT EXISTS idx_telemetry_ts ON telemetry_log(ts);
+                CREATE INDEX IF NOT EXISTS idx_telemetry_component_ts ON telemetry_log(component, ts);
+
+                CREATE TABLE IF NOT EXISTS telemetry_rollup_hourly (
+                    bucket_ts INTEGER NOT NULL,
+                    component TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    count INTEGER DEFAULT 0,
+                    msg_bytes INTEGER DEFAULT 0,
+                    PRIMARY KEY(bucket_ts, component, level)
+                );
+
+                CREATE TABLE IF NOT EXISTS telemetry_rollup_daily (
+                    bucket_ts INTEGER NOT NULL,
+                    component TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    count INTEGER DEFAULT 0,
+                    msg_bytes INTEGER DEFAULT 0,
+                    PRIMARY KEY(bucket_ts, component, level)
+                );
+
+                CREATE TABLE IF NOT EXISTS autofee_run_metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts INTEGER NOT NULL,
+                    dry_run INTEGER DEFAULT 0,
+                    changed_up INTEGER DEFAULT 0,
+                    changed_down INTEGER DEFAULT 0,
+                    kept INTEGER DEFAULT 0,
+                    floor_lock INTEGER DEFAULT 0,
+                    no_down_low INTEGER DEFAULT 0,
+                    hold_small INTEGER DEFAULT 0,
+                    cb_trigger INTEGER DEFAULT 0,
+                    discovery INTEGER DEFAULT 0,
+                    total_sec REAL,
+                    data TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_run_metrics_ts ON autofee_run_metrics(ts);
+
+                CREATE TABLE IF NOT EXISTS engine_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    engine TEXT NOT NULL,
+                    started_at INTEGER NOT NULL,
+                    duration_sec REAL,
+                    lag_sec REAL,
+                    ok INTEGER DEFAULT 1,
+                    overrun INTEGER DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_engine_runs_engine_ts ON engine_runs(engine, started_at);
+
+                CREATE TABLE IF NOT EXISTS telegram_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at INTEGER NOT NULL,
+                    parse_mode TEXT,
+                    text TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at INTEGER DEFAULT 0,
+                    last_error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_telegram_outbox_due ON telegram_outbox(next_attempt_at, id);
 
                 CREATE TABLE IF NOT EXISTS amboss_series (
                     pubkey TEXT,
@@ -122,12 +413,48 @@ class Storage:
                     data TEXT,
                     updated_at INTEGER
                 );
+
+                CREATE TABLE IF NOT EXISTS rollup_cursors (
+                    name TEXT PRIMARY KEY,
+                    source TEXT,
+                    last_rowid INTEGER,
+                    since_ts INTEGER,
+                    updated_at INTEGER
+                );
+
+                CREATE TABLE IF NOT EXISTS forward_rollup (
+                    bucket_ts INTEGER NOT NULL,
+                    chan_id TEXT NOT NULL,
+                    direction TEXT NOT NULL,
+                    amt_sat INTEGER DEFAULT 0,
+                    amt_msat INTEGER DEFAULT 0,
+                    fee_sat INTEGER DEFAULT 0,
+                    count INTEGER DEFAULT 0,
+                    PRIMARY KEY(bucket_ts, chan_id, direction)
+                );
+
+                CREATE TABLE IF NOT EXISTS rebal_rollup (
+                    bucket_ts INTEGER NOT NULL,
+                    rebal_chan TEXT NOT NULL,
+                    value_sat INTEGER DEFAULT 0,
+                    fee_sat INTEGER DEFAULT 0,
+                    count INTEGER DEFAULT 0,
+                    PRIMARY KEY(bucket_ts, rebal_chan)
+                );
+
+                CREATE TABLE IF NOT EXISTS rebal_rollup_pending (
+                    payment_rowid INTEGER PRIMARY KEY
+                );
                 """
             )
 
             self._conn.commit()
 
             self._migrate_lnd_rest_columns()
+            self._migrate_autofee_state()
+            self._migrate_autofee_cache_series()
+            self._migrate_amboss_series_blob()
+            self._migrate_telemetry_rollups()
 
             self._conn.commit()
 
@@ -146,6 +473,104 @@ class Storage:
             if col_name not in existing_cols:
                 self._conn.execute(f"ALTER TABLE secrets ADD COLUMN {col_name} {col_type}")
 
+    def _migrate_autofee_state(self) -> None:
+        columns = ",\n".join(
+            f"                {name} {_STATE_SQL_TYPES[kind]}" for name, kind in STATE_COLUMNS
+        )
+        self._conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS autofee_channel_state (
+                cid TEXT PRIMARY KEY,
+{columns},
+                extra TEXT,
+                updated_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_channel_state_class ON autofee_channel_state(class_label);
+            CREATE INDEX IF NOT EXISTS idx_channel_state_updated ON autofee_channel_state(updated_at);
+            """
+        )
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(autofee_channel_state)")}
+        for name, kind in STATE_COLUMNS:
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE autofee_channel_state ADD COLUMN {name} {_STATE_SQL_TYPES[kind]}")
+        if not self.table_exists("autofee_state"):
+            return
+        # blob JSON por cid (formato antigo) -> colunas
+        rows = []
+        for row in self._conn.execute("SELECT cid, data, updated_at FROM autofee_state"):
+            try:
+                record = json.loads(row["data"])
+            except (json.JSONDecodeError, TypeError):
+                record = {}
+            rows.append(_state_row(row["cid"], record, int(row["updated_at"] or 0)))
+        if rows:
+            self._conn.executemany(self._state_upsert_sql(), rows)
+        # mantém o formato antigo como backup para rollback (remover numa próxima versão);
+        # um backup anterior é substituído pelo estado mais recente
+        self._conn.execute("DROP TABLE IF EXISTS autofee_state_v1")
+        self._conn.execute("ALTER TABLE autofee_state RENAME TO autofee_state_v1")
+        logger.info(
+            f"autofee_state migrado para autofee_channel_state ({len(rows)} canais); "
+            "tabela antiga mantida como autofee_state_v1"
+        )
+
+    def _migrate_autofee_cache_series(self) -> None:
+        # séries da Amboss ficam só em amboss_series; remove as cópias antigas do cache do AutoFee
+        done = self._conn.execute("SELECT 1 FROM meta WHERE key='autofee_cache_series_dropped'").fetchone()
+        if done:
+            return
+        cursor = self._conn.execute(
+            "DELETE FROM autofee_cache WHERE key LIKE 'series7d:%' "
+            "OR key LIKE 'incoming_series_7d:%' OR key LIKE 'incoming_p65_7d:%'"
+        )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta(key, value) VALUES('autofee_cache_series_dropped', ?)",
+            (str(int(time.time())),),
+        )
+        if cursor.rowcount:
+            logger.info(f"autofee_cache: {cursor.rowcount} chave(s) de séries Amboss removidas (usando amboss_series)")
+
+    def _migrate_amboss_series_blob(self) -> None:
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(amboss_series)")}
+        new_cols = [("vals", "BLOB")] + [(key, "INTEGER" if key == "n" else "REAL") for key in SERIES_STATS]
+        for col_name, col_type in new_cols:
+            if col_name not in existing:
+                self._conn.execute(f"ALTER TABLE amboss_series ADD COLUMN {col_name} {col_type}")
+        # linhas antigas (array JSON em ``data``) -> BLOB + estatísticas
+        rows = self._conn.execute(
+            "SELECT rowid, data FROM amboss_series WHERE vals IS NULL AND data IS NOT NULL"
+        ).fetchall()
+        converted = []
+        for row in rows:
+            try:
+                data = json.loads(row["data"])
+            except (json.JSONDecodeError, TypeError):
+                continue
+            encoded = _series_row(data)
+            if encoded[1] is not None:
+                converted.append(encoded + (row["rowid"],))
+        if converted:
+            self._conn.executemany(
+                "UPDATE amboss_series SET data=?, vals=?, n=?, mean=?, median=?, p65=?, p95=?, std=? WHERE rowid=?",
+                converted,
+            )
+            logger.info(f"amboss_series: {len(converted)} série(s) convertidas de JSON para BLOB")
+
+    def _migrate_telemetry_rollups(self) -> None:
+        # rollups criados depois do log: preenche uma vez a partir das linhas existentes
+        if self._conn.execute("SELECT 1 FROM telemetry_rollup_daily LIMIT 1").fetchone():
+            return
+        if not self._conn.execute("SELECT 1 FROM telemetry_log LIMIT 1").fetchone():
+            return
+        for table, width in (("telemetry_rollup_hourly", 3600), ("telemetry_rollup_daily", 86400)):
+            self._conn.execute(
+                f"INSERT OR IGNORE INTO {table}(bucket_ts, component, level, count, msg_bytes) "
+                f"SELECT ts - ts % {width}, COALESCE(component, ''), COALESCE(level, ''), COUNT(*), "
+                "COALESCE(SUM(length(CAST(msg AS BLOB))), 0) "
+                f"FROM telemetry_log GROUP BY ts - ts % {width}, COALESCE(component, ''), COALESCE(level, '')"
+            )
+        logger.info("telemetry_log: rollups hora/dia preenchidos com o histórico existente")
+
     # --- Meta operations -------------------------------------------------
 
     def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
@@ -231,77 +656,384 @@ class Storage:
 
     # --- AutoFee cache/state --------------------------------------------
 
-    def load_autofee_cache(self) -> Dict[str, Any]:
+    def _load_tracked(self, table: str, key_col: str, on_error: Any) -> TrackedDict:
         with self._lock:
-            rows = self._conn.execute("SELECT key, data FROM autofee_cache").fetchall()
-            result = {}
-            for row in rows:
-                try:
-                    result[row["key"]] = json.loads(row["data"])
-                except json.JSONDecodeError:
-                    result[row["key"]] = None
-            return result
+            rows = self._conn.execute(f"SELECT {key_col} AS k, data FROM {table}").fetchall()
+        result: Dict[str, Any] = {}
+        baseline: Dict[str, str] = {}
+        for row in rows:
+            try:
+                result[row["k"]] = json.loads(row["data"])
+                baseline[row["k"]] = row["data"]
+            except (json.JSONDecodeError, TypeError):
+                result[row["k"]] = on_error() if callable(on_error) else on_error
+        return TrackedDict(table, result, baseline)
 
-    def save_autofee_cache(self, cache: Dict[str, Any]) -> None:
+    def _save_tracked(self, table: str, key_col: str, data: Dict[str, Any]) -> None:
+        """Grava só as linhas alteradas (executemany de upserts + deletes).
+
+        Um TrackedDict carregado desta tabela informa as chaves tocadas; qualquer
+        outro dict é comparado com o conteúdo atual da tabela.
+        """
         now = int(time.time())
+        if isinstance(data, TrackedDict) and data.table == table:
+            upserts, deletes, full = data.pending()
+        else:
+            with self._lock:
+                current = {
+                    row["k"]: row["data"]
+                    for row in self._conn.execute(f"SELECT {key_col} AS k, data FROM {table}")
+                }
+            upserts = {}
+            for key, value in data.items():
+                payload = json.dumps(value)
+                if current.get(key) != payload:
+                    upserts[key] = payload
+            deletes = [key for key in current if key not in data]
+            full = False
+        if not (upserts or deletes or full):
+            return
         with self._lock:
-            self._conn.execute("DELETE FROM autofee_cache")
-            for key, value in cache.items():
-                self._conn.execute(
-                    "INSERT INTO autofee_cache(key, data, updated_at) VALUES(?,?,?)",
-                    (key, json.dumps(value), now),
+            if full:
+                self._conn.execute(f"DELETE FROM {table}")
+            if deletes:
+                self._conn.executemany(f"DELETE FROM {table} WHERE {key_col}=?", [(key,) for key in deletes])
+            if upserts:
+                self._conn.executemany(
+                    f"INSERT INTO {table}({key_col}, data, updated_at) VALUES(?,?,?) "
+                    f"ON CONFLICT({key_col}) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(key, payload, now) for key, payload in upserts.items()],
                 )
             self._conn.commit()
+        if isinstance(data, TrackedDict) and data.table == table:
+            data.mark_flushed(upserts, deletes, full)
+        logger.debug(f"{table}: {len(upserts)} linha(s) gravadas, {len(deletes)} removidas")
+
+    def load_autofee_cache(self) -> Dict[str, Any]:
+        return self._load_tracked("autofee_cache", "key", None)
+
+    def save_autofee_cache(self, cache: Dict[str, Any]) -> None:
+        self._save_tracked("autofee_cache", "key", cache)
+
+    @staticmethod
+    def _state_upsert_sql() -> str:
+        cols = ["cid"] + [name for name, _ in STATE_COLUMNS] + ["extra", "updated_at"]
+        updates = ", ".join(f"{col} = excluded.{col}" for col in cols[1:])
+        return (
+            f"INSERT INTO autofee_channel_state({', '.join(cols)}) VALUES({', '.join('?' * len(cols))}) "
+            f"ON CONFLICT(cid) DO UPDATE SET {updates}"
+        )
+
+    def _read_state_records(self, cids: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        sql = "SELECT * FROM autofee_channel_state"
+        params: Tuple[Any, ...] = ()
+        if cids is not None:
+            cids = list(cids)
+            if not cids:
+                return {}
+            sql += f" WHERE cid IN ({','.join('?' * len(cids))})"
+            params = tuple(cids)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return {row["cid"]: _state_record(row) for row in rows}
 
     def load_autofee_state(self) -> Dict[str, Any]:
+        records = self._read_state_records()
+        baseline = {cid: _encode_state(record) for cid, record in records.items()}
+        return TrackedDict("autofee_channel_state", records, baseline, encode=_encode_state)
+
+    def load_autofee_state_fields(
+        self,
+        fields: Sequence[str],
+        *,
+        class_label: Optional[str] = None,
+        cids: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Any]:
+        """Só os ``fields`` pedidos de cada canal (campos nulos/ausentes são omitidos).
+
+        O dict devolvido pode ser passado para save_autofee_state: o save faz
+        merge dos campos alterados em vez de regravar o registro.
+        """
+        selects = []
+        for name in fields:
+            if name in _STATE_HOT:
+                selects.append(f"COALESCE({name}, json_extract(extra, '$.\"{name}\"')) AS \"{name}\"")
+            else:
+                selects.append(f"json_extract(extra, '$.\"{name}\"') AS \"{name}\"")
+        sql = f"SELECT cid{''.join(', ' + sel for sel in selects)} FROM autofee_channel_state"
+        where: List[str] = []
+        params: List[Any] = []
+        if class_label is not None:
+            where.append("class_label = ?")
+            params.append(class_label)
+        if cids is not None:
+            cids = list(cids)
+            where.append(f"cid IN ({','.join('?' * len(cids))})" if cids else "0")
+            params.extend(cids)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
         with self._lock:
-            rows = self._conn.execute("SELECT cid, data FROM autofee_state").fetchall()
-            result = {}
-            for row in rows:
-                try:
-                    result[row["cid"]] = json.loads(row["data"])
-                except json.JSONDecodeError:
-                    result[row["cid"]] = {}
-            return result
+            rows = self._conn.execute(sql, params).fetchall()
+        result: Dict[str, Any] = {}
+        for row in rows:
+            result[row["cid"]] = {name: row[name] for name in fields if row[name] is not None}
+        baseline = {cid: _encode_state(record) for cid, record in result.items()}
+        return TrackedDict("autofee_channel_state", result, baseline, encode=_encode_state, partial=True)
+
+    def list_channel_state(
+        self,
+        *,
+        class_label: Optional[str] = None,
+        updated_since: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[sqlite3.Row]:
+        """Linhas (colunas quentes) de autofee_channel_state, mais recentes primeiro."""
+        sql = "SELECT * FROM autofee_channel_state"
+        where: List[str] = []
+        params: List[Any] = []
+        if class_label is not None:
+            where.append("class_label = ?")
+            params.append(class_label)
+        if updated_since is not None:
+            where.append("updated_at >= ?")
+            params.append(int(updated_since))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY updated_at DESC, cid"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
 
     def save_autofee_state(self, state: Dict[str, Any]) -> None:
+        """Grava só os canais alterados; dicts parciais fazem merge campo a campo."""
+        tracked = isinstance(state, TrackedDict) and state.table == "autofee_channel_state"
+        if tracked:
+            upserts, deletes, full = state.pending()
+            changed = {cid: state[cid] for cid in upserts}
+        else:
+            current = {cid: _encode_state(record) for cid, record in self._read_state_records().items()}
+            changed = {
+                cid: record for cid, record in state.items()
+                if current.get(cid) != _encode_state(record)
+            }
+            upserts = {cid: _encode_state(record) for cid, record in changed.items()}
+            deletes = [cid for cid in current if cid not in state]
+            full = False
+        partial = tracked and state.partial
+        if partial:
+            # subconjunto de campos: não apaga canais nem campos que não foram lidos
+            existing = self._read_state_records(list(changed))
+            merged: Dict[str, Any] = {}
+            for cid, fields in changed.items():
+                record = existing.get(cid)
+                record = dict(record) if isinstance(record, dict) else {}
+                record.update(fields)
+                merged[cid] = record
+            changed, deletes, full = merged, [], False
+        if not (changed or deletes or full):
+            return
         now = int(time.time())
         with self._lock:
-            self._conn.execute("DELETE FROM autofee_state")
-            for cid, payload in state.items():
-                self._conn.execute(
-                    "INSERT INTO autofee_state(cid, data, updated_at) VALUES(?,?,?)",
-                    (cid, json.dumps(payload), now),
+            if full:
+                self._conn.execute("DELETE FROM autofee_channel_state")
+            if deletes:
+                self._conn.executemany(
+                    "DELETE FROM autofee_channel_state WHERE cid=?", [(cid,) for cid in deletes]
+                )
+            if changed:
+                self._conn.executemany(
+                    self._state_upsert_sql(),
+                    [_state_row(cid, record, now) for cid, record in changed.items()],
                 )
             self._conn.commit()
+        if tracked:
+            state.mark_flushed(upserts, [] if partial else deletes, full)
+        logger.debug(f"autofee_channel_state: {len(changed)} canal(is) gravados, {len(deletes)} removidos")
 
     # --- Amboss series cache --------------------------------------------
 
     def get_amboss_series(self, pubkey: str, metric: str, submetric: str) -> Optional[Dict[str, Any]]:
+        """Série em cache com as estatísticas da mesma linha (``stats`` é None no formato JSON antigo)."""
         with self._lock:
             row = self._conn.execute(
-                "SELECT data, updated_at FROM amboss_series WHERE pubkey=? AND metric=? AND submetric=?",
+                f"SELECT data, vals, updated_at, {', '.join(SERIES_STATS)} FROM amboss_series "
+                "WHERE pubkey=? AND metric=? AND submetric=?",
                 (pubkey, metric, submetric),
             ).fetchone()
-            if row is None:
-                return None
+        if row is None:
+            return None
+        stats: Optional[Dict[str, Any]] = None
+        if row["vals"] is not None:
+            data: Any = unpack_series(row["vals"])
+            stats = {key: row[key] for key in SERIES_STATS}
+        else:
+            # formato antigo (JSON) ainda não convertido
             try:
-                data = json.loads(row["data"])
+                data = json.loads(row["data"]) if row["data"] is not None else None
             except json.JSONDecodeError:
                 data = None
-            return {"data": data, "updated_at": row["updated_at"]}
+        return {"data": data, "stats": stats, "updated_at": row["updated_at"]}
+
+    def get_amboss_summary(self, pubkey: str, metric: str, submetric: str) -> Optional[Dict[str, Any]]:
+        """Estatísticas da série (n, mean, median, p65, p95, std) sem decodificar os valores."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT data, vals, updated_at, {', '.join(SERIES_STATS)} FROM amboss_series "
+                "WHERE pubkey=? AND metric=? AND submetric=?",
+                (pubkey, metric, submetric),
+            ).fetchone()
+        if row is None:
+            return None
+        if row["vals"] is not None:
+            summary = {key: row[key] for key in SERIES_STATS}
+        else:
+            try:
+                data = json.loads(row["data"]) if row["data"] is not None else None
+            except json.JSONDecodeError:
+                data = None
+            if not isinstance(data, list):
+                return None
+            summary = series_stats([float(v) for v in data if v is not None])
+        summary["updated_at"] = row["updated_at"]
+        return summary
 
     def set_amboss_series(self, pubkey: str, metric: str, submetric: str, data: Any) -> None:
-        payload = json.dumps(data)
+        encoded = _series_row(data)
         now = int(time.time())
         with self._lock:
             self._conn.execute(
-                "INSERT INTO amboss_series(pubkey, metric, submetric, data, updated_at) VALUES(?,?,?,?,?) "
-                "ON CONFLICT(pubkey, metric, submetric) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
-                (pubkey, metric, submetric, payload, now),
+                "INSERT INTO amboss_series(pubkey, metric, submetric, data, vals, n, mean, median, p65, p95, std, updated_at) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?,?,?) "
+                "ON CONFLICT(pubkey, metric, submetric) DO UPDATE SET data = excluded.data, vals = excluded.vals, "
+                "n = excluded.n, mean = excluded.mean, median = excluded.median, p65 = excluded.p65, "
+                "p95 = excluded.p95, std = excluded.std, updated_at = excluded.updated_at",
+                (pubkey, metric, submetric, *encoded, now),
             )
             self._conn.commit()
 
+    # --- LNDg rollups -----------------------------------------------------
+
+    def get_rollup_cursor(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, last_rowid, since_ts, updated_at FROM rollup_cursors WHERE name=?",
+                (name,),
+            ).fetchone()
+            return dict(row) if row is not None else None
+
+    def _set_rollup_cursor(self, name: str, source: str, last_rowid: int, since_ts: int) -> None:
+        self._conn.execute(
+            "INSERT INTO rollup_cursors(name, source, last_rowid, since_ts, updated_at) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(name) DO UPDATE SET source = excluded.source, last_rowid = excluded.last_rowid, "
+            "since_ts = excluded.since_ts, updated_at = excluded.updated_at",
+            (name, source, int(last_rowid), int(since_ts), int(time.time())),
+        )
+
+    def reset_forward_rollup(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM forward_rollup")
+            self._conn.execute("DELETE FROM rollup_cursors WHERE name='forwards'")
+            self._conn.commit()
+
+    def fold_forward_rollup(
+        self,
+        buckets: Dict[Tuple[int, str, str], List[int]],
+        *,
+        source: str,
+        last_rowid: int,
+        since_ts: int,
+    ) -> None:
+        """Soma os buckets (bucket_ts, chan_id, direction) e avança o cursor na mesma transação."""
+        rows = [
+            (bucket_ts, chan_id, direction, vals[0], vals[1], vals[2], vals[3])
+            for (bucket_ts, chan_id, direction), vals in buckets.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO forward_rollup(bucket_ts, chan_id, direction, amt_sat, amt_msat, fee_sat, count) "
+                "VALUES(?,?,?,?,?,?,?) "
+                "ON CONFLICT(bucket_ts, chan_id, direction) DO UPDATE SET "
+                "amt_sat = amt_sat + excluded.amt_sat, amt_msat = amt_msat + excluded.amt_msat, "
+                "fee_sat = fee_sat + excluded.fee_sat, count = count + excluded.count",
+                rows,
+            )
+            self._set_rollup_cursor("forwards", source, last_rowid, since_ts)
+            self._conn.commit()
+
+    def prune_forward_rollup(self, before_ts: int) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM forward_rollup WHERE bucket_ts < ?", (int(before_ts),))
+            self._conn.commit()
+            return cur.rowcount
+
+    def load_forward_rollup(self, since_ts: int, one_day_ts: int) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT chan_id, direction, SUM(amt_sat) AS amt_sat, SUM(amt_msat) AS amt_msat, "
+                "SUM(fee_sat) AS fee_sat, SUM(count) AS count, "
+                "SUM(CASE WHEN bucket_ts >= ? THEN amt_sat ELSE 0 END) AS amt_sat_1d, "
+                "SUM(CASE WHEN bucket_ts >= ? THEN count ELSE 0 END) AS count_1d "
+                "FROM forward_rollup WHERE bucket_ts >= ? GROUP BY chan_id, direction",
+                (int(one_day_ts), int(one_day_ts), int(since_ts)),
+            ).fetchall()
+
+    def reset_rebal_rollup(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM rebal_rollup")
+            self._conn.execute("DELETE FROM rebal_rollup_pending")
+            self._conn.execute("DELETE FROM rollup_cursors WHERE name='rebal'")
+            self._conn.commit()
+
+    def fold_rebal_rollup(
+        self,
+        buckets: Dict[Tuple[int, str], List[int]],
+        *,
+        source: str,
+        last_rowid: int,
+        since_ts: int,
+        pending: Iterable[int] = (),
+    ) -> None:
+        """Soma os buckets e grava cursor + pendentes (pagamentos em voo) na mesma transação."""
+        rows = [
+            (bucket_ts, rebal_chan, vals[0], vals[1], vals[2])
+            for (bucket_ts, rebal_chan), vals in buckets.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO rebal_rollup(bucket_ts, rebal_chan, value_sat, fee_sat, count) VALUES(?,?,?,?,?) "
+                "ON CONFLICT(bucket_ts, rebal_chan) DO UPDATE SET "
+                "value_sat = value_sat + excluded.value_sat, fee_sat = fee_sat + excluded.fee_sat, "
+                "count = count + excluded.count",
+                rows,
+            )
+            self._conn.execute("DELETE FROM rebal_rollup_pending")
+            self._conn.executemany(
+                "INSERT INTO rebal_rollup_pending(payment_rowid) VALUES(?)", [(int(rowid),) for rowid in pending]
+            )
+            self._set_rollup_cursor("rebal", source, last_rowid, since_ts)
+            self._conn.commit()
+
+    def load_rebal_pending(self) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT payment_rowid FROM rebal_rollup_pending ORDER BY payment_rowid").fetchall()
+        return [int(row[0]) for row in rows]
+
+    def prune_rebal_rollup(self, before_ts: int) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM rebal_rollup WHERE bucket_ts < ?", (int(before_ts),))
+            self._conn.commit()
+            return cur.rowcount
+
+    def load_rebal_rollup(self, since_ts: int) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT rebal_chan, SUM(value_sat) AS value_sat, SUM(fee_sat) AS fee_sat, SUM(count) AS count "
+                "FROM rebal_rollup WHERE bucket_ts >= ? GROUP BY rebal_chan",
+                (int(since_ts),),
+            ).fetchall()
+
     # --- Overrides -------------------------------------------------------
 
     def load_overrides(self, scope: str) -> Dict[str, Any]:
@@ -328,17 +1060,97 @@ class Storage:
 
     # --- Telemetry ------------------------------------------------------
 
+    def configure_telemetry(
+        self,
+        *,
+        retention_days: Optional[int] = None,
+        max_rows: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ) -> None:
+        """Ajusta retenção (0 = sem limite) e o lote de escrita do telemetry_log."""
+        with self._lock:
+            if retention_days is not None:
+                self._log_retention_days = max(0, int(retention_days))
+            if max_rows is not None:
+                self._log_max_rows = max(0, int(max_rows))
+            if batch_size is not None:
+                self._log_batch_size = max(1, int(batch_size))
+            if flush_interval is not None:
+                self._log_flush_interval = max(0.0, float(flush_interval))
+
     def log(self, component: str, level: str, message: str, extra: Optional[Dict[str, Any]] = None) -> None:
         payload = json.dumps(extra) if extra is not None else None
+        level = level.upper()
         with self._lock:
-            self._conn.execute(
+            self._log_buffer.append((int(time.time()), level, component, message, payload))
+            due = (
+                level == "ERROR"
+                or len(self._log_buffer) >= self._log_batch_size
+                or time.monotonic() - self._log_last_flush >= self._log_flush_interval
+            )
+            if due:
+                self.flush_logs()
+
+    def flush_logs(self) -> int:
+        """Grava as linhas pendentes e atualiza os rollups hora/dia numa única transação."""
+        with self._lock:
+            self._log_last_flush = time.monotonic()
+            if not self._log_buffer:
+                return 0
+            rows, self._log_buffer = self._log_buffer, []
+            hourly: Dict[Tuple[int, str, str], List[int]] = {}
+            daily: Dict[Tuple[int, str, str], List[int]] = {}
+            for ts, level, component, message, _extra in rows:
+                size = len(message.encode("utf-8")) if message else 0
+                for agg, bucket in ((hourly, ts - ts % 3600), (daily, ts - ts % 86400)):
+                    entry = agg.setdefault((bucket, component, level), [0, 0])
+                    entry[0] += 1
+                    entry[1] += size
+            self._conn.executemany(
                 "INSERT INTO telemetry_log(ts, level, component, msg, extra) VALUES(?,?,?,?,?)",
-                (int(time.time()), level.upper(), component, message, payload),
+                rows,
             )
+            for table, agg in (("telemetry_rollup_hourly", hourly), ("telemetry_rollup_daily", daily)):
+                self._conn.executemany(
+                    f"INSERT INTO {table}(bucket_ts, component, level, count, msg_bytes) VALUES(?,?,?,?,?) "
+                    "ON CONFLICT(bucket_ts, component, level) DO UPDATE SET "
+                    "count = count + excluded.count, msg_bytes = msg_bytes + excluded.msg_bytes",
+                    [(bucket, component, level, c, b) for (bucket, component, level), (c, b) in agg.items()],
+                )
             self._conn.commit()
+            return len(rows)
+
+    def prune_logs(self, *, force: bool = False) -> int:
+        """Aplica a retenção (idade e nº de linhas) ao telemetry_log; no máximo 1x por hora."""
+        with self._lock:
+            now = time.time()
+            if not force and now - self._log_last_prune < TELEMETRY_PRUNE_INTERVAL_SEC:
+                return 0
+            self._log_last_prune = now
+            self.flush_logs()
+            removed = 0
+            if self._log_retention_days:
+                cutoff = int(now - self._log_retention_days * 86400)
+                removed += self._conn.execute("DELETE FROM telemetry_log WHERE ts < ?", (cutoff,)).rowcount
+            if self._log_max_rows:
+                removed += self._conn.execute(
+                    "DELETE FROM telemetry_log WHERE id <= "
+                    "(SELECT id FROM telemetry_log ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (self._log_max_rows,),
+                ).rowcount
+            self._conn.execute(
+                "DELETE FROM telemetry_rollup_hourly WHERE bucket_ts < ?",
+                (int(now - TELEMETRY_HOURLY_RETENTION_DAYS * 86400),),
+            )
+            self._conn.commit()
+        if removed:
+            logger.info(f"telemetry_log: {removed} linha(s) removidas pela retenção")
+        return removed
 
     def recent_logs(self, component: Optional[str] = None, limit: int = 20) -> Iterable[sqlite3.Row]:
         with self._lock:
+            self.flush_logs()
             if component:
                 return self._conn.execute(
                     "SELECT * FROM telemetry_log WHERE component=? ORDER BY ts DESC LIMIT ?",
@@ -349,6 +1161,163 @@ class Storage:
                 (limit,),
             ).fetchall()
 
+    def telemetry_rollups(
+        self, *, period: str = "day", since_ts: int = 0, component: Optional[str] = None
+    ) -> List[sqlite3.Row]:
+        """Contagens por (bucket, component, level) dos rollups ``hour`` ou ``day``."""
+        table = "telemetry_rollup_hourly" if period == "hour" else "telemetry_rollup_daily"
+        sql = f"SELECT bucket_ts, component, level, count, msg_bytes FROM {table} WHERE bucket_ts >= ?"
+        params: List[Any] = [int(since_ts)]
+        if component:
+            sql += " AND component = ?"
+            params.append(component)
+        sql += " ORDER BY bucket_ts, component, level"
+        with self._lock:
+            self.flush_logs()
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- AutoFee run metrics -------------------------------------------
+
+    def record_run_metrics(self, metrics: Dict[str, Any]) -> None:
+        """Grava o registro estruturado de uma execução do AutoFee (emit_run_metrics)."""
+        symptoms = metrics.get("symptoms") or {}
+        timings = metrics.get("timings") or {}
+        ts = int(metrics.get("ts") or time.time())
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO autofee_run_metrics(ts, dry_run, changed_up, changed_down, kept, "
+                "floor_lock, no_down_low, hold_small, cb_trigger, discovery, total_sec, data) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
+                (
+                    ts,
+                    int(bool(metrics.get("dry_run"))),
+                    int(metrics.get("changed_up") or 0),
+                    int(metrics.get("changed_down") or 0),
+                    int(metrics.get("kept") or 0),
+                    *(int(symptoms.get(key) or 0) for key in SYMPTOM_KEYS),
+                    timings.get("total"),
+                    json.dumps(metrics),
+                ),
+            )
+            self._conn.execute(
+                "DELETE FROM autofee_run_metrics WHERE ts < ?",
+                (ts - RUN_METRICS_RETENTION_DAYS * 86400,),
+            )
+            self._conn.commit()
+
+    def latest_run_metrics(self, *, include_dry_run: bool = True) -> Optional[Dict[str, Any]]:
+        sql = "SELECT data FROM autofee_run_metrics"
+        if not include_dry_run:
+            sql += " WHERE dry_run = 0"
+        sql += " ORDER BY ts DESC, id DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(sql).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row["data"])
+        except (json.JSONDecodeError, TypeError):
+            return None
+
+    # --- Engine runs (scheduler) ----------------------------------------
+
+    def record_engine_run(
+        self,
+        engine: str,
+        *,
+        started_at: float,
+        duration_sec: float,
+        lag_sec: float,
+        ok: bool,
+        overrun: bool,
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO engine_runs(engine, started_at, duration_sec, lag_sec, ok, overrun) VALUES(?,?,?,?,?,?)",
+                (engine, int(started_at), float(duration_sec), float(lag_sec), int(bool(ok)), int(bool(overrun))),
+            )
+            self._conn.execute(
+                "DELETE FROM engine_runs WHERE started_at < ?",
+                (int(started_at) - ENGINE_RUNS_RETENTION_DAYS * 86400,),
+            )
+            self._conn.commit()
+
+    def engine_run_stats(self, since_ts: Optional[int] = None) -> List[sqlite3.Row]:
+        """Resumo por engine: rodadas, erros, overruns e duração média/máxima."""
+        sql = (
+            "SELECT engine, COUNT(*) AS runs, SUM(1 - ok) AS errors, SUM(overrun) AS overruns, "
+            "AVG(duration_sec) AS avg_sec, MAX(duration_sec) AS max_sec, AVG(lag_sec) AS avg_lag_sec, "
+            "MAX(started_at) AS last_ts FROM engine_runs"
+        )
+        params: List[Any] = []
+        if since_ts is not None:
+            sql += " WHERE started_at >= ?"
+            params.append(int(since_ts))
+        sql += " GROUP BY engine ORDER BY engine"
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # --- Telegram outbox ------------------------------------------------
+
+    def enqueue_telegram(self, chunks: Sequence[str], parse_mode: Optional[str] = None) -> List[int]:
+        """Grava os chunks de uma mensagem na fila de entrega (telegram_outbox)."""
+        now = int(time.time())
+        ids: List[int] = []
+        with self._lock:
+            for text in chunks:
+                cur = self._conn.execute(
+                    "INSERT INTO telegram_outbox(created_at, parse_mode, text, next_attempt_at) VALUES(?,?,?,?)",
+                    (now, parse_mode, text, now),
+                )
+                ids.append(int(cur.lastrowid))
+            self._conn.commit()
+        return ids
+
+    def due_telegram(self, now: Optional[int] = None, limit: int = 50) -> List[sqlite3.Row]:
+        """Chunks pendentes na ordem de enfileiramento, até o primeiro ainda em espera."""
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, parse_mode, text, attempts, next_attempt_at "
+                "FROM telegram_outbox ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        due: List[sqlite3.Row] = []
+        for row in rows:
+            if row["next_attempt_at"] > now:
+                break  # preserva a ordem: nada passa na frente de um chunk em backoff
+            due.append(row)
+        return due
+
+    def next_telegram_attempt(self) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT next_attempt_at FROM telegram_outbox ORDER BY id LIMIT 1"
+            ).fetchone()
+        return int(row["next_attempt_at"]) if row else None
+
+    def ack_telegram(self, ids: Sequence[int]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM telegram_outbox WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def retry_telegram(self, ids: Sequence[int], next_attempt_at: int, error: str) -> None:
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE telegram_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(int(next_attempt_at), error[:500], i) for i in ids],
+            )
+            self._conn.commit()
+
+    def telegram_outbox_size(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS n FROM telegram_outbox").fetchone()
+        return int(row["n"]) if row else 0
+
     # --- Exclusions ------------------------------------------------------
 
     def list_exclusions(self) -> Dict[str, Optional[str]]:
@@ -336,12 +336,17 @@ def load_rebal_costs(db_path: str, lookback_days: int = 7):
     t1 = t2 - timedelta(days=lookback_days)
     t1s, t2s = to_sqlite_str(t1), to_sqlite_str(t2)
 
+    # agregado no SQLite (GROUP BY) em vez de somar linha a linha
     sql = """
-    SELECT rebal_chan, value, fee
+    SELECT rebal_chan,
+           SUM(CAST(COALESCE(value, 0) AS INTEGER)),
+           SUM(CAST(COALESCE(fee, 0) AS INTEGER)),
+           COUNT(*)
     FROM gui_payments
     WHERE rebal_chan IS NOT NULL
       AND chan_out IS NOT NULL
       AND creation_date BETWEEN ? AND ?
+    GROUP BY rebal_chan
     """
     per_value = {}
     per_fee   = {}
@@ -351,13 +356,13 @@ def load_rebal_costs(db_path: str, lookback_days: int = 7):
 
     conn = sqlite3.connect(db_path)
     cur  = conn.cursor()
-    for (rebal_chan, value, fee) in cur.execute(sql, (t1s, t2s)).fetchall():
+    for (rebal_chan, value, fee, count) in cur.execute(sql, (t1s, t2s)).fetchall():
         cid = str(rebal_chan)
         v = int(value or 0)
         f = int(fee or 0)
         per_value[cid] = per_value.get(cid, 0) + v
         per_fee[cid]   = per_fee.get(cid,   0) + f
-        per_count[cid] = per_count.get(cid, 0) + 1
+        per_count[cid] = per_count.get(cid, 0) + int(count or 0)
         total_v += v
         total_f += f
     conn.close()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""Benchmark ponta a ponta dos engines (AutoFee main(), AR Trigger, Param Tuner) sobre
+um banco LNDg sintético (tools/gen_lndg_db.py), com LND/LNDg API/Amboss/Telegram
+substituídos por stubs. Cada engine roda num subprocesso próprio (pico de RSS por
+engine); grava tempo por ciclo, RSS e tempos por etapa em JSON. ``compare`` aponta
+regressões entre duas execuções."""
+import argparse
+import datetime
+import functools
+import inspect
+import json
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+ENGINES = ("autofee", "ar", "tuner")
+
+
+# --- Stubs dos serviços externos ---
+
+class StubLncli:
+    """lncli com listchannels montado a partir do gui_channels do banco sintético."""
+
+    def __init__(self, db_path: str) -> None:
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute(
+            "SELECT chan_id, funding_txid, output_index, capacity, local_balance, remote_balance, remote_pubkey, "
+            "is_active, initiator FROM gui_channels WHERE is_open = 1"
+        ).fetchall()
+        conn.close()
+        self.payload = {"channels": [
+            {
+                "chan_id": str(chan_id), "scid": str(chan_id), "channel_point": f"{txid}:{idx}",
+                "capacity": str(cap), "local_balance": str(local), "remote_balance": str(remote),
+                "remote_pubkey": pubkey, "active": bool(active), "initiator": bool(initiator),
+            }
+            for chan_id, txid, idx, cap, local, remote, pubkey, active, initiator in rows
+        ]}
+        self.updates = 0
+
+    def listchannels(self):
+        return self.payload
+
+    def updatechanpolicy(self, chan_point, ppm, **kwargs) -> None:
+        self.updates += 1
+
+
+class StubBos:
+    def __init__(self) -> None:
+        self.updates = 0
+
+    def set_fee(self, pubkey, ppm, **kwargs) -> None:
+        self.updates += 1
+
+
+class StubAmboss:
+    """Séries determinísticas por pubkey (mesma forma do AmbossService)."""
+
+    def historical_series(self, pubkey, metric, submetric, *, from_date=None, ttl=None, with_stats=False):
+        base = 50 + int(pubkey[2:8], 16) % 1500
+        vals = [base * (1 + ((day * 7 + len(metric)) % 11 - 5) / 50) for day in range(7)]
+        return (vals, None) if with_stats else vals
+
+    def prefetch_series(self, items, *, from_date=None, ttl=None, max_workers=1, batch_size=None, with_stats=False):
+        return {item: self.historical_series(*item, with_stats=with_stats) for item in items}
+
+
+class StubLNDgAPI:
+    """LNDg API: list_channels lê o gui_channels; update_channel só conta."""
+
+    def __init__(self, db_path: str) -> None:
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        self.channels = [
+            dict(row) for row in conn.execute(
+                "SELECT chan_id, alias, capacity, local_balance, local_fee_rate, remote_fee_rate, auto_rebalance, "
+                "ar_out_target, ar_in_target, ar_max_cost FROM gui_channels WHERE is_open = 1"
+            )
+        ]
+        conn.close()
+        self.updates = 0
+
+    def list_channels(self):
+        return [dict(ch) for ch in self.channels]
+
+    def update_channel(self, chan_id, payload) -> None:
+        self.updates += 1
+
+
+class StageTimer:
+    """Embrulha métodos do engine e acumula o tempo de cada etapa no ciclo atual."""
+
+    def __init__(self) -> None:
+        self.current = {}
+
+    def _add(self, name: str, secs: float) -> None:
+        self.current[name] = self.current.get(name, 0.0) + secs
+
+    def wrap(self, obj, attr: str, name: str) -> None:
+        func = getattr(obj, attr)
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self._add(name, time.perf_counter() - t0)
+        else:
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._add(name, time.perf_counter() - t0)
+        setattr(obj, attr, timed)
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: KiB no Linux, bytes no macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+# --- Processo filho: um engine, N ciclos ---
+
+def build_engine(name: str, args, storage, timer: StageTimer):
+    from brln_orchestrator.services.channel_snapshot import ChannelSnapshotProvider
+    from brln_orchestrator.services.lndg_rollup import LNDgRollupService
+    from brln_orchestrator.services.telegram import TelegramService
+
+    telegram = TelegramService(None, None, storage)
+    rollup = None if args.no_rollup else LNDgRollupService(storage, args.db)
+    if name == "autofee":
+        from brln_orchestrator.engines.autofee import AutoFeeEngine
+
+        lncli = StubLncli(args.db)
+        engine = AutoFeeEngine(storage, lncli, StubBos(), StubAmboss(), telegram, ROOT / "brln-autofee.py",
+                               rollup, ChannelSnapshotProvider(lncli, None))
+        timer.wrap(engine, "_load_forward_aggregates", "forward_aggregates")
+        timer.wrap(engine, "_load_rebal_aggregates", "rebal_aggregates")
+        return engine, lncli, lambda: engine.run(
+            dry_run=args.dry_run, mode=args.mode, didactic_explain=False, didactic_detailed=False)
+    if name == "ar":
+        from brln_orchestrator.engines.ar import ARTriggerEngine
+
+        api = StubLNDgAPI(args.db)
+        engine = ARTriggerEngine(storage, api, telegram, ROOT / "lndg_AR_trigger.py", rollup)
+        timer.wrap(engine, "_fetch_all_channels", "fetch_channels")
+        timer.wrap(engine, "_load_rebal_costs", "rebal_costs")
+        timer.wrap(engine, "_legacy_load_rebal_costs", "rebal_costs")
+        return engine, api, lambda: engine.run(dry_run=args.dry_run, mode=args.mode, no_telegram_when_no_changes=True)
+    from brln_orchestrator.engines.tuner import ParamTunerEngine
+
+    engine = ParamTunerEngine(storage, telegram, ROOT / "ai_param_tuner.py", rollup)
+    timer.wrap(engine, "_get_7d_kpis", "kpis_7d")
+    timer.wrap(engine, "_get_assisted_kpis", "assisted_kpis")
+    timer.wrap(engine, "_read_symptoms_from_telemetry", "symptoms")
+    return engine, None, lambda: engine.run(dry_run=args.dry_run, force_telegram=False, no_telegram=True)
+
+
+def engine_child(args) -> int:
+    sys.path.insert(0, str(ROOT))
+    result = {"ok": False}
+    try:
+        from brln_orchestrator.storage import Storage
+
+        t0 = time.perf_counter()
+        storage = Storage(Path(args.storage))
+        timer = StageTimer()
+        _engine, counter, call = build_engine(args.engine, args, storage, timer)
+        result["init_sec"] = round(time.perf_counter() - t0, 4)
+        walls, cpus, stages = [], [], []
+        for _ in range(args.cycles):
+            timer.current = {}
+            t0, c0 = time.perf_counter(), time.process_time()
+            call()
+            walls.append(round(time.perf_counter() - t0, 4))
+            cpus.append(round(time.process_time() - c0, 4))
+            cycle = {k: round(v, 4) for k, v in timer.current.items()}
+            if args.engine == "autofee":
+                metrics = storage.latest_run_metrics() or {}
+                for key, secs in (metrics.get("timings") or {}).items():
+                    cycle[f"main.{key}"] = secs
+            stages.append(cycle)
+        names = sorted({k for cycle in stages for k in cycle})
+        result.update({
+            "ok": True,
+            "cycles": args.cycles,
+            "walls": walls,
+            "wall_first": walls[0],
+            "wall_best": min(walls),
+            "cpu_best": min(cpus),
+            "stages": {k: min(cycle.get(k, 0.0) for cycle in stages) for k in names},
+            "stages_cycles": stages,
+            "updates": getattr(counter, "updates", None),
+        })
+        storage.close()
+    except BaseException as exc:  # o pai registra o erro (ex.: dependência ausente)
+        result["error"] = f"{type(exc).__name__}: {exc}"
+        print(traceback.format_exc(), file=sys.stderr)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    Path(args.out).write_text(json.dumps(result))
+    return 0 if result["ok"] else 1
+
+
+# --- run ---
+
+def git_rev():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def db_stats(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    stats = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+             for table in ("gui_channels", "gui_forwards", "gui_payments")}
+    conn.close()
+    stats["size_bytes"] = Path(path).stat().st_size
+    return stats
+
+
+def cmd_run(args) -> int:
+    sys.path.insert(0, str(ROOT))
+    from brln_orchestrator.storage import Storage
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="bench_e2e_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    generated = None
+    db = args.db
+    if not db:
+        sys.path.insert(0, str(Path(__file__).resolve().parent))
+        from gen_lndg_db import generate
+
+        db = str(workdir / "lndg.sqlite3")
+        generated = generate(db, channels=args.channels, forwards=args.forwards, days=args.days, seed=args.seed)
+        print(f"banco sintético: {generated['forwards']} forwards, {generated['payments']} pagamentos, "
+              f"{generated['channels']} canais ({generated['gen_sec']:.1f}s)", file=sys.stderr)
+
+    # um Storage para todos: AR e Tuner enxergam o estado e as métricas do AutoFee
+    storage_path = workdir / "orchestrator.sqlite3"
+    if storage_path.exists():
+        storage_path.unlink()
+    storage = Storage(storage_path)
+    storage.update_secrets(lndg_db_path=str(Path(db).resolve()))
+    storage.close()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git_rev": git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cycles": args.cycles,
+            "mode": args.mode,
+            "dry_run": args.dry_run,
+            "rollup": not args.no_rollup,
+            "db": db_stats(db),
+            "generator": generated,
+        },
+        "engines": {},
+    }
+    for name in args.engines:
+        out = workdir / f"result_{name}.json"
+        cmd = [sys.executable, str(Path(__file__).resolve()), "_engine", name, "--db", str(Path(db).resolve()),
+               "--storage", str(storage_path), "--out", str(out), "--cycles", str(args.cycles), "--mode", args.mode]
+        if args.dry_run:
+            cmd.append("--dry-run")
+        if args.no_rollup:
+            cmd.append("--no-rollup")
+        t0 = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=workdir, stdout=None if args.verbose else subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+        if out.exists():
+            result = json.loads(out.read_text())
+        else:
+            result = {"ok": False, "error": f"processo saiu com código {proc.returncode}"}
+        result["process_sec"] = round(time.perf_counter() - t0, 3)
+        if not result["ok"]:
+            result["stderr_tail"] = proc.stderr.strip().splitlines()[-5:]
+        report["engines"][name] = result
+        if result["ok"]:
+            print(f"{name:>8}: melhor {result['wall_best']:.3f}s (1º ciclo {result['wall_first']:.3f}s), "
+                  f"pico RSS {result['peak_rss_mb']:.0f} MB", file=sys.stderr)
+        else:
+            print(f"{name:>8}: ERRO {result['error']}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"resultado gravado em {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if not args.workdir and not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if all(r["ok"] for r in report["engines"].values()) else 1
+
+
+# --- compare ---
+
+def flatten(result: dict) -> dict:
+    values = {"wall_best": result["wall_best"], "peak_rss_mb": result["peak_rss_mb"]}
+    for name, secs in result.get("stages", {}).items():
+        values[f"stage.{name}"] = secs
+    return values
+
+
+def cmd_compare(args) -> int:
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+    regressions = 0
+    for key in ("db", "cycles", "mode", "dry_run", "rollup"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"aviso: '{key}' difere entre as execuções ({base['meta'].get(key)} x {new['meta'].get(key)})")
+    print(f"{'engine':>8} {'métrica':<28} {'base':>10} {'novo':>10} {'delta':>8}")
+    for name in ENGINES:
+        b, n = base["engines"].get(name), new["engines"].get(name)
+        if not b or not n:
+            continue
+        if not b.get("ok") or not n.get("ok"):
+            status = "erro" if not n.get("ok") else "sem base"
+            print(f"{name:>8} {'-':<28} {'':>10} {'':>10} {'':>8}  {status}")
+            regressions += int(not n.get("ok") and bool(b.get("ok")))
+            continue
+        bv, nv = flatten(b), flatten(n)
+        for key in sorted(bv.keys() & nv.keys()):
+            old, cur = bv[key], nv[key]
+            delta = (cur - old) / old if old else 0.0
+            floor = args.min_mb if key == "peak_rss_mb" else args.min_sec
+            flag = ""
+            if cur - old > floor and delta > args.threshold:
+                flag = "REGRESSÃO"
+                regressions += 1
+            elif old - cur > floor and -delta > args.threshold:
+                flag = "melhor"
+            print(f"{name:>8} {key:<28} {old:>10.3f} {cur:>10.3f} {delta:>+7.1%}  {flag}")
+    if regressions:
+        print(f"{regressions} regressão(ões) acima de {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="roda os engines e grava o resultado")
+    run.add_argument("--db", help="banco LNDg existente (padrão: gera um sintético)")
+    run.add_argument("--channels", type=int, default=200)
+    run.add_argument("--forwards", type=int, default=200_000)
+    run.add_argument("--days", type=float, default=30.0)
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    run.add_argument("--cycles", type=int, default=3, help="ciclos por engine (o 1º inclui cache/rollup frios)")
+    run.add_argument("--mode", default="conservador")
+    run.add_argument("--dry-run", action="store_true")
+    run.add_argument("--no-rollup", action="store_true", help="engines leem o LNDg por SQL direto")
+    run.add_argument("--workdir", help="diretório de trabalho (mantido); padrão: temporário")
+    run.add_argument("--keep", action="store_true", help="não apaga o diretório temporário")
+    run.add_argument("--verbose", action="store_true", help="mostra a saída dos engines")
+    run.add_argument("-o", "--output", help="arquivo JSON de saída (padrão: stdout)")
+
+    cmp_ = sub.add_parser("compare", help="compara dois resultados e sai com 1 se houver regressão")
+    cmp_.add_argument("base")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--threshold", type=float, default=0.10, help="piora relativa tolerada (padrão 10%%)")
+    cmp_.add_argument("--min-sec", type=float, default=0.02, help="diferença mínima em segundos p/ contar")
+    cmp_.add_argument("--min-mb", type=float, default=5.0, help="diferença mínima de RSS em MB p/ contar")
+
+    child = sub.add_parser("_engine")
+    child.add_argument("engine", choices=ENGINES)
+    child.add_argument("--db", required=True)
+    child.add_argument("--storage", required=True)
+    child.add_argument("--out", required=True)
+    child.add_argument("--cycles", type=int, default=1)
+    child.add_argument("--mode", default="conservador")
+    child.add_argument("--dry-run", action="store_true")
+    child.add_argument("--no-rollup", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        return cmd_run(args)
+    if args.command == "compare":
+        return cmd_compare(args)
+    return engine_child(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Benchmark do núcleo de taxa com 100, 1.000 e 10.000 canais sintéticos:
+
+- estágios (tools/fee_kernel.py): laço escalar fee_core_scalar vs fee_core_arrays;
+- ChannelCore (o que FEE_KERNEL_NUMPY troca no decide_channels): channel_core() por
+  canal vs fee_core_batch().
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import fee_kernel
+from fee_kernel_parity import columns, load_legacy, synthetic_channels, synthetic_decisions
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    legacy = load_legacy()
+    print(f"{'':>8} {'estágios':^32} {'ChannelCore':^32}")
+    print(f"{'canais':>8} {'escalar ms':>11} {'numpy ms':>10} {'speedup':>8} "
+          f"{'escalar ms':>11} {'numpy ms':>10} {'speedup':>8}")
+    for n in args.sizes:
+        rows = synthetic_channels(legacy, n)
+        cols = columns(rows)
+        channels, prev_states, _params = synthetic_decisions(legacy, n)
+        scalar = best_of(lambda: [fee_kernel.fee_core_scalar(legacy, **row) for row in rows], args.repeat)
+        core_scalar = best_of(lambda: [legacy.channel_core(c, p) for c, p in zip(channels, prev_states)],
+                              args.repeat)
+        if fee_kernel.np is None:
+            print(f"{n:>8} {scalar * 1000:>11.2f} {'-':>10} {'-':>8} {core_scalar * 1000:>11.2f} {'-':>10} {'-':>8}")
+            continue
+        vector = best_of(lambda: fee_kernel.fee_core_arrays(legacy, **cols), args.repeat)
+        core_vector = best_of(lambda: legacy.fee_core_batch(channels, prev_states), args.repeat)
+        print(f"{n:>8} {scalar * 1000:>11.2f} {vector * 1000:>10.2f} {scalar / vector:>7.1f}x "
+              f"{core_scalar * 1000:>11.2f} {core_vector * 1000:>10.2f} {core_scalar / core_vector:>7.1f}x")
+    if fee_kernel.np is None:
+        print("numpy não instalado: só o caminho escalar foi medido")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
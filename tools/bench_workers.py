@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Benchmark de decide_channels() com 1 vs N processos (--workers) sobre canais
+sintéticos. Confere também que as decisões saem idênticas e na mesma ordem."""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class FrozenTime:
+    """time congelado p/ a comparação (os workers herdam via fork)."""
+
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def load_legacy():
+    spec = importlib.util.spec_from_file_location("legacy_autofee", ROOT / "brln-autofee.py")
+    module = importlib.util.module_from_spec(spec)
+    # os workers recebem as funções por referência: o módulo precisa estar registrado
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)  # type: ignore[union-attr]
+    return module
+
+
+def synthetic_inputs(legacy, n: int, now: int, seed: int = 0):
+    rng = random.Random(seed)
+    channels, prev_states = [], []
+    for k in range(n):
+        cap = rng.choice((1_000_000, 2_000_000, 5_000_000, 10_000_000))
+        out_count = rng.choice((0, rng.randint(1, 300)))
+        out_amt = rng.randint(0, cap * 3) if out_count else 0
+        p65 = rng.uniform(50, 1500)
+        channels.append(legacy.ChannelInputs(
+            cid=str(800_000_000_000_000 + k),
+            alias=f"peer{k}",
+            local_ppm=rng.choice((0, 50, 100, 300, 800, 1500)),
+            remote_ppm=rng.randint(0, 2000),
+            pubkey="02" + f"{k:064x}",
+            chan_point=f"{k:064x}:0",
+            is_excluded=False,
+            in_shard=True,
+            active=rng.random() > 0.05,
+            capacity=cap,
+            local_balance=rng.randint(0, cap),
+            initiator=rng.random() < 0.5,
+            status_prev={},
+            out_fee_sat=int(out_amt * rng.uniform(0, 0.002)),
+            out_amt_sat=out_amt,
+            out_count=out_count,
+            out_amt_sat_1d=out_amt // 7,
+            in_amt_sat=rng.randint(0, cap * 3),
+            in_count=rng.randint(0, 300),
+            peer_incoming_msat=rng.randint(0, 10**12),
+            rebal_value_sat=rng.choice((0, rng.randint(1, cap))),
+            rebal_cost_ppm=rng.choice((None, rng.uniform(0, 1500))),
+            seed_summary=legacy.make_seed_summary(7, p65, p65 * 1.4, {
+                "inc_median": p65 * 0.9, "inc_mean": p65, "inc_std": p65 * 0.3,
+                "inc_wcorr": p65, "out_wcorr": p65 * rng.uniform(0.5, 1.5),
+            }),
+        ))
+        prev_states.append(rng.choice((None, {
+            "last_ppm": rng.randint(10, 1500), "last_dir": rng.choice(("up", "down", "flat")),
+            "last_ts": now - rng.randint(0, 10 * 86400), "baseline_fwd7d": rng.randint(0, 200),
+            "low_streak": rng.randint(0, 20), "last_seed": rng.uniform(50, 1500),
+            "first_seen_ts": now - rng.randint(0, 90 * 86400),
+        })))
+    params = legacy.DecisionParams(
+        dry_run=False, shard_slot=None, total_incoming_msat=10**12 * n // 2, avg_share=1.0 / n,
+        total_out_fee_sat=sum(c.out_fee_sat for c in channels), rebal_cost_ppm_global=600.0,
+        neg_margin_global=False,
+    )
+    return channels, params, prev_states
+
+
+def best_of(func, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main() -> int:
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--channels", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, min(4, cpus), cpus}))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy = load_legacy()
+    now = 1_790_000_000
+    legacy.time = FrozenTime(now)
+    legacy.DECISION_WORKERS_MIN_CHANNELS = 1
+
+    print(f"{'canais':>8} {'workers':>8} {'tempo s':>9} {'speedup':>8}  iguais")
+    for n in args.channels:
+        channels, params, prev_states = synthetic_inputs(legacy, n, now)
+        base_secs, base = best_of(lambda: legacy.decide_channels(channels, params, prev_states, workers=1), args.repeat)
+        for w in args.workers:
+            if w == 1:
+                secs, same = base_secs, True
+            else:
+                secs, got = best_of(lambda: legacy.decide_channels(channels, params, prev_states, workers=w), args.repeat)
+                same = got == base
+            print(f"{n:>8} {w:>8} {secs:>9.3f} {base_secs / secs:>7.2f}x  {'sim' if same else 'NÃO'}")
+            if not same:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Núcleo de taxa por canal encadeado em versão escalar e NumPy, para paridade e
+benchmark dos estágios que o decide_channel usa.
+
+fee_core_scalar só encadeia os helpers do brln-autofee.py que o decide_channel
+chama (liquidity_adjust, dynamic_step_cap_frac, router_step_cap_frac, step_toward,
+rebal_cost_floor, clamp_ppm): não há cópia da regra aqui. fee_core_arrays é o kernel
+NumPy dos mesmos estágios (step cap base e piso de rebal vêm das versões em array do
+próprio legado, as mesmas do FEE_KERNEL_NUMPY) e tem de reproduzir fee_core_scalar
+exatamente (fee_kernel_parity.py). O decide_channel intercala esses estágios com
+persistência, discovery, boosts, explorer, circuit breaker e peg: ``final`` aqui não
+é a taxa final do main().
+"""
+try:
+    import numpy as np
+except ImportError:  # opcional: sem numpy só o caminho escalar roda
+    np = None
+
+
+def fee_core_scalar(legacy, seed, local_ppm, out_ratio, fwd_count, chan_rebal_ppm,
+                    is_router=False, new_inbound=False, min_step_up=None):
+    """Referência escalar; devolve (target, raw_step, floor, final)."""
+    target = legacy.liquidity_adjust(seed + legacy.COLCHAO_PPM, out_ratio, fwd_count, new_inbound)
+    cap_frac = legacy.dynamic_step_cap_frac(out_ratio, fwd_count)
+    if is_router:
+        cap_frac = legacy.router_step_cap_frac(cap_frac)
+    if min_step_up is None:
+        min_step_up = legacy.STEP_MIN_STEP_PPM
+    raw_step = legacy.step_toward(local_ppm, target, cap_frac, min_step_up)
+    floor = legacy.rebal_cost_floor(chan_rebal_ppm) if chan_rebal_ppm > 0 else legacy.MIN_PPM
+    final = legacy.clamp_ppm(max(raw_step, floor))
+    return target, raw_step, floor, final
+
+
+def fee_core_arrays(legacy, seed, local_ppm, out_ratio, fwd_count, chan_rebal_ppm,
+                    is_router=None, new_inbound=None, min_step_up=None):
+    """Versão NumPy de fee_core_scalar: arrays com um item por canal; devolve
+    (target, raw_step, floor, final) — target/raw_step float64, floor/final int64."""
+    if np is None:
+        raise RuntimeError("numpy não instalado: use fee_core_scalar")
+    seed = np.asarray(seed, dtype=np.float64)
+    n = seed.shape[0]
+    local_ppm = np.asarray(local_ppm, dtype=np.int64)
+    out_ratio = np.asarray(out_ratio, dtype=np.float64)
+    fwd_count = np.asarray(fwd_count, dtype=np.int64)
+    chan_rebal_ppm = np.asarray(chan_rebal_ppm, dtype=np.float64)
+    no = np.zeros(n, dtype=bool)
+    is_router = no if is_router is None else np.asarray(is_router, dtype=bool)
+    new_inbound = no if new_inbound is None else np.asarray(new_inbound, dtype=bool)
+    if min_step_up is None:
+        min_step_up = np.full(n, int(legacy.STEP_MIN_STEP_PPM), dtype=np.int64)
+    else:
+        min_step_up = np.asarray(min_step_up, dtype=np.int64)
+
+    # liquidez (liquidity_adjust)
+    low = out_ratio < legacy.LOW_OUTBOUND_THRESH
+    high = ~low & (out_ratio > legacy.HIGH_OUTBOUND_THRESH)
+    idle = (fwd_count == 0) & (out_ratio > 0.60)
+    target = seed + legacy.COLCHAO_PPM
+    target = np.where(low & ~new_inbound, target * (1.0 + legacy.LOW_OUTBOUND_BUMP), target)
+    target = np.where(high, target * (1.0 - legacy.HIGH_OUTBOUND_CUT), target)
+    target = np.where(high & idle, target * (1.0 - legacy.IDLE_EXTRA_CUT), target)
+
+    # step cap (dynamic_step_cap_frac, router_step_cap_frac, step_toward)
+    cap_frac = legacy.dynamic_step_cap_frac_arrays(np, out_ratio, fwd_count)
+    cap_frac = np.where(is_router, np.minimum(0.50, cap_frac + legacy.ROUTER_STEP_CAP_BONUS), cap_frac)
+    min_step = np.where(target <= local_ppm, int(legacy.STEP_MIN_STEP_PPM), min_step_up)
+    cap = np.maximum(np.trunc(np.abs(local_ppm) * cap_frac).astype(np.int64), min_step)
+    delta = target - local_ppm
+    stepped = np.where(delta > cap, local_ppm + cap, np.where(delta < -cap, local_ppm - cap, target))
+    # local == 0: target cru; local < 0: apply_step_cap2 devolve clamp(target)
+    raw_step = np.where(local_ppm > 0, stepped,
+                        np.where(local_ppm == 0, target,
+                                 legacy.clamp_ppm_arrays(np, target).astype(np.float64)))
+
+    # piso de rebal (rebal_cost_floor) e clamp final
+    floor = np.where(chan_rebal_ppm > 0, legacy.rebal_cost_floor_arrays(np, chan_rebal_ppm), legacy.MIN_PPM)
+    final = legacy.clamp_ppm_arrays(np, np.maximum(raw_step, floor))
+    return target, raw_step, floor, final
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Paridade do kernel NumPy do núcleo de taxa, em dois níveis:
+
+1. estágios: fee_core_arrays (tools/fee_kernel.py) contra fee_core_scalar, que só
+   encadeia os helpers que o decide_channel chama;
+2. decisão: decide_channels com FEE_KERNEL_NUMPY desligado e ligado, sobre canais e
+   estados sintéticos: ChannelCore e Decision (linhas, estado, update) têm de ser iguais.
+"""
+import argparse
+import importlib.util
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import fee_kernel
+
+ROOT = Path(__file__).resolve().parent.parent
+FIELDS = ("target", "raw_step", "floor", "final")
+
+
+def load_legacy():
+    spec = importlib.util.spec_from_file_location("legacy_autofee", ROOT / "brln-autofee.py")
+    module = importlib.util.module_from_spec(spec)
+    # decide_channels/pickle resolvem funções por módulo.nome
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)  # type: ignore[union-attr]
+    return module
+
+
+def synthetic_channels(legacy, n: int, seed: int = 0) -> list[dict]:
+    """Canais aleatórios, com bordas de propósito: local 0, limiares exatos de out_ratio,
+    meios inteiros (arredondamento), sem custo de rebal, valores além de MAX_PPM e
+    passo mínimo de subida do extreme drain."""
+    rng = random.Random(seed)
+    min_steps = (legacy.STEP_MIN_STEP_PPM, legacy.EXTREME_DRAIN_MIN_STEP_PPM, legacy.EXTREME_DRAIN_TURBO_MIN_STEP_PPM)
+    ratios = (0.0, 0.03, 0.05, 0.20, 0.60, 1.0)
+    rows = []
+    for _ in range(n):
+        seed_ppm = rng.choice((rng.uniform(0, 2500), rng.randint(0, 2500) + 0.5, float(rng.randint(0, 2500))))
+        rows.append({
+            "seed": seed_ppm,
+            "local_ppm": rng.choice((0, rng.randint(1, 3000))),
+            "out_ratio": rng.choice((rng.random(), rng.choice(ratios))),
+            "fwd_count": rng.choice((0, rng.randint(1, 500))),
+            "chan_rebal_ppm": rng.choice((0.0, rng.uniform(0, 2500), rng.randint(0, 2500) + 0.5)),
+            "is_router": rng.random() < 0.3,
+            "new_inbound": rng.random() < 0.1,
+            "min_step_up": rng.choice(min_steps),
+        })
+    return rows
+
+
+def columns(rows: list[dict]) -> dict:
+    return {key: [row[key] for row in rows] for key in rows[0]}
+
+
+def synthetic_decisions(legacy, n: int, seed: int = 0):
+    """(channel_list, prev_states, params) para decide_channels: saldos nos limiares de
+    liquidez, canais sem capacidade, custo de rebal 7d ou só memorizado, estados vazios."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    channels, prev_states = [], []
+    for k in range(n):
+        cap = rng.choice((0, 1_000_000, 2_000_000, 5_000_000, 16_777_215))
+        local = int(cap * rng.choice((rng.random(), 0.0, 0.03, 0.05, 0.20, 0.60, 1.0)))
+        out_count = rng.choice((0, rng.randint(1, 400)))
+        out_amt = out_count * rng.randint(1_000, 400_000)
+        in_count = rng.choice((0, rng.randint(1, 400)))
+        means = {name: rng.choice((None, rng.uniform(1, 2000))) for name, _m, _s in legacy.SEED_SUMMARY_SERIES}
+        p65 = rng.uniform(1, 2000)
+        channels.append(legacy.ChannelInputs(
+            cid=str(800_000 << 40 | k), alias=f"peer-{k}", local_ppm=rng.choice((0, rng.randint(1, 3000))),
+            remote_ppm=rng.randint(0, 3000), pubkey=rng.choice((None, f"02{k:064x}")), chan_point=f"{k:064x}:0",
+            is_excluded=rng.random() < 0.05, in_shard=True, active=rng.choice((True, True, True, None, False)),
+            capacity=cap, local_balance=local, initiator=rng.choice((True, False, None)), status_prev={},
+            out_fee_sat=int(out_amt * rng.uniform(0, 0.002)), out_amt_sat=out_amt, out_count=out_count,
+            out_amt_sat_1d=out_amt // 7, in_amt_sat=in_count * rng.randint(1_000, 400_000), in_count=in_count,
+            peer_incoming_msat=rng.randint(0, 10**10), rebal_value_sat=rng.choice((0, rng.randint(1, 10**6))),
+            rebal_cost_ppm=rng.choice((None, 0.0, rng.uniform(1, 2500), rng.randint(0, 2500) + 0.5)),
+            seed_summary=legacy.make_seed_summary(rng.randint(0, 168), p65, p65 * rng.uniform(1, 3), means),
+        ))
+        prev_states.append(rng.choice((None, {}, {
+            "last_seed": rng.uniform(1, 2000),
+            "last_ppm": rng.randint(1, 3000),
+            "last_ts": now - rng.randint(0, 30 * 86400),
+            "last_dir": rng.choice(("up", "down", "flat")),
+            "low_streak": rng.randint(0, 40),
+            "baseline_fwd7d": rng.randint(0, 300),
+            "first_seen_ts": now - rng.randint(0, 60 * 86400),
+            "last_rebal_cost_ppm": rng.choice((0.0, rng.uniform(1, 2500))),
+            "last_rebal_cost_ts": now - rng.randint(0, 30 * 86400),
+            "class_label": rng.choice(("unknown", "sink", "source", "router")),
+            "class_conf": rng.random(),
+            "bias_ema": rng.uniform(-1, 1),
+        })))
+    params = legacy.DecisionParams(
+        dry_run=True, shard_slot=None, total_incoming_msat=10**12, avg_share=1.0 / max(1, n),
+        total_out_fee_sat=10**6, rebal_cost_ppm_global=rng.uniform(100, 1500), neg_margin_global=rng.random() < 0.5,
+    )
+    return channels, prev_states, params
+
+
+class FrozenTime:
+    """time do legado com time() fixo: as duas passadas do decide_channels veem o mesmo instante."""
+
+    def __init__(self, now: float) -> None:
+        self._now = now
+
+    def time(self) -> float:
+        return self._now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def check_stages(legacy, n: int, seed: int) -> int:
+    rows = synthetic_channels(legacy, n, seed)
+    expected = [fee_kernel.fee_core_scalar(legacy, **row) for row in rows]
+    arrays = fee_kernel.fee_core_arrays(legacy, **columns(rows))
+    mismatches = 0
+    for idx, row in enumerate(rows):
+        got = tuple(a[idx].item() for a in arrays)
+        if got != tuple(expected[idx]):
+            mismatches += 1
+            if mismatches <= 10:
+                diff = {f: (e, g) for f, e, g in zip(FIELDS, expected[idx], got) if e != g}
+                print(f"canal {idx}: {diff} entrada={row}")
+    print(f"estágios: {len(rows)} canais, {mismatches} divergência(s)")
+    return mismatches
+
+
+def check_decisions(legacy, n: int, seed: int) -> int:
+    channels, prev_states, params = synthetic_decisions(legacy, n, seed)
+    scalar_cores = [legacy.channel_core(c, p) for c, p in zip(channels, prev_states)]
+    batch_cores = legacy.fee_core_batch(channels, prev_states)
+    mismatches = 0
+    for idx, (exp, got) in enumerate(zip(scalar_cores, batch_cores)):
+        if exp != got:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"ChannelCore {idx}: escalar={exp} numpy={got}")
+
+    saved = legacy.time, legacy.FEE_KERNEL_NUMPY
+    legacy.time = FrozenTime(time.time())
+    try:
+        legacy.FEE_KERNEL_NUMPY = False
+        expected = legacy.decide_channels(channels, params, prev_states, workers=1)
+        legacy.FEE_KERNEL_NUMPY = True
+        got = legacy.decide_channels(channels, params, prev_states, workers=1)
+    finally:
+        legacy.time, legacy.FEE_KERNEL_NUMPY = saved
+    for idx, (exp, dec) in enumerate(zip(expected, got)):
+        if exp != dec:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"Decision {idx} ({exp.cid}) diverge: {exp.lines} != {dec.lines}")
+    print(f"decide_channels: {len(channels)} canais, {mismatches} divergência(s)")
+    return mismatches
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=20000)
+    parser.add_argument("--decisions", type=int, default=5000, help="canais na paridade do decide_channels")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    legacy = load_legacy()
+    if fee_kernel.np is None:
+        print("numpy não instalado: nada a comparar")
+        return 2
+    mismatches = check_stages(legacy, args.channels, args.seed)
+    mismatches += check_decisions(legacy, args.decisions, args.seed)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
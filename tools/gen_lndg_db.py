@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Gera um db.sqlite3 sintético no schema do LNDg (gui_channels, gui_forwards,
+gui_payments) para benchmarks: N canais, M forwards com volume por peer em lei de
+potência e fluxos de rebal (source -> sink) contínuos ao longo da janela."""
+import argparse
+import datetime
+import hashlib
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+SCHEMA = (
+    """CREATE TABLE gui_channels (
+        chan_id VARCHAR(20) PRIMARY KEY, remote_pubkey VARCHAR(66), funding_txid VARCHAR(64),
+        output_index INTEGER, capacity BIGINT, local_balance BIGINT, remote_balance BIGINT,
+        unsettled_balance BIGINT, initiator BOOL, alias VARCHAR(32), local_base_fee INTEGER,
+        local_fee_rate INTEGER, local_inbound_base_fee INTEGER, local_inbound_fee_rate INTEGER,
+        local_disabled BOOL, local_cltv INTEGER, remote_base_fee INTEGER, remote_fee_rate INTEGER,
+        remote_disabled BOOL, is_active BOOL, is_open BOOL, auto_rebalance BOOL, ar_amt_target BIGINT,
+        ar_in_target INTEGER, ar_out_target INTEGER, ar_max_cost INTEGER, fees_updated DATETIME,
+        auto_fees BOOL)""",
+    """CREATE TABLE gui_forwards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, forward_date DATETIME, chan_id_in VARCHAR(20),
+        chan_id_out VARCHAR(20), chan_in_alias VARCHAR(32), chan_out_alias VARCHAR(32),
+        amt_in_msat BIGINT, amt_out_msat BIGINT, fee FLOAT, inbound_fee FLOAT)""",
+    """CREATE TABLE gui_payments (
+        payment_hash VARCHAR(64) PRIMARY KEY, creation_date DATETIME, value FLOAT, fee FLOAT,
+        status INTEGER, "index" INTEGER, chan_out VARCHAR(20), chan_out_alias VARCHAR(32),
+        keysend_preimage VARCHAR(64), message VARCHAR(255), cleaned BOOL, rebal_chan VARCHAR(20))""",
+    "CREATE INDEX gui_forwards_forward_date ON gui_forwards (forward_date)",
+    "CREATE INDEX gui_payments_creation_date ON gui_payments (creation_date)",
+)
+
+BATCH = 20_000
+
+
+def _dt(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None).isoformat(sep=" ")
+
+
+def _hex(rng: random.Random, n: int) -> str:
+    return "".join(rng.choice("0123456789abcdef") for _ in range(n))
+
+
+def _power_weights(rng: random.Random, n: int, alpha: float) -> list:
+    """Pesos 1/rank^alpha distribuídos em ordem aleatória entre os canais."""
+    weights = [1.0 / (rank ** alpha) for rank in range(1, n + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def _cumulative(weights: list) -> list:
+    total, out = 0.0, []
+    for w in weights:
+        total += w
+        out.append(total)
+    return out
+
+
+def make_channels(rng: random.Random, n: int, now: float) -> list:
+    channels = []
+    block = 780_000
+    for k in range(n):
+        block += rng.randint(1, 400)
+        scid = (block << 40) | (rng.randint(0, 3000) << 16) | rng.randint(0, 3)
+        cap = rng.choice((1_000_000, 2_000_000, 3_000_000, 5_000_000, 10_000_000, 20_000_000))
+        local = int(cap * rng.betavariate(0.9, 0.9))
+        channels.append({
+            "chan_id": str(scid),
+            "remote_pubkey": rng.choice(("02", "03")) + _hex(rng, 64),
+            "funding_txid": _hex(rng, 64),
+            "output_index": rng.randint(0, 3),
+            "capacity": cap,
+            "local_balance": local,
+            "alias": f"node-{k:05d}",
+            "local_fee_rate": rng.choice((0, 10, 50, 100, 200, 350, 500, 800, 1200, 2000)),
+            "remote_fee_rate": int(rng.lognormvariate(math.log(300), 1.0)) % 5000,
+            "is_open": 1 if rng.random() > 0.03 else 0,
+            "is_active": 1 if rng.random() > 0.05 else 0,
+            "initiator": 1 if rng.random() < 0.6 else 0,
+            "auto_rebalance": 1 if rng.random() < 0.4 else 0,
+            "ar_max_cost": rng.choice((50, 65, 80, 100)),
+            "fees_updated": _dt(now - rng.randint(0, 30 * 86400)),
+        })
+    return channels
+
+
+def generate(path: str, *, channels: int = 200, forwards: int = 200_000, days: float = 30.0, seed: int = 1,
+             alpha: float = 1.1, rebal_ratio: float = 0.04, end_ts: float = None) -> dict:
+    """Cria ``path`` (sobrescreve) e devolve contagens/tempo da geração."""
+    started = time.monotonic()
+    rng = random.Random(seed)
+    end_ts = float(end_ts if end_ts is not None else time.time())
+    start_ts = end_ts - days * 86400
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+
+    chans = make_channels(rng, channels, end_ts)
+    conn.executemany(
+        "INSERT INTO gui_channels VALUES (?,?,?,?,?,?,?,0,?,?,0,?,0,0,0,144,1000,?,0,?,?,?,100000,100,?,?,?,0)",
+        [
+            (c["chan_id"], c["remote_pubkey"], c["funding_txid"], c["output_index"], c["capacity"],
+             c["local_balance"], c["capacity"] - c["local_balance"], c["initiator"], c["alias"],
+             c["local_fee_rate"], c["remote_fee_rate"], c["is_active"], c["is_open"], c["auto_rebalance"],
+             rng.choice((25, 50, 75)), c["ar_max_cost"], c["fees_updated"])
+            for c in chans
+        ],
+    )
+
+    # volume por peer em lei de potência; entrada e saída com rankings independentes
+    cum_out = _cumulative(_power_weights(rng, channels, alpha))
+    cum_in = _cumulative(_power_weights(rng, channels, alpha))
+    pick = rng.choices
+    rows = []
+    count = 0
+    # datas em ordem (como o LNDg grava): gaps exponenciais com ritmo diurno
+    mean_gap = (end_ts - start_ts) / max(1, forwards)
+    ts = start_ts
+    for _ in range(forwards):
+        hour = (ts % 86400) / 3600.0
+        ts += rng.expovariate(1.0) * mean_gap / (1.0 + 0.5 * math.sin((hour - 8) / 24 * 2 * math.pi))
+        if ts > end_ts:
+            ts = end_ts
+        ch_out = chans[pick(range(channels), cum_weights=cum_out)[0]]
+        ch_in = chans[pick(range(channels), cum_weights=cum_in)[0]]
+        if ch_in is ch_out:
+            continue
+        amt_out_sat = min(int(rng.lognormvariate(math.log(150_000), 1.4)) + 1, ch_out["capacity"] // 2)
+        fee_msat = 1000 + amt_out_sat * ch_out["local_fee_rate"] // 1000
+        amt_out_msat = amt_out_sat * 1000 + rng.randint(0, 999)
+        rows.append((_dt(ts), ch_in["chan_id"], ch_out["chan_id"], ch_in["alias"], ch_out["alias"],
+                     amt_out_msat + fee_msat, amt_out_msat, fee_msat / 1000.0, 0.0))
+        count += 1
+        if len(rows) >= BATCH:
+            conn.executemany(
+                "INSERT INTO gui_forwards (forward_date, chan_id_in, chan_id_out, chan_in_alias, chan_out_alias, "
+                "amt_in_msat, amt_out_msat, fee, inbound_fee) VALUES (?,?,?,?,?,?,?,?,?)", rows)
+            rows = []
+    if rows:
+        conn.executemany(
+            "INSERT INTO gui_forwards (forward_date, chan_id_in, chan_id_out, chan_in_alias, chan_out_alias, "
+            "amt_in_msat, amt_out_msat, fee, inbound_fee) VALUES (?,?,?,?,?,?,?,?,?)", rows)
+
+    # fluxos de rebal: pares source -> sink com ritmo, tamanho e custo próprios
+    streams = []
+    for _ in range(max(1, channels // 4)):
+        src, dst = rng.sample(chans, 2) if channels > 1 else (chans[0], chans[0])
+        streams.append((src, dst, rng.lognormvariate(math.log(200_000), 0.6), rng.uniform(50, 1500)))
+    cum_streams = _cumulative(_power_weights(rng, len(streams), alpha))
+    payments = int(forwards * rebal_ratio)
+    events = sorted(rng.uniform(start_ts, end_ts) for _ in range(payments))
+    rows = []
+    for index, ts in enumerate(events, 1):
+        if rng.random() < 0.1:
+            # pagamento comum (não rebal)
+            src, dst, size, cost_ppm = chans[rng.randrange(channels)], None, 50_000.0, 300.0
+        else:
+            src, dst, size, cost_ppm = streams[pick(range(len(streams)), cum_weights=cum_streams)[0]]
+        value = max(1_000, int(rng.gauss(size, size * 0.2)))
+        fee = value * max(1.0, rng.gauss(cost_ppm, cost_ppm * 0.25)) / 1e6
+        roll = rng.random()
+        status = 1 if end_ts - ts < 600 else (2 if roll < 0.85 else 3)
+        rows.append((hashlib.sha256(f"{seed}:{index}".encode()).hexdigest(), _dt(ts), float(value),
+                     round(fee, 3) if status == 2 else 0.0, status, index, src["chan_id"], src["alias"],
+                     0 if status != 1 else None, dst["chan_id"] if dst else None))
+    conn.executemany(
+        'INSERT INTO gui_payments (payment_hash, creation_date, value, fee, status, "index", chan_out, '
+        "chan_out_alias, cleaned, rebal_chan) VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+    return {
+        "path": str(path),
+        "channels": channels,
+        "open_channels": sum(c["is_open"] for c in chans),
+        "forwards": count,
+        "payments": payments,
+        "days": days,
+        "seed": seed,
+        "size_bytes": os.path.getsize(path),
+        "gen_sec": round(time.monotonic() - started, 2),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="arquivo SQLite de saída (sobrescrito)")
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--forwards", type=int, default=200_000)
+    parser.add_argument("--days", type=float, default=30.0, help="janela até agora (padrão 30d)")
+    parser.add_argument("--alpha", type=float, default=1.1, help="expoente da lei de potência do volume por peer")
+    parser.add_argument("--rebal-ratio", type=float, default=0.04, help="pagamentos de rebal por forward")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    info = generate(args.path, channels=args.channels, forwards=args.forwards, days=args.days, seed=args.seed,
+                    alpha=args.alpha, rebal_ratio=args.rebal_ratio)
+    print(f"{info['path']}: {info['channels']} canais ({info['open_channels']} abertos), {info['forwards']} forwards, "
+          f"{info['payments']} pagamentos, {info['size_bytes'] / 1e6:.1f} MB em {info['gen_sec']:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())